@@ -7,13 +7,13 @@ from django.http import HttpResponse, JsonResponse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.template.loader import get_template
-from core.views import send_message as send_chat_message
 from core.models import Course, ActionTraceur, Vehicule
+from core.statistiques import compter_par_statut
 from ravitaillement.models import Ravitaillement
-from entretien.models import Entretien
 from .forms import DemarrerMissionForm, TerminerMissionForm
 from notifications.utils import notify_user, send_sms, send_whatsapp
-from core.utils import get_latest_vehicle_kilometrage
+from notifications.outbox import preparer_envoi, preparer_notifications_utilisateur, mettre_en_file
+from core.kilometrage import get_kilometrage, lire_releve
 import datetime
 import openpyxl
 from openpyxl.styles import Font
@@ -65,20 +65,11 @@ def dashboard(request):
     missions_page = paginator.get_page(page_number)
     
     # Statistiques
+    statuts = {'a_effectuer': 'validee', 'en_cours': 'en_cours', 'terminees': 'terminee'}
     if request.user.role == 'admin' or request.user.is_superuser:
-        stats = {
-            'total': Course.objects.filter(Q(statut='validee') | Q(statut='en_cours') | Q(statut='terminee')).count(),
-            'a_effectuer': Course.objects.filter(statut='validee').count(),
-            'en_cours': Course.objects.filter(statut='en_cours').count(),
-            'terminees': Course.objects.filter(statut='terminee').count(),
-        }
+        stats = compter_par_statut(Course.objects.filter(statut__in=statuts.values()), statuts, cle_cache='missions')
     else:
-        stats = {
-            'total': Course.objects.filter(chauffeur=request.user).count(),
-            'a_effectuer': Course.objects.filter(chauffeur=request.user, statut='validee').count(),
-            'en_cours': Course.objects.filter(chauffeur=request.user, statut='en_cours').count(),
-            'terminees': Course.objects.filter(chauffeur=request.user, statut='terminee').count(),
-        }
+        stats = compter_par_statut(Course.objects.filter(chauffeur=request.user), statuts)
     
     context = {
         'missions': missions_page,
@@ -141,8 +132,8 @@ def demarrer_mission(request, mission_id):
         if form.is_valid():
             kilometrage_depart = form.cleaned_data['kilometrage_depart']
             
-            # Utiliser la fonction utilitaire pour obtenir le dernier kilométrage enregistré
-            dernier_kilometrage = get_latest_vehicle_kilometrage(vehicule)
+            # Dernier kilométrage enregistré, commun à tous les modules (core.kilometrage)
+            dernier_kilometrage = get_kilometrage(vehicule)
             
             if kilometrage_depart < dernier_kilometrage:
                 messages.error(request, f"Le kilométrage de départ ({kilometrage_depart} km) ne peut pas être inférieur au dernier kilométrage enregistré ({dernier_kilometrage} km).")
@@ -195,7 +186,7 @@ def demarrer_mission(request, mission_id):
         # Initialiser le formulaire avec le dernier kilométrage connu du véhicule
         initial_data = {}
         if vehicule:
-            initial_data['kilometrage_depart'] = get_latest_vehicle_kilometrage(vehicule)
+            initial_data['kilometrage_depart'] = get_kilometrage(vehicule)
         form = DemarrerMissionForm(vehicule=vehicule, initial=initial_data)
     
     context = {
@@ -239,31 +230,9 @@ def terminer_mission(request, mission_id):
             kilometrage_fin = form.cleaned_data['kilometrage_fin']
             
             # Vérifier que le kilométrage n'est pas inférieur au dernier kilométrage enregistré
-            dernier_kilometrage = 0
-            
-            # Vérifier le dernier ravitaillement
-            dernier_ravitaillement = Ravitaillement.objects.filter(
-                vehicule=mission.vehicule
-            ).order_by('-date_ravitaillement').first()
-            if dernier_ravitaillement and dernier_ravitaillement.kilometrage_apres > dernier_kilometrage:
-                dernier_kilometrage = dernier_ravitaillement.kilometrage_apres
-            
-            # Vérifier la dernière course terminée
-            derniere_course = Course.objects.filter(
-                vehicule=mission.vehicule,
-                statut='terminee'
-            ).exclude(id=mission.id).order_by('-date_fin').first()
-            if derniere_course and derniere_course.kilometrage_fin > dernier_kilometrage:
-                dernier_kilometrage = derniere_course.kilometrage_fin
-                
-            # Vérifier le dernier entretien
-            dernier_entretien = Entretien.objects.filter(
-                vehicule=mission.vehicule,
-                kilometrage_apres__isnull=False
-            ).order_by('-date_entretien').first()
-            if dernier_entretien and dernier_entretien.kilometrage_apres > dernier_kilometrage:
-                dernier_kilometrage = dernier_entretien.kilometrage_apres
-            
+            # (hors relevé de départ de la mission elle-même)
+            dernier_kilometrage = get_kilometrage(mission.vehicule, exclure=('course', mission.id))
+
             if kilometrage_fin < dernier_kilometrage:
                 messages.error(request, f"Le kilométrage d'arrivée ({kilometrage_fin} km) ne peut pas être inférieur au dernier kilométrage enregistré ({dernier_kilometrage} km).")
                 return render(request, 'chauffeur/terminer_mission.html', {'mission': mission, 'form': form})
@@ -292,26 +261,15 @@ def terminer_mission(request, mission_id):
                 entretien_title = f"Entretien nécessaire pour {vehicule.immatriculation}"
                 entretien_message = f"Le véhicule {vehicule.immatriculation} a atteint {mission.kilometrage_fin} km. Un entretien est nécessaire (dernier entretien à {vehicule.kilometrage_dernier_entretien} km)."
                 
-                # Notification interne aux administrateurs
+                # Notification interne, SMS et WhatsApp aux administrateurs (mises en file, voir notifications.outbox)
                 User = get_user_model()
-                admins = User.objects.filter(role='admin')
-                for admin in admins:
-                    notify_user(
-                        admin,
-                        entretien_title,
-                        entretien_message,
-                        notification_type='all'
-                    )
-                
-                # Notification par SMS aux administrateurs
-                for admin in admins:
-                    if admin.telephone:
-                        send_sms(admin.telephone, f"{entretien_title}\n{entretien_message}")
-                
-                # Notification par WhatsApp aux administrateurs
-                for admin in admins:
+                envois = []
+                for admin in User.objects.filter(role='admin'):
+                    envois += preparer_notifications_utilisateur(admin, entretien_title, entretien_message)
                     if admin.telephone:
-                        send_whatsapp(admin.telephone, f"*{entretien_title}*\n\n{entretien_message}")
+                        envois.append(preparer_envoi('sms', admin, f"{entretien_title}\n{entretien_message}", entretien_title, telephone=admin.telephone))
+                        envois.append(preparer_envoi('whatsapp', admin, f"*{entretien_title}*\n\n{entretien_message}", entretien_title, telephone=admin.telephone))
+                mettre_en_file(envois)
 
             # Créer une entrée dans l'historique des actions
             commentaire = form.cleaned_data['commentaire']
@@ -329,53 +287,30 @@ def terminer_mission(request, mission_id):
             demandeur_title = f"Votre course #{mission.id} est terminée"
             demandeur_message = f"Votre course de {mission.point_embarquement} à {mission.destination} est terminée. Distance parcourue: {mission.distance_parcourue} km."
             
-            # Notification interne au demandeur via le système de notification
-            notify_user(
-                mission.demandeur,
-                demandeur_title,
-                demandeur_message,
-                notification_type='all',
-                course=mission
-            )
+            # Notifications au demandeur, mises en file et distribuées hors requête (notifications.outbox)
+            envois = preparer_notifications_utilisateur(mission.demandeur, demandeur_title, demandeur_message)
             
-            # Envoi d'un message dans le chat interne
-            try:
-                # Créer une requête factice pour send_message
-                from django.http import HttpRequest
-                
-                # Créer une requête factice
-                fake_request = HttpRequest()
-                fake_request.user = request.user  # L'expéditeur est l'utilisateur actuel (le chauffeur)
-                fake_request.method = 'POST'
-                fake_request.POST = {
-                    'recipient_id': str(mission.demandeur.id),
-                    'content': f"🚗 Mission #{mission.id} terminée !\n\n" \
-                              f"📍 De: {mission.point_embarquement}\n" \
-                              f"🏁 À: {mission.destination}\n" \
-                              f"📏 Distance: {mission.distance_parcourue} km\n" \
-                              f"⏱️ Terminée le: {timezone.now().strftime('%d/%m/%Y à %H:%M')}\n\n" \
-                              f"Merci d'avoir fait confiance à notre service !"
-                }
-                
-                # Appeler la vue send_message
-                response = send_chat_message(fake_request)
-                
-                # Vérifier si l'envoi a réussi
-                if response.status_code != 200:
-                    print(f"Erreur lors de l'envoi du message dans le chat: {response.content}")
-                    
-            except Exception as e:
-                print(f"Erreur lors de l'envoi de la notification de fin de mission dans le chat: {str(e)}")
+            # Message dans le chat interne, envoyé par l'utilisateur actuel (le chauffeur)
+            envois.append(preparer_envoi(
+                'message',
+                mission.demandeur,
+                f"🚗 Mission #{mission.id} terminée !\n\n" \
+                f"📍 De: {mission.point_embarquement}\n" \
+                f"🏁 À: {mission.destination}\n" \
+                f"📏 Distance: {mission.distance_parcourue} km\n" \
+                f"⏱️ Terminée le: {timezone.now().strftime('%d/%m/%Y à %H:%M')}\n\n" \
+                f"Merci d'avoir fait confiance à notre service !",
+                expediteur=request.user
+            ))
             
-            # Notification par SMS au demandeur (désactivée pour le moment)
+            # Notification par SMS et WhatsApp au demandeur
             if mission.demandeur.telephone:
                 sms_message = f"{demandeur_title}\n{demandeur_message}"
-                send_sms(mission.demandeur.telephone, sms_message)
-            
-            # Notification par WhatsApp au demandeur (désactivée pour le moment)
-            if mission.demandeur.telephone:
+                envois.append(preparer_envoi('sms', mission.demandeur, sms_message, demandeur_title, telephone=mission.demandeur.telephone))
                 whatsapp_message = f"*{demandeur_title}*\n\n{demandeur_message}\n\nMerci d'avoir utilisé notre service."
-                send_whatsapp(mission.demandeur.telephone, whatsapp_message)
+                envois.append(preparer_envoi('whatsapp', mission.demandeur, whatsapp_message, demandeur_title, telephone=mission.demandeur.telephone))
+            
+            mettre_en_file(envois)
             
             # Mettre à jour la distance journalière
             from .models import DistanceJournaliere
@@ -685,44 +620,16 @@ def mission_excel(request, mission_id):
 @login_required
 def get_vehicule_kilometrage(request):
     vehicule_id = request.GET.get('vehicule_id')
-    if not vehicule_id:
+    if not vehicule_id or not vehicule_id.isdigit():
         return JsonResponse({'error': 'Aucun ID de véhicule fourni'}, status=400)
-    try:
-        vehicule = Vehicule.objects.get(id=vehicule_id)
-        dernier_kilometrage = 0
-        
-        # Vérifier d'abord le dernier ravitaillement
-        dernier_ravitaillement = Ravitaillement.objects.filter(
-            vehicule=vehicule
-        ).order_by('-date_ravitaillement').first()
-        if dernier_ravitaillement and dernier_ravitaillement.kilometrage_apres > 0:
-            dernier_kilometrage = dernier_ravitaillement.kilometrage_apres
-        
-        # Vérifier ensuite la dernière course terminée
-        derniere_course = Course.objects.filter(
-            vehicule=vehicule, 
-            statut='terminee'
-        ).order_by('-date_fin').first()
-        if derniere_course and derniere_course.kilometrage_fin > dernier_kilometrage:
-            dernier_kilometrage = derniere_course.kilometrage_fin
-            
-        # Vérifier enfin le dernier entretien
-        dernier_entretien = Entretien.objects.filter(
-            vehicule=vehicule,
-            kilometrage_apres__isnull=False
-        ).order_by('-date_entretien').first()
-        if dernier_entretien and dernier_entretien.kilometrage_apres > dernier_kilometrage:
-            dernier_kilometrage = dernier_entretien.kilometrage_apres
-            
-        return JsonResponse({
-            'success': True,
-            'kilometrage': dernier_kilometrage,
-            'immatriculation': vehicule.immatriculation
-        })
-    except Vehicule.DoesNotExist:
+    releve = lire_releve(int(vehicule_id))
+    if releve is None:
         return JsonResponse({'error': 'Véhicule non trouvé'}, status=404)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+    return JsonResponse({
+        'success': True,
+        'kilometrage': releve['kilometrage'],
+        'immatriculation': releve['immatriculation']
+    })
 
 @login_required
 def rapport_chauffeur(request):
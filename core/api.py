@@ -1,13 +1,35 @@
+from django.conf import settings
 from django.contrib.auth import authenticate
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag, urlsafe_base64_decode, urlsafe_base64_encode
+from django.views.decorators.gzip import gzip_page
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.utils import timezone
+from datetime import date, datetime, timedelta
+import hashlib
 import json
-from .models import Utilisateur, Course, Vehicule
-from suivi.models import SuiviVehicule
+from .models import Utilisateur, Course, CourseSupprimee, Vehicule
+from .evenements import reponse_flux
+from .jetons import ROLES_MOBILES, JetonInvalide, emettre_jetons, principal, rafraichir_jetons, verifier_jeton_acces
+from .synchronisation import ACTIONS_PAR_LOT_MAX, ActionRefusee, kilometrage_saisi, demarrer_mission, synchroniser, terminer_mission
+
+def _donnees_utilisateur(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'email': user.email,
+        'role': user.role,
+        'telephone': user.telephone,
+        'etablissement': user.etablissement.nom if user.etablissement else None,
+    }
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -29,21 +51,14 @@ def api_login(request):
         
         if user is not None and user.is_active:
             # Autoriser les rôles mobiles: chauffeur, dispatch, demandeur
-            if user.role in ['chauffeur', 'dispatch', 'demandeur']:
-                role = user.role
+            if user.role in ROLES_MOBILES:
+                jetons = emettre_jetons(user)
                 return JsonResponse({
                     'success': True,
-                    'token': f'{role}_{user.id}_{user.username}',  # Token simple pour la démo
-                    'user': {
-                        'id': user.id,
-                        'username': user.username,
-                        'first_name': user.first_name,
-                        'last_name': user.last_name,
-                        'email': user.email,
-                        'role': user.role,
-                        'telephone': user.telephone,
-                        'etablissement': user.etablissement.nom if user.etablissement else None,
-                    }
+                    # 'token' : jeton d'accès, nom conservé pour les versions existantes de l'application
+                    'token': jetons['access_token'],
+                    **jetons,
+                    'user': _donnees_utilisateur(user)
                 })
             else:
                 return JsonResponse({
@@ -70,24 +85,21 @@ def api_login(request):
 # -------------------- DEMANDEUR --------------------
 
 def _get_user_from_token(request, expected_roles=None):
+    """Utilisateur du jeton d'accès (core.jetons) : signature et expiration vérifiées sans requête"""
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
         return None, JsonResponse({'success': False, 'error': "Token d'authentification requis"}, status=401)
-    token = auth_header.split(' ')[1]
-    parts = token.split('_')
-    if len(parts) != 3:
-        return None, JsonResponse({'success': False, 'error': 'Token invalide'}, status=401)
-    role_prefix, user_id_str, username = parts
-    try:
-        user_id = int(user_id_str)
-    except ValueError:
-        return None, JsonResponse({'success': False, 'error': 'Token invalide'}, status=401)
+    token = auth_header.split(' ', 1)[1]
     try:
-        user = Utilisateur.objects.get(id=user_id, username=username, is_active=True)
-    except Utilisateur.DoesNotExist:
+        user_id, role = verifier_jeton_acces(token)
+    except JetonInvalide:
         return None, JsonResponse({'success': False, 'error': 'Token invalide ou expiré'}, status=401)
-    if expected_roles and (user.role not in expected_roles or user.role != role_prefix):
+    if expected_roles and role not in expected_roles:
         return None, JsonResponse({'success': False, 'error': 'Accès non autorisé'}, status=403)
+    user = principal(user_id)
+    # Utilisateur désactivé ou rôle modifié depuis l'émission du jeton
+    if user is None or user.role != role:
+        return None, JsonResponse({'success': False, 'error': 'Token invalide ou expiré'}, status=401)
     return user, None
 
 @csrf_exempt
@@ -120,15 +132,8 @@ def api_demandeur_demandes_create(request):
     )
     return JsonResponse({'success': True, 'demande_id': course.id})
 
-@csrf_exempt
-@require_http_methods(["GET"]) 
-def api_demandeur_demandes_list(request):
-    """Lister les demandes d'un demandeur"""
-    user, err = _get_user_from_token(request, expected_roles=['demandeur'])
-    if err:
-        return err
-    qs = Course.objects.filter(demandeur=user).order_by('-date_demande')
-    result = [{
+def _donnees_demande(c):
+    return {
         'id': c.id,
         'point_embarquement': c.point_embarquement,
         'destination': c.destination,
@@ -136,41 +141,53 @@ def api_demandeur_demandes_list(request):
         'nombre_passagers': c.nombre_passagers,
         'date_demande': c.date_demande.isoformat() if c.date_demande else None,
         'date_souhaitee': c.date_souhaitee.isoformat() if c.date_souhaitee else None,
+        'date_modification': c.date_modification.isoformat() if c.date_modification else None,
         'statut': c.statut,
         'priorite': c.priorite,
         'chauffeur': c.chauffeur.username if c.chauffeur_id else None,
         'vehicule': c.vehicule.immatriculation if c.vehicule_id else None,
-    } for c in qs]
-    return JsonResponse({'success': True, 'demandes': result})
+    }
+
+def _donnees_demande_dispatch(c):
+    return {'demandeur': c.demandeur.username if c.demandeur_id else None, **_donnees_demande(c)}
+
+@csrf_exempt
+@require_http_methods(["GET"]) 
+def api_demandeur_demandes_list(request):
+    """Lister les demandes d'un demandeur (toutes, ou les changements depuis `since`)"""
+    user, err = _get_user_from_token(request, expected_roles=['demandeur'])
+    if err:
+        return err
+    qs = Course.objects.filter(demandeur=user).select_related('chauffeur', 'vehicule')
+    if request.GET.get('since'):
+        return _changements_demandes(request, qs, CourseSupprimee.objects.filter(demandeur_id=user.id), _donnees_demande)
+    curseur = _curseur_synchro_initial()
+    result = [_donnees_demande(c) for c in qs.order_by('-date_demande')]
+    return JsonResponse({'success': True, 'demandes': result, 'sync_cursor': curseur})
 
 # -------------------- DISPATCH --------------------
 
 @csrf_exempt
 @require_http_methods(["GET"]) 
 def api_dispatch_demandes_list(request):
-    """Liste des demandes filtrables par statut pour le dispatcher"""
+    """
+    Liste des demandes filtrables par statut pour le dispatcher, ou les
+    changements depuis `since` (toutes les demandes : le filtre par statut
+    s'applique à la liste complète seulement)
+    """
     user, err = _get_user_from_token(request, expected_roles=['dispatch'])
     if err:
         return err
+    qs = Course.objects.select_related('demandeur', 'chauffeur', 'vehicule')
+    if request.GET.get('since'):
+        return _changements_demandes(request, qs, CourseSupprimee.objects.all(), _donnees_demande_dispatch)
+    curseur = _curseur_synchro_initial()
     statut = request.GET.get('statut')
-    qs = Course.objects.all().order_by('-date_demande')
+    qs = qs.order_by('-date_demande')
     if statut:
         qs = qs.filter(statut=statut)
-    data = [{
-        'id': c.id,
-        'demandeur': c.demandeur.username if c.demandeur_id else None,
-        'point_embarquement': c.point_embarquement,
-        'destination': c.destination,
-        'motif': c.motif,
-        'nombre_passagers': c.nombre_passagers,
-        'date_demande': c.date_demande.isoformat() if c.date_demande else None,
-        'date_souhaitee': c.date_souhaitee.isoformat() if c.date_souhaitee else None,
-        'statut': c.statut,
-        'priorite': c.priorite,
-        'chauffeur': c.chauffeur.username if c.chauffeur_id else None,
-        'vehicule': c.vehicule.immatriculation if c.vehicule_id else None,
-    } for c in qs]
-    return JsonResponse({'success': True, 'demandes': data})
+    data = [_donnees_demande_dispatch(c) for c in qs]
+    return JsonResponse({'success': True, 'demandes': data, 'sync_cursor': curseur})
 
 @csrf_exempt
 @require_http_methods(["POST"]) 
@@ -232,13 +249,10 @@ def api_chauffeur_demarrer(request, course_id):
         data = json.loads(request.body or '{}')
     except json.JSONDecodeError:
         return JsonResponse({'success': False, 'error': 'JSON invalide'}, status=400)
-    km_depart = data.get('kilometrage_depart')
-    if km_depart is None:
-        return JsonResponse({'success': False, 'error': 'kilometrage_depart requis'}, status=400)
-    course.kilometrage_depart = int(km_depart)
-    course.statut = 'en_cours'
-    course.date_depart = timezone.now()
-    course.save()
+    try:
+        demarrer_mission(course, kilometrage_saisi(data, 'kilometrage_depart'))
+    except ActionRefusee as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
     return JsonResponse({'success': True, 'statut': course.statut})
 
 @csrf_exempt
@@ -255,131 +269,290 @@ def api_chauffeur_terminer(request, course_id):
         data = json.loads(request.body or '{}')
     except json.JSONDecodeError:
         return JsonResponse({'success': False, 'error': 'JSON invalide'}, status=400)
-    km_fin = data.get('kilometrage_fin')
-    if km_fin is None:
-        return JsonResponse({'success': False, 'error': 'kilometrage_fin requis'}, status=400)
-
-    course.kilometrage_fin = int(km_fin)
-    course.statut = 'terminee'
-    course.date_fin = timezone.now()
-    # Distance sera recalculée dans save()
-    course.save()
+    try:
+        terminer_mission(course, kilometrage_saisi(data, 'kilometrage_fin'))
+    except ActionRefusee as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return JsonResponse({'success': True, 'statut': course.statut, 'distance_parcourue': course.distance_parcourue})
 
-    # Mettre à jour le kilométrage centralisé du véhicule et le suivi journalier
-    if course.vehicule_id and course.distance_parcourue:
-        veh = course.vehicule
-        veh.kilometrage_actuel = max(veh.kilometrage_actuel or 0, course.kilometrage_fin)
-        veh.save()
-        SuiviVehicule.mettre_a_jour_suivi(veh, timezone.now().date(), course.distance_parcourue)
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_chauffeur_synchronisation(request):
+    """
+    File d'actions hors ligne du chauffeur, appliquée en une transaction (core.synchronisation).
 
-    return JsonResponse({'success': True, 'statut': course.statut, 'distance_parcourue': course.distance_parcourue})
+    Corps : {"actions": [{"cle", "type", "donnees", "horodatage"}, ...]}, un
+    résultat par action dans la réponse.
+    """
+    user, err = _get_user_from_token(request, expected_roles=['chauffeur'])
+    if err:
+        return err
+    try:
+        data = json.loads(request.body or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'JSON invalide'}, status=400)
+    actions = data.get('actions') if isinstance(data, dict) else None
+    if not isinstance(actions, list):
+        return JsonResponse({'success': False, 'error': 'actions requis (liste)'}, status=400)
+    if len(actions) > ACTIONS_PAR_LOT_MAX:
+        return JsonResponse({'success': False, 'error': f'{ACTIONS_PAR_LOT_MAX} actions au plus par envoi'}, status=400)
+    resultats = synchroniser(user, actions)
+    return JsonResponse({
+        'success': True,
+        'resultats': resultats,
+        'erreurs': sum(1 for r in resultats if r['statut'] == 'erreur'),
+    })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_refresh_token(request):
+    """Nouveaux jetons à partir du jeton de rafraîchissement, sans mot de passe"""
+    try:
+        data = json.loads(request.body or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Format JSON invalide'}, status=400)
+    refresh_token = data.get('refresh_token') if isinstance(data, dict) else None
+    if not refresh_token:
+        return JsonResponse({'success': False, 'error': 'refresh_token requis'}, status=400)
+    try:
+        user, jetons = rafraichir_jetons(refresh_token)
+    except JetonInvalide:
+        return JsonResponse({'success': False, 'error': 'Token invalide ou expiré'}, status=401)
+    return JsonResponse({'success': True, 'token': jetons['access_token'], **jetons, 'user': _donnees_utilisateur(user)})
 
 @csrf_exempt
 @require_http_methods(["GET"])
 def api_verify_token(request):
     """Endpoint API pour vérifier la validité d'un token"""
+    user, err = _get_user_from_token(request, expected_roles=ROLES_MOBILES)
+    if err:
+        return err
+    return JsonResponse({'success': True, 'user': _donnees_utilisateur(user)})
+
+# Champs d'une mission exposés par api_chauffeur_missions : nom -> (valeur, relations à charger)
+CHAMPS_MISSION = {
+    'id': (lambda c: c.id, ()),
+    'demandeur': (lambda c: f"{c.demandeur.first_name} {c.demandeur.last_name}" if c.demandeur_id else None, ('demandeur',)),
+    'point_embarquement': (lambda c: c.point_embarquement, ()),
+    'destination': (lambda c: c.destination, ()),
+    'motif': (lambda c: c.motif, ()),
+    'nombre_passagers': (lambda c: c.nombre_passagers, ()),
+    'date_demande': (lambda c: c.date_demande.isoformat() if c.date_demande else None, ()),
+    'date_souhaitee': (lambda c: c.date_souhaitee.isoformat() if c.date_souhaitee else None, ()),
+    'statut': (lambda c: c.statut, ()),
+    'priorite': (lambda c: c.priorite, ()),
+    'vehicule_immatriculation': (lambda c: c.vehicule.immatriculation if c.vehicule_id else None, ('vehicule',)),
+    'vehicule_marque': (lambda c: c.vehicule.marque if c.vehicule_id else None, ('vehicule',)),
+    'vehicule_modele': (lambda c: c.vehicule.modele if c.vehicule_id else None, ('vehicule',)),
+    'kilometrage_depart': (lambda c: c.kilometrage_depart, ()),
+    'kilometrage_fin': (lambda c: c.kilometrage_fin, ()),
+    'distance_parcourue': (lambda c: c.distance_parcourue, ()),
+}
+MISSIONS_PAR_PAGE = 50
+MISSIONS_PAR_PAGE_MAX = 200
+CHANGEMENTS_PAR_PAGE = 200
+CHANGEMENTS_PAR_PAGE_MAX = 1000
+
+
+class ParametreInvalide(ValueError):
+    pass
+
+
+def _erreur_parametre(message):
+    return JsonResponse({'success': False, 'error': message}, status=400)
+
+
+def _champs_demandes(request, champs_disponibles):
+    """Champs demandés par `fields=a,b,c` (tous par défaut) ; l'identifiant est toujours inclus"""
+    valeur = request.GET.get('fields')
+    if not valeur:
+        return list(champs_disponibles)
+    champs = [nom.strip() for nom in valeur.split(',') if nom.strip()]
+    inconnus = [nom for nom in champs if nom not in champs_disponibles]
+    if inconnus:
+        raise ParametreInvalide(f"Champs inconnus: {', '.join(inconnus)}")
+    return ['id'] + [nom for nom in champs if nom != 'id']
+
+
+def _encoder_curseur(course):
+    return urlsafe_base64_encode(json.dumps([course.date_demande.isoformat(), course.id]).encode('utf-8'))
+
+
+def _limite(request, par_page, maximum):
     try:
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return JsonResponse({
-                'success': False,
-                'error': 'Token d\'authentification requis'
-            }, status=401)
-        
-        token = auth_header.split(' ')[1]
-        
-        # Décoder le token simple (format: role_id_username)
-        parts = token.split('_')
-        if len(parts) == 3:
-            role_prefix = parts[0]
-            try:
-                user_id = int(parts[1])
-            except ValueError:
-                user_id = None
-            username = parts[2]
-            if user_id is not None:
-                try:
-                    user = Utilisateur.objects.get(id=user_id, username=username, is_active=True)
-                    if user.role in ['chauffeur', 'dispatch', 'demandeur'] and user.role == role_prefix:
-                        return JsonResponse({
-                            'success': True,
-                            'user': {
-                                'id': user.id,
-                                'username': user.username,
-                                'first_name': user.first_name,
-                                'last_name': user.last_name,
-                                'email': user.email,
-                                'role': user.role,
-                                'telephone': user.telephone,
-                                'etablissement': user.etablissement.nom if user.etablissement else None,
-                            }
-                        })
-                except Utilisateur.DoesNotExist:
-                    pass
-        
-        return JsonResponse({
-            'success': False,
-            'error': 'Token invalide ou expiré'
-        }, status=401)
-        
-    except Exception as e:
-        return JsonResponse({
-            'success': False,
-            'error': f'Erreur serveur: {str(e)}'
-        }, status=500)
+        return min(max(int(request.GET.get('limit', par_page)), 1), maximum)
+    except ValueError:
+        raise ParametreInvalide("limit invalide")
+
+
+def _page_curseur(request, qs, par_page=MISSIONS_PAR_PAGE, maximum=MISSIONS_PAR_PAGE_MAX):
+    """
+    Page suivante d'un queryset trié du plus récent au plus ancien (date_demande, id).
+
+    Le curseur désigne la dernière ligne de la page précédente : une page coûte
+    une requête, quelle que soit sa position, et les nouvelles demandes ne
+    décalent pas les pages suivantes. Returns: (lignes, curseur suivant ou None)
+    """
+    limite = _limite(request, par_page, maximum)
+    curseur = request.GET.get('cursor')
+    if curseur:
+        try:
+            date_demande, identifiant = json.loads(urlsafe_base64_decode(curseur))
+            date_demande = datetime.fromisoformat(date_demande)
+            identifiant = int(identifiant)
+        except (ValueError, TypeError):
+            raise ParametreInvalide("cursor invalide")
+        qs = qs.filter(Q(date_demande__lt=date_demande) | Q(date_demande=date_demande, id__lt=identifiant))
+    # Une ligne de plus que la page : indique s'il reste des lignes, sans COUNT
+    lignes = list(qs.order_by('-date_demande', '-id')[:limite + 1])
+    if len(lignes) > limite:
+        lignes = lignes[:limite]
+        return lignes, _encoder_curseur(lignes[-1])
+    return lignes, None
+
+
+def _encoder_curseur_synchro(date_modification, identifiant):
+    return urlsafe_base64_encode(json.dumps([date_modification.isoformat(), identifiant]).encode('utf-8'))
+
+
+def _curseur_synchro_initial():
+    """
+    Curseur remis avec une liste complète. Il précède la lecture de API_SYNCHRO_MARGE
+    secondes : les demandes modifiées pendant la lecture, ou par une transaction
+    encore ouverte, seront renvoyées.
+    """
+    return _encoder_curseur_synchro(timezone.now() - timedelta(seconds=getattr(settings, 'API_SYNCHRO_MARGE', 600)), 0)
+
+
+def _changements_demandes(request, qs, suppressions, serialiser):
+    """
+    Demandes créées, modifiées ou supprimées depuis le curseur `since`.
+
+    Les demandes sont lues dans l'ordre (date_modification, id), par pages de
+    `limit`, à partir du curseur ; les suppressions de la même période sont
+    renvoyées sous forme d'identifiants (`supprimees`, CourseSupprimee). Une
+    page coûte deux requêtes, quel que soit l'historique.
+
+    Les changements des API_SYNCHRO_MARGE dernières secondes attendent la
+    synchronisation suivante : une transaction encore ouverte peut valider une
+    date de modification antérieure à l'heure de la requête. Le client remplace
+    ses demandes par identifiant ; une demande déjà reçue peut être renvoyée.
+    Un curseur plus ancien que la rétention des suppressions
+    (API_SYNCHRO_RETENTION jours) impose de recharger la liste complète (410).
+    """
+    try:
+        depuis, identifiant = json.loads(urlsafe_base64_decode(request.GET['since']))
+        depuis = datetime.fromisoformat(depuis)
+        identifiant = int(identifiant)
+        if timezone.is_naive(depuis):
+            raise ValueError
+        limite = _limite(request, CHANGEMENTS_PAR_PAGE, CHANGEMENTS_PAR_PAGE_MAX)
+    except ParametreInvalide as e:
+        return _erreur_parametre(str(e))
+    except (ValueError, TypeError):
+        return _erreur_parametre("since invalide")
+
+    maintenant = timezone.now()
+    if depuis < maintenant - timedelta(days=getattr(settings, 'API_SYNCHRO_RETENTION', 30)):
+        return JsonResponse({'success': False, 'error': 'Synchronisation trop ancienne : recharger la liste complète', 'resync': True}, status=410)
+    horizon = maintenant - timedelta(seconds=getattr(settings, 'API_SYNCHRO_MARGE', 600))
+
+    lignes = list(qs.filter(
+        Q(date_modification__gt=depuis) | Q(date_modification=depuis, id__gt=identifiant),
+    ).order_by('date_modification', 'id')[:limite + 1])
+    has_more = len(lignes) > limite
+    lignes = lignes[:limite]
+    # Le curseur avance jusqu'à la dernière demande antérieure à l'horizon, au plus
+    sures = [c for c in lignes if c.date_modification <= horizon]
+    if has_more and sures:
+        fin, curseur = sures[-1].date_modification, _encoder_curseur_synchro(sures[-1].date_modification, sures[-1].id)
+    else:
+        # Plus d'une page postérieure à l'horizon : la suite sera transmise une fois la marge écoulée
+        has_more = False
+        fin = maintenant
+        curseur = _encoder_curseur_synchro(horizon, 0) if horizon > depuis else request.GET['since']
+    supprimees = list(suppressions.filter(date_suppression__gt=depuis, date_suppression__lte=fin).values_list('course_id', flat=True))
+    return JsonResponse({
+        'success': True,
+        'demandes': [serialiser(c) for c in lignes],
+        'supprimees': supprimees,
+        'sync_cursor': curseur,
+        'has_more': has_more,
+    })
+
+
+def _filtre_date(request, nom):
+    valeur = request.GET.get(nom)
+    if not valeur:
+        return None
+    try:
+        return date.fromisoformat(valeur)
+    except ValueError:
+        raise ParametreInvalide(f"{nom} invalide (AAAA-MM-JJ)")
+
+
+def _reponse_conditionnelle(request, donnees):
+    """
+    Réponse JSON avec un ETag calculé sur son contenu : un client qui renvoie
+    l'ETag reçu (If-None-Match) obtient un 304 sans corps si rien n'a changé.
+    """
+    contenu = json.dumps(donnees, cls=DjangoJSONEncoder).encode('utf-8')
+    etag = quote_etag(hashlib.sha256(contenu).hexdigest()[:32])
+    reponse = get_conditional_response(request, etag=etag)
+    if reponse is None:
+        reponse = HttpResponse(contenu, content_type='application/json')
+    reponse['ETag'] = etag
+    # Réponse propre à l'utilisateur du jeton
+    reponse['Cache-Control'] = 'private, no-cache'
+    return reponse
+
 
 @csrf_exempt
 @require_http_methods(["GET"])
+@gzip_page
 def api_chauffeur_missions(request):
-    """Endpoint API pour récupérer les missions d'un chauffeur (assignées)"""
+    """
+    Missions assignées au chauffeur, de la plus récente à la plus ancienne, par pages.
+
+    Paramètres GET : limit, cursor (next_cursor de la page précédente), statut
+    (un ou plusieurs, séparés par des virgules), date_debut et date_fin (date
+    souhaitée, AAAA-MM-JJ), fields (champs à renvoyer, séparés par des virgules).
+    """
+    user, err = _get_user_from_token(request, expected_roles=['chauffeur'])
+    if err:
+        return err
     try:
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return JsonResponse({
-                'success': False,
-                'error': 'Token d\'authentification requis'
-            }, status=401)
-        
-        token = auth_header.split(' ')[1]
-        parts = token.split('_')
-        if len(parts) == 3 and parts[0] == 'chauffeur':
-            user_id = int(parts[1])
-            username = parts[2]
-            try:
-                user = Utilisateur.objects.get(id=user_id, username=username, is_active=True, role='chauffeur')
-                # Missions réellement assignées
-                courses = Course.objects.filter(chauffeur=user).order_by('-date_demande')
-                missions = []
-                for c in courses:
-                    missions.append({
-                        'id': c.id,
-                        'demandeur': f"{c.demandeur.first_name} {c.demandeur.last_name}" if c.demandeur_id else None,
-                        'point_embarquement': c.point_embarquement,
-                        'destination': c.destination,
-                        'motif': c.motif,
-                        'nombre_passagers': c.nombre_passagers,
-                        'date_demande': c.date_demande.isoformat() if c.date_demande else None,
-                        'date_souhaitee': c.date_souhaitee.isoformat() if c.date_souhaitee else None,
-                        'statut': c.statut,
-                        'priorite': c.priorite,
-                        'vehicule_immatriculation': c.vehicule.immatriculation if c.vehicule_id else None,
-                        'vehicule_marque': c.vehicule.marque if c.vehicule_id else None,
-                        'vehicule_modele': c.vehicule.modele if c.vehicule_id else None,
-                        'kilometrage_depart': c.kilometrage_depart,
-                        'kilometrage_fin': c.kilometrage_fin,
-                        'distance_parcourue': c.distance_parcourue,
-                    })
-                return JsonResponse({'success': True, 'missions': missions})
-            except Utilisateur.DoesNotExist:
-                pass
-        
-        return JsonResponse({
-            'success': False,
-            'error': 'Token invalide ou expiré'
-        }, status=401)
-        
-    except Exception as e:
-        return JsonResponse({
-            'success': False,
-            'error': f'Erreur serveur: {str(e)}'
-        }, status=500)
+        champs = _champs_demandes(request, CHAMPS_MISSION)
+        qs = Course.objects.filter(chauffeur=user)
+        statuts = [statut for statut in request.GET.get('statut', '').split(',') if statut]
+        if statuts:
+            qs = qs.filter(statut__in=statuts)
+        date_debut, date_fin = _filtre_date(request, 'date_debut'), _filtre_date(request, 'date_fin')
+        if date_debut:
+            qs = qs.filter(date_souhaitee__date__gte=date_debut)
+        if date_fin:
+            qs = qs.filter(date_souhaitee__date__lte=date_fin)
+        # Relations chargées dans la même requête, seulement si un champ demandé les utilise
+        relations = sorted({relation for nom in champs for relation in CHAMPS_MISSION[nom][1]})
+        if relations:
+            qs = qs.select_related(*relations)
+        courses, curseur_suivant = _page_curseur(request, qs)
+    except ParametreInvalide as e:
+        return _erreur_parametre(str(e))
+
+    missions = [{nom: CHAMPS_MISSION[nom][0](c) for nom in champs} for c in courses]
+    return _reponse_conditionnelle(request, {
+        'success': True,
+        'missions': missions,
+        'next_cursor': curseur_suivant,
+        'has_more': curseur_suivant is not None,
+    })
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def api_evenements(request):
+    """Flux temps réel pour les applications mobiles (SSE ou long-poll), remplace l'interrogation périodique"""
+    user, err = _get_user_from_token(request)
+    if err:
+        return err
+    return reponse_flux(request, user)
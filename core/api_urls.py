@@ -5,12 +5,14 @@ from . import api
 api_urlpatterns = [
     # Authentification
     path('login/', api.api_login, name='api_login'),
+    path('token/refresh/', api.api_refresh_token, name='api_refresh_token'),
     path('verify-token/', api.api_verify_token, name='api_verify_token'),
 
     # Chauffeur
     path('chauffeur/missions/', api.api_chauffeur_missions, name='api_chauffeur_missions'),
     path('chauffeur/missions/<int:course_id>/demarrer/', api.api_chauffeur_demarrer, name='api_chauffeur_demarrer'),
     path('chauffeur/missions/<int:course_id>/terminer/', api.api_chauffeur_terminer, name='api_chauffeur_terminer'),
+    path('chauffeur/synchronisation/', api.api_chauffeur_synchronisation, name='api_chauffeur_synchronisation'),
 
     # Demandeur
     path('demandeur/demandes/', api.api_demandeur_demandes_list, name='api_demandeur_demandes_list'),
@@ -0,0 +1,228 @@
+"""
+Flux d'événements temps réel pour les clients web et mobiles.
+
+Les signaux (core.signals) publient sur le bus les nouveaux messages du chat,
+les changements de statut des courses et les notifications internes. Les
+clients s'abonnent via `reponse_flux` : Server-Sent Events si le client envoie
+`Accept: text/event-stream`, sinon long-poll JSON avec une attente bornée.
+
+Les identifiants d'événements sont dérivés de l'horloge (microsecondes) : ils
+restent croissants après un redémarrage et le curseur d'un client reste valable.
+
+Le bus en mémoire ne voit que les événements publiés dans son propre processus.
+En production (REDIS_URL défini), BackendRedis partage les événements entre les
+workers web, la commande cron et le worker des rapports : file bornée par
+utilisateur dans Redis et réveil des abonnés par pub/sub. Un autre backend peut
+être branché via le paramètre EVENEMENTS_BACKEND, en implémentant `publier`,
+`dernier_id` et `lire`.
+
+Les attentes (long-poll, SSE) occupent le worker qui sert la requête : elles
+ne sont servies que par le processus `evenements` du Procfile (workers gevent,
+gunicorn_evenements.py), vers lequel /evenements/ et /api/evenements/ sont
+routés. Dans le serveur web (workers synchrones), EVENEMENTS_ATTENTE_MAX vaut 0 :
+la requête répond immédiatement et le flux SSE n'est pas proposé.
+"""
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+def _evenement(identifiant, type_evenement, donnees):
+    return {
+        'id': identifiant,
+        'type': type_evenement,
+        'donnees': donnees,
+        'date': timezone.now().isoformat(),
+    }
+
+
+class BackendMemoire:
+    """Bus en mémoire du processus : une file bornée d'événements par utilisateur"""
+
+    def __init__(self, taille=100):
+        self._condition = threading.Condition()
+        self._evenements = defaultdict(lambda: deque(maxlen=taille))
+        self._dernier_id = 0
+
+    def publier(self, destinataires, type_evenement, donnees):
+        with self._condition:
+            # Horodatage en microsecondes, strictement croissant dans le processus
+            self._dernier_id = max(time.time_ns() // 1000, self._dernier_id + 1)
+            evenement = _evenement(self._dernier_id, type_evenement, donnees)
+            for utilisateur_id in set(destinataires):
+                if utilisateur_id:
+                    self._evenements[utilisateur_id].append(evenement)
+            self._condition.notify_all()
+        return evenement['id']
+
+    def dernier_id(self):
+        with self._condition:
+            return self._dernier_id
+
+    def lire(self, utilisateur_id, depuis_id, attente=0):
+        """Retourne les événements de l'utilisateur postérieurs à depuis_id, en attendant au plus `attente` secondes"""
+        fin = time.monotonic() + attente
+        with self._condition:
+            while True:
+                evenements = [e for e in self._evenements.get(utilisateur_id, ()) if e['id'] > depuis_id]
+                restant = fin - time.monotonic()
+                if evenements or restant <= 0:
+                    return evenements
+                self._condition.wait(restant)
+
+
+class BackendRedis:
+    """
+    Bus partagé entre processus : un ensemble trié d'événements par utilisateur
+    (score = identifiant) et un canal pub/sub par utilisateur pour réveiller
+    les requêtes en attente.
+    """
+    CLE_DERNIER_ID = 'evenements:dernier_id'
+
+    # Identifiant tiré de l'horloge du serveur Redis, strictement croissant pour tous les processus
+    SCRIPT_IDENTIFIANT = """
+    local t = redis.call('TIME')
+    local identifiant = tonumber(t[1]) * 1000000 + tonumber(t[2])
+    local dernier = tonumber(redis.call('GET', KEYS[1]) or '0')
+    if identifiant <= dernier then identifiant = dernier + 1 end
+    redis.call('SET', KEYS[1], identifiant)
+    return identifiant
+    """
+
+    def __init__(self, taille=100, url=None):
+        import redis
+
+        self.taille = taille
+        self.retention = getattr(settings, 'EVENEMENTS_RETENTION', 86400)
+        self._client = redis.Redis.from_url(url or getattr(settings, 'EVENEMENTS_REDIS_URL', None) or settings.REDIS_URL)
+        self._identifiant = self._client.register_script(self.SCRIPT_IDENTIFIANT)
+
+    @staticmethod
+    def _cle(utilisateur_id):
+        return f"evenements:{utilisateur_id}"
+
+    @staticmethod
+    def _canal(utilisateur_id):
+        return f"evenements:canal:{utilisateur_id}"
+
+    def publier(self, destinataires, type_evenement, donnees):
+        evenement = _evenement(int(self._identifiant(keys=[self.CLE_DERNIER_ID])), type_evenement, donnees)
+        contenu = json.dumps(evenement, ensure_ascii=False)
+        pipe = self._client.pipeline()
+        for utilisateur_id in set(destinataires):
+            if utilisateur_id:
+                cle = self._cle(utilisateur_id)
+                pipe.zadd(cle, {contenu: evenement['id']})
+                pipe.zremrangebyrank(cle, 0, -self.taille - 1)
+                pipe.expire(cle, self.retention)
+                pipe.publish(self._canal(utilisateur_id), evenement['id'])
+        pipe.execute()
+        return evenement['id']
+
+    def dernier_id(self):
+        return int(self._client.get(self.CLE_DERNIER_ID) or 0)
+
+    def _evenements(self, utilisateur_id, depuis_id):
+        return [json.loads(e) for e in self._client.zrangebyscore(self._cle(utilisateur_id), f"({depuis_id}", '+inf')]
+
+    def lire(self, utilisateur_id, depuis_id, attente=0):
+        """Retourne les événements de l'utilisateur postérieurs à depuis_id, en attendant au plus `attente` secondes"""
+        evenements = self._evenements(utilisateur_id, depuis_id)
+        if evenements or attente <= 0:
+            return evenements
+        fin = time.monotonic() + attente
+        abonnement = self._client.pubsub(ignore_subscribe_messages=True)
+        try:
+            abonnement.subscribe(self._canal(utilisateur_id))
+            while True:
+                # Relecture après l'abonnement : un événement publié entre-temps n'est pas manqué
+                evenements = self._evenements(utilisateur_id, depuis_id)
+                restant = fin - time.monotonic()
+                if evenements or restant <= 0:
+                    return evenements
+                abonnement.get_message(timeout=restant)
+        finally:
+            abonnement.close()
+
+
+_bus = None
+_verrou_bus = threading.Lock()
+
+
+def get_bus():
+    """Retourne le bus d'événements configuré (EVENEMENTS_BACKEND), créé à la première utilisation"""
+    global _bus
+    if _bus is None:
+        with _verrou_bus:
+            if _bus is None:
+                backend = getattr(settings, 'EVENEMENTS_BACKEND', 'core.evenements.BackendMemoire')
+                _bus = import_string(backend)()
+    return _bus
+
+
+def publier(destinataires, type_evenement, donnees):
+    """Publie un événement après la validation de la transaction courante"""
+    destinataires = [d for d in destinataires if d]
+    if destinataires:
+        transaction.on_commit(lambda: get_bus().publier(destinataires, type_evenement, donnees))
+
+
+def _entier(valeur, defaut):
+    try:
+        return int(valeur)
+    except (TypeError, ValueError):
+        return defaut
+
+
+def reponse_flux(request, user):
+    """
+    Réponse au client abonné : SSE si demandé, sinon long-poll JSON.
+
+    Paramètres GET :
+        depuis: identifiant du dernier événement reçu (ou en-tête Last-Event-ID) ;
+                absent, la réponse renvoie seulement le curseur courant
+        attente: durée maximale d'attente en secondes (plafonnée à EVENEMENTS_ATTENTE_MAX)
+    """
+    bus = get_bus()
+    depuis = _entier(request.GET.get('depuis', request.headers.get('Last-Event-ID')), None)
+    attente_max = getattr(settings, 'EVENEMENTS_ATTENTE_MAX', 25)
+    attente = min(max(_entier(request.GET.get('attente'), attente_max), 0), attente_max)
+
+    if attente_max > 0:
+        # Pas de connexion à la base gardée pendant l'attente
+        connections.close_all()
+
+    if attente_max > 0 and 'text/event-stream' in request.headers.get('Accept', ''):
+        duree = getattr(settings, 'EVENEMENTS_SSE_DUREE', 55)
+
+        def flux(dernier):
+            # Le flux est borné dans le temps : EventSource se reconnecte avec Last-Event-ID
+            yield f"retry: 1000\n\n"
+            fin = time.monotonic() + duree
+            while time.monotonic() < fin:
+                evenements = bus.lire(user.id, dernier, attente=min(15, max(fin - time.monotonic(), 0)))
+                for evenement in evenements:
+                    dernier = evenement['id']
+                    yield f"id: {evenement['id']}\nevent: {evenement['type']}\ndata: {json.dumps(evenement, ensure_ascii=False)}\n\n"
+                if not evenements:
+                    yield ": ping\n\n"
+
+        response = StreamingHttpResponse(flux(bus.dernier_id() if depuis is None else depuis), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    if depuis is None:
+        return JsonResponse({'evenements': [], 'dernier_id': bus.dernier_id()})
+    evenements = bus.lire(user.id, depuis, attente=attente)
+    return JsonResponse({
+        'evenements': evenements,
+        'dernier_id': evenements[-1]['id'] if evenements else depuis,
+    })
@@ -0,0 +1,277 @@
+"""
+Exports tabulaires en flux : Excel (xlsx), CSV et JSON lines.
+
+Une vue décrit les colonnes de son export par une liste de `Colonne` (titre,
+valeur, largeur, format) et appelle `exporter`. Les lignes ne sont parcourues
+qu'une fois, et les querysets le sont avec .iterator(), sans cache de
+résultats : la mémoire reste stable quel que soit le nombre de lignes.
+
+- Excel : classeur xlsxwriter en mode constant_memory (une ligne en mémoire à
+  la fois), écrit dans un fichier temporaire servi par FileResponse. La
+  largeur des colonnes vient de la description, sans seconde passe.
+- CSV et JSON lines : lignes produites une à une dans une StreamingHttpResponse.
+
+Le format est choisi par le paramètre GET `format` (xlsx par défaut).
+"""
+import csv
+import json
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+
+import xlsxwriter
+from django.db.models import QuerySet
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+from django.utils.text import slugify
+
+TAILLE_LOT = 2000
+FORMATS = ('xlsx', 'csv', 'jsonl')
+TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+STYLE_EN_TETE = {'bold': True, 'text_wrap': True, 'valign': 'top', 'fg_color': '#D7E4BC', 'border': 1}
+STYLES_CELLULE = {
+    'date': {'num_format': 'dd/mm/yyyy'},
+    'datetime': {'num_format': 'dd/mm/yyyy hh:mm'},
+    'entier': {'num_format': '0'},
+    'decimal': {'num_format': '0.00'},
+}
+FORMATS_TEXTE = {'date': '%d/%m/%Y', 'datetime': '%d/%m/%Y %H:%M'}
+
+
+class Colonne:
+    """
+    Description d'une colonne d'export.
+
+    Args:
+        titre: en-tête de la colonne
+        valeur: chemin d'attributs ou de clés ('vehicule.immatriculation',
+                'get_statut_display'), ou fonction recevant la ligne
+        largeur: largeur de la colonne Excel, en caractères
+        format: 'date', 'datetime', 'entier', 'decimal', ou None pour du texte
+        defaut: valeur écrite quand la valeur est nulle (Excel et CSV)
+        cle: nom du champ en JSON lines (par défaut déduit du chemin ou du titre)
+    """
+
+    def __init__(self, titre, valeur, largeur=15, format=None, defaut='', cle=None):
+        self.titre = titre
+        self.valeur = valeur
+        self.largeur = largeur
+        self.format = format
+        self.defaut = defaut
+        if cle is None:
+            cle = valeur.replace('.', '_') if isinstance(valeur, str) else slugify(titre).replace('-', '_')
+        self.cle = cle
+
+    def valeur_brute(self, ligne):
+        if callable(self.valeur):
+            return self.valeur(ligne)
+        valeur = ligne
+        for nom in self.valeur.split('.'):
+            if valeur is None:
+                return None
+            valeur = valeur.get(nom) if isinstance(valeur, dict) else getattr(valeur, nom)
+            if callable(valeur):
+                valeur = valeur()
+        return valeur
+
+    def extraire(self, ligne):
+        valeur = self.valeur_brute(ligne)
+        return self.defaut if valeur is None else valeur
+
+
+def iterer(lignes, taille_lot=TAILLE_LOT):
+    """Parcourt les lignes une seule fois ; un queryset est lu par lots, sans cache"""
+    if isinstance(lignes, QuerySet):
+        return lignes.iterator(chunk_size=taille_lot)
+    return iter(lignes)
+
+
+def _heure_locale(valeur):
+    if isinstance(valeur, datetime) and timezone.is_aware(valeur):
+        return timezone.localtime(valeur).replace(tzinfo=None)
+    return valeur
+
+
+def _cellule(valeur):
+    """Valeur acceptée par xlsxwriter"""
+    valeur = _heure_locale(valeur)
+    if isinstance(valeur, Decimal):
+        return float(valeur)
+    if isinstance(valeur, (str, int, float, date)):
+        return valeur
+    return str(valeur)
+
+
+def _texte(colonne, valeur):
+    """Valeur d'une cellule CSV"""
+    valeur = _heure_locale(valeur)
+    if isinstance(valeur, date):
+        format_texte = FORMATS_TEXTE.get(colonne.format)
+        if format_texte is None:
+            format_texte = FORMATS_TEXTE['datetime'] if isinstance(valeur, datetime) else FORMATS_TEXTE['date']
+        return valeur.strftime(format_texte)
+    return valeur
+
+
+def _json(valeur):
+    if isinstance(valeur, (date, datetime)):
+        return valeur.isoformat()
+    if isinstance(valeur, Decimal):
+        return float(valeur)
+    return str(valeur)
+
+
+def _ligne_totaux(colonnes, totaux):
+    """Ligne de totaux : {titre de colonne: valeur}, libellé TOTAL en première colonne"""
+    ligne = [totaux.get(colonne.titre, '') for colonne in colonnes]
+    if colonnes and colonnes[0].titre not in totaux:
+        ligne[0] = 'TOTAL'
+    return ligne
+
+
+class ClasseurExport:
+    """
+    Classeur Excel en mode constant_memory, écrit dans un fichier temporaire.
+
+    En constant_memory, chaque feuille doit être écrite ligne après ligne, dans
+    l'ordre : titres, puis en-têtes et données avec `ecrire_lignes`.
+    """
+
+    def __init__(self):
+        self.fichier = tempfile.TemporaryFile()
+        self.classeur = xlsxwriter.Workbook(self.fichier, {'constant_memory': True})
+        self.style_en_tete = self.classeur.add_format(STYLE_EN_TETE)
+        self.style_titre = self.classeur.add_format({'bold': True, 'font_size': 14})
+        self.style_total = self.classeur.add_format({'bold': True, 'top': 1})
+        self.styles = {nom: self.classeur.add_format(style) for nom, style in STYLES_CELLULE.items()}
+
+    def add_format(self, proprietes):
+        return self.classeur.add_format(proprietes)
+
+    def ajouter_feuille(self, nom):
+        return self.classeur.add_worksheet(nom[:31])
+
+    def ecrire_titre(self, feuille, ligne, texte, nombre_colonnes=1, style=None):
+        style = style or self.style_titre
+        if nombre_colonnes > 1:
+            feuille.merge_range(ligne, 0, ligne, nombre_colonnes - 1, texte, style)
+        else:
+            feuille.write(ligne, 0, texte, style)
+
+    def ecrire_lignes(self, feuille, lignes, colonnes, ligne_debut=0, totaux=None, autofiltre=False, style_en_tete=None):
+        """
+        Écrit l'en-tête puis les lignes à partir de `ligne_debut`.
+
+        Args:
+            totaux: {titre de colonne: valeur} écrits sous les données, après une ligne vide
+            autofiltre: ajoute un filtre automatique sur le tableau
+            style_en_tete: format des en-têtes, à la place du format par défaut
+
+        Returns:
+            int: index de la première ligne libre sous le tableau
+        """
+        for col, colonne in enumerate(colonnes):
+            feuille.set_column(col, col, colonne.largeur)
+            feuille.write(ligne_debut, col, colonne.titre, style_en_tete or self.style_en_tete)
+
+        styles = [self.styles.get(colonne.format) for colonne in colonnes]
+        rang = ligne_debut
+        for rang, ligne in enumerate(iterer(lignes), ligne_debut + 1):
+            for col, colonne in enumerate(colonnes):
+                feuille.write(rang, col, _cellule(colonne.extraire(ligne)), styles[col])
+        if autofiltre:
+            feuille.autofilter(ligne_debut, 0, rang, len(colonnes) - 1)
+        rang += 1
+
+        if totaux:
+            rang += 1
+            for col, valeur in enumerate(_ligne_totaux(colonnes, totaux)):
+                feuille.write(rang, col, _cellule(valeur), self.style_total)
+            rang += 1
+        return rang
+
+    def reponse(self, nom_fichier):
+        """Ferme le classeur et le sert en pièce jointe ; le fichier temporaire est supprimé à la fermeture"""
+        self.classeur.close()
+        self.fichier.seek(0)
+        return FileResponse(self.fichier, as_attachment=True, filename=nom_fichier, content_type=TYPE_XLSX)
+
+
+def reponse_excel(lignes, colonnes, nom_fichier, titre=None, totaux=None, nom_feuille='Données'):
+    """
+    Classeur d'une feuille : titre et date de génération (optionnels), en-têtes, données, totaux.
+
+    Args:
+        nom_fichier: nom du fichier, sans extension
+    """
+    export = ClasseurExport()
+    feuille = export.ajouter_feuille(nom_feuille)
+    ligne = 0
+    if titre:
+        export.ecrire_titre(feuille, 0, titre, len(colonnes))
+        export.ecrire_titre(feuille, 1, f"Généré le {timezone.localtime().strftime('%d/%m/%Y %H:%M')}", len(colonnes), style=export.add_format({}))
+        ligne = 3
+    export.ecrire_lignes(feuille, lignes, colonnes, ligne, totaux=totaux)
+    return export.reponse(f"{nom_fichier}.xlsx")
+
+
+class _Tampon:
+    """Pseudo-fichier pour csv.writer : renvoie la ligne écrite au lieu de la stocker"""
+
+    def write(self, valeur):
+        return valeur
+
+
+def _flux_csv(lignes, colonnes, totaux):
+    writer = csv.writer(_Tampon())
+    # BOM pour qu'Excel reconnaisse l'UTF-8
+    yield '\ufeff' + writer.writerow([colonne.titre for colonne in colonnes])
+    for ligne in iterer(lignes):
+        yield writer.writerow([_texte(colonne, colonne.extraire(ligne)) for colonne in colonnes])
+    if totaux:
+        yield writer.writerow(_ligne_totaux(colonnes, totaux))
+
+
+def _flux_jsonl(lignes, colonnes):
+    for ligne in iterer(lignes):
+        yield json.dumps({colonne.cle: colonne.valeur_brute(ligne) for colonne in colonnes}, default=_json, ensure_ascii=False) + '\n'
+
+
+def reponse_csv(lignes, colonnes, nom_fichier, totaux=None):
+    response = StreamingHttpResponse(_flux_csv(lignes, colonnes, totaux), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = content_disposition_header(True, f"{nom_fichier}.csv")
+    return response
+
+
+def reponse_jsonl(lignes, colonnes, nom_fichier):
+    response = StreamingHttpResponse(_flux_jsonl(lignes, colonnes), content_type='application/x-ndjson; charset=utf-8')
+    response['Content-Disposition'] = content_disposition_header(True, f"{nom_fichier}.jsonl")
+    return response
+
+
+def format_demande(request, defaut='xlsx'):
+    """Format d'export demandé par le paramètre GET `format`"""
+    format_export = request.GET.get('format', defaut) if request is not None else defaut
+    return format_export if format_export in FORMATS else defaut
+
+
+def exporter(request, lignes, colonnes, nom_fichier, titre=None, totaux=None, nom_feuille='Données'):
+    """
+    Exporte les lignes au format demandé (xlsx, csv ou jsonl).
+
+    Args:
+        request: requête portant le paramètre `format` ; None pour un export Excel
+        lignes: queryset (lu avec .iterator()), liste ou générateur
+        colonnes: liste de `Colonne`
+        nom_fichier: nom du fichier, sans extension
+        titre: titre du classeur Excel
+        totaux: {titre de colonne: valeur} ajoutés en fin d'export (Excel et CSV)
+    """
+    format_export = format_demande(request)
+    if format_export == 'csv':
+        return reponse_csv(lignes, colonnes, nom_fichier, totaux=totaux)
+    if format_export == 'jsonl':
+        return reponse_jsonl(lignes, colonnes, nom_fichier)
+    return reponse_excel(lignes, colonnes, nom_fichier, titre=titre, totaux=totaux, nom_feuille=nom_feuille)
@@ -0,0 +1,103 @@
+"""
+Jetons d'authentification de l'API mobile.
+
+`api_login` émet deux jetons signés (HMAC SHA-256 avec SECRET_KEY, via
+django.core.signing) et horodatés :
+
+- le jeton d'accès (API_JETON_ACCES_DUREE) porte l'identifiant et le rôle de
+  l'utilisateur. Sa vérification ne touche pas la base : signature et âge
+  sont contrôlés localement, puis l'utilisateur est lu dans un cache de courte
+  durée (API_PRINCIPAL_CACHE_TTL), invalidé à chaque modification de
+  l'utilisateur (core.signals) ;
+- le jeton de rafraîchissement (API_JETON_RAFRAICHISSEMENT_DUREE) permet
+  d'obtenir de nouveaux jetons sans renvoyer le mot de passe. Il contient une
+  empreinte du hash du mot de passe : un changement de mot de passe révoque
+  tous les jetons de rafraîchissement émis avant.
+
+Un jeton ne peut pas être forgé sans SECRET_KEY, et un jeton d'accès n'est
+pas accepté comme jeton de rafraîchissement (sels distincts).
+"""
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .models import Utilisateur
+
+ROLES_MOBILES = ('chauffeur', 'dispatch', 'demandeur')
+SEL_ACCES = 'core.api.jeton.acces'
+SEL_RAFRAICHISSEMENT = 'core.api.jeton.rafraichissement'
+
+
+class JetonInvalide(Exception):
+    """Jeton mal formé, falsifié, expiré ou révoqué"""
+    pass
+
+
+def _duree_acces():
+    return getattr(settings, 'API_JETON_ACCES_DUREE', 900)
+
+
+def _duree_rafraichissement():
+    return getattr(settings, 'API_JETON_RAFRAICHISSEMENT_DUREE', 30 * 86400)
+
+
+def _empreinte_mot_de_passe(user):
+    return salted_hmac('core.api.jeton.mot_de_passe', user.password).hexdigest()[:16]
+
+
+def emettre_jetons(user):
+    """Jeton d'accès et jeton de rafraîchissement pour l'utilisateur"""
+    return {
+        'access_token': signing.dumps({'u': user.pk, 'r': user.role}, salt=SEL_ACCES),
+        'refresh_token': signing.dumps({'u': user.pk, 'r': user.role, 'p': _empreinte_mot_de_passe(user)}, salt=SEL_RAFRAICHISSEMENT),
+        'token_type': 'Bearer',
+        'expires_in': _duree_acces(),
+    }
+
+
+def _lire(jeton, sel, duree):
+    try:
+        contenu = signing.loads(jeton, salt=sel, max_age=duree)
+    except signing.SignatureExpired:
+        raise JetonInvalide("Jeton expiré")
+    except signing.BadSignature:
+        raise JetonInvalide("Jeton invalide")
+    if not isinstance(contenu, dict) or not isinstance(contenu.get('u'), int) or contenu.get('r') not in ROLES_MOBILES:
+        raise JetonInvalide("Jeton invalide")
+    return contenu
+
+
+def verifier_jeton_acces(jeton):
+    """Vérifie un jeton d'accès sans accès à la base. Retourne (id utilisateur, rôle)"""
+    contenu = _lire(jeton, SEL_ACCES, _duree_acces())
+    return contenu['u'], contenu['r']
+
+
+def _cle_principal(user_id):
+    return f"api:principal:{user_id}"
+
+
+def principal(user_id):
+    """Utilisateur actif du jeton, depuis le cache (une requête au plus par API_PRINCIPAL_CACHE_TTL)"""
+    cle = _cle_principal(user_id)
+    user = cache.get(cle)
+    if user is None:
+        user = Utilisateur.objects.select_related('etablissement').filter(pk=user_id, is_active=True).first()
+        if user is None:
+            return None
+        cache.set(cle, user, getattr(settings, 'API_PRINCIPAL_CACHE_TTL', 60))
+    return user
+
+
+def invalider_principal(user_id):
+    cache.delete(_cle_principal(user_id))
+
+
+def rafraichir_jetons(jeton):
+    """Nouveaux jetons à partir d'un jeton de rafraîchissement valide"""
+    contenu = _lire(jeton, SEL_RAFRAICHISSEMENT, _duree_rafraichissement())
+    user = Utilisateur.objects.filter(pk=contenu['u'], is_active=True).first()
+    if user is None or user.role != contenu['r'] or not constant_time_compare(contenu.get('p', ''), _empreinte_mot_de_passe(user)):
+        raise JetonInvalide("Jeton révoqué")
+    return user, emettre_jetons(user)
@@ -0,0 +1,188 @@
+"""
+Service kilométrique : dernier relevé connu de chaque véhicule.
+
+Chaque module qui relève le compteur (courses, ravitaillements, entretiens,
+check-lists de sécurité) alimente la ligne DernierKilometrage du véhicule à
+l'écriture, via les signaux de core.signals. Les contrôles de saisie et les
+endpoints AJAX lisent cette ligne avec `get_kilometrage` / `lire_releve`, servie
+depuis le cache : un contrôle coûte au plus une requête et tous les modules
+comparent la saisie à la même valeur.
+
+Le relevé ne fait que croître, sauf correction explicite (`definir_kilometrage`)
+ou modification/suppression de l'objet qui l'a fourni, auquel cas il est
+recalculé à partir des historiques (`recalculer_kilometrage`).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Vehicule, Course, DernierKilometrage
+
+
+def _cle_cache(vehicule_id):
+    return f"kilometrage:vehicule:{vehicule_id}"
+
+
+def _identifiant(vehicule):
+    return getattr(vehicule, 'pk', vehicule)
+
+
+def invalider_cache(vehicule_id):
+    """Oublie le relevé en cache, maintenant et après la validation de la transaction courante"""
+    cle = _cle_cache(vehicule_id)
+    cache.delete(cle)
+    transaction.on_commit(lambda: cache.delete(cle))
+
+
+def _sources():
+    """Requêtes (source, queryset annoté 'km') donnant les relevés de chaque module"""
+    from ravitaillement.models import Ravitaillement
+    from entretien.models import Entretien
+    from securite.models import CheckListSecurite
+
+    zero = Value(0)
+    return (
+        ('course', Course.objects.filter(vehicule__isnull=False).annotate(
+            km=Greatest(Coalesce('kilometrage_depart', zero), Coalesce('kilometrage_fin', zero)))),
+        ('ravitaillement', Ravitaillement.objects.annotate(km=Greatest('kilometrage_avant', 'kilometrage_apres'))),
+        ('entretien', Entretien.objects.annotate(km=Greatest('kilometrage', 'kilometrage_apres'))),
+        ('checklist', CheckListSecurite.objects.annotate(km=Coalesce('kilometrage', zero))),
+    )
+
+
+def calculer_kilometrage(vehicule_id, exclure=None):
+    """
+    Recalcule le dernier relevé d'un véhicule à partir des historiques, sans l'enregistrer.
+
+    Args:
+        vehicule_id: identifiant du véhicule
+        exclure: couple (source, objet_id) à ignorer, ex. l'entretien en cours de modification
+
+    Returns:
+        tuple: (kilometrage, source, objet_id), ou None si le véhicule n'existe pas
+    """
+    vehicule = Vehicule.objects.filter(pk=vehicule_id).values_list('kilometrage_actuel').first()
+    if vehicule is None:
+        return None
+
+    meilleur = (0, 'vehicule', None)
+    for source, queryset in _sources():
+        queryset = queryset.filter(vehicule_id=vehicule_id)
+        if exclure and exclure[0] == source:
+            queryset = queryset.exclude(pk=exclure[1])
+        releve = queryset.order_by('-km').values_list('km', 'pk').first()
+        if releve and releve[0] and releve[0] > meilleur[0]:
+            meilleur = (releve[0], source, releve[1])
+
+    # Aucun relevé : on garde la valeur saisie sur la fiche du véhicule
+    if not meilleur[0]:
+        meilleur = (vehicule[0] or 0, 'vehicule', None)
+    return meilleur
+
+
+def _ecrire(vehicule_id, kilometrage, source, objet_id):
+    champs = {'kilometrage': kilometrage, 'source': source, 'objet_id': objet_id, 'date_releve': timezone.now()}
+    if not DernierKilometrage.objects.filter(vehicule_id=vehicule_id).update(**champs):
+        try:
+            with transaction.atomic():
+                DernierKilometrage.objects.create(vehicule_id=vehicule_id, **champs)
+        except IntegrityError:
+            # Ligne créée entre-temps par une requête concurrente
+            DernierKilometrage.objects.filter(vehicule_id=vehicule_id).update(**champs)
+    invalider_cache(vehicule_id)
+
+
+def recalculer_kilometrage(vehicule):
+    """Recalcule et enregistre le dernier relevé d'un véhicule. Retourne le kilométrage, ou None"""
+    vehicule_id = _identifiant(vehicule)
+    resultat = calculer_kilometrage(vehicule_id)
+    if resultat is None:
+        return None
+    _ecrire(vehicule_id, *resultat)
+    return resultat[0]
+
+
+def enregistrer_releve(vehicule, kilometrage, source, objet_id=None):
+    """
+    Prend en compte un relevé du compteur.
+
+    Le dernier kilométrage n'est remplacé que par une valeur supérieure ou égale,
+    en une seule requête dans le cas courant. Si l'objet qui fournissait le
+    relevé a été corrigé à la baisse, le relevé est recalculé.
+    """
+    vehicule_id = _identifiant(vehicule)
+    if not vehicule_id or kilometrage is None:
+        return
+    releves = DernierKilometrage.objects.filter(vehicule_id=vehicule_id)
+    if releves.filter(kilometrage__lte=kilometrage).update(
+        kilometrage=kilometrage, source=source, objet_id=objet_id, date_releve=timezone.now()
+    ):
+        invalider_cache(vehicule_id)
+        return
+    releve = releves.values_list('source', 'objet_id').first()
+    if releve is None or (objet_id is not None and releve == (source, objet_id)):
+        recalculer_kilometrage(vehicule_id)
+
+
+def oublier_releve(vehicule, source, objet_id):
+    """Recalcule le relevé si l'objet supprimé en était la source"""
+    vehicule_id = _identifiant(vehicule)
+    if vehicule_id and DernierKilometrage.objects.filter(vehicule_id=vehicule_id, source=source, objet_id=objet_id).exists():
+        recalculer_kilometrage(vehicule_id)
+
+
+def definir_kilometrage(vehicule, kilometrage, source='correction', objet_id=None):
+    """Impose le dernier kilométrage d'un véhicule (correction), y compris à la baisse"""
+    _ecrire(_identifiant(vehicule), kilometrage, source, objet_id)
+
+
+def lire_releve(vehicule):
+    """
+    Retourne le dernier relevé d'un véhicule depuis le cache (une requête au plus sinon).
+
+    Returns:
+        dict: kilometrage, source, date_releve, immatriculation et
+        kilometrage_dernier_entretien du véhicule ; None si le véhicule n'existe pas
+    """
+    vehicule_id = _identifiant(vehicule)
+    cle = _cle_cache(vehicule_id)
+    releve = cache.get(cle)
+    if releve is not None:
+        return releve
+    lignes = DernierKilometrage.objects.filter(vehicule_id=vehicule_id).values(
+        'kilometrage', 'source', 'date_releve',
+        immatriculation=F('vehicule__immatriculation'),
+        kilometrage_dernier_entretien=F('vehicule__kilometrage_dernier_entretien'),
+    )
+    releve = lignes.first()
+    if releve is None:
+        # Véhicule jamais relevé (ou ligne absente) : on la construit une fois
+        if recalculer_kilometrage(vehicule_id) is None:
+            return None
+        releve = lignes.first()
+    cache.set(cle, releve, getattr(settings, 'KILOMETRAGE_CACHE_TTL', 300))
+    return releve
+
+
+def get_kilometrage(vehicule, exclure=None):
+    """
+    Dernier kilométrage connu d'un véhicule, 0 si inconnu.
+
+    Args:
+        vehicule: véhicule ou identifiant
+        exclure: couple (source, objet_id) à ignorer, pour contrôler la
+                 modification d'un objet sans le comparer à lui-même
+    """
+    vehicule_id = _identifiant(vehicule)
+    if not vehicule_id:
+        return 0
+    if exclure:
+        releve = DernierKilometrage.objects.filter(vehicule_id=vehicule_id).values_list('source', 'objet_id').first()
+        if releve == tuple(exclure):
+            resultat = calculer_kilometrage(vehicule_id, exclure=exclure)
+            return resultat[0] if resultat else 0
+    releve = lire_releve(vehicule_id)
+    return releve['kilometrage'] if releve else 0
@@ -1,6 +1,5 @@
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from core.models import Course, Vehicule, HistoriqueKilometrage
+from core.models import Course, Vehicule
 from django.utils import timezone
 import logging
 
@@ -63,6 +62,7 @@ class Command(BaseCommand):
             # Calculer le kilométrage correct en partant du kilométrage initial
             kilometrage_courant = vehicule.kilometrage_actuel or 0
             courses_corrigees = []
+            courses_a_enregistrer = []
 
             for course in courses:
                 km_depart = course.kilometrage_depart
@@ -92,30 +92,25 @@ class Command(BaseCommand):
                     courses_corrigees.append(correction)
 
                     if fix:
-                        with transaction.atomic():
-                            # Mettre à jour la course
-                            course.kilometrage_fin = nouveau_km_fin
-                            course.distance_parcourue = nouvelle_distance
-                            course.save()
-
-                            # Créer une entrée dans l'historique
-                            HistoriqueKilometrage.objects.create(
-                                vehicule=vehicule,
-                                utilisateur=course.chauffeur,
-                                module='course',
-                                objet_id=course.id,
-                                valeur_avant=km_fin,
-                                valeur_apres=nouveau_km_fin,
-                                commentaire=f"Correction automatique - Distance excessive réduite de {distance_calculee} à {nouvelle_distance} km"
-                            )
-
-                            corrections_appliquees += 1
+                        course.kilometrage_fin = nouveau_km_fin
+                        course.distance_parcourue = nouvelle_distance
+                        course._distance_initiale = distance_calculee
+                        courses_a_enregistrer.append(course)
 
                     self.stdout.write(
                         f"  → Correction: {km_fin} → {nouveau_km_fin} km "
                         f"(distance: {distance_calculee} → {nouvelle_distance} km)"
                     )
 
+            # Enregistrement groupé : une mise à jour et un seul insert d'historique par véhicule
+            if courses_corrigees and fix:
+                Course.enregistrer_en_masse(
+                    courses_a_enregistrer,
+                    ['kilometrage_fin', 'distance_parcourue'],
+                    commentaire=lambda course: f"Correction automatique - Distance excessive réduite de {course._distance_initiale} à {course.distance_parcourue} km",
+                )
+                corrections_appliquees += len(courses_a_enregistrer)
+
             # Mettre à jour le kilométrage du véhicule si nécessaire
             if courses_corrigees and fix:
                 dernier_km = max(course.kilometrage_fin for course in courses if course.kilometrage_fin)
@@ -0,0 +1,37 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Supprime les sessions expirées de la table django_session, par lots (à planifier une fois par jour). "
+        "Sans effet avec les sessions en cookie signé."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lot',
+            type=int,
+            default=1000,
+            help='Nombre de sessions supprimées par requête (défaut : 1000)'
+        )
+
+    def handle(self, *args, **options):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store, 'get_model_class'):
+            self.stdout.write(f"Moteur de sessions sans table ({settings.SESSION_ENGINE}) : rien à purger")
+            return
+
+        # Par lots de clés plutôt qu'un seul DELETE : la table reste disponible pendant la purge
+        Session = store.get_model_class()
+        expirees = Session.objects.filter(expire_date__lt=timezone.now())
+        nombre = 0
+        while True:
+            cles = list(expirees.values_list('session_key', flat=True)[:options['lot']])
+            if not cles:
+                break
+            nombre += Session.objects.filter(session_key__in=cles).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"{nombre} session(s) expirée(s) supprimée(s)"))
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import CourseSupprimee
+
+
+class Command(BaseCommand):
+    help = (
+        "Supprime les traces de courses supprimées plus anciennes que API_SYNCHRO_RETENTION jours, "
+        "par lots (planifiée chaque nuit par notifications.scheduler)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lot',
+            type=int,
+            default=1000,
+            help='Nombre de traces supprimées par requête (défaut : 1000)'
+        )
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=getattr(settings, 'API_SYNCHRO_RETENTION', 30))
+        anciennes = CourseSupprimee.objects.filter(date_suppression__lt=timezone.now() - retention)
+        # Par lots d'identifiants : la table reste disponible pendant la purge
+        nombre = 0
+        while True:
+            identifiants = list(anciennes.values_list('id', flat=True)[:options['lot']])
+            if not identifiants:
+                break
+            nombre += CourseSupprimee.objects.filter(id__in=identifiants).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"{nombre} trace(s) de suppression purgée(s)"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from core.models import Vehicule
+from core.kilometrage import recalculer_kilometrage
+
+
+class Command(BaseCommand):
+    help = "Recalcule le dernier relevé kilométrique des véhicules à partir des historiques (après un import ou des mises à jour en masse)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--vehicule',
+            type=str,
+            help='Immatriculation du véhicule à recalculer (optionnel)'
+        )
+
+    def handle(self, *args, **options):
+        vehicules = Vehicule.objects.order_by('id')
+        if options.get('vehicule'):
+            vehicules = vehicules.filter(immatriculation=options['vehicule'])
+
+        nombre = 0
+        for vehicule_id, immatriculation in vehicules.values_list('id', 'immatriculation'):
+            kilometrage = recalculer_kilometrage(vehicule_id)
+            self.stdout.write(f"{immatriculation} : {kilometrage} km")
+            nombre += 1
+        self.stdout.write(self.style.SUCCESS(f"{nombre} véhicule(s) recalculé(s)"))
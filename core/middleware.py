@@ -1,8 +1,76 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
 from django.shortcuts import redirect
 from django.utils import timezone
 from django.urls import reverse
 from .models import ApplicationControl
 
+APPLICATION_CONTROL_CACHE_KEY = 'core:application_control'
+_ABSENT = object()
+
+# Cache du processus : état du contrôle d'accès et instant d'expiration (horloge monotone)
+_etat_local = {'valeur': None, 'expire': 0.0}
+
+
+def _cache_partage():
+    """Retourne le cache partagé entre workers s'il est configuré (ex. Redis), sinon None"""
+    alias = getattr(settings, 'APPLICATION_CONTROL_CACHE_ALIAS', None)
+    return caches[alias] if alias else None
+
+
+def get_application_control_state():
+    """
+    Retourne l'état du contrôle d'accès sous forme de dictionnaire, ou None s'il n'existe pas.
+
+    L'état est conservé en mémoire du processus pendant APPLICATION_CONTROL_CACHE_TTL
+    secondes, puis relu depuis le cache partagé (si configuré) et en dernier recours
+    depuis la base. Toute modification de ApplicationControl invalide le cache
+    (voir core.signals), le chemin chaud ne coûte donc aucune requête SQL.
+    """
+    maintenant = time.monotonic()
+    if maintenant < _etat_local['expire']:
+        return _etat_local['valeur']
+
+    cache_partage = _cache_partage()
+    etat = cache_partage.get(APPLICATION_CONTROL_CACHE_KEY, _ABSENT) if cache_partage else _ABSENT
+    if etat is _ABSENT:
+        try:
+            control = ApplicationControl.objects.get(pk=1)
+            etat = {
+                'is_open': control.is_open,
+                'start_datetime': control.start_datetime,
+                'end_datetime': control.end_datetime,
+                'message': control.message,
+            }
+        except ApplicationControl.DoesNotExist:
+            etat = None
+        if cache_partage:
+            cache_partage.set(APPLICATION_CONTROL_CACHE_KEY, etat, getattr(settings, 'APPLICATION_CONTROL_SHARED_CACHE_TTL', 60))
+
+    _etat_local['valeur'] = etat
+    _etat_local['expire'] = maintenant + getattr(settings, 'APPLICATION_CONTROL_CACHE_TTL', 5)
+    return etat
+
+
+def _oublier_etat():
+    _etat_local['expire'] = 0.0
+    cache_partage = _cache_partage()
+    if cache_partage:
+        cache_partage.delete(APPLICATION_CONTROL_CACHE_KEY)
+
+
+def invalider_cache_application_control():
+    """
+    Force la relecture de l'état du contrôle d'accès, maintenant et après la
+    validation de la transaction courante : un autre worker qui relit l'ancienne
+    ligne avant la validation ne la garde pas dans le cache partagé.
+    """
+    _oublier_etat()
+    transaction.on_commit(_oublier_etat)
+
+
 class ApplicationAccessControlMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -20,15 +88,43 @@ class ApplicationAccessControlMiddleware:
         # Autoriser l'accès à /application-control/ si la session spéciale est présente
         if '/application-control/' in request.path and request.session.get('admin_control_authenticated'):
             return self.get_response(request)
-        # Si l'application est bloquée
-        try:
-            control = ApplicationControl.objects.get(pk=1)
-        except ApplicationControl.DoesNotExist:
+        # Si l'application est bloquée (état mis en cache, voir get_application_control_state)
+        control = get_application_control_state()
+        if control is None:
             return self.get_response(request)
         now = timezone.now()
-        is_blocked = (not control.is_open) or (control.end_datetime and now > control.end_datetime) or (control.start_datetime and now < control.start_datetime)
+        is_blocked = (not control['is_open']) or (control['end_datetime'] and now > control['end_datetime']) or (control['start_datetime'] and now < control['start_datetime'])
         if is_blocked:
-            request.session['block_message'] = control.message
+            # La page de blocage relit le message dans l'état en cache : aucune écriture de session
             return redirect('application_blocked')
         # Si non bloqué, fonctionnement normal
-        return self.get_response(request) 
\ No newline at end of file
+        return self.get_response(request)
+
+
+class RenouvellementSessionMiddleware:
+    """
+    Prolonge la session seulement quand elle approche de son expiration.
+
+    Remplace SESSION_SAVE_EVERY_REQUEST, qui réécrit la session (ligne
+    django_session et cookie) à chaque requête : l'heure du dernier
+    renouvellement est conservée dans la session, qui n'est réenregistrée que
+    lorsqu'il lui reste moins de SESSION_RENOUVELLEMENT_SEUIL secondes, ou
+    quand son contenu change.
+    """
+    CLE = '_session_renouvelee'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        session = getattr(request, 'session', None)
+        if session is not None:
+            renouvelee = session.get(self.CLE)
+            # Session existante (les visiteurs anonymes sans session n'en créent pas)
+            if session.session_key:
+                maintenant = int(time.time())
+                age = session.get_session_cookie_age()
+                seuil = getattr(settings, 'SESSION_RENOUVELLEMENT_SEUIL', age - 86400)
+                if renouvelee is None or renouvelee + age - maintenant < seuil:
+                    session[self.CLE] = maintenant
+        return self.get_response(request)
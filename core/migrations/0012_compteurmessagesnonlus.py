@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def initialiser_compteurs(apps, schema_editor):
+    Message = apps.get_model('core', 'Message')
+    CompteurMessagesNonLus = apps.get_model('core', 'CompteurMessagesNonLus')
+    lignes = (
+        Message.objects.filter(is_read=False)
+        .values('recipient_id', 'sender_id')
+        .annotate(nombre=models.Count('id'), dernier=models.Max('id'))
+        .order_by()
+    )
+    CompteurMessagesNonLus.objects.bulk_create([
+        CompteurMessagesNonLus(
+            utilisateur_id=ligne['recipient_id'],
+            correspondant_id=ligne['sender_id'],
+            non_lus=ligne['nombre'],
+            dernier_message_id=ligne['dernier'],
+        )
+        for ligne in lignes
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_historiquecorrectionkilometrage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompteurMessagesNonLus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('non_lus', models.PositiveIntegerField(default=0)),
+                ('correspondant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('dernier_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.message')),
+                ('utilisateur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compteurs_non_lus', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Compteur de messages non lus',
+                'verbose_name_plural': 'Compteurs de messages non lus',
+                'unique_together': {('utilisateur', 'correspondant')},
+            },
+        ),
+        migrations.RunPython(initialiser_compteurs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_message_conversation_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='actiontraceur',
+            index=models.Index(fields=['date_action'], name='actiontraceur_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['chauffeur', 'statut'], name='course_chauffeur_statut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['vehicule', 'statut', 'date_fin'], name='course_vehicule_statut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['date_demande'], name='course_date_demande_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['date_depart'], name='course_date_depart_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(condition=models.Q(('statut', 'en_attente')), fields=['date_demande'], name='course_en_attente_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Max, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def initialiser_releves(apps, schema_editor):
+    """Dernier relevé de chaque véhicule : maximum des relevés de chaque module (une requête groupée par module)"""
+    Vehicule = apps.get_model('core', 'Vehicule')
+    DernierKilometrage = apps.get_model('core', 'DernierKilometrage')
+    zero = Value(0)
+    sources = (
+        ('course', apps.get_model('core', 'Course').objects.filter(vehicule__isnull=False),
+         Greatest(Coalesce('kilometrage_depart', zero), Coalesce('kilometrage_fin', zero))),
+        ('ravitaillement', apps.get_model('ravitaillement', 'Ravitaillement').objects.all(),
+         Greatest('kilometrage_avant', 'kilometrage_apres')),
+        ('entretien', apps.get_model('entretien', 'Entretien').objects.all(),
+         Greatest('kilometrage', 'kilometrage_apres')),
+        ('checklist', apps.get_model('securite', 'CheckListSecurite').objects.all(),
+         Coalesce('kilometrage', zero)),
+    )
+    releves = {}
+    for source, queryset, expression in sources:
+        lignes = queryset.values('vehicule_id').annotate(km=Max(expression)).order_by()
+        for ligne in lignes:
+            if ligne['km'] and ligne['km'] > releves.get(ligne['vehicule_id'], (0, None))[0]:
+                releves[ligne['vehicule_id']] = (ligne['km'], source)
+    DernierKilometrage.objects.bulk_create([
+        DernierKilometrage(
+            vehicule_id=vehicule_id,
+            kilometrage=releves.get(vehicule_id, (kilometrage_actuel or 0,))[0],
+            source=releves.get(vehicule_id, (None, 'vehicule'))[1],
+        )
+        for vehicule_id, kilometrage_actuel in Vehicule.objects.values_list('id', 'kilometrage_actuel')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_index_acces'),
+        ('entretien', '0003_index_acces'),
+        ('ravitaillement', '0003_index_acces'),
+        ('securite', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DernierKilometrage',
+            fields=[
+                ('vehicule', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='dernier_kilometrage', serialize=False, to='core.vehicule')),
+                ('kilometrage', models.PositiveIntegerField(default=0)),
+                ('source', models.CharField(choices=[('vehicule', 'Véhicule'), ('course', 'Course'), ('ravitaillement', 'Ravitaillement'), ('entretien', 'Entretien'), ('checklist', 'Check-list de sécurité'), ('correction', 'Correction')], default='vehicule', max_length=20)),
+                ('objet_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('date_releve', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Dernier kilométrage',
+                'verbose_name_plural': 'Derniers kilométrages',
+            },
+        ),
+        migrations.RunPython(initialiser_releves, migrations.RunPython.noop),
+    ]
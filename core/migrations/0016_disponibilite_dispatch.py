@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_dernierkilometrage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicule',
+            name='nombre_places',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Nombre de places passagers (vide = non renseigné)', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['vehicule', 'statut', 'date_souhaitee'], name='course_conflit_vehicule_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_disponibilite_dispatch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['chauffeur', '-date_demande', '-id'], name='course_chauffeur_date_idx'),
+        ),
+    ]
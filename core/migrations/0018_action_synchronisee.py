@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_course_chauffeur_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActionSynchronisee',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cle', models.CharField(max_length=64)),
+                ('type_action', models.CharField(choices=[('demarrer', 'Démarrage de mission'), ('terminer', 'Fin de mission'), ('ravitaillement', 'Ravitaillement'), ('checklist', 'Check-list de sécurité')], max_length=20)),
+                ('resultat', models.JSONField(default=dict)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('utilisateur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actions_synchronisees', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Action synchronisée',
+                'verbose_name_plural': 'Actions synchronisées',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='actionsynchronisee',
+            constraint=models.UniqueConstraint(fields=('utilisateur', 'cle'), name='action_synchronisee_cle_unique'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_action_synchronisee'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseSupprimee',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_id', models.PositiveIntegerField()),
+                ('demandeur_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('date_suppression', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Course supprimée',
+                'verbose_name_plural': 'Courses supprimées',
+            },
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='date_modification',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['date_modification', 'id'], name='course_modification_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['demandeur', 'date_modification', 'id'], name='course_demandeur_modif_idx'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -122,6 +122,7 @@ class Vehicule(models.Model):
     createur = models.ForeignKey(Utilisateur, on_delete=models.SET_NULL, null=True, related_name='vehicules_crees')
     kilometrage_dernier_entretien = models.PositiveIntegerField(default=0, help_text="Kilométrage du dernier entretien effectué")
     kilometrage_actuel = models.PositiveIntegerField(null=True, blank=True, help_text="Kilométrage actuel du véhicule (centralisé)")
+    nombre_places = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Nombre de places passagers (vide = non renseigné)")
     
     def __str__(self):
         return f"{self.immatriculation} - {self.marque} {self.modele}"
@@ -190,7 +191,138 @@ class Vehicule(models.Model):
         date_estimee = timezone.now().date() + timezone.timedelta(days=jours_restant)
         return date_estimee, None
 
-class Course(models.Model):
+class SuiviKilometrageMixin:
+    """
+    Historique des champs kilométriques sans relire la ligne avant chaque enregistrement.
+
+    Les valeurs des champs suivis sont mémorisées au chargement (`from_db`) et
+    après chaque enregistrement ; `save` compare avec ces valeurs et écrit les
+    lignes HistoriqueKilometrage en un seul bulk_create. `enregistrer_en_masse`
+    fait de même pour une liste d'objets (commandes de gestion, corrections).
+
+    Attributs de classe :
+        champs_kilometrage: champs dont les modifications sont historisées
+        champs_suivis: autres champs dont la valeur initiale est utile (ex. statut)
+        module_kilometrage: valeur du champ HistoriqueKilometrage.module
+        champ_utilisateur_kilometrage: attributs candidats pour l'utilisateur de l'historique
+    """
+    champs_kilometrage = ()
+    champs_suivis = ()
+    module_kilometrage = None
+    champ_utilisateur_kilometrage = ()
+
+    @classmethod
+    def _attnames_suivis(cls):
+        return {cls._meta.get_field(champ).attname for champ in cls.champs_kilometrage + cls.champs_suivis}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        suivis = cls._attnames_suivis()
+        instance._valeurs_initiales = {nom: valeur for nom, valeur in zip(field_names, values) if nom in suivis}
+        return instance
+
+    def _memoriser_valeurs(self, champs=None):
+        suivis = self._attnames_suivis()
+        if champs is not None:
+            suivis &= set(champs)
+        self._valeurs_initiales = {**getattr(self, '_valeurs_initiales', {}), **{nom: getattr(self, nom) for nom in suivis}}
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._memoriser_valeurs(fields)
+
+    def valeurs_initiales(self):
+        """Valeurs des champs suivis telles qu'en base, None pour un objet non enregistré"""
+        if self._state.adding or self.pk is None:
+            return None
+        initiales = getattr(self, '_valeurs_initiales', {})
+        manquants = self._attnames_suivis() - initiales.keys()
+        if manquants:
+            # Objet construit à la main ou champ différé (only/defer) : une seule lecture
+            manquants = sorted(manquants)
+            ligne = type(self)._base_manager.filter(pk=self.pk).values_list(*manquants).first()
+            initiales = {**initiales, **dict(zip(manquants, ligne or (None,) * len(manquants)))}
+            self._valeurs_initiales = initiales
+        return initiales
+
+    def _utilisateur_kilometrage_id(self):
+        for attribut in self.champ_utilisateur_kilometrage:
+            valeur = getattr(self, f"{attribut}_id", None)
+            if valeur:
+                return valeur
+        return None
+
+    def lignes_historique_kilometrage(self, initiales, commentaire=None, champs=None):
+        """Lignes HistoriqueKilometrage (non enregistrées) décrivant les changements depuis `initiales`"""
+        lignes = []
+        nom_modele = type(self).__name__
+        if callable(commentaire):
+            commentaire = commentaire(self)
+        for champ in self.champs_kilometrage:
+            if champs is not None and champ not in champs:
+                continue
+            apres = getattr(self, champ)
+            avant = None if initiales is None else initiales.get(champ)
+            if apres is None or (initiales is not None and avant == apres):
+                continue
+            lignes.append(HistoriqueKilometrage(
+                vehicule_id=self.vehicule_id,
+                utilisateur_id=self._utilisateur_kilometrage_id(),
+                module=self.module_kilometrage,
+                objet_id=self.pk,
+                valeur_avant=avant,
+                valeur_apres=apres,
+                commentaire=commentaire or f"{'Création' if initiales is None else 'Modification'} du {champ} via {nom_modele} #{self.pk}",
+            ))
+        return lignes
+
+    def save(self, *args, **kwargs):
+        initiales = self.valeurs_initiales()
+        update_fields = kwargs.get('update_fields')
+        super().save(*args, **kwargs)
+        lignes = self.lignes_historique_kilometrage(initiales, champs=update_fields)
+        if lignes and self.vehicule_id:
+            HistoriqueKilometrage.objects.bulk_create(lignes)
+        self._memoriser_valeurs(update_fields)
+
+    @classmethod
+    def enregistrer_en_masse(cls, objets, champs, commentaire=None, batch_size=500):
+        """
+        Enregistre des objets modifiés en quelques requêtes : bulk_update des champs,
+        un bulk_create pour tout l'historique, puis recalcul du dernier relevé
+        kilométrique des véhicules concernés (bulk_update n'émet pas de signaux).
+
+        Les objets doivent avoir été chargés depuis la base avant modification.
+        `commentaire` peut être une fonction recevant l'objet.
+        """
+        from .kilometrage import recalculer_kilometrage
+
+        objets = list(objets)
+        if not objets:
+            return 0
+        lignes = []
+        for objet in objets:
+            lignes += objet.lignes_historique_kilometrage(objet.valeurs_initiales(), commentaire, champs)
+        # bulk_update ne renseigne pas les champs auto_now (date de modification)
+        auto_now = [champ.name for champ in cls._meta.concrete_fields if getattr(champ, 'auto_now', False)]
+        if auto_now:
+            maintenant = timezone.now()
+            for objet in objets:
+                for nom in auto_now:
+                    setattr(objet, nom, maintenant)
+            champs = list(champs) + [nom for nom in auto_now if nom not in champs]
+        with transaction.atomic():
+            nombre = cls.objects.bulk_update(objets, champs, batch_size=batch_size)
+            HistoriqueKilometrage.objects.bulk_create([l for l in lignes if l.vehicule_id], batch_size=batch_size)
+            if set(champs) & set(cls.champs_kilometrage):
+                for vehicule_id in {objet.vehicule_id for objet in objets if objet.vehicule_id}:
+                    recalculer_kilometrage(vehicule_id)
+        for objet in objets:
+            objet._memoriser_valeurs(champs)
+        return nombre
+
+class Course(SuiviKilometrageMixin, models.Model):
     """Modèle pour les courses/missions"""
     PRIORITE_CHOICES = [
         ('important', 'Important'),
@@ -214,6 +346,8 @@ class Course(models.Model):
     nombre_passagers = models.PositiveIntegerField(default=1, verbose_name="Nombre de passagers")
     date_demande = models.DateTimeField(auto_now_add=True)
     date_souhaitee = models.DateTimeField(null=True, blank=True)
+    # Curseur de la synchronisation différentielle des applications mobiles (core.api)
+    date_modification = models.DateTimeField(auto_now=True)
     
     # Champs remplis par le dispatcher
     chauffeur = models.ForeignKey(Utilisateur, on_delete=models.SET_NULL, null=True, blank=True, related_name='courses_assignees')
@@ -238,6 +372,31 @@ class Course(models.Model):
         verbose_name='Priorité',
     )
     
+    class Meta:
+        indexes = [
+            # Missions d'un chauffeur par statut (tableaux de bord chauffeur, API mobile)
+            models.Index(fields=['chauffeur', 'statut'], name='course_chauffeur_statut_idx'),
+            # Missions d'un chauffeur par pages, des plus récentes aux plus anciennes (API mobile)
+            models.Index(fields=['chauffeur', '-date_demande', '-id'], name='course_chauffeur_date_idx'),
+            # Disponibilité des véhicules et dernière course terminée d'un véhicule
+            models.Index(fields=['vehicule', 'statut', 'date_fin'], name='course_vehicule_statut_idx'),
+            models.Index(fields=['date_demande'], name='course_date_demande_idx'),
+            models.Index(fields=['date_depart'], name='course_date_depart_idx'),
+            # Conflits d'horaire lors de l'affectation d'un véhicule (dispatch.disponibilite) ;
+            # ceux d'un chauffeur passent par course_chauffeur_statut_idx
+            models.Index(fields=['vehicule', 'statut', 'date_souhaitee'], name='course_conflit_vehicule_idx'),
+            # Demandes en attente de traitement (file du dispatch), index partiel
+            models.Index(fields=['date_demande'], condition=models.Q(statut='en_attente'), name='course_en_attente_idx'),
+            # Demandes modifiées depuis la dernière synchronisation (API mobile dispatch et demandeur)
+            models.Index(fields=['date_modification', 'id'], name='course_modification_idx'),
+            models.Index(fields=['demandeur', 'date_modification', 'id'], name='course_demandeur_modif_idx'),
+        ]
+    
+    champs_kilometrage = ('kilometrage_depart', 'kilometrage_fin')
+    champs_suivis = ('statut',)
+    module_kilometrage = 'course'
+    champ_utilisateur_kilometrage = ('chauffeur',)
+
     def __str__(self):
         return f"Course {self.id} - {self.demandeur.username} - {self.statut}"
     
@@ -252,39 +411,11 @@ class Course(models.Model):
             self.date_depart = timezone.now()
         if self.statut == 'terminee' and not self.date_fin:
             self.date_fin = timezone.now()
-        # Historique kilométrage
-        is_update = self.pk is not None
-        if is_update:
-            old = type(self).objects.get(pk=self.pk)
-            km_fields = [('kilometrage_depart', old.kilometrage_depart, self.kilometrage_depart),
-                         ('kilometrage_fin', old.kilometrage_fin, self.kilometrage_fin)]
-            for champ, avant, apres in km_fields:
-                if avant != apres and apres is not None:
-                    from core.models import HistoriqueKilometrage
-                    HistoriqueKilometrage.objects.create(
-                        vehicule=self.vehicule,
-                        utilisateur=self.chauffeur,
-                        module='course',
-                        objet_id=self.pk,
-                        valeur_avant=avant,
-                        valeur_apres=apres,
-                        commentaire=f"Modification du {champ} via Course #{self.pk}"
-                    )
+        # Statut avant enregistrement : core.signals publie les changements de statut
+        initiales = self.valeurs_initiales()
+        self._statut_precedent = initiales['statut'] if initiales else None
+        # L'historique kilométrique est écrit par SuiviKilometrageMixin
         super().save(*args, **kwargs)
-        # Création (nouvelle course)
-        if not is_update:
-            for champ, apres in [('kilometrage_depart', self.kilometrage_depart), ('kilometrage_fin', self.kilometrage_fin)]:
-                if apres is not None:
-                    from core.models import HistoriqueKilometrage
-                    HistoriqueKilometrage.objects.create(
-                        vehicule=self.vehicule,
-                        utilisateur=self.chauffeur,
-                        module='course',
-                        objet_id=self.pk,
-                        valeur_avant=None,
-                        valeur_apres=apres,
-                        commentaire=f"Création du {champ} via Course #{self.pk}"
-                    )
 
     def clean(self):
         # Validation du kilométrage
@@ -306,6 +437,11 @@ class ActionTraceur(models.Model):
     date_action = models.DateTimeField(auto_now_add=True)
     details = models.TextField(blank=True, null=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_action'], name='actiontraceur_date_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.utilisateur.username} - {self.action} - {self.date_action}"
 
@@ -366,6 +502,174 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Lecture d'une conversation (get_messages) et marquage des messages lus
+            models.Index(fields=['recipient', 'sender', 'timestamp'], name='core_msg_conversation_idx'),
+        ]
 
     def __str__(self):
         return f"De {self.sender} à {self.recipient} le {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+class CompteurMessagesNonLus(models.Model):
+    """
+    Nombre de messages non lus reçus par un utilisateur, par correspondant.
+
+    Maintenu à l'envoi (signal post_save de Message, ou `incrementer` après un
+    bulk_create) et remis à zéro à la lecture d'une conversation (get_messages),
+    afin que la liste des contacts et le badge de messages non lus ne parcourent
+    jamais la table Message.
+    """
+    utilisateur = models.ForeignKey('Utilisateur', on_delete=models.CASCADE, related_name='compteurs_non_lus')
+    correspondant = models.ForeignKey('Utilisateur', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    non_lus = models.PositiveIntegerField(default=0)
+    dernier_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        unique_together = ('utilisateur', 'correspondant')
+        verbose_name = "Compteur de messages non lus"
+        verbose_name_plural = "Compteurs de messages non lus"
+
+    def __str__(self):
+        return f"{self.utilisateur} ← {self.correspondant or 'Système'} : {self.non_lus}"
+
+    @classmethod
+    def incrementer(cls, messages):
+        """Comptabilise des messages non lus nouvellement créés (une mise à jour par conversation)"""
+        conversations = {}
+        for message in messages:
+            if message.is_read:
+                continue
+            cle = (message.recipient_id, message.sender_id)
+            nombre, dernier = conversations.get(cle, (0, None))
+            if message.pk and (dernier is None or message.pk > dernier):
+                dernier = message.pk
+            conversations[cle] = (nombre + 1, dernier)
+
+        for (utilisateur_id, correspondant_id), (nombre, dernier) in conversations.items():
+            champs = {'non_lus': models.F('non_lus') + nombre}
+            if dernier:
+                champs['dernier_message_id'] = dernier
+            compteurs = cls.objects.filter(utilisateur_id=utilisateur_id, correspondant_id=correspondant_id)
+            if compteurs.update(**champs):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        utilisateur_id=utilisateur_id,
+                        correspondant_id=correspondant_id,
+                        non_lus=nombre,
+                        dernier_message_id=dernier,
+                    )
+            except IntegrityError:
+                # Compteur créé entre-temps par une requête concurrente
+                compteurs.update(**champs)
+
+    @classmethod
+    def marquer_lus(cls, utilisateur, correspondant):
+        cls.objects.filter(utilisateur=utilisateur, correspondant=correspondant, non_lus__gt=0).update(non_lus=0, dernier_message=None)
+
+    @classmethod
+    def reconstruire(cls):
+        """Recalcule tous les compteurs à partir de la table Message (une requête groupée)"""
+        lignes = (
+            Message.objects.filter(is_read=False)
+            .values('recipient_id', 'sender_id')
+            .annotate(nombre=models.Count('id'), dernier=models.Max('id'))
+            .order_by()
+        )
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([
+                cls(
+                    utilisateur_id=ligne['recipient_id'],
+                    correspondant_id=ligne['sender_id'],
+                    non_lus=ligne['nombre'],
+                    dernier_message_id=ligne['dernier'],
+                )
+                for ligne in lignes
+            ], batch_size=500)
+
+
+class DernierKilometrage(models.Model):
+    """
+    Dernier relevé kilométrique connu d'un véhicule.
+
+    Maintenu à l'écriture par les signaux des modules qui relèvent le compteur
+    (courses, ravitaillements, entretiens, check-lists de sécurité) et par les
+    corrections ; lu via core.kilometrage, qui le met en cache pour les
+    contrôles de saisie des formulaires.
+    """
+    SOURCE_CHOICES = (
+        ('vehicule', 'Véhicule'),
+        ('course', 'Course'),
+        ('ravitaillement', 'Ravitaillement'),
+        ('entretien', 'Entretien'),
+        ('checklist', 'Check-list de sécurité'),
+        ('correction', 'Correction'),
+    )
+    vehicule = models.OneToOneField(Vehicule, on_delete=models.CASCADE, primary_key=True, related_name='dernier_kilometrage')
+    kilometrage = models.PositiveIntegerField(default=0)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='vehicule')
+    objet_id = models.PositiveIntegerField(null=True, blank=True)
+    date_releve = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Dernier kilométrage"
+        verbose_name_plural = "Derniers kilométrages"
+
+    def __str__(self):
+        return f"{self.vehicule_id} : {self.kilometrage} km ({self.get_source_display()})"
+
+
+class ActionSynchronisee(models.Model):
+    """
+    Action de l'application mobile chauffeur déjà appliquée (core.synchronisation).
+
+    La clé d'idempotence est choisie par le téléphone pour chaque action de sa
+    file hors ligne : une action renvoyée après une coupure réseau n'est pas
+    appliquée une seconde fois, le résultat enregistré est renvoyé à la place.
+    """
+    TYPE_CHOICES = (
+        ('demarrer', 'Démarrage de mission'),
+        ('terminer', 'Fin de mission'),
+        ('ravitaillement', 'Ravitaillement'),
+        ('checklist', 'Check-list de sécurité'),
+    )
+    utilisateur = models.ForeignKey(Utilisateur, on_delete=models.CASCADE, related_name='actions_synchronisees')
+    cle = models.CharField(max_length=64)
+    type_action = models.CharField(max_length=20, choices=TYPE_CHOICES)
+    resultat = models.JSONField(default=dict)
+    date_creation = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Action synchronisée"
+        verbose_name_plural = "Actions synchronisées"
+        constraints = [
+            # Une clé d'idempotence par chauffeur
+            models.UniqueConstraint(fields=['utilisateur', 'cle'], name='action_synchronisee_cle_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.utilisateur_id} - {self.cle} ({self.type_action})"
+
+
+class CourseSupprimee(models.Model):
+    """
+    Trace d'une course supprimée, pour la synchronisation différentielle des
+    applications mobiles : le client qui avait la course la retire de son cache.
+
+    Écrite par core.signals à la suppression ; les traces plus anciennes que
+    API_SYNCHRO_RETENTION jours sont purgées chaque nuit (commande
+    purger_suppressions_synchro), un client dont le curseur est plus ancien
+    doit recharger la liste complète.
+    """
+    course_id = models.PositiveIntegerField()
+    demandeur_id = models.PositiveIntegerField(null=True, blank=True)
+    date_suppression = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "Course supprimée"
+        verbose_name_plural = "Courses supprimées"
+
+    def __str__(self):
+        return f"Course {self.course_id} supprimée le {self.date_suppression:%d/%m/%Y %H:%M}"
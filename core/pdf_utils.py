@@ -10,12 +10,38 @@ from django.conf import settings
 from django.http import HttpResponse
 from django.template.loader import render_to_string
 import markdown
-import pdfkit
-from pathlib import Path
+from .rendu_pdf import reponse_pdf
 
 # Configuration globale pour wkhtmltopdf
 WKHTMLTOPDF_PATH = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'
 
+# Options pdfkit des exports de templates. Les templates PDF n'ont pas de JavaScript :
+# pas de javascript-delay, qui ajoutait une seconde d'attente à chaque rendu.
+OPTIONS_RENDU = {
+    'page-size': 'A4',
+    'margin-top': '0.75in',
+    'margin-right': '0.75in',
+    'margin-bottom': '0.75in',
+    'margin-left': '0.75in',
+    'encoding': 'UTF-8',
+    'no-outline': None,
+    'enable-local-file-access': None,
+    'disable-smart-shrinking': None,
+    'image-quality': 100,
+    'image-dpi': 300,
+    'no-stop-slow-scripts': None,
+}
+
+OPTIONS_HTML = {
+    'page-size': 'A4',
+    'margin-top': '0.75in',
+    'margin-right': '0.75in',
+    'margin-bottom': '0.75in',
+    'margin-left': '0.75in',
+    'encoding': 'UTF-8',
+    'no-outline': None,
+}
+
 class PDFExportError(Exception):
     """Exception personnalisée pour les erreurs d'export PDF"""
     pass
@@ -40,48 +66,15 @@ def render_to_pdf(template_name, context, filename=None):
         # Prétraiter le HTML pour optimiser les images
         html_content = preprocess_html_for_pdf(html_content)
         
-        # Créer un fichier temporaire pour le PDF
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        # Configuration pdfkit optimisée pour Render
-        options = {
-            'page-size': 'A4',
-            'margin-top': '0.75in',
-            'margin-right': '0.75in',
-            'margin-bottom': '0.75in',
-            'margin-left': '0.75in',
-            'encoding': 'UTF-8',
-            'no-outline': None,
-            'enable-local-file-access': None,
-            'disable-smart-shrinking': None,
-            'image-quality': 100,
-            'image-dpi': 300,
-            'javascript-delay': 1000,
-            'no-stop-slow-scripts': None,
-        }
-        
-        # Configuration du chemin vers wkhtmltopdf
-        config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
-        
-        # Générer le PDF
-        pdfkit.from_string(html_content, temp_path, options=options, configuration=config)
-        
-        # Lire le PDF généré
-        with open(temp_path, 'rb') as pdf_file:
-            pdf_content = pdf_file.read()
-        
-        # Nettoyer le fichier temporaire
-        os.unlink(temp_path)
-        
-        # Créer la réponse HTTP
-        response = HttpResponse(pdf_content, content_type='application/pdf')
-        if filename:
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        else:
-            response['Content-Disposition'] = 'attachment; filename="export.pdf"'
-        
-        return response
+        # Conversion par les processus de rendu, résultat mis en cache sur disque
+        return reponse_pdf(
+            html_content,
+            filename or 'export.pdf',
+            template_name=template_name,
+            options=OPTIONS_RENDU,
+            executable=WKHTMLTOPDF_PATH,
+            contexte=context,
+        )
         
     except Exception as e:
         # En cas d'erreur, retourner un message d'erreur
@@ -100,42 +93,12 @@ def html_to_pdf(html_content, filename=None):
         HttpResponse avec le PDF en attachement
     """
     try:
-        # Créer un fichier temporaire pour le PDF
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        # Configuration pdfkit
-        options = {
-            'page-size': 'A4',
-            'margin-top': '0.75in',
-            'margin-right': '0.75in',
-            'margin-bottom': '0.75in',
-            'margin-left': '0.75in',
-            'encoding': 'UTF-8',
-            'no-outline': None,
-        }
-        
-        # Configuration du chemin vers wkhtmltopdf
-        config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
-        
-        # Générer le PDF
-        pdfkit.from_string(html_content, temp_path, options=options, configuration=config)
-        
-        # Lire le PDF généré
-        with open(temp_path, 'rb') as pdf_file:
-            pdf_content = pdf_file.read()
-        
-        # Nettoyer le fichier temporaire
-        os.unlink(temp_path)
-        
-        # Créer la réponse HTTP
-        response = HttpResponse(pdf_content, content_type='application/pdf')
-        if filename:
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        else:
-            response['Content-Disposition'] = 'attachment; filename="export.pdf"'
-        
-        return response
+        return reponse_pdf(
+            html_content,
+            filename or 'export.pdf',
+            options=OPTIONS_HTML,
+            executable=WKHTMLTOPDF_PATH,
+        )
         
     except Exception as e:
         error_message = f"Erreur lors de la conversion HTML vers PDF: {str(e)}"
@@ -0,0 +1,299 @@
+"""
+Service de rendu PDF en arrière-plan.
+
+La conversion HTML -> PDF (wkhtmltopdf via pdfkit, ou WeasyPrint) prend
+plusieurs secondes. Elle ne se fait plus dans le worker web :
+
+- le template est rendu en HTML dans la requête (rapide, accès à la base) ;
+- la conversion est confiée à un pool de processus de rendu démarrés à
+  l'avance (PDF_RENDUS_WORKERS), via la file du ProcessPoolExecutor ;
+- le PDF est écrit sur disque (PDF_RENDUS_DIR) sous une clé calculée à partir
+  du template et du HTML rendu sans les horodatages d'impression
+  (CHAMPS_HORODATAGE), c'est-à-dire des données : un export identique est
+  servi directement depuis le disque, et une modification des données change
+  la clé ;
+- un fichier témoin `<clé>.encours` signale le rendu en cours à tous les
+  processus web, jusqu'à l'écriture du PDF ou du fichier d'erreur ;
+- la requête attend au plus PDF_RENDUS_ATTENTE secondes. Au-delà, l'utilisateur
+  est redirigé vers la page de suivi `document_pdf`, qui sert le fichier dès
+  qu'il est prêt.
+
+Les processus de rendu n'accèdent ni à Django ni à la base : ils reçoivent le
+HTML et écrivent le fichier.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as DelaiDepasse
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.shortcuts import redirect
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.http import urlencode
+
+logger = logging.getLogger(__name__)
+
+MOTIF_CLE = re.compile(r'[0-9a-f]{64}')
+
+# Horodatages d'impression des contextes PDF, exclus de la clé du document
+CHAMPS_HORODATAGE = ('date_impression', 'date_export', 'date_generation', 'current_date', 'now')
+
+_verrou = threading.Lock()
+_verrou_pool = threading.Lock()
+_pool = None
+_en_cours = {}  # clé -> Future des rendus soumis par ce processus
+_derniere_purge = 0
+_contexte = threading.local()
+
+
+def _repertoire():
+    repertoire = getattr(settings, 'PDF_RENDUS_DIR', None) or os.path.join(tempfile.gettempdir(), 'ipscod-pdf')
+    os.makedirs(repertoire, exist_ok=True)
+    return repertoire
+
+
+def cle_document(template_name, html, moteur='wkhtmltopdf', base_url=None):
+    """Clé du document : empreinte du moteur, du template et du HTML rendu avec son contexte"""
+    empreinte = hashlib.sha256()
+    for partie in (moteur, template_name or '', base_url or '', html):
+        empreinte.update(partie.encode('utf-8'))
+        empreinte.update(b'\0')
+    return empreinte.hexdigest()
+
+
+def html_cle(template_name, contexte):
+    """
+    HTML du template rendu avec les horodatages d'impression vidés, pour la clé :
+    le même export imprimé une minute plus tard réutilise le document rendu.
+    Retourne None si le contexte n'a pas d'horodatage.
+    """
+    horodatages = {champ: '' for champ in CHAMPS_HORODATAGE if champ in contexte}
+    if not horodatages:
+        return None
+    return render_to_string(template_name, {**contexte, **horodatages})
+
+
+def chemin_document(cle):
+    return os.path.join(_repertoire(), f"{cle}.pdf")
+
+
+def _chemin_erreur(cle):
+    return os.path.join(_repertoire(), f"{cle}.err")
+
+
+def _chemin_temoin(cle):
+    return os.path.join(_repertoire(), f"{cle}.encours")
+
+
+def _rendu_en_cours(cle):
+    """Témoin présent et récent : un processus web rend ce document"""
+    try:
+        age = time.time() - os.path.getmtime(_chemin_temoin(cle))
+    except OSError:
+        return False
+    # Témoin abandonné par un processus arrêté pendant le rendu
+    return age < getattr(settings, 'PDF_RENDUS_DELAI_MAX', 600)
+
+
+# --- Processus de rendu (sans Django) ---
+
+def _prechauffer():
+    """Charge les moteurs de rendu au démarrage de chaque processus"""
+    import pdfkit  # noqa: F401
+    try:
+        import weasyprint  # noqa: F401
+    except Exception:
+        pass
+
+
+def _pret():
+    return os.getpid()
+
+
+def _convertir(html, chemin, moteur='wkhtmltopdf', options=None, executable=None, base_url=None):
+    """Convertit le HTML en PDF ; le fichier n'apparaît qu'une fois complet"""
+    temporaire = f"{chemin}.{os.getpid()}.tmp"
+    try:
+        if moteur == 'weasyprint':
+            from weasyprint import HTML
+            HTML(string=html, base_url=base_url).write_pdf(temporaire)
+        else:
+            import pdfkit
+            # Sans exécutable configuré (ou introuvable), wkhtmltopdf est cherché dans le PATH
+            configuration = pdfkit.configuration(wkhtmltopdf=executable) if executable and os.path.exists(executable) else None
+            pdfkit.from_string(html, temporaire, options=options, configuration=configuration)
+        os.replace(temporaire, chemin)
+    finally:
+        if os.path.exists(temporaire):
+            os.unlink(temporaire)
+    return chemin
+
+
+# --- Côté serveur web ---
+
+def _nombre_workers():
+    return getattr(settings, 'PDF_RENDUS_WORKERS', 2)
+
+
+def _pool_rendu():
+    """Pool de processus de rendu, démarrés dès sa création"""
+    global _pool
+    with _verrou_pool:
+        if _pool is None:
+            nombre = _nombre_workers()
+            _pool = ProcessPoolExecutor(
+                max_workers=nombre,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_prechauffer,
+            )
+            # Une tâche vide par worker : les processus démarrent maintenant, pas au premier export
+            for _ in range(nombre):
+                _pool.submit(_pret)
+        return _pool
+
+
+def demarrer_pool():
+    """Démarre les processus de rendu (au lancement du serveur d'application)"""
+    if _nombre_workers() > 0:
+        _pool_rendu()
+
+
+def _termine(cle, future):
+    erreur = future.exception()
+    if erreur is not None:
+        logger.error(f"Échec du rendu PDF {cle}: {erreur}")
+        with open(_chemin_erreur(cle), 'w', encoding='utf-8') as fichier:
+            fichier.write(str(erreur))
+    with _verrou:
+        _en_cours.pop(cle, None)
+        try:
+            os.unlink(_chemin_temoin(cle))
+        except OSError:
+            pass
+
+
+def soumettre(cle, html, moteur='wkhtmltopdf', options=None, executable=None, base_url=None):
+    """
+    Met le rendu en file, sauf s'il est déjà en cours pour la même clé.
+
+    Returns:
+        Future: terminé quand le PDF est écrit sur disque. Sans worker
+        (PDF_RENDUS_WORKERS = 0), le rendu est fait immédiatement dans le thread courant.
+    """
+    _purger_si_necessaire()
+    chemin = chemin_document(cle)
+    pool = _pool_rendu() if _nombre_workers() > 0 else None
+    with _verrou:
+        future = _en_cours.get(cle)
+        if future is not None:
+            return future
+        if os.path.exists(_chemin_erreur(cle)):
+            os.unlink(_chemin_erreur(cle))
+        with open(_chemin_temoin(cle), 'w'):
+            pass
+        if pool is not None:
+            future = pool.submit(_convertir, html, chemin, moteur, options, executable, base_url)
+        else:
+            future = Future()
+        _en_cours[cle] = future
+
+    if pool is None:
+        try:
+            future.set_result(_convertir(html, chemin, moteur, options, executable, base_url))
+        except Exception as e:
+            future.set_exception(e)
+    future.add_done_callback(lambda f: _termine(cle, f))
+    return future
+
+
+def etat_document(cle):
+    """'pret', 'echec', 'en_cours' ou 'inconnu'"""
+    if not MOTIF_CLE.fullmatch(cle or ''):
+        return 'inconnu'
+    if os.path.exists(chemin_document(cle)):
+        return 'pret'
+    if os.path.exists(_chemin_erreur(cle)):
+        return 'echec'
+    return 'en_cours' if _rendu_en_cours(cle) else 'inconnu'
+
+
+def erreur_document(cle):
+    try:
+        with open(_chemin_erreur(cle), encoding='utf-8') as fichier:
+            return fichier.read()
+    except OSError:
+        return ''
+
+
+def servir_document(cle, filename):
+    chemin = chemin_document(cle)
+    # Un document servi reste en cache plus longtemps
+    os.utime(chemin)
+    return FileResponse(open(chemin, 'rb'), as_attachment=True, filename=filename, content_type='application/pdf')
+
+
+@contextmanager
+def attente_complete():
+    """Dans ce bloc, reponse_pdf attend la fin du rendu au lieu de rediriger (tâches en arrière-plan)"""
+    precedent = getattr(_contexte, 'attente_complete', False)
+    _contexte.attente_complete = True
+    try:
+        yield
+    finally:
+        _contexte.attente_complete = precedent
+
+
+def reponse_pdf(html, filename='export.pdf', template_name=None, moteur='wkhtmltopdf', options=None, executable=None, base_url=None, contexte=None):
+    """
+    Réponse HTTP pour le PDF du HTML donné.
+
+    Le document est servi depuis le disque s'il a déjà été rendu ; sinon il est
+    mis en file et la requête attend au plus PDF_RENDUS_ATTENTE secondes avant
+    de rediriger vers la page de suivi du rendu. Avec le contexte du template,
+    la clé ne dépend pas des horodatages d'impression (voir `html_cle`).
+    """
+    html_pour_cle = html_cle(template_name, contexte) if template_name and contexte else None
+    cle = cle_document(template_name, html_pour_cle or html, moteur, base_url)
+    if not os.path.exists(chemin_document(cle)):
+        future = soumettre(cle, html, moteur, options, executable, base_url)
+        try:
+            attente = None if getattr(_contexte, 'attente_complete', False) else getattr(settings, 'PDF_RENDUS_ATTENTE', 3)
+            future.result(timeout=attente)
+        except DelaiDepasse:
+            return redirect(f"{reverse('document_pdf', args=[cle])}?{urlencode({'nom': filename})}")
+        except Exception as e:
+            return HttpResponse(f"Erreur lors de la génération du PDF: {str(e)}", content_type='text/plain', status=500)
+    return servir_document(cle, filename)
+
+
+def purger_documents(age=None):
+    """Supprime les documents rendus plus anciens que `age` secondes (PDF_RENDUS_DUREE par défaut)"""
+    age = getattr(settings, 'PDF_RENDUS_DUREE', 86400) if age is None else age
+    limite = time.time() - age
+    supprimes = 0
+    with os.scandir(_repertoire()) as entrees:
+        for entree in entrees:
+            try:
+                if entree.is_file() and entree.stat().st_mtime < limite:
+                    os.unlink(entree.path)
+                    supprimes += 1
+            except OSError:
+                pass
+    return supprimes
+
+
+def _purger_si_necessaire():
+    """Purge au plus une fois par heure, au fil des soumissions"""
+    global _derniere_purge
+    maintenant = time.time()
+    if maintenant - _derniere_purge > 3600:
+        _derniere_purge = maintenant
+        purger_documents()
@@ -1,14 +1,119 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.core.mail import send_mail
 from django.conf import settings
 from datetime import timedelta
 import logging
 
-from .models import Course, Vehicule, Utilisateur, Etablissement # Assurez-vous d'importer tous les modèles nécessaires
+from django.db.models import F
+from .models import Course, CourseSupprimee, Vehicule, Utilisateur, Etablissement, ApplicationControl, Message, CompteurMessagesNonLus # Assurez-vous d'importer tous les modèles nécessaires
+from .middleware import invalider_cache_application_control
+from .evenements import publier
+from .jetons import invalider_principal
+from . import kilometrage
 
 logger = logging.getLogger(__name__)
 
+@receiver([post_save, post_delete], sender=ApplicationControl)
+def invalider_controle_application(sender, instance, **kwargs):
+    # Le middleware met l'état en cache : le relire immédiatement après une modification
+    invalider_cache_application_control()
+
+@receiver([post_save, post_delete], sender=Utilisateur)
+def invalider_principal_api(sender, instance, **kwargs):
+    # Désactivation ou changement de rôle pris en compte dès la requête API suivante
+    invalider_principal(instance.pk)
+
+@receiver(post_save, sender=Message)
+def compter_message_non_lu(sender, instance, created, **kwargs):
+    # Les messages insérés par bulk_create doivent appeler CompteurMessagesNonLus.incrementer
+    if created and not instance.is_read:
+        CompteurMessagesNonLus.incrementer([instance])
+
+@receiver(post_delete, sender=Message)
+def decompter_message_supprime(sender, instance, **kwargs):
+    if not instance.is_read:
+        CompteurMessagesNonLus.objects.filter(
+            utilisateur_id=instance.recipient_id,
+            correspondant_id=instance.sender_id,
+            non_lus__gt=0
+        ).update(non_lus=F('non_lus') - 1)
+
+# Publication des événements temps réel (voir core.evenements)
+@receiver(post_save, sender=Message)
+def publier_nouveau_message(sender, instance, created, **kwargs):
+    if created:
+        publier([instance.recipient_id], 'message', {
+            'id': instance.id,
+            'sender_id': instance.sender_id,
+            'content': instance.content[:60],
+            'is_system_message': instance.is_system_message,
+        })
+
+@receiver(post_save, sender=Course)
+def publier_statut_course(sender, instance, created, **kwargs):
+    statut_precedent = getattr(instance, '_statut_precedent', None)
+    if not created and statut_precedent == instance.statut:
+        return
+    destinataires = [instance.demandeur_id, instance.chauffeur_id, instance.dispatcher_id]
+    if created:
+        # Nouvelle demande : prévenir les dispatchers
+        destinataires += list(Utilisateur.objects.filter(role='dispatch', is_active=True).values_list('id', flat=True))
+    publier(destinataires, 'course', {
+        'id': instance.id,
+        'statut': instance.statut,
+        'statut_precedent': statut_precedent,
+    })
+
+@receiver(post_save, sender='notifications.Notification')
+def publier_notification(sender, instance, created, **kwargs):
+    if created:
+        publier([instance.user_id], 'notification', {'id': instance.id, 'message': instance.message})
+
+# Dernier relevé kilométrique des véhicules (voir core.kilometrage)
+@receiver(post_save, sender=Vehicule)
+def initialiser_releve_vehicule(sender, instance, created, **kwargs):
+    if created:
+        kilometrage.definir_kilometrage(instance.pk, instance.kilometrage_actuel or 0, 'vehicule')
+    else:
+        # Immatriculation et dernier entretien sont servis avec le relevé
+        kilometrage.invalider_cache(instance.pk)
+
+@receiver(post_save, sender=Course)
+def releve_course(sender, instance, **kwargs):
+    km = max(instance.kilometrage_depart or 0, instance.kilometrage_fin or 0)
+    if instance.vehicule_id and km:
+        kilometrage.enregistrer_releve(instance.vehicule_id, km, 'course', instance.pk)
+
+@receiver(post_save, sender='ravitaillement.Ravitaillement')
+def releve_ravitaillement(sender, instance, **kwargs):
+    kilometrage.enregistrer_releve(instance.vehicule_id, max(instance.kilometrage_avant or 0, instance.kilometrage_apres or 0), 'ravitaillement', instance.pk)
+
+@receiver(post_save, sender='entretien.Entretien')
+def releve_entretien(sender, instance, **kwargs):
+    kilometrage.enregistrer_releve(instance.vehicule_id, max(instance.kilometrage or 0, instance.kilometrage_apres or 0), 'entretien', instance.pk)
+
+@receiver(post_save, sender='securite.CheckListSecurite')
+def releve_checklist(sender, instance, **kwargs):
+    kilometrage.enregistrer_releve(instance.vehicule_id, instance.kilometrage, 'checklist', instance.pk)
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender='ravitaillement.Ravitaillement')
+@receiver(post_delete, sender='entretien.Entretien')
+@receiver(post_delete, sender='securite.CheckListSecurite')
+def oublier_releve_supprime(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Vehicule) or getattr(origin, 'model', None) is Vehicule:
+        # Suppression du véhicule : son relevé disparaît avec lui
+        return
+    source = 'checklist' if sender._meta.model_name == 'checklistsecurite' else sender._meta.model_name
+    kilometrage.oublier_releve(instance.vehicule_id, source, instance.pk)
+
+@receiver(post_delete, sender=Course)
+def tracer_course_supprimee(sender, instance, **kwargs):
+    # Synchronisation différentielle des applications mobiles : la suppression est transmise au client
+    # (purge des traces anciennes : commande purger_suppressions_synchro, planifiée chaque nuit)
+    CourseSupprimee.objects.create(course_id=instance.pk, demandeur_id=instance.demandeur_id)
+
 # Fonction utilitaire pour envoyer des SMS (à implémenter avec un service tiers)
 def send_sms_notification(phone_number, message):
     # Ici, vous intégreriez votre API de fournisseur SMS (ex: Twilio, Nexmo)
@@ -0,0 +1,84 @@
+"""
+Compteurs des tableaux de bord.
+
+Les cartes de statistiques des tableaux de bord (dispatch, chauffeur,
+demandeur, sécurité, accueil) comptent les lignes d'un modèle par statut. Au
+lieu d'un COUNT par carte, tous les compteurs d'un modèle sont lus en une
+seule requête d'agrégation conditionnelle (`Count(filter=...)`).
+
+Les compteurs d'un périmètre partagé (toutes les courses, un établissement)
+peuvent être mis en cache STATISTIQUES_CACHE_TTL secondes avec `cle_cache`
+(la clé comprend une empreinte de la requête et des conditions) : les
+tableaux de bord rechargés en boucle par plusieurs utilisateurs ne
+relisent pas la table à chaque affichage. Les compteurs personnels (les
+missions d'un chauffeur) sont servis par les index et ne sont pas mis en cache.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Count, Q
+
+
+def _empreinte(queryset, compteurs):
+    """Empreinte de la requête et des conditions : deux périmètres distincts ne partagent pas une clé"""
+    try:
+        requete = str(queryset.query)
+    except EmptyResultSet:
+        requete = 'vide'
+    conditions = ';'.join(f"{nom}={condition!r}" for nom, condition in compteurs.items())
+    return hashlib.sha1(f"{requete}|{conditions}".encode('utf-8')).hexdigest()[:16]
+
+
+def _cle(queryset, compteurs, cle_cache):
+    perimetre = ':'.join(str(partie) for partie in cle_cache) if isinstance(cle_cache, (tuple, list)) else cle_cache
+    return f"statistiques:{queryset.model._meta.label_lower}:{perimetre}:{','.join(compteurs)}:{_empreinte(queryset, compteurs)}"
+
+
+def compter(queryset, compteurs, cle_cache=None):
+    """
+    Compteurs d'un queryset en une requête.
+
+    Args:
+        queryset: lignes du périmètre (ex. les courses d'un chauffeur)
+        compteurs: {nom: condition Q, ou None pour le total}
+        cle_cache: identifiant du périmètre (ex. ('etablissement', 3)) pour
+            mettre le résultat en cache ; None : pas de cache
+
+    Returns:
+        dict: {nom: nombre}
+    """
+    cle = _cle(queryset, compteurs, cle_cache) if cle_cache is not None else None
+    if cle:
+        resultat = cache.get(cle)
+        if resultat is not None:
+            return resultat
+    resultat = queryset.order_by().aggregate(**{
+        nom: Count('pk', filter=condition) if condition is not None else Count('pk')
+        for nom, condition in compteurs.items()
+    })
+    if cle:
+        cache.set(cle, resultat, getattr(settings, 'STATISTIQUES_CACHE_TTL', 10))
+    return resultat
+
+
+def compter_par_statut(queryset, statuts, champ='statut', cle_cache=None):
+    """
+    Total et nombre de lignes pour chaque statut, en une requête.
+
+    Args:
+        statuts: {nom du compteur: valeur du statut}, ex. {'validees': 'validee'}
+
+    Returns:
+        dict: {'total': n, nom du compteur: n, ...}
+    """
+    compteurs = {'total': None}
+    compteurs.update({nom: Q(**{champ: valeur}) for nom, valeur in statuts.items()})
+    return compter(queryset, compteurs, cle_cache)
+
+
+def pourcentages(compteurs, total='total'):
+    """Part de chaque compteur dans le total, en pourcentage (0 si le total est nul)"""
+    nombre = compteurs[total]
+    return {nom: (valeur / nombre * 100) if nombre > 0 else 0 for nom, valeur in compteurs.items() if nom != total}
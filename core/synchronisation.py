@@ -0,0 +1,246 @@
+"""
+Synchronisation hors ligne de l'application mobile chauffeur.
+
+Sans réseau, le téléphone met ses actions en file (démarrage et fin de
+mission avec le compteur, ravitaillements, check-lists) et les envoie en un
+seul appel à la reconnexion (`api_chauffeur_synchronisation`) :
+
+- chaque action porte une clé d'idempotence choisie par le téléphone ; une
+  action dont la clé est déjà enregistrée (ActionSynchronisee) n'est pas
+  rejouée, son résultat d'origine est renvoyé avec le statut `deja_traite` ;
+- le lot est appliqué dans une seule transaction, dans l'ordre de la file,
+  chaque action dans son propre point de sauvegarde : une action refusée est
+  annulée seule et n'empêche pas les suivantes ;
+- seules les actions réussies enregistrent leur clé : une action refusée
+  (mission pas encore validée, par exemple) peut être renvoyée plus tard ;
+- l'horodatage de l'action, s'il est fourni, date la mission, le
+  ravitaillement ou la check-list (jamais dans le futur).
+
+Les actions reprennent les règles des écrans et des endpoints unitaires, dont
+le contrôle du compteur : un relevé inférieur au dernier kilométrage enregistré
+du véhicule (core.kilometrage) est refusé.
+`demarrer_mission` / `terminer_mission` sont partagées avec
+`api_chauffeur_demarrer` / `api_chauffeur_terminer`, les ravitaillements et
+les check-lists passent par RavitaillementForm et ChecklistSecuriteForm.
+"""
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from suivi.models import SuiviVehicule
+from .kilometrage import get_kilometrage
+from .models import ActionSynchronisee, Course
+
+ACTIONS_PAR_LOT_MAX = 500
+
+
+class ActionRefusee(Exception):
+    """Action invalide ou impossible dans l'état actuel de la mission"""
+    def __init__(self, message, erreurs=None):
+        super().__init__(message)
+        self.erreurs = erreurs
+
+
+def kilometrage_saisi(donnees, nom):
+    valeur = donnees.get(nom)
+    if valeur is None:
+        raise ActionRefusee(f"{nom} requis")
+    try:
+        valeur = int(valeur)
+    except (TypeError, ValueError):
+        raise ActionRefusee(f"{nom} invalide")
+    if valeur < 0:
+        raise ActionRefusee(f"{nom} invalide")
+    return valeur
+
+
+def demarrer_mission(course, kilometrage_depart, horodatage=None):
+    """Passe une mission validée en cours avec le compteur de départ"""
+    if course.statut != 'validee':
+        raise ActionRefusee(f"La mission ne peut pas être démarrée (statut : {course.get_statut_display()})")
+    dernier_kilometrage = get_kilometrage(course.vehicule_id)
+    if kilometrage_depart < dernier_kilometrage:
+        raise ActionRefusee(f"Le kilométrage de départ ({kilometrage_depart} km) ne peut pas être inférieur au dernier kilométrage enregistré ({dernier_kilometrage} km).")
+    course.kilometrage_depart = kilometrage_depart
+    course.statut = 'en_cours'
+    course.date_depart = horodatage or timezone.now()
+    course.save()
+    return course
+
+
+def terminer_mission(course, kilometrage_fin, horodatage=None):
+    """Termine une mission en cours et met à jour le kilométrage et le suivi du véhicule"""
+    if course.statut != 'en_cours':
+        raise ActionRefusee(f"La mission ne peut pas être terminée (statut : {course.get_statut_display()})")
+    if course.kilometrage_depart is not None and kilometrage_fin < course.kilometrage_depart:
+        raise ActionRefusee("Le kilométrage d'arrivée ne peut pas être inférieur au kilométrage de départ.")
+    # Hors relevé de départ de la mission elle-même
+    dernier_kilometrage = get_kilometrage(course.vehicule_id, exclure=('course', course.id))
+    if kilometrage_fin < dernier_kilometrage:
+        raise ActionRefusee(f"Le kilométrage d'arrivée ({kilometrage_fin} km) ne peut pas être inférieur au dernier kilométrage enregistré ({dernier_kilometrage} km).")
+    horodatage = horodatage or timezone.now()
+    course.kilometrage_fin = kilometrage_fin
+    course.statut = 'terminee'
+    course.date_fin = horodatage
+    # Distance recalculée dans save()
+    course.save()
+
+    # Kilométrage centralisé du véhicule et suivi journalier
+    if course.vehicule_id and course.distance_parcourue:
+        veh = course.vehicule
+        veh.kilometrage_actuel = max(veh.kilometrage_actuel or 0, course.kilometrage_fin)
+        veh.save()
+        SuiviVehicule.mettre_a_jour_suivi(veh, timezone.localtime(horodatage).date(), course.distance_parcourue)
+    return course
+
+
+def _mission(user, donnees):
+    try:
+        return Course.objects.select_related('vehicule').get(id=int(donnees.get('course_id')), chauffeur=user)
+    except (TypeError, ValueError, Course.DoesNotExist):
+        raise ActionRefusee("Mission introuvable")
+
+
+def _refuser_formulaire(form):
+    erreurs = {champ: [e['message'] for e in liste] for champ, liste in form.errors.get_json_data().items()}
+    raise ActionRefusee("Données invalides", erreurs)
+
+
+def _action_demarrer(user, donnees, horodatage):
+    course = demarrer_mission(_mission(user, donnees), kilometrage_saisi(donnees, 'kilometrage_depart'), horodatage)
+    return {'course_id': course.id, 'statut': course.statut}
+
+
+def _action_terminer(user, donnees, horodatage):
+    course = terminer_mission(_mission(user, donnees), kilometrage_saisi(donnees, 'kilometrage_fin'), horodatage)
+    return {'course_id': course.id, 'statut': course.statut, 'distance_parcourue': course.distance_parcourue}
+
+
+def _action_ravitaillement(user, donnees, horodatage):
+    from ravitaillement.forms import RavitaillementForm
+
+    form = RavitaillementForm({**donnees, 'chauffeur': user.pk}, createur=user)
+    if not form.is_valid():
+        _refuser_formulaire(form)
+    kilometrage_avant = form.cleaned_data['kilometrage_avant']
+    dernier_kilometrage = get_kilometrage(form.cleaned_data['vehicule'])
+    if kilometrage_avant < dernier_kilometrage:
+        raise ActionRefusee(
+            f"Le kilométrage avant ({kilometrage_avant}) ne peut pas être inférieur au dernier kilométrage enregistré ({dernier_kilometrage}).",
+            {'kilometrage_avant': [f"Dernier kilométrage enregistré : {dernier_kilometrage}"]},
+        )
+    ravitaillement = form.save()
+    if horodatage:
+        # date_ravitaillement est renseignée à la création (auto_now_add)
+        ravitaillement.date_ravitaillement = horodatage
+        ravitaillement.save(update_fields=['date_ravitaillement'])
+    return {'ravitaillement_id': ravitaillement.id, 'cout_total': float(ravitaillement.cout_total)}
+
+
+def _action_checklist(user, donnees, horodatage):
+    from securite.forms import ChecklistSecuriteForm
+
+    form = ChecklistSecuriteForm(user=user)
+    # Éléments non transmis : valeur par défaut du formulaire (OK / présent), comme à l'écran
+    valeurs = {nom: champ.initial for nom, champ in form.fields.items() if champ.initial is not None}
+    form = ChecklistSecuriteForm({**valeurs, **donnees}, user=user)
+    if not form.is_valid():
+        _refuser_formulaire(form)
+    checklist = form.save(commit=False, controleur=user)
+    checklist.lieu_controle = str(donnees.get('lieu_controle') or '')[:100]
+    checklist.date_controle = horodatage or timezone.now()
+    checklist.save()
+    return {'checklist_id': checklist.id, 'statut': checklist.statut}
+
+
+ACTIONS = {
+    'demarrer': _action_demarrer,
+    'terminer': _action_terminer,
+    'ravitaillement': _action_ravitaillement,
+    'checklist': _action_checklist,
+}
+
+
+def _horodatage(valeur):
+    if not valeur:
+        return None
+    horodatage = parse_datetime(str(valeur))
+    if horodatage is None:
+        raise ActionRefusee("horodatage invalide")
+    if timezone.is_naive(horodatage):
+        horodatage = timezone.make_aware(horodatage)
+    # Horloge du téléphone en avance : l'action ne peut pas dater du futur
+    return min(horodatage, timezone.now())
+
+
+def _cle(action):
+    cle = action.get('cle') if isinstance(action, dict) else None
+    if not isinstance(cle, str) or not cle or len(cle) > 64:
+        return None
+    return cle
+
+
+def _appliquer(user, action, cle):
+    """Applique une action dans un point de sauvegarde et enregistre sa clé"""
+    type_action = action.get('type')
+    if type_action not in ACTIONS:
+        raise ActionRefusee("type d'action inconnu")
+    donnees = action.get('donnees') or {}
+    if not isinstance(donnees, dict):
+        raise ActionRefusee("donnees invalides")
+    with transaction.atomic():
+        resultat = ACTIONS[type_action](user, donnees, _horodatage(action.get('horodatage')))
+        ActionSynchronisee.objects.create(utilisateur=user, cle=cle, type_action=type_action, resultat=resultat)
+    return resultat
+
+
+def synchroniser(user, actions):
+    """
+    Applique la file d'actions d'un chauffeur dans une transaction.
+
+    Args:
+        user: chauffeur authentifié
+        actions: liste de {'cle', 'type', 'donnees', 'horodatage' (optionnel)}
+
+    Returns:
+        list: un résultat par action, dans l'ordre de la file :
+        {'cle', 'statut': 'ok' | 'deja_traite' | 'erreur', 'resultat'} ou
+        {'cle', 'statut': 'erreur', 'erreur', 'erreurs' (par champ, optionnel)}
+    """
+    resultats = []
+    with transaction.atomic():
+        cles = [cle for cle in map(_cle, actions) if cle]
+        deja_traitees = {
+            a.cle: a.resultat for a in ActionSynchronisee.objects.filter(utilisateur=user, cle__in=cles)
+        }
+        for action in actions:
+            cle = _cle(action)
+            if cle is None:
+                resultats.append({'cle': action.get('cle') if isinstance(action, dict) else None, 'statut': 'erreur', 'erreur': "cle d'idempotence requise (64 caractères au plus)"})
+                continue
+            if cle in deja_traitees:
+                resultats.append({'cle': cle, 'statut': 'deja_traite', 'resultat': deja_traitees[cle]})
+                continue
+            try:
+                resultat = _appliquer(user, action, cle)
+            except ActionRefusee as e:
+                erreur = {'cle': cle, 'statut': 'erreur', 'erreur': str(e)}
+                if e.erreurs:
+                    erreur['erreurs'] = e.erreurs
+                resultats.append(erreur)
+                continue
+            except ValidationError as e:
+                resultats.append({'cle': cle, 'statut': 'erreur', 'erreur': ' '.join(e.messages)})
+                continue
+            except IntegrityError:
+                # Même clé appliquée entre-temps par une requête concurrente (renvoi du téléphone)
+                precedente = ActionSynchronisee.objects.filter(utilisateur=user, cle=cle).first()
+                if precedente is None:
+                    raise
+                resultats.append({'cle': cle, 'statut': 'deja_traite', 'resultat': precedente.resultat})
+                deja_traitees[cle] = precedente.resultat
+                continue
+            deja_traitees[cle] = resultat
+            resultats.append({'cle': cle, 'statut': 'ok', 'resultat': resultat})
+    return resultats
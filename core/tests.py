@@ -1,7 +1,24 @@
-from django.test import TestCase, Client
+from django.db import connection
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.contrib.sessions.models import Session
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from .models import Etablissement, Vehicule, Course, ActionTraceur, ApplicationControl
+from .models import Etablissement, Vehicule, Course, CourseSupprimee, ActionTraceur, ApplicationControl, Message, CompteurMessagesNonLus, DernierKilometrage, HistoriqueKilometrage
+from .middleware import APPLICATION_CONTROL_CACHE_KEY, get_application_control_state, invalider_cache_application_control
+from .evenements import BackendMemoire, get_bus
+from .kilometrage import get_kilometrage, lire_releve
+from .statistiques import compter_par_statut, pourcentages
+from .exports import Colonne, ClasseurExport, exporter
+from . import rendu_pdf
+from securite.models import CheckListSecurite
+from django.core.cache import cache
+import json
+import threading
+from io import BytesIO, StringIO
+import time
+from openpyxl import load_workbook
 from django.utils import timezone
 from datetime import timedelta
 from ravitaillement.models import Ravitaillement
@@ -9,6 +26,9 @@ from entretien.models import Entretien
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 import os
+import tempfile
+from concurrent.futures import Future
+from unittest import mock
 
 class CoreTests(TestCase):
     def setUp(self):
@@ -231,3 +251,797 @@ class MediaStorageTest(TestCase):
             self.assertEqual(f.read(), test_content)
         # Nettoyage
         os.remove(media_path)
+
+
+class ApplicationControlCacheTests(TestCase):
+    def setUp(self):
+        self.control = ApplicationControl.objects.create(pk=1, is_open=True)
+
+    def tearDown(self):
+        # Le rollback du test ne déclenche pas les signaux : vider le cache du processus
+        invalider_cache_application_control()
+        cache.delete(APPLICATION_CONTROL_CACHE_KEY)
+
+    def test_etat_en_cache_sans_requete(self):
+        get_application_control_state()
+        with self.assertNumQueries(0):
+            self.assertTrue(get_application_control_state()['is_open'])
+
+    def test_invalidation_apres_modification(self):
+        self.assertTrue(get_application_control_state()['is_open'])
+        self.control.is_open = False
+        self.control.save()
+        self.assertFalse(get_application_control_state()['is_open'])
+        response = self.client.get('/login/')
+        self.assertRedirects(response, reverse('application_blocked'), fetch_redirect_response=False)
+        # Le message vient de l'état en cache : aucune session créée pour un visiteur bloqué
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(self.client.get(reverse('application_blocked')).status_code, 200)
+
+    @override_settings(APPLICATION_CONTROL_CACHE_ALIAS='default')
+    def test_cache_partage_invalide_apres_validation(self):
+        get_application_control_state()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.control.is_open = False
+            self.control.save()
+            # Un autre worker relit l'ancienne ligne avant la validation de la transaction
+            cache.set(APPLICATION_CONTROL_CACHE_KEY, {**get_application_control_state(), 'is_open': True})
+        self.assertEqual(len(callbacks), 1)
+        self.assertIsNone(cache.get(APPLICATION_CONTROL_CACHE_KEY))
+        self.assertFalse(get_application_control_state()['is_open'])
+
+class CompteursMessagesNonLusTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.system_user = User.objects.create_user(username='system', password='testpass123')
+        self.alice = User.objects.create_user(username='alice', password='testpass123', role='demandeur')
+        self.bob = User.objects.create_user(username='bob', password='testpass123', role='chauffeur')
+        self.client.login(username='alice', password='testpass123')
+
+    def test_compteurs_maintenus_a_l_envoi_et_a_la_lecture(self):
+        self.client.login(username='bob', password='testpass123')
+        self.client.post(reverse('send_message'), {'recipient_id': self.alice.id, 'content': 'Bonjour'})
+        self.client.post(reverse('send_message'), {'recipient_id': self.alice.id, 'content': 'Es-tu là ?'})
+        Message.objects.create(sender=self.system_user, recipient=self.alice, content='Info', is_system_message=True)
+
+        self.client.login(username='alice', password='testpass123')
+        statut = self.client.get(reverse('get_unread_messages_status')).json()
+        self.assertEqual(statut['unread_count'], 3)
+        self.assertEqual(statut['last_unread']['sender'], 'Système')
+
+        users = {u['id']: u for u in self.client.get(reverse('get_users')).json()['users'] if not u['is_system']}
+        self.assertEqual(users[self.bob.id]['unread_count'], 2)
+
+        self.client.get(reverse('get_messages'), {'correspondent_id': self.bob.id})
+        self.assertEqual(self.client.get(reverse('get_unread_messages_status')).json()['unread_count'], 1)
+        self.assertEqual(CompteurMessagesNonLus.objects.get(utilisateur=self.alice, correspondant=self.bob).non_lus, 0)
+
+    def test_lecture_malgre_un_compteur_decale(self):
+        # bulk_create ne passe pas par les signaux : le compteur reste à zéro
+        Message.objects.bulk_create([Message(sender=self.bob, recipient=self.alice, content='Sans compteur')])
+        self.client.get(reverse('get_messages'), {'correspondent_id': self.bob.id})
+        self.assertFalse(Message.objects.filter(recipient=self.alice, is_read=False).exists())
+
+    def test_liste_des_contacts_sans_parcourir_les_messages(self):
+        for i in range(5):
+            get_user_model().objects.create_user(username=f'contact{i}', password='testpass123')
+        with CaptureQueriesContext(connection) as requetes:
+            self.client.get(reverse('get_users'))
+        self.assertFalse([q for q in requetes.captured_queries if 'core_message' in q['sql']])
+        self.assertEqual(len([q for q in requetes.captured_queries if 'core_compteurmessagesnonlus' in q['sql']]), 1)
+
+    def test_reconstruction(self):
+        Message.objects.create(sender=self.bob, recipient=self.alice, content='A')
+        Message.objects.bulk_create([Message(sender=self.bob, recipient=self.alice, content='B')])
+        CompteurMessagesNonLus.reconstruire()
+        self.assertEqual(CompteurMessagesNonLus.objects.get(utilisateur=self.alice, correspondant=self.bob).non_lus, 2)
+
+class ConversationMessagesTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create_user(username='alice', password='testpass123', role='demandeur')
+        self.bob = User.objects.create_user(username='bob', password='testpass123', role='chauffeur')
+        self.messages = [
+            Message.objects.create(sender=self.bob if i % 2 else self.alice, recipient=self.alice if i % 2 else self.bob, content=f'Message {i}')
+            for i in range(5)
+        ]
+        self.client.login(username='alice', password='testpass123')
+        self.url = reverse('get_messages')
+
+    def test_curseur_et_limite(self):
+        data = self.client.get(self.url, {'correspondent_id': self.bob.id, 'limit': 2}).json()
+        self.assertEqual([m['content'] for m in data['messages']], ['Message 3', 'Message 4'])
+        self.assertTrue(data['has_more'])
+        self.assertEqual(data['last_id'], self.messages[4].id)
+
+        data = self.client.get(self.url, {'correspondent_id': self.bob.id, 'before_id': self.messages[3].id}).json()
+        self.assertEqual(len(data['messages']), 3)
+        self.assertFalse(data['has_more'])
+
+        Message.objects.create(sender=self.bob, recipient=self.alice, content='Nouveau')
+        data = self.client.get(self.url, {'correspondent_id': self.bob.id, 'since_id': self.messages[4].id}).json()
+        self.assertEqual([m['content'] for m in data['messages']], ['Nouveau'])
+
+    def test_etag_304_si_rien_n_a_change(self):
+        response = self.client.get(self.url, {'correspondent_id': self.bob.id})
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, {'correspondent_id': self.bob.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Message.objects.create(sender=self.bob, recipient=self.alice, content='Nouveau')
+        response = self.client.get(self.url, {'correspondent_id': self.bob.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+class FluxEvenementsTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create_user(username='alice', password='testpass123', role='demandeur')
+        self.bob = User.objects.create_user(username='bob', password='testpass123', role='chauffeur')
+        self.client.login(username='alice', password='testpass123')
+        self.depuis = get_bus().dernier_id()
+
+    def test_attente_reveillee_par_publication(self):
+        bus = BackendMemoire()
+        threading.Timer(0.05, bus.publier, args=([self.alice.id], 'message', {'id': 1})).start()
+        evenements = bus.lire(self.alice.id, 0, attente=5)
+        self.assertEqual([e['type'] for e in evenements], ['message'])
+        self.assertEqual(bus.lire(self.bob.id, 0), [])
+
+    def test_identifiants_croissants_apres_redemarrage(self):
+        identifiant = BackendMemoire().publier([self.alice.id], 'message', {'id': 1})
+        # Nouveau processus : le curseur du client reste valable
+        bus = BackendMemoire()
+        self.assertGreater(bus.publier([self.alice.id], 'message', {'id': 2}), identifiant)
+        self.assertEqual(len(bus.lire(self.alice.id, identifiant)), 1)
+
+    @override_settings(EVENEMENTS_ATTENTE_MAX=0)
+    def test_serveur_web_repond_sans_attendre(self):
+        # Workers synchrones : ni attente ni flux SSE, le client reçoit le curseur en JSON
+        response = self.client.get(reverse('flux_evenements'), {'depuis': self.depuis, 'attente': 25}, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json(), {'evenements': [], 'dernier_id': self.depuis})
+
+    def test_long_poll_messages_et_statut_course(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(sender=self.bob, recipient=self.alice, content='Bonjour')
+        course = Course.objects.create(demandeur=self.alice, point_embarquement='A', destination='B', motif='Test')
+        with self.captureOnCommitCallbacks(execute=True):
+            course.statut = 'validee'
+            course.save()
+
+        data = self.client.get(reverse('flux_evenements'), {'depuis': self.depuis, 'attente': 0}).json()
+        self.assertEqual([e['type'] for e in data['evenements']], ['message', 'course'])
+        self.assertEqual(data['evenements'][1]['donnees']['statut_precedent'], 'en_attente')
+        self.assertEqual(data['dernier_id'], data['evenements'][-1]['id'])
+
+        # Rien de nouveau depuis le dernier événement reçu
+        data = self.client.get(reverse('flux_evenements'), {'depuis': data['dernier_id'], 'attente': 0}).json()
+        self.assertEqual(data['evenements'], [])
+
+class PlansDeRequetesTests(TestCase):
+    """Vérifie sur un jeu de données que les requêtes des tableaux de bord utilisent les index déclarés"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.etablissement = Etablissement.objects.create(nom="Etablissement index")
+        cls.demandeur = User.objects.create_user(username='demandeur_idx', password='testpass123', role='demandeur')
+        cls.chauffeurs = [User.objects.create_user(username=f'chauffeur_idx{i}', password='testpass123', role='chauffeur') for i in range(5)]
+        cls.vehicules = [
+            Vehicule.objects.create(immatriculation=f"IDX{i}", marque="Renault", modele="Clio", couleur="rouge", etablissement=cls.etablissement, numero_chassis=f"CHIDX{i}", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+            for i in range(5)
+        ]
+        statuts = ['en_attente', 'validee', 'en_cours', 'terminee', 'terminee', 'terminee']
+        maintenant = timezone.now()
+        Course.objects.bulk_create([
+            Course(demandeur=cls.demandeur, chauffeur=cls.chauffeurs[i % 5], vehicule=cls.vehicules[i % 5], point_embarquement="A", destination="B", motif="Test",
+                   statut=statuts[i % len(statuts)], date_depart=maintenant - timedelta(hours=i), date_fin=maintenant - timedelta(hours=i - 1))
+            for i in range(600)
+        ])
+        Ravitaillement.objects.bulk_create([
+            Ravitaillement(vehicule=cls.vehicules[i % 5], createur=cls.demandeur, litres=10, cout_unitaire=2, cout_total=20) for i in range(200)
+        ])
+        Entretien.objects.bulk_create([
+            Entretien(vehicule=cls.vehicules[i % 5], createur=cls.demandeur, garage="G", motif="M", cout=10, date_entretien=maintenant.date() - timedelta(days=i)) for i in range(200)
+        ])
+        ActionTraceur.objects.bulk_create([ActionTraceur(utilisateur=cls.demandeur, action="Test") for _ in range(200)])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUtiliseIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan, f"Index {index} non utilisé :\n{plan}")
+
+    def test_index_utilises(self):
+        vehicule, chauffeur = self.vehicules[0], self.chauffeurs[0]
+        self.assertUtiliseIndex(Course.objects.filter(chauffeur=chauffeur, statut='en_cours'), 'course_chauffeur_statut_idx')
+        self.assertUtiliseIndex(Course.objects.filter(chauffeur=chauffeur).order_by('-date_demande', '-id')[:50], 'course_chauffeur_date_idx')
+        self.assertUtiliseIndex(Course.objects.filter(vehicule=vehicule, statut='terminee').order_by('-date_fin'), 'course_vehicule_statut_idx')
+        self.assertUtiliseIndex(Course.objects.filter(date_demande__gte=timezone.now() - timedelta(days=1)), 'course_date')
+        # Un filtre __date applique une fonction à la colonne : les tableaux de bord filtrent par intervalle
+        self.assertUtiliseIndex(Course.objects.filter(date_depart__range=(timezone.now() - timedelta(days=1), timezone.now())), 'course_date_depart_idx')
+        self.assertUtiliseIndex(Course.objects.filter(statut='en_attente').order_by('date_demande'), 'course_en_attente_idx')
+        self.assertUtiliseIndex(Ravitaillement.objects.filter(vehicule=vehicule).order_by('-date_ravitaillement'), 'ravitaillement_vehicule_idx')
+        self.assertUtiliseIndex(Entretien.objects.filter(vehicule=vehicule, date_entretien__gte=timezone.now().date() - timedelta(days=30)), 'entretien_vehicule_date_idx')
+        self.assertUtiliseIndex(ActionTraceur.objects.filter(date_action__gte=timezone.now() - timedelta(days=1)), 'actiontraceur_date_idx')
+
+
+class DernierKilometrageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.etablissement = Etablissement.objects.create(nom="Etablissement km")
+        self.admin = User.objects.create_user(username='admin_km', password='testpass123', role='admin')
+        self.vehicule = Vehicule.objects.create(immatriculation="KM1", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.etablissement, numero_chassis="CHKM1", kilometrage_actuel=1000, date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+
+    def _entretien(self, kilometrage, kilometrage_apres=0):
+        return Entretien.objects.create(vehicule=self.vehicule, createur=self.admin, garage="G", motif="M", cout=10, date_entretien=timezone.now().date(), kilometrage=kilometrage, kilometrage_apres=kilometrage_apres)
+
+    def test_releve_maintenu_a_l_ecriture(self):
+        self.assertEqual(get_kilometrage(self.vehicule), 1000)
+        ravitaillement = Ravitaillement.objects.create(vehicule=self.vehicule, createur=self.admin, litres=10, cout_unitaire=2, kilometrage_avant=1000, kilometrage_apres=1200)
+        self.assertEqual(get_kilometrage(self.vehicule), 1200)
+        CheckListSecurite.objects.create(vehicule=self.vehicule, controleur=self.admin, lieu_controle="Parking", kilometrage=1500)
+        releve = DernierKilometrage.objects.get(vehicule=self.vehicule)
+        self.assertEqual((releve.kilometrage, releve.source), (1500, 'checklist'))
+
+        # Un relevé plus ancien ne fait pas reculer le compteur
+        Course.objects.create(demandeur=self.admin, vehicule=self.vehicule, point_embarquement="A", destination="B", motif="Test", statut='terminee', kilometrage_depart=1200, kilometrage_fin=1300)
+        self.assertEqual(get_kilometrage(self.vehicule), 1500)
+
+        # Suppression de la source : le relevé est recalculé à partir des historiques
+        CheckListSecurite.objects.all().delete()
+        self.assertEqual(get_kilometrage(self.vehicule), 1300)
+        ravitaillement.delete()
+        self.assertEqual(get_kilometrage(self.vehicule), 1300)
+
+    def test_correction_a_la_baisse_de_la_source(self):
+        entretien = self._entretien(2000, 2100)
+        self.assertEqual(get_kilometrage(self.vehicule), 2100)
+        # La modification d'un entretien n'est pas comparée à lui-même
+        self.assertEqual(get_kilometrage(self.vehicule, exclure=('entretien', entretien.id)), 1000)
+        entretien.kilometrage, entretien.kilometrage_apres = 1800, 1900
+        entretien.save()
+        self.assertEqual(get_kilometrage(self.vehicule), 1900)
+
+    def test_lecture_servie_depuis_le_cache(self):
+        self._entretien(3000)
+        self.assertEqual(lire_releve(self.vehicule.id)['immatriculation'], "KM1")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_kilometrage(self.vehicule.id), 3000)
+
+    def test_endpoints_ajax_concordants(self):
+        self._entretien(2500, 2600)
+        self.client.login(username='admin_km', password='testpass123')
+        urls = {
+            reverse('chauffeur:get_vehicule_kilometrage'): 'kilometrage',
+            reverse('ravitaillement:get_vehicule_kilometrage'): 'kilometrage',
+            reverse('entretien:get_vehicule_kilometrage'): 'kilometrage',
+            reverse('securite:get_kilometrage_vehicule'): 'kilometrage_actuel',
+        }
+        for url, cle in urls.items():
+            response = self.client.get(url, {'vehicule_id': self.vehicule.id})
+            self.assertEqual(response.json()[cle], 2600, url)
+        response = self.client.get(reverse('chauffeur:get_vehicule_kilometrage'), {'vehicule_id': 999999})
+        self.assertEqual(response.status_code, 404)
+
+
+class SuiviKilometrageTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.etablissement = Etablissement.objects.create(nom="Etablissement suivi")
+        self.demandeur = User.objects.create_user(username='demandeur_suivi', password='testpass123', role='demandeur')
+        self.chauffeur = User.objects.create_user(username='chauffeur_suivi', password='testpass123', role='chauffeur')
+        self.vehicule = Vehicule.objects.create(immatriculation="SUIVI1", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.etablissement, numero_chassis="CHSUIVI1", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+
+    def _course(self, **kwargs):
+        return Course.objects.create(demandeur=self.demandeur, chauffeur=self.chauffeur, vehicule=self.vehicule, point_embarquement="A", destination="B", motif="Test", **kwargs)
+
+    def test_modification_sans_relecture(self):
+        course = Course.objects.get(pk=self._course(statut='en_cours', kilometrage_depart=100).pk)
+        HistoriqueKilometrage.objects.all().delete()
+        course.statut = 'terminee'
+        course.kilometrage_fin = 150
+        with CaptureQueriesContext(connection) as requetes:
+            course.save()
+        self.assertFalse([q for q in requetes if q['sql'].startswith('SELECT') and 'WHERE "core_course"."id" = ' in q['sql']])
+        self.assertEqual(len([q for q in requetes if 'INSERT INTO "core_historiquekilometrage"' in q['sql']]), 1)
+        self.assertEqual(course._statut_precedent, 'en_cours')
+        historique = HistoriqueKilometrage.objects.get()
+        self.assertEqual((historique.valeur_avant, historique.valeur_apres, historique.utilisateur), (None, 150, self.chauffeur))
+
+        # Les valeurs mémorisées suivent les enregistrements successifs
+        course.kilometrage_fin = 160
+        course.save()
+        self.assertEqual(HistoriqueKilometrage.objects.latest('id').valeur_avant, 150)
+
+    def test_champ_differe(self):
+        course = self._course(kilometrage_depart=100)
+        copie = Course.objects.defer('kilometrage_depart').get(pk=course.pk)
+        copie.kilometrage_depart = 120
+        copie.save()
+        self.assertEqual(HistoriqueKilometrage.objects.latest('id').valeur_avant, 100)
+
+    def test_enregistrement_en_masse(self):
+        for i in range(5):
+            self._course(statut='terminee', kilometrage_depart=100 * i, kilometrage_fin=100 * i + 2000)
+        HistoriqueKilometrage.objects.all().delete()
+        courses = list(Course.objects.filter(vehicule=self.vehicule))
+        for course in courses:
+            course.kilometrage_fin = course.kilometrage_depart + 50
+        with CaptureQueriesContext(connection) as requetes:
+            Course.enregistrer_en_masse(courses, ['kilometrage_fin'], commentaire="Correction")
+        self.assertEqual(len([q for q in requetes if 'INSERT INTO "core_historiquekilometrage"' in q['sql']]), 1)
+        self.assertEqual(HistoriqueKilometrage.objects.filter(commentaire="Correction").count(), 5)
+        self.assertEqual(get_kilometrage(self.vehicule), 450)
+
+
+class ExportsFluxTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.etablissement = Etablissement.objects.create(nom="Etablissement export")
+        self.demandeur = User.objects.create_user(username='demandeur_export', password='testpass123', role='demandeur', first_name="Jean", last_name="Export")
+        for i in range(3):
+            Course.objects.create(demandeur=self.demandeur, point_embarquement="A", destination=f"Destination {i}", motif="Test", etablissement=self.etablissement, distance_parcourue=10 * i)
+        self.colonnes = [
+            Colonne('ID', 'id', format='entier'),
+            Colonne('Demandeur', 'demandeur.get_full_name'),
+            Colonne('Véhicule', 'vehicule.immatriculation', defaut="Non assigné"),
+            Colonne('Date', 'date_demande', format='datetime'),
+            Colonne('Distance', 'distance_parcourue', format='entier'),
+        ]
+        self.factory = RequestFactory()
+
+    def _courses(self):
+        return Course.objects.select_related('demandeur', 'vehicule').order_by('id')
+
+    def test_csv_en_flux(self):
+        courses = self._courses()
+        response = exporter(self.factory.get('/', {'format': 'csv'}), courses, self.colonnes, "courses", totaux={'Distance': 30})
+        self.assertTrue(response.streaming)
+        self.assertIn('courses.csv', response['Content-Disposition'])
+        lignes = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lignes[0], "ID,Demandeur,Véhicule,Date,Distance")
+        self.assertEqual(len(lignes), 5)
+        self.assertIn("Jean Export,Non assigné", lignes[1])
+        self.assertEqual(lignes[-1], "TOTAL,,,,30")
+        # Le queryset est lu avec .iterator() : aucun cache de résultats
+        self.assertIsNone(courses._result_cache)
+
+    def test_json_lines(self):
+        response = exporter(self.factory.get('/', {'format': 'jsonl'}), self._courses(), self.colonnes, "courses")
+        lignes = [json.loads(ligne) for ligne in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual(len(lignes), 3)
+        self.assertEqual(lignes[0]['demandeur_get_full_name'], "Jean Export")
+        self.assertIsNone(lignes[0]['vehicule_immatriculation'])
+        self.assertEqual(lignes[2]['distance_parcourue'], 20)
+
+    def test_excel_constant_memory(self):
+        export = ClasseurExport()
+        self.assertTrue(export.classeur.constant_memory)
+        response = exporter(self.factory.get('/'), self._courses(), self.colonnes, "courses", titre="Courses", totaux={'Distance': 30})
+        classeur = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        lignes = list(classeur.active.iter_rows(values_only=True))
+        self.assertEqual(lignes[0][0], "Courses")
+        self.assertEqual(lignes[3], ('ID', 'Demandeur', 'Véhicule', 'Date', 'Distance'))
+        self.assertEqual(lignes[4][1:3], ("Jean Export", "Non assigné"))
+        self.assertEqual(lignes[-1], ('TOTAL', None, None, None, 30))
+
+
+class RenduPdfTests(TestCase):
+    def setUp(self):
+        self.repertoire = tempfile.TemporaryDirectory()
+        self.addCleanup(self.repertoire.cleanup)
+        reglages = override_settings(PDF_RENDUS_WORKERS=0, PDF_RENDUS_DIR=self.repertoire.name)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.conversions = []
+        conversion = mock.patch.object(rendu_pdf, '_convertir', side_effect=self._convertir)
+        conversion.start()
+        self.addCleanup(conversion.stop)
+        self.factory = RequestFactory()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='pdf', password='testpass123', role='admin')
+
+    def _convertir(self, html, chemin, *args):
+        self.conversions.append(html)
+        if 'erreur' in html:
+            raise OSError("wkhtmltopdf introuvable")
+        with open(chemin, 'wb') as fichier:
+            fichier.write(b'%PDF-' + html.encode('utf-8'))
+        return chemin
+
+    def test_cle_par_template_et_contexte(self):
+        cle = rendu_pdf.cle_document('a.html', '<p>1</p>')
+        self.assertEqual(cle, rendu_pdf.cle_document('a.html', '<p>1</p>'))
+        self.assertNotEqual(cle, rendu_pdf.cle_document('a.html', '<p>2</p>'))
+        self.assertNotEqual(cle, rendu_pdf.cle_document('b.html', '<p>1</p>'))
+        self.assertNotEqual(cle, rendu_pdf.cle_document('a.html', '<p>1</p>', moteur='weasyprint'))
+
+    def test_cle_sans_horodatage_d_impression(self):
+        def rendre(template_name, contexte):
+            return f"<p>{contexte['titre']} {contexte['date_impression']}</p>"
+
+        with mock.patch.object(rendu_pdf, 'render_to_string', side_effect=rendre):
+            for minute in ('10:00', '10:01'):
+                contexte = {'titre': 'Courses', 'date_impression': f'01/01/2026 {minute}'}
+                rendu_pdf.reponse_pdf(rendre('a.html', contexte), template_name='a.html', contexte=contexte).close()
+            contexte = {'titre': 'Courses modifiées', 'date_impression': '01/01/2026 10:02'}
+            rendu_pdf.reponse_pdf(rendre('a.html', contexte), template_name='a.html', contexte=contexte).close()
+        self.assertEqual(self.conversions, ['<p>Courses 01/01/2026 10:00</p>', '<p>Courses modifiées 01/01/2026 10:02</p>'])
+        # Rendu terminé : plus de fichier témoin
+        self.assertFalse([nom for nom in os.listdir(self.repertoire.name) if nom.endswith('.encours')])
+
+    def test_document_servi_depuis_le_disque(self):
+        response = rendu_pdf.reponse_pdf('<p>rapport</p>', 'rapport.pdf', template_name='a.html')
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-<p>rapport</p>')
+        self.assertIn('rapport.pdf', response['Content-Disposition'])
+        rendu_pdf.reponse_pdf('<p>rapport</p>', 'rapport.pdf', template_name='a.html').close()
+        response.close()
+        self.assertEqual(len(self.conversions), 1)
+
+    def test_echec_du_rendu(self):
+        response = rendu_pdf.reponse_pdf('<p>erreur</p>', template_name='a.html')
+        self.assertEqual(response.status_code, 500)
+        cle = rendu_pdf.cle_document('a.html', '<p>erreur</p>')
+        self.assertEqual(rendu_pdf.etat_document(cle), 'echec')
+        self.assertIn("introuvable", rendu_pdf.erreur_document(cle))
+
+    def test_redirection_quand_le_rendu_depasse_l_attente(self):
+        future = Future()
+        cle = rendu_pdf.cle_document('a.html', '<p>long</p>')
+        with override_settings(PDF_RENDUS_ATTENTE=0), mock.patch.object(rendu_pdf, 'soumettre', return_value=future):
+            # Rendu lancé par un autre processus web : seul le fichier témoin est visible
+            open(os.path.join(self.repertoire.name, f"{cle}.encours"), 'w').close()
+            response = rendu_pdf.reponse_pdf('<p>long</p>', 'long.pdf', template_name='a.html')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.url, f"{reverse('document_pdf', args=[cle])}?nom=long.pdf")
+
+            self.client.login(username='pdf', password='testpass123')
+            self.assertEqual(self.client.get(response.url, {'etat': 1}).json(), {'etat': 'en_cours'})
+            self.assertEqual(self.client.get(response.url).status_code, 202)
+
+    def test_vue_document_pdf(self):
+        self.client.login(username='pdf', password='testpass123')
+        self.assertEqual(self.client.get(reverse('document_pdf', args=['0' * 64])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('document_pdf', args=['settings'])).status_code, 404)
+
+        rendu_pdf.reponse_pdf('<p>pret</p>', template_name='a.html').close()
+        url = reverse('document_pdf', args=[rendu_pdf.cle_document('a.html', '<p>pret</p>')])
+        self.assertEqual(self.client.get(url, {'etat': 1}).json(), {'etat': 'pret'})
+        response = self.client.get(url, {'nom': 'pret.pdf'})
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-<p>pret</p>')
+        self.assertIn('pret.pdf', response['Content-Disposition'])
+
+
+class JetonsApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.chauffeur = User.objects.create_user(username='chauffeur_api', password='testpass123', role='chauffeur')
+        self.demandeur = User.objects.create_user(username='demandeur_api', password='testpass123', role='demandeur')
+        Course.objects.create(demandeur=self.demandeur, chauffeur=self.chauffeur, point_embarquement='A', destination='B', motif='Test', statut='validee')
+
+    def _login(self, username):
+        return self.client.post(reverse('api_login'), json.dumps({'username': username, 'password': 'testpass123'}), content_type='application/json').json()
+
+    def _get(self, nom, jeton):
+        return self.client.get(reverse(nom), HTTP_AUTHORIZATION=f"Bearer {jeton}")
+
+    def test_jeton_signe_et_principal_en_cache(self):
+        jetons = self._login('chauffeur_api')
+        self.assertEqual(jetons['token'], jetons['access_token'])
+        self.assertEqual(self._get('api_chauffeur_missions', jetons['access_token']).json()['missions'][0]['destination'], 'B')
+        # Utilisateur en cache : la vérification du jeton ne fait aucune requête
+        with self.assertNumQueries(0):
+            self.assertEqual(self._get('api_verify_token', jetons['access_token']).json()['user']['username'], 'chauffeur_api')
+
+        # L'ancien format et un jeton modifié sont refusés, un autre rôle est interdit
+        self.assertEqual(self._get('api_chauffeur_missions', f"chauffeur_{self.chauffeur.id}_chauffeur_api").status_code, 401)
+        self.assertEqual(self._get('api_chauffeur_missions', jetons['access_token'][:-2] + 'xx').status_code, 401)
+        self.assertEqual(self._get('api_demandeur_demandes_list', jetons['access_token']).status_code, 403)
+        # Le jeton de rafraîchissement n'est pas un jeton d'accès
+        self.assertEqual(self._get('api_chauffeur_missions', jetons['refresh_token']).status_code, 401)
+
+        # Désactivation prise en compte immédiatement
+        self.chauffeur.is_active = False
+        self.chauffeur.save()
+        self.assertEqual(self._get('api_chauffeur_missions', jetons['access_token']).status_code, 401)
+
+    def test_expiration_et_rafraichissement(self):
+        jetons = self._login('demandeur_api')
+        url = reverse('api_refresh_token')
+        with override_settings(API_JETON_ACCES_DUREE=-1):
+            self.assertEqual(self._get('api_demandeur_demandes_list', jetons['access_token']).status_code, 401)
+
+        with mock.patch('django.contrib.auth.hashers.check_password') as check_password:
+            nouveaux = self.client.post(url, json.dumps({'refresh_token': jetons['refresh_token']}), content_type='application/json').json()
+        check_password.assert_not_called()
+        self.assertEqual(self._get('api_demandeur_demandes_list', nouveaux['access_token']).status_code, 200)
+        self.assertEqual(self.client.post(url, json.dumps({'refresh_token': jetons['access_token']}), content_type='application/json').status_code, 401)
+
+        # Un changement de mot de passe révoque les jetons de rafraîchissement
+        self.demandeur.set_password('nouveau123')
+        self.demandeur.save()
+        self.assertEqual(self.client.post(url, json.dumps({'refresh_token': nouveaux['refresh_token']}), content_type='application/json').status_code, 401)
+
+
+class MissionsChauffeurApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.chauffeur = User.objects.create_user(username='chauffeur_flux', password='testpass123', role='chauffeur')
+        demandeur = User.objects.create_user(username='demandeur_flux', password='testpass123', role='demandeur', first_name='Awa', last_name='Diallo')
+        vehicule = Vehicule.objects.create(immatriculation="API1", marque="Toyota", modele="Hilux", couleur="blanc", numero_chassis="CHASSISAPI1", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+        for i in range(5):
+            Course.objects.create(demandeur=demandeur, chauffeur=self.chauffeur, vehicule=vehicule, point_embarquement='A', destination=f'D{i}', motif='Test', statut='terminee' if i < 2 else 'validee', date_souhaitee=timezone.now() + timedelta(days=i))
+        self.jeton = self.client.post(reverse('api_login'), json.dumps({'username': 'chauffeur_flux', 'password': 'testpass123'}), content_type='application/json').json()['access_token']
+
+    def _get(self, **parametres):
+        en_tetes = {'HTTP_AUTHORIZATION': f"Bearer {self.jeton}"}
+        if 'etag' in parametres:
+            en_tetes['HTTP_IF_NONE_MATCH'] = parametres.pop('etag')
+        return self.client.get(reverse('api_chauffeur_missions'), parametres, **en_tetes)
+
+    def test_pages_par_curseur_en_une_requete(self):
+        self._get()  # utilisateur du jeton mis en cache
+        destinations = []
+        curseur = ''
+        while True:
+            with self.assertNumQueries(1):
+                data = self._get(limit=2, cursor=curseur).json() if curseur else self._get(limit=2).json()
+            destinations += [m['destination'] for m in data['missions']]
+            self.assertEqual(data['missions'][0]['demandeur'], 'Awa Diallo')
+            if not data['has_more']:
+                break
+            curseur = data['next_cursor']
+        self.assertEqual(destinations, ['D4', 'D3', 'D2', 'D1', 'D0'])
+        self.assertEqual(self._get(cursor='invalide').status_code, 400)
+
+    def test_filtres_et_projection(self):
+        data = self._get(statut='terminee', fields='destination,statut').json()
+        self.assertEqual(data['missions'], [{'id': m['id'], 'destination': m['destination'], 'statut': 'terminee'} for m in data['missions']])
+        self.assertEqual(len(data['missions']), 2)
+        demain = (timezone.localtime() + timedelta(days=1)).date()
+        self.assertEqual([m['destination'] for m in self._get(date_debut=demain.isoformat(), date_fin=demain.isoformat()).json()['missions']], ['D1'])
+        self.assertEqual(self._get(fields='mot_de_passe').status_code, 400)
+
+    def test_etag_et_gzip(self):
+        response = self._get()
+        etag = response['ETag']
+        self.assertEqual(self._get(etag=etag).status_code, 304)
+        Course.objects.filter(destination='D4').update(statut='en_cours')
+        self.assertEqual(self._get(etag=etag).status_code, 200)
+
+        response = self.client.get(reverse('api_chauffeur_missions'), HTTP_AUTHORIZATION=f"Bearer {self.jeton}", HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+
+class SynchronisationChauffeurApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        etablissement = Etablissement.objects.create(nom="Etab sync", code="SYNC")
+        self.chauffeur = User.objects.create_user(username='chauffeur_sync', password='testpass123', role='chauffeur', etablissement=etablissement)
+        demandeur = User.objects.create_user(username='demandeur_sync', password='testpass123', role='demandeur')
+        self.vehicule = Vehicule.objects.create(immatriculation="SYNC1", marque="Toyota", modele="Hilux", couleur="blanc", numero_chassis="CHASSISSYNC1", kilometrage_actuel=1000, etablissement=etablissement, date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+        self.course = Course.objects.create(demandeur=demandeur, chauffeur=self.chauffeur, vehicule=self.vehicule, point_embarquement='A', destination='B', motif='Test', statut='validee')
+        self.jeton = self.client.post(reverse('api_login'), json.dumps({'username': 'chauffeur_sync', 'password': 'testpass123'}), content_type='application/json').json()['access_token']
+
+    def _envoyer(self, actions):
+        return self.client.post(reverse('api_chauffeur_synchronisation'), json.dumps({'actions': actions}), content_type='application/json', HTTP_AUTHORIZATION=f"Bearer {self.jeton}")
+
+    def _file(self):
+        depart = timezone.now() - timedelta(hours=3)
+        return [
+            {'cle': 'a1', 'type': 'demarrer', 'horodatage': depart.isoformat(), 'donnees': {'course_id': self.course.id, 'kilometrage_depart': 1000}},
+            {'cle': 'a2', 'type': 'ravitaillement', 'donnees': {'vehicule': self.vehicule.id, 'nom_station': 'Total', 'kilometrage_avant': 1010, 'kilometrage_apres': 1020, 'litres': '40', 'cout_unitaire': '650'}},
+            {'cle': 'a3', 'type': 'checklist', 'donnees': {'vehicule': self.vehicule.id, 'kilometrage': 1020, 'freins': 'defectueux', 'lieu_controle': 'Parking'}},
+            {'cle': 'a4', 'type': 'terminer', 'donnees': {'course_id': self.course.id, 'kilometrage_fin': 1080}},
+        ]
+
+    def test_file_appliquee_en_un_envoi(self):
+        data = self._envoyer(self._file()).json()
+        self.assertEqual([r['statut'] for r in data['resultats']], ['ok'] * 4)
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.statut, self.course.distance_parcourue), ('terminee', 80))
+        self.assertLess(self.course.date_depart, timezone.now() - timedelta(hours=2))
+        self.vehicule.refresh_from_db()
+        self.assertEqual(self.vehicule.kilometrage_actuel, 1080)
+        self.assertEqual(Ravitaillement.objects.get().chauffeur, self.chauffeur)
+        self.assertEqual(CheckListSecurite.objects.get().statut, 'anomalie_mineure')
+
+        # Renvoi après une coupure : rien n'est rejoué, les résultats d'origine sont renvoyés
+        renvoi = self._envoyer(self._file()).json()
+        self.assertEqual([r['statut'] for r in renvoi['resultats']], ['deja_traite'] * 4)
+        self.assertEqual(renvoi['resultats'][3]['resultat'], data['resultats'][3]['resultat'])
+        self.assertEqual(Ravitaillement.objects.count(), 1)
+        self.assertEqual(CheckListSecurite.objects.count(), 1)
+
+    def test_resultat_par_action(self):
+        file = self._file()
+        file[1]['donnees']['kilometrage_apres'] = 1000  # inférieur au kilométrage avant
+        file.insert(0, {'type': 'demarrer', 'donnees': {}})
+        data = self._envoyer(file).json()
+        self.assertEqual([r['statut'] for r in data['resultats']], ['erreur', 'ok', 'erreur', 'ok', 'ok'])
+        self.assertEqual(data['erreurs'], 2)
+        self.assertIn('__all__', data['resultats'][2]['erreurs'])
+        self.assertEqual(Ravitaillement.objects.count(), 0)
+
+        # L'action refusée n'a pas enregistré sa clé : corrigée, elle est appliquée au renvoi
+        # (après le compteur de fin de mission, 1080 km)
+        file[2]['donnees'].update(kilometrage_avant=1080, kilometrage_apres=1100)
+        self.assertEqual([r['statut'] for r in self._envoyer(file[2:3]).json()['resultats']], ['ok'])
+        # Une mission terminée ne peut plus être démarrée
+        refus = self._envoyer([{'cle': 'b1', 'type': 'demarrer', 'donnees': {'course_id': self.course.id, 'kilometrage_depart': 1100}}]).json()
+        self.assertEqual(refus['resultats'][0]['statut'], 'erreur')
+        self.assertEqual(self._envoyer('pas une liste').status_code, 400)
+
+    def test_compteur_inferieur_au_dernier_kilometrage(self):
+        file = self._file()
+        file[0]['donnees']['kilometrage_depart'] = 900
+        file[1]['donnees'].update(kilometrage_avant=950, kilometrage_apres=990)
+        data = self._envoyer(file[:2]).json()
+        self.assertEqual([r['statut'] for r in data['resultats']], ['erreur', 'erreur'])
+        self.assertIn('1000 km', data['resultats'][0]['erreur'])
+        self.assertIn('kilometrage_avant', data['resultats'][1]['erreurs'])
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.statut, 'validee')
+        self.assertEqual(Ravitaillement.objects.count(), 0)
+
+
+@override_settings(API_SYNCHRO_MARGE=0)
+class SynchronisationDemandesApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.demandeur = User.objects.create_user(username='demandeur_delta', password='testpass123', role='demandeur')
+        self.autre = User.objects.create_user(username='autre_delta', password='testpass123', role='demandeur')
+        User.objects.create_user(username='dispatch_delta', password='testpass123', role='dispatch')
+        self.courses = [
+            Course.objects.create(demandeur=demandeur, point_embarquement='A', destination=f'D{i}', motif='Test')
+            for i, demandeur in enumerate([self.demandeur, self.demandeur, self.autre])
+        ]
+        self.jetons = {
+            nom: self.client.post(reverse('api_login'), json.dumps({'username': nom, 'password': 'testpass123'}), content_type='application/json').json()['access_token']
+            for nom in ('demandeur_delta', 'dispatch_delta')
+        }
+
+    def _get(self, nom, utilisateur, **parametres):
+        return self.client.get(reverse(nom), parametres, HTTP_AUTHORIZATION=f"Bearer {self.jetons[utilisateur]}")
+
+    def test_changements_et_suppressions(self):
+        complet = self._get('api_demandeur_demandes_list', 'demandeur_delta').json()
+        self.assertEqual(len(complet['demandes']), 2)
+        curseur = complet['sync_cursor']
+
+        # Rien n'a changé : la réponse est vide
+        self._get('api_demandeur_demandes_list', 'demandeur_delta', since=curseur)  # utilisateur du jeton mis en cache
+        with self.assertNumQueries(2):
+            delta = self._get('api_demandeur_demandes_list', 'demandeur_delta', since=curseur).json()
+        self.assertEqual((delta['demandes'], delta['supprimees']), ([], []))
+
+        modifiee, supprimee, autre = self.courses
+        supprimee_id, autre_id = supprimee.id, autre.id
+        modifiee.statut = 'validee'
+        modifiee.save()
+        supprimee.delete()
+        autre.delete()
+        nouvelle = Course.objects.create(demandeur=self.demandeur, point_embarquement='A', destination='D3', motif='Test')
+        delta = self._get('api_demandeur_demandes_list', 'demandeur_delta', since=delta['sync_cursor']).json()
+        self.assertEqual([(d['id'], d['statut']) for d in delta['demandes']], [(modifiee.id, 'validee'), (nouvelle.id, 'en_attente')])
+        self.assertEqual(delta['supprimees'], [supprimee_id])
+
+        # Le dispatcher voit toutes les suppressions
+        delta = self._get('api_dispatch_demandes_list', 'dispatch_delta', since=curseur).json()
+        self.assertEqual(sorted(delta['supprimees']), sorted([supprimee_id, autre_id]))
+        self.assertEqual(delta['demandes'][0]['demandeur'], 'demandeur_delta')
+
+    def test_pages_et_curseur_invalide(self):
+        curseur = self._get('api_dispatch_demandes_list', 'dispatch_delta').json()['sync_cursor']
+        for course in self.courses:
+            course.save()
+        vus = []
+        while True:
+            delta = self._get('api_dispatch_demandes_list', 'dispatch_delta', since=curseur, limit=2).json()
+            vus += [d['id'] for d in delta['demandes']]
+            curseur = delta['sync_cursor']
+            if not delta['has_more']:
+                break
+        self.assertEqual(vus, [c.id for c in self.courses])
+
+        self.assertEqual(self._get('api_dispatch_demandes_list', 'dispatch_delta', since='invalide').status_code, 400)
+        with override_settings(API_SYNCHRO_RETENTION=-1):
+            self.assertEqual(self._get('api_dispatch_demandes_list', 'dispatch_delta', since=curseur).status_code, 410)
+
+    @override_settings(API_SYNCHRO_MARGE=600)
+    def test_transaction_validee_apres_le_curseur(self):
+        Course.objects.update(date_modification=timezone.now() - timedelta(hours=1))
+        curseur = self._get('api_dispatch_demandes_list', 'dispatch_delta').json()['sync_cursor']
+        self.courses[0].save()
+        delta = self._get('api_dispatch_demandes_list', 'dispatch_delta', since=curseur).json()
+        self.assertEqual([d['id'] for d in delta['demandes']], [self.courses[0].id])
+
+        # Transaction validée après la synchronisation, avec une date de modification antérieure
+        Course.objects.filter(pk=self.courses[1].pk).update(date_modification=timezone.now() - timedelta(seconds=60))
+        delta = self._get('api_dispatch_demandes_list', 'dispatch_delta', since=delta['sync_cursor']).json()
+        self.assertEqual([d['id'] for d in delta['demandes']], [self.courses[1].id, self.courses[0].id])
+
+    def test_purge_des_suppressions(self):
+        supprimees = [course.id for course in self.courses[:2]]
+        self.courses[0].delete()
+        ancienne = CourseSupprimee.objects.create(course_id=999, date_suppression=timezone.now() - timedelta(days=31))
+        CourseSupprimee.objects.create(course_id=998, date_suppression=timezone.now() - timedelta(days=40))
+        # La suppression d'une course n'exécute plus la purge
+        self.courses[1].delete()
+        self.assertTrue(CourseSupprimee.objects.filter(pk=ancienne.pk).exists())
+        call_command('purger_suppressions_synchro', lot=1, stdout=StringIO())
+        self.assertEqual(sorted(CourseSupprimee.objects.values_list('course_id', flat=True)), supprimees)
+
+
+class RenouvellementSessionTests(TestCase):
+    def setUp(self):
+        get_user_model().objects.create_user(username='session_user', password='testpass123', role='demandeur')
+        self.client.login(username='session_user', password='testpass123')
+
+    def _ecritures_session(self):
+        with CaptureQueriesContext(connection) as requetes:
+            self.client.get(reverse('home'))
+        return [q['sql'] for q in requetes.captured_queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+
+    def test_session_prolongee_seulement_pres_de_l_expiration(self):
+        self._ecritures_session()  # première requête : heure de renouvellement enregistrée
+        self.assertEqual(self._ecritures_session(), [])
+        expiration = Session.objects.get().expire_date
+
+        # Deux jours plus tard, il reste moins que le seuil : une écriture prolonge la session
+        with mock.patch('core.middleware.time.time', return_value=time.time() + 2 * 86400):
+            self.assertEqual(len(self._ecritures_session()), 1)
+            self.assertEqual(self._ecritures_session(), [])
+        self.assertGreater(Session.objects.get().expire_date, expiration)
+
+    def test_purge_des_sessions_expirees(self):
+        Session.objects.update(expire_date=timezone.now() - timedelta(days=1))
+        get_user_model().objects.create_user(username='session_active', password='testpass123')
+        Client().login(username='session_active', password='testpass123')
+        call_command('purger_sessions', lot=1, stdout=StringIO())
+        self.assertEqual(Session.objects.count(), 1)
+
+
+class StatistiquesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.demandeur = User.objects.create_user(username='demandeur_stats', password='testpass123', role='demandeur')
+        for statut in ('en_attente', 'en_attente', 'validee', 'terminee'):
+            Course.objects.create(demandeur=self.demandeur, point_embarquement='A', destination='B', motif='Test', statut=statut)
+
+    def test_compteurs_en_une_requete_et_en_cache(self):
+        statuts = {'en_attente': 'en_attente', 'validees': 'validee', 'refusees': 'refusee'}
+        with self.assertNumQueries(1):
+            stats = compter_par_statut(Course.objects.all(), statuts, cle_cache='toutes')
+        self.assertEqual(stats, {'total': 4, 'en_attente': 2, 'validees': 1, 'refusees': 0})
+        self.assertEqual(pourcentages(stats)['en_attente'], 50)
+        with self.assertNumQueries(0):
+            self.assertEqual(compter_par_statut(Course.objects.all(), statuts, cle_cache='toutes'), stats)
+        # Sans clé de cache, les compteurs sont relus
+        Course.objects.filter(statut='en_attente').update(statut='refusee')
+        self.assertEqual(compter_par_statut(Course.objects.all(), statuts)['refusees'], 2)
+
+    def test_cle_de_cache_distincte_par_requete_et_conditions(self):
+        statuts = {'en_attente': 'en_attente'}
+        toutes = compter_par_statut(Course.objects.all(), statuts, cle_cache='tableau')
+        # Même identifiant de périmètre, autre requête ou autres conditions : pas de résultat partagé
+        with self.assertNumQueries(1):
+            terminees = compter_par_statut(Course.objects.filter(statut='terminee'), statuts, cle_cache='tableau')
+        self.assertEqual((toutes['total'], terminees['total']), (4, 1))
+        with self.assertNumQueries(1):
+            self.assertEqual(compter_par_statut(Course.objects.all(), {'en_attente': 'validee'}, cle_cache='tableau')['en_attente'], 1)
+        self.assertEqual(compter_par_statut(Course.objects.none(), statuts, cle_cache='tableau')['total'], 0)
+
+    def test_tableau_de_bord_demandeur(self):
+        self.client.login(username='demandeur_stats', password='testpass123')
+        stats = self.client.get(reverse('demandeur:dashboard')).context['stats']
+        self.assertEqual(stats, {'total': 4, 'en_attente': 2, 'validees': 1, 'refusees': 0})
@@ -50,6 +50,8 @@ urlpatterns = [
     path('messagerie/messages/', views.get_messages, name='get_messages'),
     path('messagerie/users/', views.get_users, name='get_users'),
     path('messagerie/unread_status/', views.get_unread_messages_status, name='get_unread_messages_status'),
+    path('evenements/', views.flux_evenements, name='flux_evenements'),
+    path('documents/pdf/<str:cle>/', views.document_pdf, name='document_pdf'),
     path('vehicule/<int:vehicule_id>/changer-etablissement/', views.vehicule_change_etablissement, name='vehicule_change_etablissement'),
     path('configuration/', views.configuration_view, name='configuration'),
     path('test/', views.test_view, name='test'),
@@ -57,8 +59,10 @@ urlpatterns = [
     
     # API endpoints pour les applications mobiles
     path('api/login/', api.api_login, name='api_login'),
+    path('api/token/refresh/', api.api_refresh_token, name='api_refresh_token'),
     path('api/verify-token/', api.api_verify_token, name='api_verify_token'),
     path('api/chauffeur/missions/', api.api_chauffeur_missions, name='api_chauffeur_missions'),
+    path('api/evenements/', api.api_evenements, name='api_evenements'),
     # Demandeur
     path('api/demandeur/demandes/', api.api_demandeur_demandes_list, name='api_demandeur_demandes_list'),
     path('api/demandeur/demandes/create/', api.api_demandeur_demandes_create, name='api_demandeur_demandes_create'),
@@ -68,4 +72,5 @@ urlpatterns = [
     # Chauffeur actions
     path('api/chauffeur/missions/<int:course_id>/demarrer/', api.api_chauffeur_demarrer, name='api_chauffeur_demarrer'),
     path('api/chauffeur/missions/<int:course_id>/terminer/', api.api_chauffeur_terminer, name='api_chauffeur_terminer'),
+    path('api/chauffeur/synchronisation/', api.api_chauffeur_synchronisation, name='api_chauffeur_synchronisation'),
 ]
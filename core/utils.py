@@ -1,5 +1,6 @@
 import os
 import io
+import itertools
 import base64
 from datetime import datetime
 from django.conf import settings
@@ -9,14 +10,11 @@ from django.template.loader import get_template
 # Nouvelles bibliothèques PDF compatibles Python 3.13
 from .pdf_utils import render_to_pdf as new_render_to_pdf, html_to_pdf, markdown_to_pdf, is_pdf_available
 from django.contrib.staticfiles import finders
-import xlsxwriter
+from .exports import Colonne, reponse_excel
 from django.core.mail import send_mail
 from core.models import Utilisateur
 from django.contrib import messages
 from django.utils import timezone
-from ravitaillement.models import Ravitaillement
-from entretien.models import Entretien
-from securite.models import CheckListSecurite
 
 
 def link_callback(uri, rel):
@@ -137,73 +135,25 @@ def export_to_excel(title, data, filename):
     
     Args:
         title (str): Titre du document
-        data (list): Liste de dictionnaires contenant les données à exporter
+        data (iterable): Dictionnaires contenant les données à exporter (liste ou générateur)
         filename (str): Nom du fichier de sortie
     
     Returns:
         HttpResponse: Réponse HTTP avec le fichier Excel
+    
+    Les colonnes sont les clés du premier dictionnaire. Le classeur est écrit
+    en flux (core.exports) : les données ne sont parcourues qu'une fois.
     """
     try:
-        # Créer un buffer en mémoire pour le fichier Excel
-        buffer = io.BytesIO()
-        
-        # Créer un nouveau classeur Excel
-        workbook = xlsxwriter.Workbook(buffer)
-        
-        # Créer une feuille de calcul
-        worksheet = workbook.add_worksheet('Données')
-        
-        # Définir des formats pour l'en-tête et les données
-        header_format = workbook.add_format({
-            'bold': True,
-            'text_wrap': True,
-            'valign': 'top',
-            'fg_color': '#D7E4BC',
-            'border': 1
-        })
-        
-        data_format = workbook.add_format({
-            'text_wrap': True,
-            'valign': 'top',
-            'border': 1
-        })
-        
-        # Écrire le titre
-        worksheet.write(0, 0, title, header_format)
-        worksheet.merge_range(0, 0, 0, len(data[0].keys()) - 1 if data else 0, title, header_format)
-        
-        # Écrire la date de génération
-        worksheet.write(1, 0, f"Généré le {datetime.now().strftime('%d/%m/%Y %H:%M')}", data_format)
-        worksheet.merge_range(1, 0, 1, len(data[0].keys()) - 1 if data else 0, f"Généré le {datetime.now().strftime('%d/%m/%Y %H:%M')}", data_format)
-        
-        # Écrire les en-têtes
-        if data and isinstance(data[0], dict):
-            headers = list(data[0].keys())
-            for col, header in enumerate(headers):
-                worksheet.write(3, col, header, header_format)
-            
-            # Écrire les données
-            for row, item in enumerate(data, start=4):
-                for col, header in enumerate(headers):
-                    value = item.get(header, '')
-                    worksheet.write(row, col, value, data_format)
-            
-            # Ajuster automatiquement la largeur des colonnes
-            for col, header in enumerate(headers):
-                max_length = len(str(header))
-                for item in data:
-                    max_length = max(max_length, len(str(item.get(header, ''))))
-                worksheet.set_column(col, col, min(max_length + 2, 50))  # Limiter à 50 caractères
-        
-        # Fermer le classeur
-        workbook.close()
-        
-        # Préparer la réponse HTTP
-        buffer.seek(0)
-        response = HttpResponse(buffer, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        return response
+        lignes = iter(data)
+        premiere = next(lignes, None)
+        entetes = list(premiere.keys()) if isinstance(premiere, dict) else []
+        colonnes = [
+            Colonne(entete, lambda ligne, cle=entete: ligne.get(cle, ''), largeur=min(max(len(str(entete)) + 2, 15), 50))
+            for entete in entetes
+        ]
+        lignes = itertools.chain([premiere], lignes) if entetes else []
+        return reponse_excel(lignes, colonnes, os.path.splitext(filename)[0], titre=title)
         
     except Exception as e:
         # En cas d'erreur, retourner une réponse d'erreur
@@ -296,35 +246,5 @@ def get_latest_vehicle_kilometrage(vehicule):
     Returns:
         int: Le dernier kilométrage enregistré, ou 0 si aucun n'est trouvé
     """
-    try:
-        # Essayer de récupérer le dernier ravitaillement
-        dernier_ravitaillement = Ravitaillement.objects.filter(
-            vehicule=vehicule
-        ).order_by('-date_ravitaillement').first()
-        
-        if dernier_ravitaillement and dernier_ravitaillement.kilometrage_apres:
-            return dernier_ravitaillement.kilometrage_apres
-        
-        # Essayer de récupérer le dernier entretien
-        dernier_entretien = Entretien.objects.filter(
-            vehicule=vehicule
-        ).order_by('-date_entretien').first()
-        
-        if dernier_entretien and dernier_entretien.kilometrage:
-            return dernier_entretien.kilometrage
-        
-        # Essayer de récupérer la dernière checklist de sécurité
-        derniere_checklist = CheckListSecurite.objects.filter(
-            vehicule=vehicule
-        ).order_by('-date_verification').first()
-        
-        if derniere_checklist and derniere_checklist.kilometrage:
-            return derniere_checklist.kilometrage
-        
-        # Si aucun kilométrage n'est trouvé, retourner 0
-        return 0
-        
-    except Exception as e:
-        # En cas d'erreur, retourner 0
-        print(f"Erreur lors de la récupération du kilométrage: {str(e)}")
-        return 0
+    from .kilometrage import get_kilometrage
+    return get_kilometrage(vehicule)
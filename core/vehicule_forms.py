@@ -26,7 +26,7 @@ class VehiculeForm(forms.ModelForm):
         model = Vehicule
         fields = [
             'etablissement',
-            'immatriculation', 'marque', 'modele', 'couleur', 'numero_chassis', 'image',
+            'immatriculation', 'marque', 'modele', 'couleur', 'numero_chassis', 'nombre_places', 'image',
             'date_expiration_assurance', 'date_expiration_controle_technique',
             'date_expiration_vignette', 'date_expiration_stationnement'
         ]
@@ -36,6 +36,7 @@ class VehiculeForm(forms.ModelForm):
             'modele': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Ex: Corolla'}),
             'couleur': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Ex: Bleu'}),
             'numero_chassis': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Ex: VF1234567890'}),
+            'nombre_places': forms.NumberInput(attrs={'class': 'form-control', 'min': 1, 'placeholder': 'Ex: 4'}),
             'image': forms.ClearableFileInput(attrs={'class': 'form-control'}),
         }
     
@@ -54,6 +55,7 @@ class VehiculeForm(forms.ModelForm):
         self.fields['modele'].label = "Modèle"
         self.fields['couleur'].label = "Couleur"
         self.fields['numero_chassis'].label = "Numéro de châssis"
+        self.fields['nombre_places'].label = "Nombre de places passagers"
         self.fields['image'].label = "Image du véhicule"
         self.fields['date_expiration_assurance'].label = "Date d'expiration de l'assurance"
         self.fields['date_expiration_controle_technique'].label = "Date d'expiration du contrôle technique"
@@ -4,18 +4,23 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.contrib.auth.forms import SetPasswordForm
 from django.utils import timezone
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, Http404
 import os
-from .models import Vehicule, Course, ActionTraceur, Utilisateur, Etablissement, ApplicationControl, Message
+from .models import Vehicule, Course, ActionTraceur, Utilisateur, Etablissement, ApplicationControl, Message, CompteurMessagesNonLus
 from .forms import UtilisateurCreationForm, UtilisateurChangeForm, ApplicationControlForm, AdminPasswordForm, EtablissementForm
 from .vehicule_forms import VehiculeForm, VehiculeChangeEtablissementForm
-from .utils import render_to_pdf, get_latest_vehicle_kilometrage, export_to_excel
+from .utils import render_to_pdf, export_to_excel
+from .kilometrage import get_kilometrage
+from .statistiques import compter
 from entretien.models import Entretien
 from ravitaillement.models import Ravitaillement
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from .decorators import admin_required, departement_required, require_departement_password
+from .middleware import get_application_control_state
+from .evenements import reponse_flux
+from .rendu_pdf import etat_document, erreur_document, servir_document
 from django import forms
-from django.views.decorators.http import require_POST, require_GET
+from django.views.decorators.http import require_POST, require_GET, condition
 # from twilio.rest import Client  # Commenté pour le déploiement
 from django.conf import settings
 # import africastalking  # Commenté pour le déploiement
@@ -23,7 +28,8 @@ from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from dotenv import load_dotenv
-from django.db.models import Q
+from django.db.models import Q, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from datetime import datetime, time
 import xlwt
 from django.contrib.auth import get_user_model
@@ -69,17 +75,17 @@ def home_view(request):
     context = {}
     
     # Calcul du temps restant avant blocage
-    try:
-        control = ApplicationControl.objects.get(pk=1)
+    control = get_application_control_state()
+    if control is not None:
         now = timezone.now()
-        if control.is_open and control.end_datetime and now < control.end_datetime:
-            delta = control.end_datetime - now
+        if control['is_open'] and control['end_datetime'] and now < control['end_datetime']:
+            delta = control['end_datetime'] - now
             context['temps_restant'] = int(delta.total_seconds())
             context['temps_restant_str'] = str(delta).split('.')[0]  # HH:MM:SS
         else:
             context['temps_restant'] = 0
             context['temps_restant_str'] = None
-    except ApplicationControl.DoesNotExist:
+    else:
         context['temps_restant'] = None
         context['temps_restant_str'] = None
     
@@ -90,11 +96,15 @@ def home_view(request):
                 context['etablissements'] = Etablissement.objects.all()
             if Etablissement.objects.count() == 0:
                 context['no_etablissement'] = True
-        # Récupérer les statistiques
-        context['vehicules_count'] = Vehicule.objects.filter(etablissement=request.user.etablissement).count() if request.user.etablissement else 0
-        context['courses_count'] = Course.objects.filter(etablissement=request.user.etablissement).count() if request.user.etablissement else 0
-        context['entretiens_count'] = Entretien.objects.filter(vehicule__etablissement=request.user.etablissement).count() if request.user.etablissement else 0
-        context['ravitaillements_count'] = Ravitaillement.objects.filter(vehicule__etablissement=request.user.etablissement).count() if request.user.etablissement else 0
+        # Récupérer les statistiques (en cache par établissement, voir core.statistiques)
+        etablissement = request.user.etablissement
+        for nom, queryset in (
+            ('vehicules_count', Vehicule.objects.filter(etablissement=etablissement)),
+            ('courses_count', Course.objects.filter(etablissement=etablissement)),
+            ('entretiens_count', Entretien.objects.filter(vehicule__etablissement=etablissement)),
+            ('ravitaillements_count', Ravitaillement.objects.filter(vehicule__etablissement=etablissement)),
+        ):
+            context[nom] = compter(queryset, {'total': None}, cle_cache=('etablissement', etablissement.pk))['total'] if etablissement else 0
         
         # Récupérer les activités récentes
         context['activites'] = ActionTraceur.objects.filter(utilisateur__etablissement=request.user.etablissement).order_by('-date_action')[:10] if request.user.etablissement else []
@@ -900,7 +910,8 @@ def application_control(request):
     return render(request, 'core/application_control.html', {'form': form, 'control': control})
 
 def application_blocked(request):
-    message = request.session.get('block_message', "L'application est actuellement bloquée. Veuillez contacter l'administrateur.")
+    control = get_application_control_state()
+    message = (control or {}).get('message') or "L'application est actuellement bloquée. Veuillez contacter l'administrateur."
     return render(request, 'core/application_blocked.html', {'message': message})
 
 def application_control_logout(request):
@@ -1165,7 +1176,7 @@ def course_create(request):
             try:
                 vehicule = Vehicule.objects.get(pk=vehicule_id)
                 # Utiliser la fonction pour obtenir le dernier kilométrage connu
-                initial['kilometrage_debut'] = get_latest_vehicle_kilometrage(vehicule)
+                initial['kilometrage_debut'] = get_kilometrage(vehicule)
                 initial['vehicule'] = vehicule_id # Pré-remplir le champ véhicule
             except Vehicule.DoesNotExist:
                 messages.warning(request, "Le véhicule spécifié n'existe pas.")
@@ -1238,22 +1249,85 @@ def send_message(request):
             status=500
         )
 
+# Nombre de messages renvoyés par défaut et au maximum par appel de get_messages
+MESSAGES_PAR_PAGE = 50
+MESSAGES_PAR_PAGE_MAX = 200
+
+def _messages_conversation(user, correspondent_id):
+    return Message.objects.filter(
+        (models.Q(sender=user) & models.Q(recipient_id=correspondent_id)) |
+        (models.Q(sender_id=correspondent_id) & models.Q(recipient=user)) |
+        (models.Q(sender__isnull=True, recipient=user, is_system_message=True))  # Inclure les messages système
+    )
+
+def _entier_positif(valeur):
+    try:
+        valeur = int(valeur)
+    except (TypeError, ValueError):
+        return None
+    return valeur if valeur >= 0 else None
+
+def _etag_conversation(request):
+    """
+    ETag de la conversation : dernier message et nombre de messages envoyés encore
+    non lus (le statut de lecture fait partie de la réponse), plus les paramètres
+    de pagination. Une seule requête agrégée sur l'index de conversation.
+    """
+    correspondent_id = _entier_positif(request.GET.get('correspondent_id'))
+    if not correspondent_id or not request.user.is_authenticated:
+        return None
+    etat = _messages_conversation(request.user, correspondent_id).aggregate(
+        dernier=models.Max('id'),
+        envoyes_non_lus=models.Count('id', filter=models.Q(sender=request.user, is_read=False)),
+    )
+    return '"{}-{}-{}-{}-{}-{}-{}"'.format(
+        request.user.pk, correspondent_id, etat['dernier'] or 0, etat['envoyes_non_lus'],
+        request.GET.get('since_id', ''), request.GET.get('before_id', ''), request.GET.get('limit', ''),
+    )
+
 @login_required
 @require_GET
+@condition(etag_func=_etag_conversation)
 def get_messages(request):
+    """
+    Retourne les messages d'une conversation.
+    
+    Paramètres GET :
+        correspondent_id: identifiant du correspondant (obligatoire)
+        since_id: ne renvoyer que les messages postérieurs à cet identifiant (interrogation périodique)
+        before_id: renvoyer les messages antérieurs à cet identifiant (remontée de l'historique)
+        limit: nombre maximal de messages (défaut MESSAGES_PAR_PAGE, plafonné à MESSAGES_PAR_PAGE_MAX)
+    
+    Sans curseur, renvoie les derniers messages de la conversation. La réponse porte un
+    ETag : le client renvoie If-None-Match et reçoit 304 si rien n'a changé.
+    """
     correspondent_id = request.GET.get('correspondent_id')
     if not correspondent_id:
         return JsonResponse({'error': 'Correspondant manquant.'}, status=400)
     User = get_user_model()
     try:
         correspondent = User.objects.get(id=correspondent_id)
-    except User.DoesNotExist:
+    except (User.DoesNotExist, ValueError):
         return JsonResponse({'error': 'Correspondant introuvable.'}, status=404)
-    messages = Message.objects.filter(
-        (models.Q(sender=request.user) & models.Q(recipient=correspondent)) |
-        (models.Q(sender=correspondent) & models.Q(recipient=request.user)) |
-        (models.Q(sender__isnull=True, recipient=request.user, is_system_message=True))  # Inclure les messages système
-    ).order_by('timestamp')
+    
+    since_id = _entier_positif(request.GET.get('since_id'))
+    before_id = _entier_positif(request.GET.get('before_id'))
+    limit = _entier_positif(request.GET.get('limit')) or MESSAGES_PAR_PAGE
+    limit = min(limit, MESSAGES_PAR_PAGE_MAX)
+    
+    messages = _messages_conversation(request.user, correspondent.id).select_related('sender', 'recipient')
+    if since_id is not None:
+        # Messages nouveaux, du plus ancien au plus récent
+        messages = list(messages.filter(id__gt=since_id).order_by('id')[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        # Dernière page (ou page précédant before_id), remise dans l'ordre chronologique
+        if before_id is not None:
+            messages = messages.filter(id__lt=before_id)
+        messages = list(messages.order_by('-id')[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
     
     messages_data = []
     for m in messages:
@@ -1264,11 +1338,11 @@ def get_messages(request):
         recipient_name = m.recipient.get_full_name() or m.recipient.username
         
         # Déterminer si le message a été envoyé par l'utilisateur courant
-        sent_by_me = m.sender == request.user if m.sender else False
+        sent_by_me = m.sender_id == request.user.id if m.sender_id else False
         
         # Statut de lecture (uniquement pour les messages envoyés par l'utilisateur)
         read_status = ''
-        if m.sender == request.user:
+        if sent_by_me:
             read_status = 'lu' if m.is_read else 'non lu'
             
         messages_data.append({
@@ -1282,48 +1356,51 @@ def get_messages(request):
             'read_status': read_status,
             'is_system_message': m.is_system_message
         })
-    # Marquer comme lus les messages reçus non lus
+    # Marquer comme lus les messages reçus non lus (mise à jour indexée, toujours exécutée : un
+    # compteur décalé ne doit pas laisser de messages non lus), puis remettre le compteur à zéro
     Message.objects.filter(sender=correspondent, recipient=request.user, is_read=False).update(is_read=True)
-    return JsonResponse({'messages': messages_data})
+    CompteurMessagesNonLus.marquer_lus(request.user, correspondent)
+    return JsonResponse({
+        'messages': messages_data,
+        'last_id': messages[-1].id if messages else since_id,
+        'has_more': has_more,
+    })
 
 @login_required
 @require_GET
 def get_users(request):
     User = get_user_model()
-    users = User.objects.exclude(id=request.user.id)
+    # Nombre de messages non lus par correspondant, lu dans CompteurMessagesNonLus (une seule requête)
+    non_lus = CompteurMessagesNonLus.objects.filter(
+        utilisateur=request.user,
+        correspondant=OuterRef('pk')
+    ).values('non_lus')[:1]
+    users = User.objects.exclude(id=request.user.id).annotate(
+        unread_count=Coalesce(Subquery(non_lus), 0)
+    )
     users_data = []
     
     # Ajouter l'utilisateur système pour les messages système
     system_user = get_system_user()
     if system_user:
-        unread_system = Message.objects.filter(
-            sender=system_user, 
-            recipient=request.user, 
-            is_read=False,
-            is_system_message=True
-        ).count()
-        
         users_data.append({
             'id': system_user.id,
             'name': 'Système',
             'role': 'Système',
-            'unread_count': unread_system,
+            'unread_count': 0,
             'is_system': True
         })
     
     # Ajouter les autres utilisateurs
     for u in users:
-        unread_count = Message.objects.filter(
-            sender=u, 
-            recipient=request.user, 
-            is_read=False
-        ).count()
+        if system_user and u.id == system_user.id:
+            users_data[0]['unread_count'] = u.unread_count
         
         users_data.append({
             'id': u.id,
             'name': u.get_full_name() or u.username,
             'role': u.get_role_display() if hasattr(u, 'get_role_display') else '',
-            'unread_count': unread_count,
+            'unread_count': u.unread_count,
             'is_system': False
         })
     return JsonResponse({'users': users_data})
@@ -1331,9 +1408,14 @@ def get_users(request):
 @login_required
 @require_GET
 def get_unread_messages_status(request):
-    unread = Message.objects.filter(recipient=request.user, is_read=False).order_by('-timestamp')
-    count = unread.count()
-    last_msg = unread.first()
+    # Les compteurs par conversation évitent de parcourir la table Message à chaque interrogation
+    compteurs = list(
+        CompteurMessagesNonLus.objects.filter(utilisateur=request.user, non_lus__gt=0)
+        .select_related('dernier_message__sender')
+        .order_by('-dernier_message__timestamp')
+    )
+    count = sum(c.non_lus for c in compteurs)
+    last_msg = next((c.dernier_message for c in compteurs if c.dernier_message), None)
     last_data = None
     if last_msg:
         sender_name = 'Système' if last_msg.is_system_message else (last_msg.sender.get_full_name() or last_msg.sender.username)
@@ -1346,6 +1428,29 @@ def get_unread_messages_status(request):
 
 
 
+@login_required
+@require_GET
+def flux_evenements(request):
+    """Flux temps réel des messages, statuts de courses et notifications (SSE ou long-poll)"""
+    return reponse_flux(request, request.user)
+
+@login_required
+@require_GET
+def document_pdf(request, cle):
+    """Suivi d'un rendu PDF en arrière-plan : page d'attente, puis le document dès qu'il est prêt"""
+    nom = request.GET.get('nom') or 'export.pdf'
+    etat = etat_document(cle)
+    if request.GET.get('etat'):
+        # Interrogé par la page d'attente
+        return JsonResponse({'etat': etat})
+    if etat == 'pret':
+        return servir_document(cle, nom)
+    if etat == 'echec':
+        return HttpResponse(f"Erreur lors de la génération du PDF: {erreur_document(cle)}", content_type='text/plain', status=500)
+    if etat == 'inconnu':
+        raise Http404("Document inconnu ou expiré")
+    return render(request, 'core/document_pdf_en_cours.html', {'nom': nom}, status=202)
+
 def user_is_dispatch_or_admin(user):
     return user.is_authenticated and (user.role in ['dispatch', 'admin'] or user.is_superuser)
 
@@ -5,6 +5,7 @@ from django.core.paginator import Paginator
 from django.db.models import Q
 from django.utils import timezone
 from core.models import Course, ActionTraceur, Utilisateur, Message
+from core.statistiques import compter_par_statut
 from .forms import DemandeForm
 from notifications.utils import notify_user, send_sms, send_whatsapp
 import datetime
@@ -55,20 +56,11 @@ def dashboard(request):
     demandes_page = paginator.get_page(page_number)
     
     # Statistiques
+    statuts = {'en_attente': 'en_attente', 'validees': 'validee', 'refusees': 'refusee'}
     if request.user.role == 'admin' or request.user.is_superuser:
-        stats = {
-            'total': Course.objects.count(),
-            'en_attente': Course.objects.filter(statut='en_attente').count(),
-            'validees': Course.objects.filter(statut='validee').count(),
-            'refusees': Course.objects.filter(statut='refusee').count(),
-        }
+        stats = compter_par_statut(Course.objects.all(), statuts, cle_cache='toutes')
     else:
-        stats = {
-            'total': Course.objects.filter(demandeur=request.user).count(),
-            'en_attente': Course.objects.filter(demandeur=request.user, statut='en_attente').count(),
-            'validees': Course.objects.filter(demandeur=request.user, statut='validee').count(),
-            'refusees': Course.objects.filter(demandeur=request.user, statut='refusee').count(),
-        }
+        stats = compter_par_statut(Course.objects.filter(demandeur=request.user), statuts)
     
     context = {
         'demandes_page': demandes_page,
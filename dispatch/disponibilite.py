@@ -0,0 +1,93 @@
+"""
+Disponibilité des véhicules et des chauffeurs pour l'affectation d'une demande.
+
+Les véhicules et les chauffeurs libres pour une demande sont lus chacun en une
+seule requête annotée, sans boucle par objet :
+
+- conflit d'horaire : une course validée dont la date souhaitée est à moins de
+  DISPATCH_DUREE_MISSION heures de celle de la demande (une course validée sans
+  date bloque toujours), ou une course en cours si la demande commence dans ce
+  délai ;
+- capacité : le véhicule doit avoir au moins `nombre_passagers` places (un
+  nombre de places non renseigné n'exclut pas le véhicule) ;
+- documents : assurance, contrôle technique, vignette et stationnement valides
+  à la date de la mission ;
+- sécurité : la dernière check-list du véhicule ne doit pas être non conforme.
+
+Les mêmes querysets servent de choix au formulaire de traitement : un véhicule
+ou un chauffeur affecté entre l'affichage et l'envoi du formulaire est refusé
+à la validation.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from core.models import Course, Utilisateur, Vehicule
+from securite.models import CheckListSecurite
+
+DOCUMENTS_VEHICULE = (
+    'date_expiration_assurance',
+    'date_expiration_controle_technique',
+    'date_expiration_vignette',
+    'date_expiration_stationnement',
+)
+
+
+def duree_mission():
+    return timedelta(hours=getattr(settings, 'DISPATCH_DUREE_MISSION', 4))
+
+
+def debut_mission(demande):
+    return demande.date_souhaitee or timezone.now()
+
+
+def conflits_horaire(demande):
+    """Condition sur Course : courses qui occupent leur véhicule et leur chauffeur pendant la demande"""
+    debut = debut_mission(demande)
+    duree = duree_mission()
+    conflits = Q(statut='validee') & (
+        Q(date_souhaitee__isnull=True)
+        | Q(date_souhaitee__gt=debut - duree, date_souhaitee__lt=debut + duree)
+    )
+    if debut < timezone.now() + duree:
+        conflits |= Q(statut='en_cours')
+    return conflits & ~Q(pk=demande.pk)
+
+
+def chevauche(statut, date_souhaitee, debut, maintenant=None):
+    """Même règle que `conflits_horaire`, pour une course déjà chargée (planification en lot)"""
+    duree = duree_mission()
+    if statut == 'en_cours':
+        return debut < (maintenant or timezone.now()) + duree
+    if statut == 'validee':
+        return date_souhaitee is None or abs(date_souhaitee - debut) < duree
+    return False
+
+
+def vehicules_disponibles(demande, vehicules=None):
+    """Véhicules libres pour la demande, en une requête"""
+    vehicules = Vehicule.objects.all() if vehicules is None else vehicules
+    date_mission = timezone.localtime(debut_mission(demande)).date()
+    derniere_checklist = CheckListSecurite.objects.filter(
+        vehicule=OuterRef('pk')
+    ).order_by('-date_controle', '-pk').values('statut')[:1]
+
+    return vehicules.annotate(
+        en_conflit=Exists(Course.objects.filter(conflits_horaire(demande), vehicule=OuterRef('pk'))),
+        statut_derniere_checklist=Subquery(derniere_checklist),
+    ).filter(
+        Q(nombre_places__isnull=True) | Q(nombre_places__gte=demande.nombre_passagers),
+        Q(statut_derniere_checklist__isnull=True) | ~Q(statut_derniere_checklist='non_conforme'),
+        en_conflit=False,
+        **{f"{document}__gte": date_mission for document in DOCUMENTS_VEHICULE}
+    ).order_by('immatriculation')
+
+
+def chauffeurs_disponibles(demande, chauffeurs=None):
+    """Chauffeurs actifs libres pour la demande, en une requête"""
+    chauffeurs = Utilisateur.objects.filter(role='chauffeur', is_active=True) if chauffeurs is None else chauffeurs
+    return chauffeurs.annotate(
+        en_conflit=Exists(Course.objects.filter(conflits_horaire(demande), chauffeur=OuterRef('pk'))),
+    ).filter(en_conflit=False).order_by('last_name', 'first_name', 'username')
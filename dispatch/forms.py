@@ -1,5 +1,6 @@
 from django import forms
 from core.models import Utilisateur, Vehicule
+from .disponibilite import chauffeurs_disponibles, vehicules_disponibles
 
 class TraiterDemandeForm(forms.Form):
     """Formulaire pour le traitement des demandes de mission par le dispatcher"""
@@ -25,7 +26,7 @@ class TraiterDemandeForm(forms.Form):
     
     vehicule = forms.ModelChoiceField(
         label="Véhicule",
-        queryset=Vehicule.objects.all(),  # Ce queryset sera remplacé dynamiquement dans la vue
+        queryset=Vehicule.objects.all(),  # Remplacé par les véhicules disponibles pour la demande
         required=False,
         widget=forms.Select(attrs={'class': 'form-select'})
     )
@@ -36,6 +37,13 @@ class TraiterDemandeForm(forms.Form):
         widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 3})
     )
     
+    def __init__(self, *args, demande=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if demande is not None:
+            # Seuls les chauffeurs et véhicules libres pour la demande sont proposés et acceptés
+            self.fields['chauffeur'].queryset = chauffeurs_disponibles(demande)
+            self.fields['vehicule'].queryset = vehicules_disponibles(demande)
+    
     def clean(self):
         cleaned_data = super().clean()
         decision = cleaned_data.get('decision')
@@ -0,0 +1,219 @@
+"""
+Recommandation des affectations (chauffeur, véhicule) des demandes en attente.
+
+Les caractéristiques des chauffeurs et des véhicules sont calculées une fois,
+en un nombre fixe de requêtes, quel que soit le nombre de demandes :
+
+- chauffeur : charge actuelle (courses validées ou en cours) ;
+- véhicule : kilomètres depuis le dernier entretien
+  (`kilometrage_actuel - kilometrage_dernier_entretien`, rapportés au seuil
+  d'entretien de 4500 km), consommation moyenne (L/100 km) tirée des
+  ravitaillements, fin de validité des documents, dernière check-list ;
+- occupations : courses validées ou en cours susceptibles de chevaucher les
+  demandes (même règle que dispatch.disponibilite).
+
+Chaque caractéristique devient une pénalité entre 0 et 1, pondérée par
+DISPATCH_POIDS_RECOMMANDATION. Les pénalités sont calculées colonne par
+colonne pour tous les chauffeurs et tous les véhicules ; le score d'une paire
+est 100 × (1 − pénalité du chauffeur − pénalité du véhicule). Les demandes
+sont traitées par priorité (haute urgence d'abord) puis par date souhaitée :
+en planification en lot, une demande prioritaire choisit la première, et la
+paire retenue occupe le chauffeur et le véhicule pour les demandes suivantes.
+"""
+import heapq
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from core.models import Course, Utilisateur, Vehicule
+from ravitaillement.models import Ravitaillement
+from securite.models import CheckListSecurite
+from .disponibilite import DOCUMENTS_VEHICULE, duree_mission, chevauche, debut_mission
+
+ORDRE_PRIORITE = {'haute_urgence': 0, 'urgence': 1, 'important': 2}
+SEUIL_ENTRETIEN = 4500  # km, comme Vehicule.entretien_necessaire
+POIDS_PAR_DEFAUT = {'charge': 0.4, 'entretien': 0.35, 'consommation': 0.25}
+
+
+def _poids():
+    return getattr(settings, 'DISPATCH_POIDS_RECOMMANDATION', POIDS_PAR_DEFAUT)
+
+
+def ordre_demandes(demandes):
+    """Demandes triées par priorité, puis date souhaitée, puis ancienneté"""
+    return sorted(demandes, key=lambda d: (ORDRE_PRIORITE.get(d.priorite, len(ORDRE_PRIORITE)), debut_mission(d), d.date_demande))
+
+
+def _normaliser(valeurs):
+    """Mise à l'échelle [0, 1] par min-max ; une valeur inconnue (None) vaut 0.5"""
+    connues = [v for v in valeurs if v is not None]
+    if not connues:
+        return [0.5] * len(valeurs)
+    bas, haut = min(connues), max(connues)
+    ecart = haut - bas
+    return [0.5 if v is None else ((v - bas) / ecart if ecart else 0.0) for v in valeurs]
+
+
+class Recommandeur:
+    """
+    Caractéristiques et pénalités de tous les chauffeurs et véhicules, pour un lot de demandes.
+
+    Args:
+        demandes: demandes en attente (instances de Course) à affecter
+        chauffeurs, vehicules: querysets des candidats (par défaut tous les
+            chauffeurs actifs et tous les véhicules)
+    """
+
+    def __init__(self, demandes, chauffeurs=None, vehicules=None):
+        self.demandes = ordre_demandes(demandes)
+        self.maintenant = timezone.now()
+        poids = _poids()
+        self._charger_chauffeurs(chauffeurs, poids)
+        self._charger_vehicules(vehicules, poids)
+        self._charger_occupations()
+
+    # --- Caractéristiques (nombre fixe de requêtes) ---
+
+    def _charger_chauffeurs(self, chauffeurs, poids):
+        chauffeurs = Utilisateur.objects.filter(role='chauffeur', is_active=True) if chauffeurs is None else chauffeurs
+        self.chauffeurs = list(chauffeurs.annotate(
+            charge=Count('courses_assignees', filter=Q(courses_assignees__statut__in=['validee', 'en_cours'])),
+        ).order_by('pk'))
+        self.charges = [c.charge for c in self.chauffeurs]
+        # Échelle fixée au départ : les affectations du lot augmentent la charge sans changer l'échelle
+        self._echelle_charge = max(self.charges, default=0) + 1
+        self._poids_charge = poids.get('charge', 0)
+        self.penalites_chauffeurs = [self._penalite_chauffeur(i) for i in range(len(self.chauffeurs))]
+
+    def _penalite_chauffeur(self, i):
+        return self._poids_charge * min(1.0, self.charges[i] / self._echelle_charge)
+
+    def _charger_vehicules(self, vehicules, poids):
+        vehicules = Vehicule.objects.all() if vehicules is None else vehicules
+        derniere_checklist = CheckListSecurite.objects.filter(
+            vehicule=OuterRef('pk')
+        ).order_by('-date_controle', '-pk').values('statut')[:1]
+        self.vehicules = list(vehicules.annotate(
+            fin_validite=Least(*DOCUMENTS_VEHICULE),
+            statut_derniere_checklist=Subquery(derniere_checklist),
+        ).order_by('pk'))
+
+        # Consommation moyenne par véhicule, en une requête groupée
+        consommation = {}
+        for ligne in Ravitaillement.objects.filter(
+            vehicule__in=[v.pk for v in self.vehicules], kilometrage_apres__gt=F('kilometrage_avant')
+        ).values('vehicule_id').annotate(
+            litres=Sum('litres'), distance=Sum(F('kilometrage_apres') - F('kilometrage_avant')),
+        ).order_by():
+            if ligne['distance']:
+                consommation[ligne['vehicule_id']] = float(ligne['litres']) * 100 / ligne['distance']
+
+        kilometres = [
+            max(0, (v.kilometrage_actuel or v.kilometrage_dernier_entretien) - v.kilometrage_dernier_entretien)
+            for v in self.vehicules
+        ]
+        self.consommations = [consommation.get(v.pk) for v in self.vehicules]
+        entretien = [min(1.0, km / SEUIL_ENTRETIEN) for km in kilometres]
+        conso = _normaliser(self.consommations)
+        self.penalites_vehicules = [
+            poids.get('entretien', 0) * e + poids.get('consommation', 0) * c
+            for e, c in zip(entretien, conso)
+        ]
+
+    def _charger_occupations(self):
+        """Courses validées ou en cours qui peuvent chevaucher une demande du lot"""
+        self.occupations_vehicules = defaultdict(list)
+        self.occupations_chauffeurs = defaultdict(list)
+        if not self.demandes:
+            return
+        debuts = [debut_mission(d) for d in self.demandes]
+        duree = duree_mission()
+        courses = Course.objects.filter(
+            Q(statut='en_cours') | Q(statut='validee', date_souhaitee__isnull=True)
+            | Q(statut='validee', date_souhaitee__gt=min(debuts) - duree, date_souhaitee__lt=max(debuts) + duree)
+        ).exclude(pk__in=[d.pk for d in self.demandes]).values_list('vehicule_id', 'chauffeur_id', 'statut', 'date_souhaitee')
+        for vehicule_id, chauffeur_id, statut, date_souhaitee in courses:
+            if vehicule_id:
+                self.occupations_vehicules[vehicule_id].append((statut, date_souhaitee))
+            if chauffeur_id:
+                self.occupations_chauffeurs[chauffeur_id].append((statut, date_souhaitee))
+
+    # --- Candidats d'une demande ---
+
+    def _libre(self, occupations, debut):
+        return not any(chevauche(statut, date_souhaitee, debut, self.maintenant) for statut, date_souhaitee in occupations)
+
+    def _vehicules_eligibles(self, demande):
+        debut = debut_mission(demande)
+        date_mission = timezone.localtime(debut).date()
+        return [
+            i for i, v in enumerate(self.vehicules)
+            if v.fin_validite >= date_mission
+            and (v.nombre_places is None or v.nombre_places >= demande.nombre_passagers)
+            and v.statut_derniere_checklist != 'non_conforme'
+            and self._libre(self.occupations_vehicules[v.pk], debut)
+        ]
+
+    def _chauffeurs_eligibles(self, demande):
+        debut = debut_mission(demande)
+        return [i for i, c in enumerate(self.chauffeurs) if self._libre(self.occupations_chauffeurs[c.pk], debut)]
+
+    def _proposition(self, i, j):
+        penalite = self.penalites_chauffeurs[i] + self.penalites_vehicules[j]
+        return {
+            'chauffeur': self.chauffeurs[i],
+            'vehicule': self.vehicules[j],
+            'score': round(100 * (1 - penalite), 1),
+            'charge': self.charges[i],
+            'consommation': self.consommations[j],
+        }
+
+    def classement(self, demande, nombre=5):
+        """Les `nombre` meilleures paires (chauffeur, véhicule) libres pour la demande"""
+        chauffeurs = sorted(self._chauffeurs_eligibles(demande), key=self.penalites_chauffeurs.__getitem__)[:nombre]
+        vehicules = sorted(self._vehicules_eligibles(demande), key=self.penalites_vehicules.__getitem__)[:nombre]
+        # Score séparable : les meilleures paires combinent les meilleurs chauffeurs et les meilleurs véhicules
+        paires = heapq.nsmallest(
+            nombre,
+            ((i, j) for i in chauffeurs for j in vehicules),
+            key=lambda paire: self.penalites_chauffeurs[paire[0]] + self.penalites_vehicules[paire[1]],
+        )
+        return [self._proposition(i, j) for i, j in paires]
+
+    def _occuper(self, demande, proposition):
+        occupation = ('validee', debut_mission(demande))
+        self.occupations_chauffeurs[proposition['chauffeur'].pk].append(occupation)
+        self.occupations_vehicules[proposition['vehicule'].pk].append(occupation)
+        i = self.chauffeurs.index(proposition['chauffeur'])
+        self.charges[i] += 1
+        self.penalites_chauffeurs[i] = self._penalite_chauffeur(i)
+
+    def planifier(self):
+        """
+        Affecte les demandes du lot dans l'ordre de priorité, sans double réservation.
+
+        Returns:
+            list: une entrée par demande, {'demande', 'proposition'} ; la
+            proposition est None si aucun chauffeur ou véhicule n'est libre
+        """
+        plan = []
+        for demande in self.demandes:
+            propositions = self.classement(demande, nombre=1)
+            proposition = propositions[0] if propositions else None
+            if proposition:
+                self._occuper(demande, proposition)
+            plan.append({'demande': demande, 'proposition': proposition})
+        return plan
+
+
+def recommander(demande, nombre=5):
+    """Meilleures paires (chauffeur, véhicule) pour une demande"""
+    return Recommandeur([demande]).classement(demande, nombre)
+
+
+def planifier(demandes):
+    """Plan d'affectation d'un lot de demandes (voir Recommandeur.planifier)"""
+    return Recommandeur(demandes).planifier()
@@ -1,3 +1,142 @@
+from datetime import date, timedelta
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Course, Etablissement, Utilisateur, Vehicule
+from securite.models import CheckListSecurite
+from .disponibilite import chauffeurs_disponibles, vehicules_disponibles
+from .recommandation import planifier, recommander
+
+
+class DisponibiliteDispatchTest(TestCase):
+    def setUp(self):
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.dispatcher = Utilisateur.objects.create_user(username="dispatch1", password="testpass1", etablissement=self.dep, role="dispatch")
+        self.demandeur = Utilisateur.objects.create_user(username="demandeur1", password="testpass1", etablissement=self.dep, role="demandeur")
+        self.chauffeur_libre = Utilisateur.objects.create_user(username="chauffeur1", password="testpass1", etablissement=self.dep, role="chauffeur")
+        self.chauffeur_occupe = Utilisateur.objects.create_user(username="chauffeur2", password="testpass1", etablissement=self.dep, role="chauffeur")
+        self.date_mission = timezone.now() + timedelta(days=2)
+        self.demande = Course.objects.create(demandeur=self.demandeur, point_embarquement="A", destination="B", motif="Test", nombre_passagers=3, date_souhaitee=self.date_mission)
+
+    def _vehicule(self, immatriculation, **champs):
+        documents = {
+            'date_expiration_assurance': "2030-01-01",
+            'date_expiration_controle_technique': "2030-01-01",
+            'date_expiration_vignette': "2030-01-01",
+            'date_expiration_stationnement': "2030-01-01",
+        }
+        documents.update(champs)
+        return Vehicule.objects.create(immatriculation=immatriculation, marque="Toyota", modele="Hilux", couleur="blanc", etablissement=self.dep, numero_chassis=f"CHASSIS{immatriculation}", **documents)
+
+    def test_vehicules_et_chauffeurs_disponibles(self):
+        libre = self._vehicule("LIBRE1", nombre_places=4)
+        sans_capacite = self._vehicule("LIBRE2")
+        self._vehicule("PETIT1", nombre_places=2)
+        self._vehicule("EXPIRE1", date_expiration_assurance=date.today() + timedelta(days=1))
+        occupe = self._vehicule("OCCUPE1")
+        Course.objects.create(demandeur=self.demandeur, chauffeur=self.chauffeur_occupe, vehicule=occupe, point_embarquement="C", destination="D", motif="Test", statut='validee', date_souhaitee=self.date_mission + timedelta(hours=1))
+        plus_tard = self._vehicule("PLUSTARD1")
+        Course.objects.create(demandeur=self.demandeur, vehicule=plus_tard, point_embarquement="C", destination="D", motif="Test", statut='validee', date_souhaitee=self.date_mission + timedelta(days=1))
+        # Une course en cours aujourd'hui ne bloque pas une mission dans deux jours
+        en_cours = self._vehicule("ENCOURS1")
+        Course.objects.create(demandeur=self.demandeur, vehicule=en_cours, point_embarquement="C", destination="D", motif="Test", statut='en_cours', date_souhaitee=timezone.now())
+        non_conforme = self._vehicule("CHECK1")
+        CheckListSecurite.objects.create(vehicule=non_conforme, controleur=self.dispatcher, lieu_controle="Garage", kilometrage=1000, statut='non_conforme', date_controle=timezone.now() - timedelta(days=1))
+        reparee = self._vehicule("CHECK2")
+        CheckListSecurite.objects.create(vehicule=reparee, controleur=self.dispatcher, lieu_controle="Garage", kilometrage=1000, statut='non_conforme', date_controle=timezone.now() - timedelta(days=2))
+        CheckListSecurite.objects.create(vehicule=reparee, controleur=self.dispatcher, lieu_controle="Garage", kilometrage=1100, statut='conforme', date_controle=timezone.now() - timedelta(days=1))
+
+        with CaptureQueriesContext(connection) as requetes:
+            vehicules = list(vehicules_disponibles(self.demande))
+            chauffeurs = list(chauffeurs_disponibles(self.demande))
+        self.assertEqual(len(requetes), 2)
+        self.assertEqual(vehicules, [reparee, en_cours, libre, sans_capacite, plus_tard])
+        self.assertEqual(chauffeurs, [self.chauffeur_libre])
+
+    def test_traiter_demande_refuse_un_vehicule_occupe(self):
+        occupe = self._vehicule("OCCUPE1")
+        Course.objects.create(demandeur=self.demandeur, vehicule=occupe, point_embarquement="C", destination="D", motif="Test", statut='validee', date_souhaitee=self.date_mission)
+        self.client.login(username="dispatch1", password="testpass1")
+        url = reverse('dispatch:traiter_demande', args=[self.demande.id])
+
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['vehicules']), [])
+        self.assertEqual(list(response.context['chauffeurs']), [self.chauffeur_libre, self.chauffeur_occupe])
+
+        response = self.client.post(url, {'decision': 'valider', 'chauffeur': self.chauffeur_libre.id, 'vehicule': occupe.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('vehicule', response.context['form'].errors)
+        self.demande.refresh_from_db()
+        self.assertEqual(self.demande.statut, 'en_attente')
+
+
+class RecommandationDispatchTest(TestCase):
+    def setUp(self):
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.dispatcher = Utilisateur.objects.create_user(username="dispatch1", password="testpass1", etablissement=self.dep, role="dispatch")
+        self.demandeur = Utilisateur.objects.create_user(username="demandeur1", password="testpass1", etablissement=self.dep, role="demandeur")
+        self.chauffeur_libre = Utilisateur.objects.create_user(username="chauffeur1", password="testpass1", etablissement=self.dep, role="chauffeur")
+        self.chauffeur_charge = Utilisateur.objects.create_user(username="chauffeur2", password="testpass1", etablissement=self.dep, role="chauffeur")
+        self.vehicule_neuf = self._vehicule("NEUF1", kilometrage_dernier_entretien=10000, kilometrage_actuel=10500)
+        self.vehicule_use = self._vehicule("USE1", kilometrage_dernier_entretien=10000, kilometrage_actuel=14000)
+        self.date_mission = timezone.now() + timedelta(days=1)
+        # Charge du second chauffeur : une mission la semaine suivante, sans chevauchement
+        Course.objects.create(demandeur=self.demandeur, chauffeur=self.chauffeur_charge, point_embarquement="C", destination="D", motif="Test", statut='validee', date_souhaitee=self.date_mission + timedelta(days=7))
+        self.importante = self._demande('important')
+        self.haute_urgence = self._demande('haute_urgence')
+        self.urgence = self._demande('urgence')
+
+    def _vehicule(self, immatriculation, **champs):
+        return Vehicule.objects.create(immatriculation=immatriculation, marque="Toyota", modele="Hilux", couleur="blanc", etablissement=self.dep, numero_chassis=f"CHASSIS{immatriculation}", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01", **champs)
+
+    def _demande(self, priorite):
+        return Course.objects.create(demandeur=self.demandeur, point_embarquement="A", destination="B", motif="Test", priorite=priorite, date_souhaitee=self.date_mission)
+
+    def test_classement_d_une_demande(self):
+        propositions = recommander(self.haute_urgence, nombre=4)
+        self.assertEqual(len(propositions), 4)
+        self.assertEqual((propositions[0]['chauffeur'], propositions[0]['vehicule']), (self.chauffeur_libre, self.vehicule_neuf))
+        self.assertEqual((propositions[-1]['chauffeur'], propositions[-1]['vehicule']), (self.chauffeur_charge, self.vehicule_use))
+        self.assertGreater(propositions[0]['score'], propositions[-1]['score'])
+
+    def test_plan_par_priorite_sans_double_affectation(self):
+        with self.assertNumQueries(4):
+            plan = planifier([self.importante, self.haute_urgence, self.urgence])
+        self.assertEqual([ligne['demande'] for ligne in plan], [self.haute_urgence, self.urgence, self.importante])
+        premiere, seconde = plan[0]['proposition'], plan[1]['proposition']
+        self.assertEqual((premiere['chauffeur'], premiere['vehicule']), (self.chauffeur_libre, self.vehicule_neuf))
+        self.assertEqual((seconde['chauffeur'], seconde['vehicule']), (self.chauffeur_charge, self.vehicule_use))
+        self.assertIsNone(plan[2]['proposition'])
+
+    def test_affectation_en_lot(self):
+        self.client.login(username="dispatch1", password="testpass1")
+        url = reverse('dispatch:planification')
+        plan = self.client.get(url).context['plan']
+        affectations = [f"{l['demande'].id}:{l['proposition']['chauffeur'].id}:{l['proposition']['vehicule'].id}" for l in plan if l['proposition']]
+        # Une affectation en conflit avec la première du lot est ignorée
+        affectations.append(f"{self.importante.id}:{self.chauffeur_libre.id}:{self.vehicule_neuf.id}")
+
+        with self.captureOnCommitCallbacks():
+            response = self.client.post(url, {'affectation': affectations})
+        self.assertRedirects(response, url)
+        self.haute_urgence.refresh_from_db()
+        self.importante.refresh_from_db()
+        self.assertEqual((self.haute_urgence.statut, self.haute_urgence.chauffeur, self.haute_urgence.vehicule), ('validee', self.chauffeur_libre, self.vehicule_neuf))
+        self.assertEqual(Course.objects.filter(statut='validee', date_souhaitee=self.date_mission).count(), 2)
+        self.assertEqual(self.importante.statut, 'en_attente')
 
-# Create your tests here.
+    def test_affectation_en_lot_d_une_demande_sans_date(self):
+        sans_date = Course.objects.create(demandeur=self.demandeur, point_embarquement="E", destination="F", motif="Test", priorite='urgence')
+        self.client.login(username="dispatch1", password="testpass1")
+        with self.captureOnCommitCallbacks():
+            self.client.post(reverse('dispatch:planification'), {'affectation': [
+                f"{self.haute_urgence.id}:{self.chauffeur_libre.id}:{self.vehicule_neuf.id}",
+                f"{sans_date.id}:{self.chauffeur_charge.id}:{self.vehicule_use.id}",
+            ]})
+        sans_date.refresh_from_db()
+        self.assertEqual((sans_date.statut, sans_date.chauffeur), ('validee', self.chauffeur_charge))
+        self.assertEqual(Course.objects.get(pk=self.haute_urgence.pk).statut, 'validee')
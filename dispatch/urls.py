@@ -7,6 +7,7 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('demande/<int:demande_id>/', views.detail_demande, name='detail_demande'),
     path('demande/<int:demande_id>/traiter/', views.traiter_demande, name='traiter_demande'),
+    path('planification/', views.planification, name='planification'),
     
     # URL pour la liste des courses (nouvelle)
     path('courses/', views.dashboard, name='liste_courses'),
@@ -1,7 +1,9 @@
 # import pandas as pd  # Temporairement commenté pour le déploiement
-from django.http import HttpResponse
+import os
+
+from django.db.models import QuerySet
+from core.exports import Colonne, exporter, reponse_excel
 from core.utils import render_to_pdf
-from io import BytesIO
 
 def get_demandeur_info(demandeur):
     """
@@ -23,22 +25,38 @@ def get_demandeur_info(demandeur):
     
     return full_name
 
-def export_courses_to_excel(courses, filename='courses_export.xlsx'):
+COLONNES_COURSES = [
+    Colonne('ID', 'id', largeur=8, format='entier'),
+    Colonne('Date demande', 'date_demande', largeur=17, format='datetime'),
+    Colonne('Demandeur', lambda course: get_demandeur_info(course.demandeur), largeur=30, cle='demandeur'),
+    Colonne('Chauffeur', 'chauffeur.get_full_name', largeur=22, defaut='Non assigné'),
+    Colonne('Véhicule', 'vehicule.immatriculation', largeur=14, defaut='Non assigné'),
+    Colonne('Point d\'embarquement', 'point_embarquement', largeur=25),
+    Colonne('Destination', 'destination', largeur=25),
+    Colonne('Motif', 'motif', largeur=30),
+    Colonne('Passagers', 'nombre_passagers', largeur=10, format='entier'),
+    Colonne('Date départ', 'date_depart', largeur=17, format='datetime'),
+    Colonne('Date fin', 'date_fin', largeur=17, format='datetime'),
+    Colonne('Km départ', 'kilometrage_depart', largeur=12, format='entier'),
+    Colonne('Km fin', 'kilometrage_fin', largeur=12, format='entier'),
+    Colonne('Distance (km)', 'distance_parcourue', largeur=12, format='entier'),
+    Colonne('Statut', 'get_statut_display', largeur=14, cle='statut'),
+]
+
+
+def export_courses_to_excel(courses, filename='courses_export.xlsx', request=None):
     """
     Exporte une liste de courses vers un fichier Excel
+    
+    Le queryset est lu en flux ; avec `request`, le paramètre GET `format`
+    permet aussi un export CSV ou JSON lines.
     """
-    # Temporairement désactivé pour le déploiement
-    return HttpResponse(
-        "Export Excel temporairement indisponible - pandas en cours de configuration",
-        content_type='text/plain'
-    )
+    if isinstance(courses, QuerySet):
+        courses = courses.select_related('demandeur', 'chauffeur', 'vehicule')
+    return exporter(request, courses, COLONNES_COURSES, os.path.splitext(filename)[0], titre="Liste des courses")
 
 def export_course_detail_to_excel(course, filename='course_detail_export.xlsx'):
     """
     Exporte les détails d'une course vers un fichier Excel
     """
-    # Temporairement désactivé pour le déploiement
-    return HttpResponse(
-        "Export Excel temporairement indisponible - pandas en cours de configuration",
-        content_type='text/plain'
-    )
+    return reponse_excel([course], COLONNES_COURSES, os.path.splitext(filename)[0], titre=f"Course #{course.id}")
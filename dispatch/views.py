@@ -1,6 +1,7 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db import transaction
 from django.core.paginator import Paginator
 from django.db.models import Q, Sum, F, Count, Case, When, Value, IntegerField
 from django.contrib.auth import get_user_model
@@ -8,10 +9,13 @@ from core.models import Message  # Import du modèle Message pour le chat intern
 from django.utils import timezone
 from django.http import HttpResponse
 from core.models import Course, ActionTraceur, Utilisateur, Vehicule
+from core.statistiques import compter_par_statut, pourcentages
 from .forms import TraiterDemandeForm
+from .disponibilite import chauffeurs_disponibles, vehicules_disponibles
+from .recommandation import planifier, recommander
 from .utils import export_courses_to_excel, export_course_detail_to_excel
 from core.utils import render_to_pdf
-from notifications.utils import notify_user, send_sms, send_whatsapp, notify_course_participants, notify_multiple_users
+from notifications.outbox import CANAUX_UTILISATEUR, preparer_envoi, preparer_notifications_utilisateur, mettre_en_file
 import datetime
 
 # Récupérer l'utilisateur système pour les messages système
@@ -184,7 +188,7 @@ def export_suivi_kilometrage_excel(request):
     filename = f'suivi_kilometrage_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
     
     # Utiliser la fonction d'exportation Excel
-    return export_courses_to_excel(courses, filename=filename)
+    return export_courses_to_excel(courses, filename=filename, request=request)
 
 @login_required
 def dashboard(request):
@@ -247,28 +251,11 @@ def dashboard(request):
     page_number = request.GET.get('page')
     demandes_page = paginator.get_page(page_number)
     
-    # Statistiques
-    total = Course.objects.count()
-    en_attente = Course.objects.filter(statut='en_attente').count()
-    validee = Course.objects.filter(statut='validee').count()
-    en_cours = Course.objects.filter(statut='en_cours').count()
-    terminee = Course.objects.filter(statut='terminee').count()
-    refusee = Course.objects.filter(statut='refusee').count()
-    
-    # Calculer les pourcentages
-    stats = {
-        'total': total,
-        'en_attente': en_attente,
-        'validee': validee,
-        'en_cours': en_cours,
-        'terminee': terminee,
-        'refusee': refusee,
-        'en_attente_percent': (en_attente / total * 100) if total > 0 else 0,
-        'validee_percent': (validee / total * 100) if total > 0 else 0,
-        'en_cours_percent': (en_cours / total * 100) if total > 0 else 0,
-        'terminee_percent': (terminee / total * 100) if total > 0 else 0,
-        'refusee_percent': (refusee / total * 100) if total > 0 else 0
-    }
+    # Statistiques (une requête, partagée entre les dispatchers pendant quelques secondes)
+    stats = compter_par_statut(Course.objects.all(), {
+        statut: statut for statut in ('en_attente', 'validee', 'en_cours', 'terminee', 'refusee')
+    }, cle_cache='toutes')
+    stats.update({f"{nom}_percent": part for nom, part in pourcentages(stats).items()})
     
     context = {
         'demandes': demandes_page,
@@ -301,6 +288,107 @@ def detail_demande(request, demande_id):
     
     return render(request, 'dispatch/detail_demande.html', context)
 
+def date_course(demande):
+    """Date souhaitée affichée dans les notifications ; une demande peut ne pas en avoir"""
+    if demande.date_souhaitee is None:
+        return "date à convenir"
+    return demande.date_souhaitee.strftime('%d/%m/%Y à %H:%M')
+
+
+def valider_demande(demande, chauffeur, vehicule, dispatcher, commentaire=''):
+    """Valide une demande : affectation, historique et notifications des participants"""
+    # Mettre à jour la demande
+    demande.statut = 'validee'
+    demande.chauffeur = chauffeur
+    demande.vehicule = vehicule
+    demande.dispatcher = dispatcher
+    demande.date_validation = timezone.now()
+    demande.save()
+    
+    # Le véhicule est maintenant assigné à cette course
+    # Pas besoin de mettre à jour un champ de disponibilité car nous filtrons
+    # les véhicules disponibles en fonction des courses en cours
+    
+    # Créer une entrée dans l'historique des actions
+    action_details = f"Demande #{demande.id} validée - Chauffeur: {demande.chauffeur.get_full_name()}, Véhicule: {demande.vehicule.immatriculation}"
+    if commentaire:
+        action_details += f" - Commentaire: {commentaire}"
+    
+    ActionTraceur.objects.create(
+        utilisateur=dispatcher,
+        action="Validation de demande de mission",
+        details=action_details
+    )
+    
+    # Notification individuelle au demandeur (message personnalisé)
+    demandeur_title = f"Votre demande de course #{demande.id} a été validée"
+    demandeur_message = f"Votre demande de course de {demande.point_embarquement} à {demande.destination} a été validée. Chauffeur assigné: {demande.chauffeur.get_full_name()}."
+    
+    # Les notifications sont mises en file et distribuées hors requête (notifications.outbox)
+    envois = []
+    
+    # Notification interne, SMS et WhatsApp au demandeur
+    envois += preparer_notifications_utilisateur(
+        demande.demandeur,
+        demandeur_title,
+        demandeur_message,
+        canaux=CANAUX_UTILISATEUR + ('sms', 'whatsapp')
+    )
+    
+    # Notification individuelle au chauffeur (message personnalisé)
+    chauffeur_title = f"Nouvelle course assignée #{demande.id}"
+    chauffeur_message = f"Une nouvelle course vous a été assignée de {demande.point_embarquement} à {demande.destination}"
+    chauffeur_message += f" pour le {date_course(demande)}." if demande.date_souhaitee else f", {date_course(demande)}."
+    
+    # Notification interne, SMS et WhatsApp au chauffeur
+    envois += preparer_notifications_utilisateur(
+        demande.chauffeur,
+        chauffeur_title,
+        chauffeur_message,
+        canaux=CANAUX_UTILISATEUR + ('sms', 'whatsapp')
+    )
+    
+    # Notification de groupe à tous les participants (message général)
+    participants = [demande.demandeur, demande.chauffeur, demande.dispatcher]
+    groupe_message = f"""Course #{demande.id} validée:\n- Trajet: {demande.point_embarquement} → {demande.destination}\n- Date: {date_course(demande)}\n- Demandeur: {demande.demandeur.get_full_name()}\n- Chauffeur: {demande.chauffeur.get_full_name()}\n- Véhicule: {demande.vehicule.marque} {demande.vehicule.modele} ({demande.vehicule.immatriculation})\n- Nombre de passagers: {demande.nombre_passagers}\n"""
+    for participant in participants:
+        envois += preparer_notifications_utilisateur(participant, '', groupe_message, canaux=('whatsapp',))
+    
+    # Notification dans le chat interne pour le demandeur
+    chat_message_demandeur = f"""Votre demande de mission a été validée ✅
+- Trajet: {demande.point_embarquement} → {demande.destination}
+- Date: {date_course(demande)}
+- Chauffeur: {demande.chauffeur.get_full_name()}
+- Véhicule: {demande.vehicule}"""
+    
+    # Notification dans le chat interne pour le chauffeur
+    chat_message_chauffeur = f"""Nouvelle mission assignée 🚗
+- Trajet: {demande.point_embarquement} → {demande.destination}
+- Date: {date_course(demande)}
+- Demandeur: {demande.demandeur.get_full_name()}
+- Véhicule: {demande.vehicule}"""
+    
+    # Message pour l'admin/dispatcher
+    chat_message_admin = f"""Nouvelle mission planifiée 📋
+- Trajet: {demande.point_embarquement} → {demande.destination}
+- Date: {date_course(demande)}
+- Demandeur: {demande.demandeur.get_full_name()}
+- Chauffeur: {demande.chauffeur.get_full_name()}
+- Véhicule: {demande.vehicule}
+- Statut: Validée"""
+    
+    # Messages du chat interne envoyés par l'utilisateur système
+    system_user = get_system_user()
+    envois += [
+        preparer_envoi('message', demande.demandeur, chat_message_demandeur, expediteur=system_user, systeme=True),
+        preparer_envoi('message', demande.chauffeur, chat_message_chauffeur, expediteur=system_user, systeme=True),
+        # L'admin/dispatcher qui a validé
+        preparer_envoi('message', dispatcher, chat_message_admin, expediteur=system_user, systeme=True),
+    ]
+    
+    mettre_en_file(envois)
+
+
 @login_required
 def traiter_demande(request, demande_id):
     """Vue pour traiter une demande de mission"""
@@ -317,138 +405,14 @@ def traiter_demande(request, demande_id):
         messages.warning(request, f"Cette demande a déjà été traitée et est actuellement '{demande.get_statut_display()}'.")
         return redirect('dispatch:detail_demande', demande_id=demande_id)
     
-    # Récupérer les chauffeurs disponibles
-    chauffeurs = Utilisateur.objects.filter(role='chauffeur', is_active=True)
-    
-    # Récupérer tous les véhicules
-    tous_vehicules = Vehicule.objects.all()
-    
-    # Filtrer les véhicules disponibles en utilisant la méthode est_disponible
-    vehicules = [v for v in tous_vehicules if v.est_disponible()]
-    
     if request.method == 'POST':
-        form = TraiterDemandeForm(request.POST)
+        form = TraiterDemandeForm(request.POST, demande=demande)
         if form.is_valid():
             decision = form.cleaned_data['decision']
             commentaire = form.cleaned_data['commentaire']
             
             if decision == 'valider':
-                # Mettre à jour la demande
-                demande.statut = 'validee'
-                demande.chauffeur = form.cleaned_data['chauffeur']
-                demande.vehicule = form.cleaned_data['vehicule']
-                demande.dispatcher = request.user
-                demande.date_validation = timezone.now()
-                demande.save()
-                
-                # Le véhicule est maintenant assigné à cette course
-                # Pas besoin de mettre à jour un champ de disponibilité car nous filtrons
-                # les véhicules disponibles en fonction des courses en cours
-                
-                # Créer une entrée dans l'historique des actions
-                action_details = f"Demande #{demande.id} validée - Chauffeur: {demande.chauffeur.get_full_name()}, Véhicule: {demande.vehicule.immatriculation}"
-                if commentaire:
-                    action_details += f" - Commentaire: {commentaire}"
-                
-                ActionTraceur.objects.create(
-                    utilisateur=request.user,
-                    action="Validation de demande de mission",
-                    details=action_details
-                )
-                
-                # Notification individuelle au demandeur (message personnalisé)
-                demandeur_title = f"Votre demande de course #{demande.id} a été validée"
-                demandeur_message = f"Votre demande de course de {demande.point_embarquement} à {demande.destination} a été validée. Chauffeur assigné: {demande.chauffeur.get_full_name()}."
-                
-                # Notification interne au demandeur
-                notify_user(
-                    demande.demandeur,
-                    demandeur_title,
-                    demandeur_message,
-                    notification_type='all',
-                    course=demande
-                )
-                
-                # Notification individuelle au chauffeur (message personnalisé)
-                chauffeur_title = f"Nouvelle course assignée #{demande.id}"
-                chauffeur_message = f"Une nouvelle course vous a été assignée de {demande.point_embarquement} à {demande.destination} pour le {demande.date_souhaitee.strftime('%d/%m/%Y à %H:%M')}."
-                
-                # Notification interne au chauffeur
-                notify_user(
-                    demande.chauffeur,
-                    chauffeur_title,
-                    chauffeur_message,
-                    notification_type='all',
-                    course=demande
-                )
-                
-                # Notification de groupe à tous les participants (message général)
-                participants = [demande.demandeur, demande.chauffeur, demande.dispatcher]
-                groupe_message = f"""Course #{demande.id} validée:\n- Trajet: {demande.point_embarquement} → {demande.destination}\n- Date: {demande.date_souhaitee.strftime('%d/%m/%Y à %H:%M')}\n- Demandeur: {demande.demandeur.get_full_name()}\n- Chauffeur: {demande.chauffeur.get_full_name()}\n- Véhicule: {demande.vehicule.marque} {demande.vehicule.modele} ({demande.vehicule.immatriculation})\n- Nombre de passagers: {demande.nombre_passagers}\n"""
-                notify_course_participants(
-                    participants,
-                    groupe_message,
-                    notification_type='whatsapp'
-                )
-                
-                # Notification SMS/WhatsApp au demandeur
-                if demande.demandeur.telephone:
-                    send_sms(demande.demandeur.telephone, demandeur_message)
-                    send_whatsapp(demande.demandeur.telephone, demandeur_message)
-                # Notification SMS/WhatsApp au chauffeur
-                if demande.chauffeur and demande.chauffeur.telephone:
-                    send_sms(demande.chauffeur.telephone, chauffeur_message)
-                    send_whatsapp(demande.chauffeur.telephone, chauffeur_message)
-                
-                # Notification dans le chat interne pour le demandeur
-                chat_message_demandeur = f"""Votre demande de mission a été validée ✅
-- Trajet: {demande.point_embarquement} → {demande.destination}
-- Date: {demande.date_souhaitee.strftime('%d/%m/%Y à %H:%M')}
-- Chauffeur: {demande.chauffeur.get_full_name()}
-- Véhicule: {demande.vehicule}"""
-                
-                # Notification dans le chat interne pour le chauffeur
-                chat_message_chauffeur = f"""Nouvelle mission assignée 🚗
-- Trajet: {demande.point_embarquement} → {demande.destination}
-- Date: {demande.date_souhaitee.strftime('%d/%m/%Y à %H:%M')}
-- Demandeur: {demande.demandeur.get_full_name()}
-- Véhicule: {demande.vehicule}"""
-                
-                # Création des messages dans le chat interne
-                # Utiliser l'utilisateur système comme expéditeur pour les messages système
-                system_user = get_system_user()
-                
-                # Message pour le demandeur
-                Message.objects.create(
-                    sender=system_user,
-                    recipient=demande.demandeur,
-                    content=chat_message_demandeur,
-                    is_system_message=True
-                )
-                
-                # Message pour le chauffeur
-                Message.objects.create(
-                    sender=system_user,
-                    recipient=demande.chauffeur,
-                    content=chat_message_chauffeur,
-                    is_system_message=True
-                )
-                
-                # Message pour l'admin/dispatcher
-                chat_message_admin = f"""Nouvelle mission planifiée 📋
-- Trajet: {demande.point_embarquement} → {demande.destination}
-- Date: {demande.date_souhaitee.strftime('%d/%m/%Y à %H:%M')}
-- Demandeur: {demande.demandeur.get_full_name()}
-- Chauffeur: {demande.chauffeur.get_full_name()}
-- Véhicule: {demande.vehicule}
-- Statut: Validée"""
-                
-                Message.objects.create(
-                    sender=system_user,
-                    recipient=request.user,  # L'admin/dispatcher qui a validé
-                    content=chat_message_admin,
-                    is_system_message=True
-                )
+                valider_demande(demande, form.cleaned_data['chauffeur'], form.cleaned_data['vehicule'], request.user, commentaire)
                 
                 messages.success(request, f'La demande #{demande.id} a été validée avec succès.')
                 return redirect('dispatch:liste_courses')
@@ -476,85 +440,116 @@ def traiter_demande(request, demande_id):
                 if commentaire:
                     demandeur_message += f" Motif: {commentaire}"
                 
-                # Notification interne au demandeur
-                notify_user(
+                # Les notifications sont mises en file et distribuées hors requête (notifications.outbox)
+                # Notification interne, SMS et WhatsApp au demandeur
+                envois = preparer_notifications_utilisateur(
                     demande.demandeur,
                     demandeur_title,
                     demandeur_message,
-                    notification_type='all',
-                    course=demande
+                    canaux=CANAUX_UTILISATEUR + ('sms', 'whatsapp')
                 )
                 
                 # Notification dans le chat interne pour le refus
                 chat_message_refus = f"""Votre demande de mission a été refusée ❌
 - Trajet: {demande.point_embarquement} → {demande.destination}
-- Date: {demande.date_souhaitee.strftime('%d/%m/%Y à %H:%M')}"""
+- Date: {date_course(demande)}"""
                 
                 if commentaire:
                     chat_message_refus += f"\n- Motif: {commentaire}"
                 
-                # Récupérer l'utilisateur système pour les messages système
-                system_user = get_system_user()
-                
-                # Message de refus pour le demandeur
-                Message.objects.create(
-                    sender=system_user,
-                    recipient=demande.demandeur,
-                    content=chat_message_refus,
-                    is_system_message=True
-                )
-                
                 # Message de refus pour l'admin/dispatcher
                 chat_message_admin_refus = f"""Demande refusée ❌
 - Trajet: {demande.point_embarquement} → {demande.destination}
-- Date: {demande.date_souhaitee.strftime('%d/%m/%Y à %H:%M')}
+- Date: {date_course(demande)}
 - Demandeur: {demande.demandeur.get_full_name()}
 - Motif: {commentaire or 'Aucun motif fourni'}"""
                 
-                Message.objects.create(
-                    sender=system_user,
-                    recipient=request.user,  # L'admin/dispatcher qui a refusé
-                    content=chat_message_admin_refus,
-                    is_system_message=True
-                )
+                # Messages du chat interne envoyés par l'utilisateur système
+                system_user = get_system_user()
+                envois += [
+                    preparer_envoi('message', demande.demandeur, chat_message_refus, expediteur=system_user, systeme=True),
+                    # L'admin/dispatcher qui a refusé
+                    preparer_envoi('message', request.user, chat_message_admin_refus, expediteur=system_user, systeme=True),
+                ]
                 
                 # Notification de groupe (au demandeur et au dispatcher uniquement)
                 groupe_title = f"Demande de course #{demande.id} refusée"
                 groupe_message = f"""Demande #{demande.id} refusée:
 - Trajet: {demande.point_embarquement} → {demande.destination}
 - Demandeur: {demande.demandeur.get_full_name()}
-- Date demandée: {demande.date_souhaitee.strftime('%d/%m/%Y à %H:%M')}
+- Date demandée: {date_course(demande)}
 """
                 if commentaire:
                     groupe_message += f"- Motif: {commentaire}"
                 
-                # Créer une liste avec seulement le demandeur et le dispatcher
-                participants = [demande.demandeur, demande.dispatcher]
-                
-                # Envoyer la notification WhatsApp
-                notify_multiple_users(
-                    participants,
-                    groupe_title,
-                    groupe_message,
-                    notification_type='whatsapp',
-                    course=demande
-                )
+                # Notification WhatsApp au demandeur et au dispatcher uniquement
+                for participant in [demande.demandeur, demande.dispatcher]:
+                    envois += preparer_notifications_utilisateur(participant, groupe_title, groupe_message, canaux=('whatsapp',))
                 
-                # Notification SMS/WhatsApp au demandeur
-                if demande.demandeur.telephone:
-                    send_sms(demande.demandeur.telephone, demandeur_message)
-                    send_whatsapp(demande.demandeur.telephone, demandeur_message)
+                mettre_en_file(envois)
                 
                 messages.success(request, f'La demande #{demande.id} a été refusée.')
                 return redirect('dispatch:liste_courses')
     else:
-        form = TraiterDemandeForm()
+        form = TraiterDemandeForm(demande=demande)
     
+    # Chauffeurs et véhicules libres pour la demande (dispatch.disponibilite), une requête chacun
     return render(request, 'dispatch/traiter_demande.html', {
         'form': form,
         'demande': demande,
-        'chauffeurs': chauffeurs,
-        'vehicules': vehicules
+        'chauffeurs': form.fields['chauffeur'].queryset,
+        'vehicules': form.fields['vehicule'].queryset,
+        'recommandations': recommander(demande, nombre=3),
+    })
+
+
+# Nombre maximum de demandes planifiées en une fois
+PLANIFICATION_MAX = 100
+
+
+@login_required
+def planification(request):
+    """Affectation en lot des demandes en attente, à partir du plan recommandé"""
+    if request.user.role != 'dispatch' and request.user.role != 'admin' and not request.user.is_superuser:
+        messages.error(request, "Vous n'avez pas les droits pour accéder à cette page.")
+        return redirect('home')
+    
+    if request.method == 'POST':
+        # Chaque affectation cochée : "demande:chauffeur:vehicule"
+        affectations = []
+        for valeur in request.POST.getlist('affectation')[:PLANIFICATION_MAX]:
+            try:
+                affectations.append(tuple(int(identifiant) for identifiant in valeur.split(':')))
+            except ValueError:
+                continue
+        
+        validees, ignorees = 0, []
+        demandes = Course.objects.select_related('demandeur').in_bulk([a[0] for a in affectations if len(a) == 3])
+        # Le lot est enregistré en une transaction : une erreur n'en laisse pas une partie validée
+        with transaction.atomic():
+            for demande_id, chauffeur_id, vehicule_id in (a for a in affectations if len(a) == 3):
+                demande = demandes.get(demande_id)
+                # Disponibilité revérifiée : les affectations précédentes du lot sont déjà enregistrées
+                if demande is None or not Course.objects.select_for_update().filter(pk=demande_id, statut='en_attente').exists():
+                    ignorees.append(demande_id)
+                    continue
+                chauffeur = chauffeurs_disponibles(demande).filter(pk=chauffeur_id).first()
+                vehicule = vehicules_disponibles(demande).filter(pk=vehicule_id).first()
+                if chauffeur is None or vehicule is None:
+                    ignorees.append(demande_id)
+                    continue
+                valider_demande(demande, chauffeur, vehicule, request.user, "Affectation en lot")
+                validees += 1
+        
+        if validees:
+            messages.success(request, f"{validees} demande(s) validée(s).")
+        if ignorees:
+            messages.warning(request, "Demandes non affectées (déjà traitées ou chauffeur/véhicule devenu indisponible) : " + ", ".join(f"#{i}" for i in ignorees))
+        return redirect('dispatch:planification')
+    
+    demandes = list(Course.objects.filter(statut='en_attente').select_related('demandeur').order_by('date_demande')[:PLANIFICATION_MAX])
+    return render(request, 'dispatch/planification.html', {
+        'plan': planifier(demandes),
     })
 
 
@@ -688,4 +683,4 @@ def courses_list_excel(request):
     
     # Générer le fichier Excel
     filename = f"courses_list_{timezone.now().strftime('%Y%m%d')}.xlsx"
-    return export_courses_to_excel(courses, filename)
+    return export_courses_to_excel(courses, filename, request=request)
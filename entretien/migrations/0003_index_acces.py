@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entretien', '0002_entretien_kilometrage_entretien_kilometrage_apres_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entretien',
+            index=models.Index(fields=['vehicule', 'date_entretien', 'statut'], name='entretien_vehicule_date_idx'),
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.db import models
-from core.models import Utilisateur, Vehicule, ActionTraceur
+from core.models import Utilisateur, Vehicule, ActionTraceur, SuiviKilometrageMixin
 from django.core.exceptions import ValidationError
 
 def piece_justificative_path(instance, filename):
@@ -7,7 +7,7 @@ def piece_justificative_path(instance, filename):
     # Format: entretien/vehicule_id/YYYYMMDD_filename
     return f'entretien/{instance.vehicule.id}/{instance.date_entretien.strftime("%Y%m%d")}_{filename}'
 
-class Entretien(models.Model):
+class Entretien(SuiviKilometrageMixin, models.Model):
     """Modèle pour les entretiens de véhicules"""
     TYPE_CHOICES = (
         ('ordinaire', 'Entretien ordinaire'),
@@ -41,51 +41,29 @@ class Entretien(models.Model):
     date_modification = models.DateTimeField(auto_now=True)
     commentaires = models.TextField(blank=True, null=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicule', 'date_entretien', 'statut'], name='entretien_vehicule_date_idx'),
+        ]
+    
+    champs_kilometrage = ('kilometrage', 'kilometrage_apres')
+    module_kilometrage = 'entretien'
+    champ_utilisateur_kilometrage = ('createur',)
+
     def __str__(self):
         return f"Entretien {self.vehicule.immatriculation} - {self.date_entretien} - {self.get_statut_display()}"
     
     def save(self, *args, **kwargs):
-        # Historique kilométrage
-        is_update = self.pk is not None
-        if is_update:
-            old = type(self).objects.get(pk=self.pk)
-            km_fields = [('kilometrage', old.kilometrage, self.kilometrage),
-                         ('kilometrage_apres', old.kilometrage_apres, self.kilometrage_apres)]
-            for champ, avant, apres in km_fields:
-                if avant != apres and apres is not None:
-                    from core.models import HistoriqueKilometrage
-                    HistoriqueKilometrage.objects.create(
-                        vehicule=self.vehicule,
-                        utilisateur=self.createur,
-                        module='entretien',
-                        objet_id=self.pk,
-                        valeur_avant=avant,
-                        valeur_apres=apres,
-                        commentaire=f"Modification du {champ} via Entretien #{self.pk}"
-                    )
+        # L'historique kilométrique est écrit par SuiviKilometrageMixin
+        is_new = self._state.adding
         super().save(*args, **kwargs)
-        # Création (nouvel entretien)
-        if not is_update:
-            for champ, apres in [('kilometrage', self.kilometrage), ('kilometrage_apres', self.kilometrage_apres)]:
-                if apres is not None:
-                    from core.models import HistoriqueKilometrage
-                    HistoriqueKilometrage.objects.create(
-                        vehicule=self.vehicule,
-                        utilisateur=self.createur,
-                        module='entretien',
-                        objet_id=self.pk,
-                        valeur_avant=None,
-                        valeur_apres=apres,
-                        commentaire=f"Création du {champ} via Entretien #{self.pk}"
-                    )
-        # Créer une entrée dans le traceur d'actions
-        is_new = self.pk is None
         if self.statut == 'termine' and self.kilometrage_apres > 0:
             self.vehicule.kilometrage_dernier_entretien = self.kilometrage
             # Synchronisation du kilométrage centralisé (mise à jour du kilometrage_actuel du véhicule)
             if self.vehicule.kilometrage_actuel is None or self.kilometrage_apres > self.vehicule.kilometrage_actuel:
                 self.vehicule.kilometrage_actuel = self.kilometrage_apres
             self.vehicule.save(update_fields=["kilometrage_dernier_entretien", "kilometrage_actuel"])
+        # Créer une entrée dans le traceur d'actions
         if is_new:
             ActionTraceur.objects.create(
                 utilisateur=self.createur,
@@ -1,3 +1,4 @@
+import json
 from django.test import TestCase, Client
 from django.urls import reverse
 from core.models import Etablissement, Utilisateur, Vehicule
@@ -27,3 +28,14 @@ class IsolationDepartementEntretienTest(TestCase):
         response = client.get(reverse("entretien:liste_entretiens"))
         self.assertContains(response, "Freins")
         self.assertNotContains(response, "Vidange")
+
+    def test_export_entretiens_entretien_precedent(self):
+        Entretien.objects.create(vehicule=self.vehicule1, motif="Pneus", garage="Garage A", cout=50, date_entretien="2024-03-01", statut="termine", kilometrage=5000, kilometrage_apres=5100, createur=self.user1)
+        self.client.login(username="user1", password="testpass1")
+        response = self.client.get(reverse("entretien:exporter_entretiens_excel"), {'format': 'jsonl'})
+        lignes = [json.loads(ligne) for ligne in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([ligne['motif'] for ligne in lignes], ["Pneus", "Vidange"])
+        self.assertEqual(lignes[0]['date_ancien_entretien'], "2024-01-01")
+        self.assertEqual(lignes[0]['km_prevu_actuel'], 4500)
+        self.assertEqual(lignes[0]['ecart_prevu_realise'], "-500 km")
+        self.assertIsNone(lignes[1]['date_ancien_entretien'])
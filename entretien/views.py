@@ -1,60 +1,23 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, HttpResponse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q
+from django.db.models import Q, Sum, OuterRef, Subquery
 from django.utils import timezone
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
 
-from core.models import Vehicule, ActionTraceur, Course
+from core.models import Vehicule, ActionTraceur
 from .models import Entretien
 from .forms import EntretienForm
 from core.utils import render_to_pdf, export_to_excel
+from core.exports import Colonne, exporter
+from core.kilometrage import get_kilometrage, lire_releve
 from core.decorators import is_admin_or_dispatch_or_superuser
-from ravitaillement.models import Ravitaillement
 
 # Fonction pour vérifier si l'utilisateur est admin ou superuser
 def is_admin_or_superuser(user):
     return user.is_authenticated and (user.role == 'admin' or user.is_superuser)
 
-def _get_latest_kilometrage_for_vehicule(vehicule, exclude_entretien_id=None):
-    dernier_kilometrage = 0
-
-    # Vérifier le dernier ravitaillement
-    dernier_ravitaillement = Ravitaillement.objects.filter(
-        vehicule=vehicule
-    ).order_by('-date_ravitaillement').first()
-    if dernier_ravitaillement and dernier_ravitaillement.kilometrage_apres is not None and dernier_ravitaillement.kilometrage_apres > dernier_kilometrage:
-        dernier_kilometrage = dernier_ravitaillement.kilometrage_apres
-
-    # Vérifier la dernière course terminée
-    derniere_course = Course.objects.filter(
-        vehicule=vehicule,
-        statut='terminee'
-    ).order_by('-date_fin').first()
-    if derniere_course and derniere_course.kilometrage_fin is not None and derniere_course.kilometrage_fin > dernier_kilometrage:
-        dernier_kilometrage = derniere_course.kilometrage_fin
-
-    # Vérifier le dernier entretien
-    entretien_query = Entretien.objects.filter(
-        vehicule=vehicule,
-        kilometrage_apres__isnull=False
-    )
-    if exclude_entretien_id:
-        entretien_query = entretien_query.exclude(id=exclude_entretien_id)
-    
-    dernier_entretien = entretien_query.order_by('-date_entretien').first()
-    if dernier_entretien and dernier_entretien.kilometrage_apres is not None and dernier_entretien.kilometrage_apres > dernier_kilometrage:
-        dernier_kilometrage = dernier_entretien.kilometrage_apres
-    elif dernier_entretien and dernier_entretien.kilometrage is not None and dernier_entretien.kilometrage > dernier_kilometrage: # Fallback to kilometrage if kilometrage_apres is null or less
-        dernier_kilometrage = dernier_entretien.kilometrage
-
-    # Fallback to vehicule's own kilometrage if nothing else found
-    if dernier_kilometrage == 0:
-        dernier_kilometrage = vehicule.kilometrage_dernier_entretien or vehicule.kilometrage_actuel or 0
-
-    return dernier_kilometrage
-
 @login_required
 @user_passes_test(is_admin_or_dispatch_or_superuser)
 def dashboard(request):
@@ -152,7 +115,7 @@ def creer_entretien(request):
             entretien.etablissement = entretien.vehicule.etablissement
             
             # Vérifier que le kilométrage n'est pas inférieur au dernier kilométrage enregistré
-            dernier_kilometrage = _get_latest_kilometrage_for_vehicule(entretien.vehicule)
+            dernier_kilometrage = get_kilometrage(entretien.vehicule)
             
             if entretien.kilometrage < dernier_kilometrage:
                 messages.error(request, f"Le kilométrage ({entretien.kilometrage} km) ne peut pas être inférieur au dernier kilométrage enregistré ({dernier_kilometrage} km).")
@@ -185,7 +148,7 @@ def creer_entretien(request):
             try:
                 vehicule = Vehicule.objects.get(id=vehicule_id)
                 # Utiliser la fonction d'aide pour le kilométrage initial
-                kilometrage = _get_latest_kilometrage_for_vehicule(vehicule)
+                kilometrage = get_kilometrage(vehicule)
                 initial = {'vehicule': vehicule.id, 'kilometrage': kilometrage}
             except Exception:
                 pass
@@ -273,7 +236,7 @@ def modifier_entretien(request, entretien_id):
             entretien.etablissement = entretien.vehicule.etablissement
             
             # Vérifier que le kilométrage n'est pas inférieur au dernier kilométrage enregistré
-            dernier_kilometrage = _get_latest_kilometrage_for_vehicule(entretien.vehicule, exclude_entretien_id=entretien.id)
+            dernier_kilometrage = get_kilometrage(entretien.vehicule, exclure=('entretien', entretien.id))
             
             if entretien.kilometrage < dernier_kilometrage:
                 messages.error(request, f"Le kilométrage ({entretien.kilometrage} km) ne peut pas être inférieur au dernier kilométrage enregistré ({dernier_kilometrage} km).")
@@ -311,7 +274,7 @@ def modifier_entretien(request, entretien_id):
             try:
                 vehicule = entretien.vehicule
                 # Utiliser la fonction d'aide pour le kilométrage initial
-                kilometrage = _get_latest_kilometrage_for_vehicule(vehicule)
+                kilometrage = get_kilometrage(vehicule)
                 initial['kilometrage'] = kilometrage
             except Exception:
                 pass
@@ -449,6 +412,44 @@ def exporter_entretiens_pdf(request):
         filename="liste_entretiens.pdf"
     )
 
+INTERVALLE_ENTRETIEN_KM = 4500
+
+
+def _km_ancien_entretien(entretien):
+    if entretien.date_ancien_entretien is None:
+        return None
+    return entretien.ancien_kilometrage_apres or entretien.ancien_kilometrage or 0
+
+
+def _km_prevu_actuel(entretien):
+    """Kilométrage prévu pour cet entretien, d'après l'entretien précédent"""
+    km_ancien = _km_ancien_entretien(entretien)
+    return 0 if km_ancien is None else km_ancien + INTERVALLE_ENTRETIEN_KM
+
+
+def _ecart_prevu_realise(entretien):
+    if entretien.date_ancien_entretien is None or entretien.kilometrage is None:
+        return None
+    return f"{(_km_prevu_actuel(entretien) - entretien.kilometrage):.0f} km"
+
+
+COLONNES_EXPORT_ENTRETIENS = [
+    Colonne('Véhicule', 'vehicule.immatriculation', largeur=15),
+    Colonne('Date Entretien Actuel', 'date_entretien', largeur=14, format='date'),
+    Colonne('Km Entretien (Début)', 'kilometrage', largeur=14, format='entier'),
+    Colonne('Km Entretien (Fin)', 'kilometrage_apres', largeur=14, format='entier'),
+    Colonne('Garage', 'garage', largeur=20),
+    Colonne('Motif', 'motif', largeur=30),
+    Colonne('Coût ($)', 'cout', largeur=12, format='decimal'),
+    Colonne('Statut', 'get_statut_display', largeur=12, cle='statut'),
+    Colonne('Date Ancien Entretien', 'date_ancien_entretien', largeur=14, format='date', defaut="N/A"),
+    Colonne('Km Ancien Entretien', _km_ancien_entretien, largeur=14, format='entier', defaut="N/A", cle='km_ancien_entretien'),
+    Colonne('Km Prévu Actuel (basé sur l\'ancien)', _km_prevu_actuel, largeur=18, format='entier', cle='km_prevu_actuel'),
+    Colonne('Écart Prévu vs Réalisé (Km)', _ecart_prevu_realise, largeur=16, defaut="N/A", cle='ecart_prevu_realise'),
+    Colonne('Projection Prochain Entretien (Km)', lambda e: (e.kilometrage_apres or e.kilometrage or 0) + INTERVALLE_ENTRETIEN_KM, largeur=18, format='entier', cle='projection_prochain_entretien'),
+]
+
+
 @login_required
 @user_passes_test(is_admin_or_dispatch_or_superuser)
 def exporter_entretiens_excel(request):
@@ -478,50 +479,17 @@ def exporter_entretiens_excel(request):
     if date_fin:
         queryset = queryset.filter(date_entretien__lte=date_fin)
     
-    # Préparer les données pour l'exportation
-    data = []
-    total_budget_consomme = 0
-    for entretien in queryset:
-        previous_entretien = Entretien.objects.filter(
-            vehicule=entretien.vehicule,
-            date_entretien__lt=entretien.date_entretien
-        ).order_by('-date_entretien').first()
-
-        date_ancien_entretien = "N/A"
-        kilometrage_ancien_entretien = "N/A"
-        kilometrage_prevu_actuel = 0
-        ecart_prevu_realise = "N/A"
-
-        if previous_entretien:
-            date_ancien_entretien = previous_entretien.date_entretien.strftime('%d/%m/%Y')
-            kilometrage_ancien_entretien = previous_entretien.kilometrage_apres or previous_entretien.kilometrage or 0
-            
-            # Calculate planned kilometrage for the current maintenance based on the previous one
-            kilometrage_prevu_actuel = (kilometrage_ancien_entretien or 0) + 4500
-            
-            # Calculate deviation
-            if entretien.kilometrage is not None:
-                ecart_prevu_realise = f"{(kilometrage_prevu_actuel - entretien.kilometrage):.0f} km"
-            
-        projection_prochain_entretien = (entretien.kilometrage_apres or entretien.kilometrage or 0) + 4500
-
-        data.append({
-            'Véhicule': entretien.vehicule.immatriculation,
-            'Date Entretien Actuel': entretien.date_entretien.strftime('%d/%m/%Y'),
-            'Km Entretien (Début)': entretien.kilometrage,
-            'Km Entretien (Fin)': entretien.kilometrage_apres,
-            'Garage': entretien.garage,
-            'Motif': entretien.motif,
-            'Coût ($)': entretien.cout,
-            'Statut': entretien.get_statut_display(),
-            'Date Ancien Entretien': date_ancien_entretien,
-            'Km Ancien Entretien': kilometrage_ancien_entretien,
-            'Km Prévu Actuel (basé sur l\'ancien)': kilometrage_prevu_actuel,
-            'Écart Prévu vs Réalisé (Km)': ecart_prevu_realise,
-            'Projection Prochain Entretien (Km)': projection_prochain_entretien,
-        })
-        if entretien.statut == 'termine' and entretien.cout is not None:
-            total_budget_consomme += entretien.cout
+    # Entretien précédent du véhicule, en sous-requêtes (une seule requête pour tout l'export)
+    precedent = Entretien.objects.filter(
+        vehicule=OuterRef('vehicule'),
+        date_entretien__lt=OuterRef('date_entretien')
+    ).order_by('-date_entretien')
+    queryset = queryset.select_related('vehicule').annotate(
+        date_ancien_entretien=Subquery(precedent.values('date_entretien')[:1]),
+        ancien_kilometrage=Subquery(precedent.values('kilometrage')[:1]),
+        ancien_kilometrage_apres=Subquery(precedent.values('kilometrage_apres')[:1]),
+    ).order_by('-date_entretien', '-id')
+    total_budget_consomme = queryset.aggregate(total=Sum('cout', filter=Q(statut='termine')))['total'] or 0
     
     # Tracer l'action
     ActionTraceur.objects.create(
@@ -532,12 +500,8 @@ def exporter_entretiens_excel(request):
     # Ajouter le nom de l'établissement dans le titre et le budget consommé
     titre = f"Liste des Entretiens - Établissement : {request.user.etablissement.nom if not request.user.is_superuser and hasattr(request.user, 'etablissement') and request.user.etablissement else 'Tous'} (Budget Consommé: {total_budget_consomme:.2f} $)"
     
-    # Générer le Excel
-    return export_to_excel(
-        titre,
-        data,
-        "entretiens.xlsx"
-    )
+    # Générer le Excel (ou CSV / JSON lines avec ?format=)
+    return exporter(request, queryset, COLONNES_EXPORT_ENTRETIENS, "entretiens", titre=titre)
 
 @login_required
 @user_passes_test(is_admin_or_dispatch_or_superuser)
@@ -673,12 +637,10 @@ def exporter_entretien_excel(request, entretien_id):
 @user_passes_test(is_admin_or_dispatch_or_superuser)
 def get_vehicule_kilometrage(request):
     vehicule_id = request.GET.get('vehicule_id')
-    if vehicule_id:
-        try:
-            vehicule = Vehicule.objects.get(id=vehicule_id)
-            latest_kilometrage = _get_latest_kilometrage_for_vehicule(vehicule)
-            prochain_entretien_km = (vehicule.kilometrage_dernier_entretien or 0) + 4500
-            return JsonResponse({'kilometrage': latest_kilometrage, 'prochain_entretien_km': prochain_entretien_km})
-        except Vehicule.DoesNotExist:
+    if vehicule_id and vehicule_id.isdigit():
+        releve = lire_releve(int(vehicule_id))
+        if releve is None:
             return JsonResponse({'error': 'Véhicule non trouvé'}, status=404)
+        prochain_entretien_km = (releve['kilometrage_dernier_entretien'] or 0) + 4500
+        return JsonResponse({'kilometrage': releve['kilometrage'], 'prochain_entretien_km': prochain_entretien_km})
     return JsonResponse({'error': 'ID du véhicule manquant'}, status=400)
@@ -91,6 +91,7 @@ MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Pour servir les fichiers statiques
     'corsheaders.middleware.CorsMiddleware',  # Middleware CORS
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'core.middleware.RenouvellementSessionMiddleware',  # Prolonge la session seulement près de l'expiration
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',  # Réactivé pour la sécurité
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -187,6 +188,13 @@ if 'default' not in DATABASES or 'ENGINE' not in DATABASES['default']:
         }
     }
 
+# Serveur du flux d'événements (gunicorn_evenements.py, workers gevent) : une connexion
+# persistante par greenlet épuiserait les connexions PostgreSQL
+SERVEUR_EVENEMENTS = os.environ.get('SERVEUR_EVENEMENTS') == 'True'
+if SERVEUR_EVENEMENTS:
+    for base in DATABASES.values():
+        base['CONN_MAX_AGE'] = 0
+
 print(f"Final DATABASES config: {DATABASES}")
 print(f"Database ENGINE: {DATABASES['default']['ENGINE']}")
 if 'HOST' in DATABASES['default']:
@@ -372,12 +380,108 @@ CRONJOBS = [
     ('0 9 * * *', 'notifications.tasks.check_maintenance_required'),
 ]
 
+# Configuration du cache
+# Cache mémoire local par défaut ; définir REDIS_URL pour partager le cache entre les workers gunicorn
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Contrôle d'accès à l'application (core.middleware)
+# Durée de vie (secondes) de l'état en mémoire de chaque processus
+APPLICATION_CONTROL_CACHE_TTL = 5
+# Alias du cache partagé entre workers (None = pas de cache partagé)
+APPLICATION_CONTROL_CACHE_ALIAS = 'default' if REDIS_URL else None
+# Durée de vie (secondes) de l'état dans le cache partagé ; invalidé à chaque modification
+APPLICATION_CONTROL_SHARED_CACHE_TTL = 60
+
+# File d'envoi des notifications (notifications.outbox)
+# Canaux mis en file ; ajouter 'sms' et 'whatsapp' une fois le client Twilio réactivé (notifications.utils)
+NOTIFICATIONS_CANAUX_ACTIFS = ('notification', 'email', 'webpush', 'message')
+NOTIFICATIONS_OUTBOX_WORKERS = int(os.environ.get('NOTIFICATIONS_OUTBOX_WORKERS', 4))  # Threads de distribution
+NOTIFICATIONS_OUTBOX_INTERVAL = 10  # Secondes entre deux passages du worker en arrière-plan
+NOTIFICATIONS_OUTBOX_MAX_TENTATIVES = 5
+NOTIFICATIONS_OUTBOX_BACKOFF_BASE = 30  # Délai (secondes) avant la 2e tentative, doublé ensuite
+NOTIFICATIONS_OUTBOX_BACKOFF_MAX = 3600
+
+# Flux d'événements temps réel (core.evenements)
+# Bus partagé entre processus avec Redis ; le bus en mémoire ne sert qu'en développement (un seul processus)
+EVENEMENTS_BACKEND = 'core.evenements.BackendRedis' if REDIS_URL else 'core.evenements.BackendMemoire'
+EVENEMENTS_RETENTION = 86400  # Secondes de conservation des événements d'un utilisateur dans Redis
+# Attente maximale (secondes) d'une requête long-poll ; les workers synchrones du serveur web
+# répondent sans attendre, seul le serveur du flux d'événements garde les requêtes ouvertes
+EVENEMENTS_ATTENTE_MAX = 25 if SERVEUR_EVENEMENTS else 0
+EVENEMENTS_SSE_DUREE = 55  # Durée d'une connexion SSE avant reconnexion du client
+
+# Dernier relevé kilométrique des véhicules (core.kilometrage)
+KILOMETRAGE_CACHE_TTL = 300  # Secondes ; le cache est aussi invalidé à chaque relevé
+
+# Correction collective du kilométrage (securite.corrections)
+SECURITE_CORRECTION_SEUIL_ARRIERE_PLAN = 5000  # Lignes concernées au-delà desquelles la correction est confiée au worker
+
+# Rendu des PDF en arrière-plan (core.rendu_pdf)
+PDF_RENDUS_WORKERS = int(os.environ.get('PDF_RENDUS_WORKERS', 2))  # Processus de rendu ; 0 = rendu dans la requête
+PDF_RENDUS_DIR = os.environ.get('PDF_RENDUS_DIR', os.path.join(BASE_DIR, 'cache', 'pdf'))  # Documents rendus, par clé
+PDF_RENDUS_ATTENTE = 3  # Secondes d'attente dans la requête avant la redirection vers la page de suivi
+PDF_RENDUS_DUREE = 86400  # Durée de conservation (secondes) d'un document rendu
+PDF_RENDUS_DELAI_MAX = 600  # Au-delà (secondes), un rendu toujours signalé en cours est considéré abandonné
+
+# Cache des rapports (rapport.cache)
+# Secondes ; le cache est aussi invalidé à chaque écriture sur les courses, ravitaillements et entretiens.
+# Sans cache partagé (REDIS_URL), l'invalidation n'atteint que le worker gunicorn qui a traité
+# l'écriture : les autres ne servent un rapport périmé que quelques secondes
+RAPPORTS_CACHE_TTL = 900 if REDIS_URL else 5
+
+# Génération des rapports en arrière-plan (rapport.taches)
+# Les rapports sont produits par le processus `worker` du Procfile (commande traiter_rapports) ;
+# RAPPORTS_WORKER_INTEGRE=True lance plutôt un thread de génération dans le serveur d'application
+# (déploiements sans processus worker : render.yaml, docker-compose)
+RAPPORTS_WORKER_INTEGRE = os.environ.get('RAPPORTS_WORKER_INTEGRE', 'False') == 'True'
+RAPPORTS_WORKER_INTERVALLE = 30  # Secondes entre deux passages du worker intégré
+RAPPORTS_RESERVATION = 1800  # Secondes après lesquelles un rapport resté en cours (worker arrêté) est repris
+
+# Disponibilité des véhicules et chauffeurs pour le dispatch (dispatch.disponibilite)
+DISPATCH_DUREE_MISSION = 4  # Heures : deux missions plus proches que cette durée se chevauchent
+# Pondération des critères de recommandation des affectations (dispatch.recommandation)
+DISPATCH_POIDS_RECOMMANDATION = {'charge': 0.4, 'entretien': 0.35, 'consommation': 0.25}
+
+# Jetons de l'API mobile (core.jetons)
+API_JETON_ACCES_DUREE = 900  # Secondes de validité d'un jeton d'accès
+API_JETON_RAFRAICHISSEMENT_DUREE = 30 * 86400  # Secondes de validité d'un jeton de rafraîchissement
+API_PRINCIPAL_CACHE_TTL = 60  # Secondes de cache de l'utilisateur d'un jeton ; invalidé à chaque modification de l'utilisateur
+
+# Synchronisation différentielle des demandes de l'API mobile (core.api)
+API_SYNCHRO_MARGE = 600  # Secondes, très supérieure à la plus longue transaction : les changements plus récents sont renvoyés à la synchronisation suivante
+API_SYNCHRO_RETENTION = 30  # Jours de conservation des suppressions (purge : `purger_suppressions_synchro`) ; un curseur plus ancien recharge la liste complète
+
+# Compteurs des tableaux de bord (core.statistiques)
+STATISTIQUES_CACHE_TTL = 10  # Secondes de cache des compteurs partagés (toutes les courses, un établissement)
+
 # Configuration des sessions
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Lecture depuis le cache partagé (Redis) quand il existe : un cache local à chaque worker
+# garderait une session déconnectée dans les autres. SESSION_ENGINE peut aussi désigner
+# 'django.contrib.sessions.backends.signed_cookies' (aucune table de sessions).
+SESSION_ENGINE = os.getenv('SESSION_ENGINE') or (
+    'django.contrib.sessions.backends.cached_db' if REDIS_URL else 'django.contrib.sessions.backends.db'
+)
 SESSION_COOKIE_AGE = 1209600  # 2 semaines en secondes
 SESSION_COOKIE_SECURE = not DEBUG  # True en production
 SESSION_COOKIE_HTTPONLY = True
-SESSION_SAVE_EVERY_REQUEST = True
+# La session n'est pas réécrite à chaque requête : core.middleware.RenouvellementSessionMiddleware
+# la prolonge quand il lui reste moins de SESSION_RENOUVELLEMENT_SEUIL secondes (au plus une
+# écriture par jour et par session). Purge des sessions expirées : `purger_sessions`.
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_RENOUVELLEMENT_SEUIL = SESSION_COOKIE_AGE - 86400
 
 # Configuration de sécurité pour la production
 if not DEBUG:
@@ -430,8 +534,10 @@ from .cors_config import *
 
 # Configuration des tâches planifiées avec django-crontab
 CRONJOBS = [
-    # Exécuter la vérification des documents et entretiens tous les jours à 8h00
-    ('0 8 * * *', 'notifications.tasks.check_documents_and_send_notifications')
+    # La vérification des documents (8h00) et la réconciliation nocturne (2h00) sont
+    # planifiées par notifications.scheduler, une fois par jour tous processus confondus
+    # Vider la file d'envoi des notifications (filet de sécurité si le worker n'est pas démarré)
+    ('* * * * *', 'django.core.management.call_command', ['traiter_envois_notifications']),
 ]
 
 # Format de sortie des logs CRON
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gestion_vehicules.settings')
 
 application = get_wsgi_application()
+
+# Processus de rendu PDF démarrés avec le serveur d'application (voir core.rendu_pdf),
+# sauf dans le serveur du flux d'événements qui ne produit pas de PDF
+from django.conf import settings  # noqa: E402
+from core.rendu_pdf import demarrer_pool  # noqa: E402
+
+if not settings.SERVEUR_EVENEMENTS:
+    demarrer_pool()
@@ -0,0 +1,26 @@
+"""
+Configuration gunicorn du serveur du flux d'événements (processus `evenements`
+du Procfile).
+
+Ce processus ne sert que /evenements/ et /api/evenements/ : workers gevent,
+pour que les requêtes en attente (long-poll et SSE, core.evenements) ne
+bloquent pas le worker. Le serveur web reste en workers synchrones et garde
+les traitements lourds (rendus PDF, rapports, planificateur, file d'envoi).
+
+SERVEUR_EVENEMENTS (lu par les settings) désactive les connexions
+persistantes à la base, qui seraient gardées par chaque greenlet, et le
+démarrage des threads et processus d'arrière-plan dans ce serveur. Les
+événements publiés par les autres processus n'arrivent que par le bus Redis
+(REDIS_URL, voir EVENEMENTS_BACKEND).
+"""
+import os
+
+os.environ['SERVEUR_EVENEMENTS'] = 'True'
+
+worker_class = 'gevent'
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+
+
+def post_fork(server, worker):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -20,6 +20,11 @@ class NotificationsConfig(AppConfig):
         if is_testing or is_management_command:
             logger.info(f"Mode test ou commande de gestion - Planificateur non démarré (TESTING={is_testing}, is_management={is_management_command})")
             return
+        if getattr(settings, 'SERVEUR_EVENEMENTS', False):
+            # Le serveur du flux d'événements (gevent) ne fait tourner aucun traitement d'arrière-plan
+            from . import signals
+            signals.setup_signals()
+            return
             
         try:
             # Importer et configurer les signaux
@@ -27,11 +32,20 @@ class NotificationsConfig(AppConfig):
             signals.setup_signals()
             logger.info("Signaux de notification chargés")
             
-            # Démarrer le planificateur
-            from .scheduler import start_scheduler
-            logger.info("Démarrage du planificateur de tâches...")
-            start_scheduler()
-            logger.info("Planificateur de tâches démarré avec succès")
+            # Démarrer le planificateur dans le serveur d'application seulement : pas dans
+            # les commandes (cron, worker des rapports), qui chargent aussi les applications
+            if not self._is_manage_py():
+                from .scheduler import start_scheduler
+                logger.info("Démarrage du planificateur de tâches...")
+                start_scheduler()
+                logger.info("Planificateur de tâches démarré avec succès")
+            
+            # Démarrer le worker de la file d'envoi des notifications, sauf dans les commandes :
+            # traiter_envois_notifications est elle-même le worker
+            if not self._is_manage_py():
+                from .outbox import start_outbox_worker
+                start_outbox_worker()
+                logger.info("Worker d'envoi des notifications démarré")
             
         except Exception as e:
             logger.error(f"Erreur lors de l'initialisation des notifications: {e}", exc_info=True)
@@ -44,3 +58,12 @@ class NotificationsConfig(AppConfig):
         return len(sys.argv) > 1 and sys.argv[1] in [
             'runserver', 'migrate', 'makemigrations', 'collectstatic', 'test'
         ]
+
+    def _is_manage_py(self):
+        """
+        Vérifie si le processus est une commande de gestion quelconque (manage.py ou
+        django-admin), par exemple traiter_rapports --boucle ou une commande lancée par cron.
+        """
+        import os
+        import sys
+        return os.path.basename(sys.argv[0]) in ('manage.py', 'django-admin', 'django-admin.py')
@@ -0,0 +1,48 @@
+import time
+from django.core.management.base import BaseCommand
+from notifications.outbox import traiter_file_envois
+
+
+class Command(BaseCommand):
+    help = "Distribue les notifications en attente dans la file d'envoi (SMS, WhatsApp, email, push, chat)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help='Tourne en continu et vide la file toutes les --intervalle secondes'
+        )
+        parser.add_argument(
+            '--intervalle',
+            type=int,
+            default=5,
+            help='Pause en secondes entre deux passages en mode --boucle (défaut: 5)'
+        )
+        parser.add_argument(
+            '--lot',
+            type=int,
+            default=100,
+            help="Nombre maximal d'envois traités par passage (défaut: 100)"
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Nombre de threads de distribution (défaut: NOTIFICATIONS_OUTBOX_WORKERS)'
+        )
+
+    def handle(self, *args, **options):
+        total_reussis = total_echecs = 0
+        while True:
+            reussis, echecs = traiter_file_envois(limite=options['lot'], nb_workers=options['workers'])
+            total_reussis += reussis
+            total_echecs += echecs
+            if reussis or echecs:
+                continue
+            if not options['boucle']:
+                break
+            time.sleep(max(options['intervalle'], 1))
+
+        self.stdout.write(
+            self.style.SUCCESS(f"✅ {total_reussis} envoi(s) distribué(s), {total_echecs} en échec ou reprogrammé(s)")
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from notifications.tasks import check_documents, get_system_user
+
+
+class Command(BaseCommand):
+    help = "Vérifie l'expiration des documents de bord et notifie les administrateurs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Calcule les notifications sans les enregistrer (mesure de performance)'
+        )
+
+    def handle(self, *args, **options):
+        system_user = get_system_user()
+        if not system_user:
+            raise CommandError("Aucun utilisateur système trouvé pour envoyer les notifications")
+
+        with CaptureQueriesContext(connection) as requetes:
+            stats = check_documents(timezone.now().date(), system_user, dry_run=options['dry_run'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ {stats['documents_analyses']} document(s) à échéance analysé(s) en {stats['duree']:.3f}s "
+                f"({len(requetes)} requête(s) SQL) - {stats['notifications_creees']} notification(s) créée(s), "
+                f"{stats['notifications_relancees']} relancée(s), {stats['notifications_desactivees']} désactivée(s), "
+                f"{stats['messages']} message(s){' [simulation]' if options['dry_run'] else ''}"
+            )
+        )
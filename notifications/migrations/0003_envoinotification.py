@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notifications', '0002_remove_pushsubscription_subscription_info_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvoiNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('canal', models.CharField(choices=[('sms', 'SMS'), ('whatsapp', 'WhatsApp'), ('email', 'Email'), ('webpush', 'Notification push'), ('message', 'Message du chat interne'), ('notification', 'Notification interne')], max_length=20)),
+                ('telephone', models.CharField(blank=True, max_length=20)),
+                ('titre', models.CharField(blank=True, max_length=255)),
+                ('contenu', models.TextField()),
+                ('est_message_systeme', models.BooleanField(default=False)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('envoye', 'Envoyé'), ('echec', 'Échec')], default='en_attente', max_length=20)),
+                ('tentatives', models.PositiveSmallIntegerField(default=0)),
+                ('prochaine_tentative', models.DateTimeField(default=django.utils.timezone.now)),
+                ('derniere_erreur', models.TextField(blank=True)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_envoi', models.DateTimeField(blank=True, null=True)),
+                ('destinataire', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='envois_notifications', to=settings.AUTH_USER_MODEL)),
+                ('expediteur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='envois_notifications_emis', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Envoi de notification',
+                'verbose_name_plural': 'Envois de notifications',
+                'ordering': ['prochaine_tentative'],
+                'indexes': [models.Index(fields=['statut', 'prochaine_tentative'], name='notif_envoi_file_idx')],
+            },
+        ),
+    ]
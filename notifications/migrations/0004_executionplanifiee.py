@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_envoinotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExecutionPlanifiee',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tache', models.CharField(max_length=100)),
+                ('jour', models.DateField()),
+                ('date_execution', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Exécution planifiée',
+                'verbose_name_plural': 'Exécutions planifiées',
+                'unique_together': {('tache', 'jour')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+ANCIEN_TYPE = 'contrôle technique'
+NOUVEAU_TYPE = 'controle_technique'
+
+
+def renommer_type_controle_technique(apps, schema_editor):
+    """
+    Les notifications créées avant la vérification ensembliste des documents
+    (notifications.tasks.check_documents) portent l'ancien libellé comme type :
+    elles reprennent la clé des choix du modèle, pour que le délai de rappel
+    s'applique et qu'aucune notification ne soit renvoyée en double.
+    """
+    DocumentNotification = apps.get_model('notifications', 'DocumentNotification')
+    # Une notification active existe déjà sous la nouvelle clé : l'ancienne est désactivée
+    deja_actives = DocumentNotification.objects.filter(document_type=NOUVEAU_TYPE, is_active=True).values('vehicule_id')
+    DocumentNotification.objects.filter(document_type=ANCIEN_TYPE, is_active=True, vehicule_id__in=deja_actives).update(is_active=False)
+    # update() conserve date_modification, point de départ du délai de rappel
+    DocumentNotification.objects.filter(document_type=ANCIEN_TYPE).update(document_type=NOUVEAU_TYPE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_executionplanifiee'),
+    ]
+
+    operations = [
+        migrations.RunPython(renommer_type_controle_technique, migrations.RunPython.noop),
+    ]
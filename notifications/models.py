@@ -91,3 +91,72 @@ class Notification(models.Model):
 
     def __str__(self):
         return f"{self.user} - {self.message[:20]}"
+
+class EnvoiNotification(models.Model):
+    """
+    File d'attente durable des notifications sortantes (SMS, WhatsApp, email, webpush,
+    messages du chat interne et notifications internes).
+
+    Les vues se contentent d'enregistrer les envois ; ils sont distribués hors requête
+    par le worker de notifications.outbox avec nouvelles tentatives et délai exponentiel.
+    """
+    CANAL_CHOICES = (
+        ('sms', 'SMS'),
+        ('whatsapp', 'WhatsApp'),
+        ('email', 'Email'),
+        ('webpush', 'Notification push'),
+        ('message', 'Message du chat interne'),
+        ('notification', 'Notification interne'),
+    )
+    STATUT_CHOICES = (
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('envoye', 'Envoyé'),
+        ('echec', 'Échec'),
+    )
+
+    canal = models.CharField(max_length=20, choices=CANAL_CHOICES)
+    destinataire = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='envois_notifications')
+    expediteur = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='envois_notifications_emis')
+    telephone = models.CharField(max_length=20, blank=True)
+    titre = models.CharField(max_length=255, blank=True)
+    contenu = models.TextField()
+    est_message_systeme = models.BooleanField(default=False)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='en_attente')
+    tentatives = models.PositiveSmallIntegerField(default=0)
+    prochaine_tentative = models.DateTimeField(default=timezone.now)
+    derniere_erreur = models.TextField(blank=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_envoi = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Envoi de notification"
+        verbose_name_plural = "Envois de notifications"
+        ordering = ['prochaine_tentative']
+        indexes = [
+            models.Index(fields=['statut', 'prochaine_tentative'], name='notif_envoi_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_canal_display()} - {self.destinataire or self.telephone} - {self.get_statut_display()}"
+
+
+class ExecutionPlanifiee(models.Model):
+    """
+    Verrou d'une tâche quotidienne du planificateur (notifications.scheduler).
+
+    Chaque processus du serveur fait tourner son planificateur : le premier qui
+    enregistre la tâche du jour l'exécute, les autres la sautent (contrainte
+    d'unicité sur la tâche et le jour).
+    """
+    tache = models.CharField(max_length=100)
+    jour = models.DateField()
+    date_execution = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Exécution planifiée"
+        verbose_name_plural = "Exécutions planifiées"
+        unique_together = ('tache', 'jour')
+
+    def __str__(self):
+        return f"{self.tache} - {self.jour}"
@@ -0,0 +1,319 @@
+"""
+File d'envoi durable des notifications (outbox).
+
+Les vues construisent les envois avec `preparer_envoi` / `preparer_notifications_utilisateur`
+puis les enregistrent en une seule requête avec `mettre_en_file`. Le worker
+(`traiter_file_envois`, lancé par le thread `OutboxWorkerThread` ou par la commande
+`traiter_envois_notifications`) les distribue ensuite hors du cycle requête/réponse,
+avec nouvelles tentatives et délai exponentiel en cas d'échec du fournisseur.
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction, close_old_connections
+from django.utils import timezone
+
+from .models import EnvoiNotification, Notification, PushSubscription
+
+logger = logging.getLogger(__name__)
+
+# Canaux utilisés par défaut pour notifier un utilisateur (équivalent de notification_type='all')
+CANAUX_UTILISATEUR = ('notification', 'email', 'webpush')
+
+
+# Canaux distribuables par défaut : SMS et WhatsApp restent inactifs tant que
+# le client Twilio de notifications.utils n'est pas réactivé
+CANAUX_ACTIFS = ('notification', 'email', 'webpush', 'message')
+
+
+def _parametre(nom, defaut):
+    return getattr(settings, nom, defaut)
+
+
+def canal_actif(canal):
+    """Vrai si le canal est configuré (NOTIFICATIONS_CANAUX_ACTIFS) et peut être distribué"""
+    return canal in _parametre('NOTIFICATIONS_CANAUX_ACTIFS', CANAUX_ACTIFS)
+
+
+def preparer_envoi(canal, destinataire=None, contenu='', titre='', telephone='', expediteur=None, systeme=False):
+    """Construit un envoi (non enregistré) pour un canal donné"""
+    return EnvoiNotification(
+        canal=canal,
+        destinataire=destinataire,
+        expediteur=expediteur,
+        telephone=telephone or '',
+        titre=(titre or '')[:255],
+        contenu=contenu,
+        est_message_systeme=systeme,
+    )
+
+
+def preparer_notifications_utilisateur(user, titre, message, canaux=CANAUX_UTILISATEUR):
+    """
+    Construit les envois destinés à un utilisateur sur les canaux demandés.
+
+    Les canaux inapplicables sont ignorés dès maintenant (canal inactif, pas de
+    téléphone pour SMS/WhatsApp, pas d'email ou envoi d'emails désactivé), afin
+    de ne pas encombrer la file avec des envois voués à l'échec.
+    """
+    if user is None:
+        return []
+    envois = []
+    for canal in canaux:
+        if not canal_actif(canal):
+            continue
+        if canal in ('sms', 'whatsapp'):
+            if not getattr(user, 'telephone', None):
+                continue
+            envois.append(preparer_envoi(canal, user, message, titre, telephone=user.telephone))
+        elif canal == 'email':
+            if not user.email or not _parametre('SEND_EMAILS', False):
+                continue
+            envois.append(preparer_envoi(canal, user, message, titre))
+        else:
+            envois.append(preparer_envoi(canal, user, message, titre))
+    return envois
+
+
+def mettre_en_file(envois):
+    """
+    Enregistre les envois en une seule requête et réveille le worker après la
+    validation de la transaction courante. Les envois sur un canal inactif
+    ne sont pas enregistrés.
+    """
+    envois = [e for e in envois if e is not None and canal_actif(e.canal)]
+    if not envois:
+        return []
+    crees = EnvoiNotification.objects.bulk_create(envois)
+    transaction.on_commit(reveiller_worker)
+    return crees
+
+
+# --- Distribution -----------------------------------------------------------
+
+def _envoyer_sms(envoi):
+    from .utils import send_sms
+    return send_sms(envoi.telephone, envoi.contenu)
+
+
+def _envoyer_whatsapp(envoi):
+    from .utils import send_whatsapp
+    return send_whatsapp(envoi.telephone, envoi.contenu)
+
+
+def _envoyer_email(envoi):
+    if not envoi.destinataire or not envoi.destinataire.email:
+        return True
+    send_mail(
+        subject=envoi.titre or 'Notification',
+        message=envoi.contenu,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[envoi.destinataire.email],
+        fail_silently=False,
+    )
+    return True
+
+
+def _envoyer_webpush(envoi):
+    abonnements = list(PushSubscription.objects.filter(user_id=envoi.destinataire_id))
+    if not abonnements:
+        return True
+    vapid_private_key = getattr(settings, 'VAPID_PRIVATE_KEY', None)
+    if not vapid_private_key:
+        logger.warning("VAPID_PRIVATE_KEY non configurée : notification push ignorée")
+        return True
+    from pywebpush import webpush
+    payload = json.dumps({
+        "title": envoi.titre,
+        "body": envoi.contenu,
+        "icon": "/static/images/logo_ips_co.png",
+        "url": "/",
+    })
+    for sub in abonnements:
+        webpush(
+            subscription_info={"endpoint": sub.endpoint, "keys": {"p256dh": sub.p256dh, "auth": sub.auth}},
+            data=payload,
+            vapid_private_key=vapid_private_key,
+            vapid_claims={"sub": "mailto:admin@asofes.com"},
+        )
+    return True
+
+
+def _envoyer_message(envoi):
+    from core.models import Message
+    Message.objects.create(
+        sender=envoi.expediteur,
+        recipient=envoi.destinataire,
+        content=envoi.contenu,
+        is_system_message=envoi.est_message_systeme,
+    )
+    return True
+
+
+def _envoyer_notification(envoi):
+    Notification.objects.create(user=envoi.destinataire, message=(envoi.titre or envoi.contenu)[:255])
+    return True
+
+
+DISTRIBUTEURS = {
+    'sms': _envoyer_sms,
+    'whatsapp': _envoyer_whatsapp,
+    'email': _envoyer_email,
+    'webpush': _envoyer_webpush,
+    'message': _envoyer_message,
+    'notification': _envoyer_notification,
+}
+
+
+def _delai_nouvelle_tentative(tentatives):
+    """Délai exponentiel : base, 2 x base, 4 x base... plafonné"""
+    base = _parametre('NOTIFICATIONS_OUTBOX_BACKOFF_BASE', 30)
+    plafond = _parametre('NOTIFICATIONS_OUTBOX_BACKOFF_MAX', 3600)
+    return timedelta(seconds=min(base * (2 ** max(tentatives - 1, 0)), plafond))
+
+
+def _reserver_lot(limite):
+    """
+    Réserve un lot d'envois échus. Un envoi resté 'en_cours' au-delà du délai de
+    réservation (worker arrêté brutalement) redevient éligible.
+    """
+    maintenant = timezone.now()
+    ids = list(
+        EnvoiNotification.objects.filter(
+            statut__in=('en_attente', 'en_cours'),
+            prochaine_tentative__lte=maintenant,
+        ).order_by('prochaine_tentative').values_list('id', flat=True)[:limite]
+    )
+    if not ids:
+        return []
+    reservation = maintenant + timedelta(seconds=_parametre('NOTIFICATIONS_OUTBOX_LEASE', 300))
+    # La mise à jour conditionnelle garantit qu'un envoi n'est réservé que par un seul worker
+    EnvoiNotification.objects.filter(
+        id__in=ids,
+        statut__in=('en_attente', 'en_cours'),
+        prochaine_tentative__lte=maintenant,
+    ).update(statut='en_cours', prochaine_tentative=reservation)
+    return list(
+        EnvoiNotification.objects.select_related('destinataire', 'expediteur')
+        .filter(id__in=ids, statut='en_cours', prochaine_tentative=reservation)
+    )
+
+
+def distribuer_envoi(envoi):
+    """Distribue un envoi et enregistre son résultat. Retourne True en cas de succès"""
+    envoi.tentatives += 1
+    erreur = ''
+    try:
+        succes = bool(DISTRIBUTEURS[envoi.canal](envoi))
+        if not succes:
+            erreur = "Le fournisseur a refusé l'envoi"
+    except Exception as e:
+        succes = False
+        erreur = str(e)
+
+    if succes:
+        envoi.statut = 'envoye'
+        envoi.date_envoi = timezone.now()
+        envoi.derniere_erreur = ''
+    elif envoi.tentatives >= _parametre('NOTIFICATIONS_OUTBOX_MAX_TENTATIVES', 5):
+        envoi.statut = 'echec'
+        envoi.derniere_erreur = erreur
+        logger.warning(f"Envoi {envoi.id} ({envoi.canal}) abandonné après {envoi.tentatives} tentatives : {erreur}")
+    else:
+        envoi.statut = 'en_attente'
+        envoi.prochaine_tentative = timezone.now() + _delai_nouvelle_tentative(envoi.tentatives)
+        envoi.derniere_erreur = erreur
+    envoi.save(update_fields=['statut', 'tentatives', 'prochaine_tentative', 'derniere_erreur', 'date_envoi'])
+    return succes
+
+
+def _distribuer_dans_thread(envoi):
+    try:
+        return distribuer_envoi(envoi)
+    finally:
+        close_old_connections()
+
+
+def traiter_file_envois(limite=100, nb_workers=None):
+    """
+    Traite un lot d'envois échus. Les envois vers des fournisseurs externes sont
+    distribués en parallèle sur un pool de threads.
+
+    Returns:
+        tuple: (nombre d'envois réussis, nombre d'envois en échec)
+    """
+    lot = _reserver_lot(limite)
+    if not lot:
+        return 0, 0
+    nb_workers = nb_workers or _parametre('NOTIFICATIONS_OUTBOX_WORKERS', 4)
+    if nb_workers <= 1 or len(lot) == 1:
+        resultats = [distribuer_envoi(envoi) for envoi in lot]
+    else:
+        with ThreadPoolExecutor(max_workers=nb_workers) as pool:
+            resultats = list(pool.map(_distribuer_dans_thread, lot))
+    reussis = sum(1 for r in resultats if r)
+    return reussis, len(resultats) - reussis
+
+
+# --- Worker en arrière-plan --------------------------------------------------
+
+_reveil = threading.Event()
+
+
+def reveiller_worker():
+    """Demande au worker en arrière-plan de traiter la file sans attendre"""
+    _reveil.set()
+
+
+class OutboxWorkerThread(threading.Thread):
+    """Thread qui vide la file d'envoi dès qu'elle est alimentée, et au moins toutes les N secondes"""
+    def __init__(self, intervalle=None):
+        super().__init__(name='notifications-outbox')
+        self.daemon = True
+        self.running = False
+        self.intervalle = intervalle or _parametre('NOTIFICATIONS_OUTBOX_INTERVAL', 10)
+
+    def run(self):
+        self.running = True
+        logger.info("Démarrage du worker d'envoi des notifications...")
+        while self.running:
+            _reveil.wait(self.intervalle)
+            _reveil.clear()
+            try:
+                while self.running:
+                    reussis, echecs = traiter_file_envois()
+                    if not reussis and not echecs:
+                        break
+            except Exception as e:
+                logger.error(f"Erreur dans le worker d'envoi des notifications: {e}")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.running = False
+        _reveil.set()
+
+
+outbox_thread = None
+
+
+def start_outbox_worker():
+    """Démarre le worker d'envoi dans un thread séparé (une seule instance par processus)"""
+    global outbox_thread
+    if outbox_thread and outbox_thread.is_alive():
+        return
+    outbox_thread = OutboxWorkerThread()
+    outbox_thread.start()
+
+
+def stop_outbox_worker():
+    global outbox_thread
+    if outbox_thread:
+        outbox_thread.stop()
+        outbox_thread.join(timeout=5)
+        outbox_thread = None
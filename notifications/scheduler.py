@@ -1,11 +1,32 @@
 import logging
 import time
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
 from django.utils import timezone
+from .models import ExecutionPlanifiee
 from .tasks import check_documents_and_send_notifications
 import threading
 
 logger = logging.getLogger(__name__)
 
+
+def executer_une_fois(tache, fonction):
+    """
+    Exécute une tâche quotidienne une seule fois par jour, tous processus confondus.
+
+    Returns:
+        bool: True si la tâche a été exécutée par ce processus
+    """
+    try:
+        with transaction.atomic():
+            ExecutionPlanifiee.objects.create(tache=tache, jour=timezone.localdate())
+    except IntegrityError:
+        logger.info(f"Tâche {tache} déjà exécutée aujourd'hui par un autre processus")
+        return False
+    fonction()
+    return True
+
+
 class SchedulerThread(threading.Thread):
     """
     Un thread simple pour exécuter la vérification périodique des documents et entretiens.
@@ -26,11 +47,20 @@ class SchedulerThread(threading.Thread):
                 # Vérifier si c'est 8h00 du matin
                 if now.hour == 8 and now.minute == 0:
                     logger.info("Exécution de la vérification des documents et entretiens...")
-                    check_documents_and_send_notifications()
+                    executer_une_fois('verification_documents', check_documents_and_send_notifications)
                     
                     # Attendre 1 minute pour éviter les exécutions multiples
                     time.sleep(60)
                 
+                # Réconciliation nocturne des faits journaliers de la flotte à 2h00
+                # (seule planification : la fenêtre est celle de la commande, 7 jours par défaut)
+                if now.hour == 2 and now.minute == 0:
+                    logger.info("Réconciliation des faits journaliers de la flotte...")
+                    executer_une_fois('reconciliation_faits_journaliers', lambda: call_command('reconcilier_faits_journaliers'))
+                    # Purge des traces de suppression de la synchronisation mobile
+                    executer_une_fois('purge_suppressions_synchro', lambda: call_command('purger_suppressions_synchro'))
+                    time.sleep(60)
+                
                 # Vérifier toutes les minutes
                 time.sleep(30)  # Vérifier deux fois par minute pour plus de précision
                 
@@ -1,7 +1,9 @@
+import time
 from django.utils import timezone
+from django.db import transaction
 from datetime import timedelta
 from .models import DocumentNotification, EntretienNotification
-from core.models import Vehicule, Message, Utilisateur
+from core.models import Vehicule, Message, Utilisateur, CompteurMessagesNonLus
 from django.db.models import Q
 
 def check_documents_and_send_notifications():
@@ -68,61 +70,123 @@ def get_system_user():
         print(f"Erreur lors de la récupération/création de l'utilisateur système: {e}")
         return None
 
-def check_documents(today, system_user):
+# Documents de bord surveillés : (type de DocumentNotification, champ de Vehicule, libellé dans les messages)
+DOCUMENTS_SURVEILLES = (
+    ('assurance', 'date_expiration_assurance', 'assurance'),
+    ('controle_technique', 'date_expiration_controle_technique', 'contrôle technique'),
+    ('vignette', 'date_expiration_vignette', 'vignette'),
+)
+JOURS_ALERTE_DOCUMENTS = 30  # Alerte 30 jours avant l'expiration
+DELAI_RAPPEL_DOCUMENTS = timedelta(days=7)  # Pas de nouveau rappel pour un même document avant 7 jours
+
+def check_documents(today, system_user, dry_run=False):
     """
     Vérifie les documents de bord et envoie des notifications si nécessaire.
     
+    Le traitement est ensembliste : une requête par type de document sélectionne les
+    véhicules dont le document expire dans la fenêtre d'alerte, les notifications
+    actives sont mises à jour ou créées en masse et les messages aux administrateurs
+    sont insérés en un seul bulk_create. Le nombre de requêtes ne dépend donc pas
+    du nombre de véhicules.
+    
     Args:
         today (date): Date du jour pour la vérification
         system_user (Utilisateur): Utilisateur système pour l'envoi des notifications
+        dry_run (bool): Si True, calcule les notifications sans rien écrire en base
+    
+    Returns:
+        dict: Statistiques (documents analysés, notifications créées / relancées /
+        désactivées, messages envoyés, durée en secondes)
     """
-    try:
-        # Vérifier les documents expirés ou sur le point d'expirer
-        for vehicule in Vehicule.objects.all():
-            try:
-                # Vérifier l'assurance
-                if vehicule.date_expiration_assurance:
-                    jours_restants = (vehicule.date_expiration_assurance - today).days
-                    if jours_restants <= 30:  # Alerte 30 jours avant l'expiration
-                        send_document_notification(
-                            vehicule=vehicule,
-                            document_type='assurance',
-                            date_expiration=vehicule.date_expiration_assurance,
-                            jours_restants=jours_restants,
-                            system_user=system_user
-                        )
-                
-                # Vérifier le contrôle technique
-                if vehicule.date_expiration_controle_technique:
-                    jours_restants = (vehicule.date_expiration_controle_technique - today).days
-                    if jours_restants <= 30:  # Alerte 30 jours avant l'expiration
-                        send_document_notification(
-                            vehicule=vehicule,
-                            document_type='contrôle technique',
-                            date_expiration=vehicule.date_expiration_controle_technique,
-                            jours_restants=jours_restants,
-                            system_user=system_user
-                        )
-                
-                # Vérifier la vignette
-                if vehicule.date_expiration_vignette:
-                    jours_restants = (vehicule.date_expiration_vignette - today).days
-                    if jours_restants <= 30:  # Alerte 30 jours avant l'expiration
-                        send_document_notification(
-                            vehicule=vehicule,
-                            document_type='vignette',
-                            date_expiration=vehicule.date_expiration_vignette,
-                            jours_restants=jours_restants,
-                            system_user=system_user
-                        )
-                        
-            except Exception as e:
-                print(f"Erreur lors de la vérification des documents pour le véhicule {vehicule.immatriculation}: {e}")
-                continue  # Continuer avec le véhicule suivant en cas d'erreur
-                
-    except Exception as e:
-        print(f"Erreur critique lors de la vérification des documents: {e}")
-        raise  # Relancer l'exception pour la gestion des erreurs de niveau supérieur
+    debut = time.perf_counter()
+    limite = today + timedelta(days=JOURS_ALERTE_DOCUMENTS)
+    maintenant = timezone.now()
+    
+    # 1. Documents arrivant à expiration : une requête par type de document
+    a_notifier = {}
+    for document_type, champ, libelle in DOCUMENTS_SURVEILLES:
+        lignes = Vehicule.objects.filter(**{
+            f'{champ}__isnull': False,
+            f'{champ}__lte': limite,
+        }).values_list('id', 'immatriculation', champ)
+        for vehicule_id, immatriculation, date_expiration in lignes:
+            a_notifier[(vehicule_id, document_type)] = (immatriculation, date_expiration, libelle)
+    
+    # 2. Notifications actives existantes pour les types surveillés (une requête)
+    actives = {}
+    for notification in DocumentNotification.objects.filter(
+        is_active=True,
+        document_type__in=[d[0] for d in DOCUMENTS_SURVEILLES],
+    ):
+        actives.setdefault((notification.vehicule_id, notification.document_type), notification)
+    
+    a_creer, a_relancer, contenus = [], [], []
+    for cle, (immatriculation, date_expiration, libelle) in a_notifier.items():
+        notification = actives.get(cle)
+        # Ne pas renvoyer de notification si une notification récente existe déjà pour ce document
+        if notification and notification.date_modification >= maintenant - DELAI_RAPPEL_DOCUMENTS \
+                and notification.date_expiration == date_expiration:
+            continue
+        
+        jours_restants = (date_expiration - today).days
+        message = f"Le document {libelle} du véhicule {immatriculation} "
+        if jours_restants <= 0:
+            message += f"a expiré le {date_expiration.strftime('%d/%m/%Y')}"
+        else:
+            message += f"expire dans {jours_restants} jour(s) (le {date_expiration.strftime('%d/%m/%Y')})"
+        contenus.append(message)
+        
+        if notification:
+            notification.date_expiration = date_expiration
+            notification.date_modification = maintenant
+            a_relancer.append(notification)
+        else:
+            a_creer.append(DocumentNotification(
+                vehicule_id=cle[0],
+                document_type=cle[1],
+                date_expiration=date_expiration,
+                is_active=True
+            ))
+    
+    # Les documents renouvelés (sortis de la fenêtre d'alerte) ne sont plus actifs
+    a_desactiver = [n.pk for cle, n in actives.items() if cle not in a_notifier]
+    
+    admin_ids = list(
+        Utilisateur.objects.filter(Q(is_superuser=True) | Q(role='admin')).values_list('id', flat=True).distinct()
+    )
+    if contenus and not admin_ids:
+        print("Aucun administrateur trouvé pour l'envoi des notifications")
+    messages_systeme = [
+        Message(sender=system_user, recipient_id=admin_id, content=contenu, is_system_message=True)
+        for contenu in contenus
+        for admin_id in admin_ids
+    ]
+    
+    if not dry_run:
+        with transaction.atomic():
+            DocumentNotification.objects.bulk_create(a_creer, batch_size=500)
+            DocumentNotification.objects.bulk_update(a_relancer, ['date_expiration', 'date_modification'], batch_size=500)
+            if a_desactiver:
+                DocumentNotification.objects.filter(pk__in=a_desactiver).update(is_active=False, date_modification=maintenant)
+            Message.objects.bulk_create(messages_systeme, batch_size=500)
+            # bulk_create ne déclenche pas post_save : mettre à jour les compteurs de non lus
+            CompteurMessagesNonLus.incrementer(messages_systeme)
+    
+    stats = {
+        'documents_analyses': len(a_notifier),
+        'notifications_creees': len(a_creer),
+        'notifications_relancees': len(a_relancer),
+        'notifications_desactivees': len(a_desactiver),
+        'messages': len(messages_systeme),
+        'duree': time.perf_counter() - debut,
+        'dry_run': dry_run,
+    }
+    print(
+        f"Vérification des documents{' (simulation)' if dry_run else ''} : {stats['documents_analyses']} document(s) "
+        f"à échéance, {len(a_creer)} créée(s), {len(a_relancer)} relancée(s), {len(a_desactiver)} désactivée(s), "
+        f"{len(messages_systeme)} message(s) en {stats['duree']:.3f}s"
+    )
+    return stats
 
 def check_entretiens(today, system_user):
     """
@@ -164,75 +228,6 @@ def check_entretiens(today, system_user):
         print(f"Erreur critique lors de la vérification des entretiens: {e}")
         raise  # Relancer l'exception pour la gestion des erreurs de niveau supérieur
 
-def send_document_notification(vehicule, document_type, date_expiration, jours_restants, system_user):
-    """
-    Envoie une notification pour un document sur le point d'expirer ou ayant expiré.
-    
-    Args:
-        vehicule (Vehicule): Le véhicule concerné
-        document_type (str): Type de document (assurance, contrôle technique, vignette)
-        date_expiration (date): Date d'expiration du document
-        jours_restants (int): Nombre de jours restants avant expiration (négatif si expiré)
-        system_user (Utilisateur): Utilisateur système pour l'envoi des notifications
-    """
-    try:
-        # Vérifier si une notification similaire a déjà été envoyée récemment (dans les 7 derniers jours)
-        recent_notification = DocumentNotification.objects.filter(
-            vehicule=vehicule,
-            document_type=document_type,
-            date_creation__gte=timezone.now() - timedelta(days=7)
-        ).exists()
-        
-        if not recent_notification:
-            # Créer un message système
-            message = f"Le document {document_type} du véhicule {vehicule.immatriculation} "
-            if jours_restants <= 0:
-                message += f"a expiré le {date_expiration.strftime('%d/%m/%Y')}"
-            else:
-                message += f"expire dans {jours_restants} jour(s) (le {date_expiration.strftime('%d/%m/%Y')})"
-            
-            # Récupérer les utilisateurs administrateurs
-            admin_users = Utilisateur.objects.filter(Q(is_superuser=True) | Q(role='admin'))
-            
-            if not admin_users.exists():
-                print("Aucun administrateur trouvé pour l'envoi des notifications")
-                return False
-            
-            # Envoyer la notification à chaque administrateur
-            for user in admin_users.distinct():
-                try:
-                    Message.objects.create(
-                        sender=system_user,
-                        recipient=user,
-                        content=message,
-                        is_system_message=True
-                    )
-                    print(f"Notification envoyée à {user.username}: {message}")
-                except Exception as e:
-                    print(f"Erreur lors de l'envoi de la notification à {user.username}: {e}")
-            
-            # Enregistrer la notification dans la base de données
-            try:
-                DocumentNotification.objects.create(
-                    vehicule=vehicule,
-                    document_type=document_type,
-                    date_expiration=date_expiration,
-                    is_active=True
-                )
-                print(f"Notification enregistrée pour le véhicule {vehicule.immatriculation}, document: {document_type}")
-                return True
-                
-            except Exception as e:
-                print(f"Erreur lors de l'enregistrement de la notification: {e}")
-                return False
-        else:
-            print(f"Une notification récente existe déjà pour ce document ({document_type}) du véhicule {vehicule.immatriculation}")
-            return False
-            
-    except Exception as e:
-        print(f"Erreur lors de l'envoi de la notification pour le document {document_type} du véhicule {vehicule.immatriculation}: {e}")
-        return False
-
 def send_entretien_notification(vehicule, kilometres_parcourus, kilometres_restants, system_user):
     """
     Envoie une notification pour un entretien nécessaire.
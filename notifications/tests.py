@@ -0,0 +1,176 @@
+from datetime import timedelta
+from importlib import import_module
+from django.apps import apps
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core.models import Etablissement, Utilisateur, Vehicule, Course, Message, CompteurMessagesNonLus
+from .models import DocumentNotification, EnvoiNotification, Notification
+from .outbox import preparer_envoi, preparer_notifications_utilisateur, mettre_en_file, traiter_file_envois
+from .scheduler import executer_une_fois
+from .tasks import check_documents
+
+
+@override_settings(NOTIFICATIONS_OUTBOX_WORKERS=1, NOTIFICATIONS_OUTBOX_MAX_TENTATIVES=2, NOTIFICATIONS_OUTBOX_BACKOFF_BASE=30)
+class FileEnvoiNotificationsTest(TestCase):
+    def setUp(self):
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.dispatch = Utilisateur.objects.create_user(username="dispatch1", password="testpass1", etablissement=self.dep, role="dispatch")
+        self.demandeur = Utilisateur.objects.create_user(username="demandeur1", password="testpass1", etablissement=self.dep, role="demandeur", telephone="+243000000001")
+        self.chauffeur = Utilisateur.objects.create_user(username="chauffeur1", password="testpass1", etablissement=self.dep, role="chauffeur")
+        self.vehicule = Vehicule.objects.create(immatriculation="AAA1", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.dep, numero_chassis="CHASSIS1", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+
+    def test_distribution_messages_et_notifications_internes(self):
+        mettre_en_file([
+            preparer_envoi('message', self.demandeur, "Bonjour", expediteur=self.dispatch),
+            *preparer_notifications_utilisateur(self.demandeur, "Titre", "Contenu", canaux=('notification',)),
+        ])
+        self.assertFalse(Message.objects.exists())
+
+        self.assertEqual(traiter_file_envois(), (2, 0))
+        self.assertTrue(Message.objects.filter(sender=self.dispatch, recipient=self.demandeur, content="Bonjour").exists())
+        self.assertTrue(Notification.objects.filter(user=self.demandeur, message="Titre").exists())
+        self.assertFalse(EnvoiNotification.objects.exclude(statut='envoye').exists())
+
+    @override_settings(NOTIFICATIONS_CANAUX_ACTIFS=('notification', 'sms'))
+    def test_echec_fournisseur_reprogramme_puis_abandonne(self):
+        # Canal SMS activé mais send_sms retourne False tant que le client Twilio est désactivé
+        envoi, = mettre_en_file(preparer_notifications_utilisateur(self.demandeur, "Titre", "Contenu", canaux=('sms',)))
+        self.assertEqual(traiter_file_envois(), (0, 1))
+        envoi.refresh_from_db()
+        self.assertEqual(envoi.statut, 'en_attente')
+        self.assertEqual(envoi.tentatives, 1)
+        self.assertGreater(envoi.prochaine_tentative, timezone.now() + timedelta(seconds=20))
+
+        # Pas encore échu : rien à traiter
+        self.assertEqual(traiter_file_envois(), (0, 0))
+
+        EnvoiNotification.objects.filter(pk=envoi.pk).update(prochaine_tentative=timezone.now())
+        traiter_file_envois()
+        envoi.refresh_from_db()
+        self.assertEqual(envoi.statut, 'echec')
+        self.assertEqual(envoi.tentatives, 2)
+
+    def test_canaux_inactifs_non_mis_en_file(self):
+        # SMS et WhatsApp ne sont pas actifs par défaut : rien n'est mis en file pour eux
+        envois = preparer_notifications_utilisateur(self.demandeur, "Titre", "Contenu", canaux=('sms', 'whatsapp', 'notification'))
+        self.assertEqual([e.canal for e in envois], ['notification'])
+        mettre_en_file([preparer_envoi('sms', self.demandeur, "Contenu", telephone=self.demandeur.telephone)])
+        self.assertFalse(EnvoiNotification.objects.exists())
+
+    @override_settings(NOTIFICATIONS_CANAUX_ACTIFS=('notification', 'sms', 'whatsapp'))
+    def test_canaux_inapplicables_ignores(self):
+        # Le chauffeur n'a pas de téléphone
+        envois = preparer_notifications_utilisateur(self.chauffeur, "Titre", "Contenu", canaux=('sms', 'whatsapp', 'notification'))
+        self.assertEqual([e.canal for e in envois], ['notification'])
+
+    def test_validation_demande_met_en_file_sans_envoyer(self):
+        demande = Course.objects.create(demandeur=self.demandeur, point_embarquement="A", destination="B", motif="Test", date_souhaitee=timezone.now() + timedelta(days=1))
+        self.client.login(username="dispatch1", password="testpass1")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('dispatch:traiter_demande', args=[demande.id]), {
+                'decision': 'valider',
+                'chauffeur': self.chauffeur.id,
+                'vehicule': self.vehicule.id,
+            })
+        self.assertEqual(response.status_code, 302)
+        demande.refresh_from_db()
+        self.assertEqual(demande.statut, 'validee')
+
+        # Aucun message n'est créé pendant la requête : tout passe par la file
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual(EnvoiNotification.objects.filter(canal='message').count(), 3)
+        self.assertTrue(EnvoiNotification.objects.filter(canal='notification', destinataire=self.demandeur).exists())
+        # SMS / WhatsApp inactifs : pas d'envoi voué à l'échec dans la file
+        self.assertFalse(EnvoiNotification.objects.filter(canal__in=('sms', 'whatsapp')).exists())
+
+        traiter_file_envois()
+        self.assertEqual(Message.objects.filter(is_system_message=True).count(), 3)
+
+
+class VerificationDocumentsTest(TestCase):
+    def setUp(self):
+        self.today = timezone.now().date()
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.admin = Utilisateur.objects.create_user(username="admin1", password="testpass1", etablissement=self.dep, role="admin")
+        self.system_user = Utilisateur.objects.create_user(username="system", password="testpass1")
+
+    def _creer_vehicules(self, nombre, debut=0):
+        for i in range(debut, debut + nombre):
+            Vehicule.objects.create(
+                immatriculation=f"DOC{i}", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.dep,
+                numero_chassis=f"CHASSISDOC{i}",
+                date_expiration_assurance=self.today + timedelta(days=10),
+                date_expiration_controle_technique=self.today + timedelta(days=90),
+                date_expiration_vignette=self.today - timedelta(days=1),
+                date_expiration_stationnement=self.today + timedelta(days=90),
+            )
+
+    def test_notifications_creees_puis_non_dupliquees(self):
+        self._creer_vehicules(2)
+        stats = check_documents(self.today, self.system_user)
+        self.assertEqual(stats['notifications_creees'], 4)
+        self.assertEqual(DocumentNotification.objects.filter(is_active=True).count(), 4)
+        self.assertEqual(set(DocumentNotification.objects.values_list('document_type', flat=True)), {'assurance', 'vignette'})
+        self.assertEqual(Message.objects.filter(recipient=self.admin, is_system_message=True).count(), 4)
+
+        # Deuxième passage : notifications récentes, rien n'est renvoyé
+        stats = check_documents(self.today, self.system_user)
+        self.assertEqual(stats['messages'], 0)
+        self.assertEqual(Message.objects.count(), 4)
+
+        # Assurance renouvelée : la notification est désactivée
+        Vehicule.objects.update(date_expiration_assurance=self.today + timedelta(days=365))
+        stats = check_documents(self.today, self.system_user)
+        self.assertEqual(stats['notifications_desactivees'], 2)
+        self.assertFalse(DocumentNotification.objects.filter(document_type='assurance', is_active=True).exists())
+
+    def test_simulation_sans_ecriture(self):
+        self._creer_vehicules(2)
+        stats = check_documents(self.today, self.system_user, dry_run=True)
+        self.assertEqual(stats['notifications_creees'], 4)
+        self.assertFalse(DocumentNotification.objects.exists())
+        self.assertFalse(Message.objects.exists())
+
+    def test_nombre_de_requetes_independant_du_parc(self):
+        self._creer_vehicules(2)
+        with CaptureQueriesContext(connection) as petit_parc:
+            check_documents(self.today, self.system_user)
+        DocumentNotification.objects.all().delete()
+        CompteurMessagesNonLus.objects.all().delete()
+        self._creer_vehicules(20, debut=2)
+        with CaptureQueriesContext(connection) as grand_parc:
+            check_documents(self.today, self.system_user)
+        self.assertEqual(len(petit_parc), len(grand_parc))
+
+    def test_anciennes_notifications_de_controle_technique_reprises(self):
+        self._creer_vehicules(2)
+        Vehicule.objects.update(date_expiration_controle_technique=self.today + timedelta(days=10))
+        vehicule, autre = Vehicule.objects.order_by('id')
+        expiration = self.today + timedelta(days=10)
+        # Notifications enregistrées avant la vérification ensembliste, sous l'ancien libellé
+        ancienne = DocumentNotification.objects.create(vehicule=vehicule, document_type='contrôle technique', date_expiration=expiration)
+        doublon = DocumentNotification.objects.create(vehicule=autre, document_type='contrôle technique', date_expiration=expiration)
+        DocumentNotification.objects.create(vehicule=autre, document_type='controle_technique', date_expiration=expiration)
+
+        migration = import_module('notifications.migrations.0005_renommer_type_controle_technique')
+        migration.renommer_type_controle_technique(apps, None)
+        ancienne.refresh_from_db()
+        doublon.refresh_from_db()
+        self.assertEqual((ancienne.document_type, ancienne.is_active), ('controle_technique', True))
+        self.assertFalse(doublon.is_active)
+        self.assertEqual(DocumentNotification.objects.filter(document_type='controle_technique', is_active=True).count(), 2)
+
+        # Notification récente reprise : pas de nouveau rappel du contrôle technique
+        check_documents(self.today, self.system_user)
+        self.assertFalse(Message.objects.filter(content__icontains='contrôle technique').exists())
+
+    def test_tache_quotidienne_executee_une_fois(self):
+        # Plusieurs processus font tourner le planificateur : un seul exécute la tâche du jour
+        executions = []
+        self.assertTrue(executer_une_fois('verification_documents', lambda: executions.append(1)))
+        self.assertFalse(executer_une_fois('verification_documents', lambda: executions.append(2)))
+        self.assertEqual(executions, [1])
+        self.assertTrue(executer_une_fois('reconciliation_faits_journaliers', lambda: executions.append(3)))
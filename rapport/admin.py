@@ -2,11 +2,11 @@ from django.contrib import admin
 from .models import Rapport
 
 class RapportAdmin(admin.ModelAdmin):
-    list_display = ('titre', 'type_rapport', 'format_rapport', 'date_debut', 'date_fin', 'date_generation', 'generateur')
-    list_filter = ('type_rapport', 'format_rapport', 'date_generation')
+    list_display = ('titre', 'type_rapport', 'format_rapport', 'date_debut', 'date_fin', 'date_generation', 'generateur', 'statut', 'progression')
+    list_filter = ('statut', 'type_rapport', 'format_rapport', 'date_generation')
     search_fields = ('titre', 'generateur__username')
     date_hierarchy = 'date_generation'
-    readonly_fields = ('date_generation',)
+    readonly_fields = ('date_generation', 'date_fin_traitement')
     fieldsets = (
         ('Informations générales', {
             'fields': ('titre', 'type_rapport', 'format_rapport', 'generateur')
@@ -17,6 +17,9 @@ class RapportAdmin(admin.ModelAdmin):
         ('Fichier', {
             'fields': ('fichier', 'parametres')
         }),
+        ('Génération', {
+            'fields': ('statut', 'progression', 'message_erreur', 'date_fin_traitement')
+        }),
     )
 
 admin.site.register(Rapport, RapportAdmin)
@@ -0,0 +1,107 @@
+"""
+Agrégation des métriques de la flotte en un nombre fixe de requêtes.
+
+Les rapports véhicules calculaient auparavant chaque métrique véhicule par
+véhicule (7+ requêtes par véhicule). Les fonctions de ce module regroupent les
+calculs par véhicule côté base de données (GROUP BY et sous-requêtes), de sorte
+que le coût d'un rapport ne dépend plus de la taille de la flotte.
+"""
+from collections import defaultdict
+
+from django.db.models import Count, Min, OuterRef, Subquery, Sum
+
+from core.models import Course
+from entretien.models import Entretien
+from ravitaillement.models import Ravitaillement
+
+
+def _metriques_vides():
+    """Retourne les métriques par défaut d'un véhicule sans activité"""
+    return {
+        'distance_parcourue_courses': 0,
+        'plus_ancien_kilometrage_depart': None,
+        'nb_courses': 0,
+        'derniere_course': None,
+        'nb_entretiens': 0,
+        'cout_entretiens': 0,
+        'types_entretiens': '',
+        'total_litres': 0,
+        'total_cout_carburant': 0,
+    }
+
+
+def collecter_metriques_vehicules(vehicules, date_debut=None, date_fin=None):
+    """
+    Calcule les métriques de tous les véhicules du queryset en requêtes groupées.
+
+    Args:
+        vehicules (QuerySet): Véhicules à analyser (déjà filtrés)
+        date_debut (str|date, optional): Borne basse appliquée aux entretiens et ravitaillements
+        date_fin (str|date, optional): Borne haute appliquée aux entretiens et ravitaillements
+
+    Returns:
+        dict: {vehicule_id: {métrique: valeur}} pour chaque véhicule du queryset
+    """
+    vehicule_ids = vehicules.values('pk')
+    metriques = defaultdict(_metriques_vides)
+
+    # 1. Courses terminées : distance, plus ancien kilométrage de départ, nombre
+    courses_terminees = Course.objects.filter(vehicule__in=vehicule_ids, statut='terminee')
+    derniere_course_par_vehicule = {}
+    for ligne in courses_terminees.values('vehicule_id').annotate(
+        distance=Sum('distance_parcourue'),
+        km_depart_min=Min('kilometrage_depart'),
+        nb=Count('id'),
+        derniere_course_id=Subquery(
+            Course.objects.filter(
+                vehicule_id=OuterRef('vehicule_id'), statut='terminee'
+            ).order_by('-date_fin').values('pk')[:1]
+        ),
+    ).order_by():
+        m = metriques[ligne['vehicule_id']]
+        m['distance_parcourue_courses'] = ligne['distance'] or 0
+        m['plus_ancien_kilometrage_depart'] = ligne['km_depart_min']
+        m['nb_courses'] = ligne['nb']
+        if ligne['derniere_course_id']:
+            derniere_course_par_vehicule[ligne['vehicule_id']] = ligne['derniere_course_id']
+
+    # Dernière course terminée de chaque véhicule, chargée en une seule requête
+    if derniere_course_par_vehicule:
+        courses = Course.objects.in_bulk(derniere_course_par_vehicule.values())
+        for vehicule_id, course_id in derniere_course_par_vehicule.items():
+            metriques[vehicule_id]['derniere_course'] = courses.get(course_id)
+
+    # 2. Entretiens : nombre, coût et types distincts
+    entretiens = Entretien.objects.filter(vehicule__in=vehicule_ids)
+    if date_debut:
+        entretiens = entretiens.filter(date_creation__date__gte=date_debut)
+    if date_fin:
+        entretiens = entretiens.filter(date_creation__date__lte=date_fin)
+    for ligne in entretiens.values('vehicule_id').annotate(
+        nb=Count('id'), cout=Sum('cout')
+    ).order_by():
+        m = metriques[ligne['vehicule_id']]
+        m['nb_entretiens'] = ligne['nb']
+        m['cout_entretiens'] = ligne['cout'] or 0
+
+    libelles_types = dict(Entretien.TYPE_CHOICES)
+    types_par_vehicule = defaultdict(set)
+    for vehicule_id, type_entretien in entretiens.values_list('vehicule_id', 'type_entretien').distinct().order_by():
+        types_par_vehicule[vehicule_id].add(libelles_types.get(type_entretien, type_entretien))
+    for vehicule_id, types in types_par_vehicule.items():
+        metriques[vehicule_id]['types_entretiens'] = ', '.join(sorted(types))
+
+    # 3. Ravitaillements : litres et coût du carburant
+    ravitaillements = Ravitaillement.objects.filter(vehicule__in=vehicule_ids)
+    if date_debut:
+        ravitaillements = ravitaillements.filter(date_ravitaillement__date__gte=date_debut)
+    if date_fin:
+        ravitaillements = ravitaillements.filter(date_ravitaillement__date__lte=date_fin)
+    for ligne in ravitaillements.values('vehicule_id').annotate(
+        litres=Sum('litres'), cout=Sum('cout_total')
+    ).order_by():
+        m = metriques[ligne['vehicule_id']]
+        m['total_litres'] = ligne['litres'] or 0
+        m['total_cout_carburant'] = ligne['cout'] or 0
+
+    return metriques
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RapportConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rapport'
+
+    def ready(self):
+        import rapport.signals  # noqa
@@ -0,0 +1,132 @@
+"""
+Cache des données calculées des rapports.
+
+Un rapport est calculé une fois pour un type de rapport, des paramètres de
+filtre normalisés et le périmètre de l'utilisateur (son établissement, ou tous
+pour un superutilisateur). La vue HTML et ses exports (PDF, Excel) lisent la
+même entrée : passer de l'écran à l'export ne recalcule rien.
+
+Les paramètres de sortie (export, format, page) ne font pas partie de la clé.
+Toute écriture sur Course, Ravitaillement ou Entretien (signaux post_save et
+post_delete, voir rapport.signals) change la version des rapports, ce qui rend
+toutes les entrées existantes obsolètes d'un coup. Les mises à jour en masse
+(QuerySet.update) n'envoient pas de signaux : elles appellent
+`invalider_rapports` elles-mêmes.
+
+La version vit dans le cache : elle n'est partagée entre les workers gunicorn
+qu'avec un cache partagé (REDIS_URL). Avec le cache mémoire local, une
+écriture n'invalide que le cache du processus qui l'a traitée ;
+RAPPORTS_CACHE_TTL est alors réduit à quelques secondes.
+
+Le worker des rapports (rapport.taches) calcule dans un bloc `calcul_isole` :
+son cache local ne voit pas les changements de version publiés par les
+processus web, il ne lit donc pas le cache et calcule les données une fois
+pour le rapport produit.
+"""
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CLE_VERSION = 'rapport:version'
+PARAMETRES_SORTIE = ('export', 'export_historique', 'format', 'page', 'csrfmiddlewaretoken')
+
+_contexte = threading.local()
+
+
+def _version():
+    version = cache.get(CLE_VERSION)
+    if version is None:
+        # Version initialisée à l'horloge : une version évincée du cache ne
+        # peut pas retomber sur la valeur d'entrées plus anciennes
+        version = time.time_ns()
+        if not cache.add(CLE_VERSION, version, None):
+            version = cache.get(CLE_VERSION, version)
+    return version
+
+
+def _nouvelle_version():
+    try:
+        cache.incr(CLE_VERSION)
+    except ValueError:
+        cache.set(CLE_VERSION, time.time_ns(), None)
+
+
+def invalider_rapports():
+    """Rend obsolètes tous les rapports en cache, maintenant et après la validation de la transaction courante"""
+    _nouvelle_version()
+    # Un rapport calculé pendant la transaction lirait les anciennes données
+    transaction.on_commit(_nouvelle_version)
+
+
+def perimetre(user):
+    """Périmètre des données visibles : tous les établissements pour un superutilisateur"""
+    return 'tous' if user.is_superuser else f"etablissement:{user.etablissement_id or 0}"
+
+
+def parametres_normalises(request, noms=None):
+    """
+    Paramètres de filtre de la requête, triés et sans valeurs vides.
+
+    Args:
+        noms: paramètres lus par le calcul du rapport ; par défaut tous les
+              paramètres GET sauf ceux de sortie (export, format, page)
+    """
+    if noms is None:
+        noms = [nom for nom in request.GET if nom not in PARAMETRES_SORTIE]
+    parametres = {}
+    for nom in noms:
+        valeurs = sorted(valeur.strip() for valeur in request.GET.getlist(nom) if valeur.strip())
+        if valeurs:
+            parametres[nom] = valeurs
+    return sorted(parametres.items())
+
+
+def _empreinte(request, parametres=None):
+    return hashlib.sha256(json.dumps(
+        [perimetre(request.user), parametres_normalises(request, parametres)]
+    ).encode('utf-8')).hexdigest()
+
+
+def cle_rapport(type_rapport, request, parametres=None):
+    return f"rapport:{_version()}:{type_rapport}:{_empreinte(request, parametres)}"
+
+
+@contextmanager
+def calcul_isole():
+    """Dans ce bloc, rapport_en_cache ignore le cache partagé : chaque rapport est calculé une fois pour le bloc"""
+    precedent = getattr(_contexte, 'donnees', None)
+    _contexte.donnees = {}
+    try:
+        yield
+    finally:
+        _contexte.donnees = precedent
+
+
+def rapport_en_cache(type_rapport, request, calculer, parametres=None):
+    """
+    Données du rapport depuis le cache, calculées par `calculer()` au besoin.
+
+    Args:
+        type_rapport: nom du rapport, partagé par la vue et ses exports
+        calculer: fonction sans argument renvoyant les données (picklables)
+        parametres: paramètres GET lus par le calcul (voir parametres_normalises)
+    """
+    isolees = getattr(_contexte, 'donnees', None)
+    if isolees is not None:
+        cle = (type_rapport, _empreinte(request, parametres))
+        if cle not in isolees:
+            isolees[cle] = calculer()
+        return isolees[cle]
+
+    cle = cle_rapport(type_rapport, request, parametres)
+    donnees = cache.get(cle)
+    if donnees is None:
+        donnees = calculer()
+        cache.set(cle, donnees, getattr(settings, 'RAPPORTS_CACHE_TTL', 900))
+    return donnees
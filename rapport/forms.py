@@ -0,0 +1,34 @@
+from django import forms
+from .models import Rapport
+
+
+class DemandeRapportForm(forms.ModelForm):
+    """Demande d'un rapport produit en arrière-plan (voir rapport.taches)"""
+    class Meta:
+        model = Rapport
+        fields = ('type_rapport', 'format_rapport', 'date_debut', 'date_fin')
+        widgets = {
+            'type_rapport': forms.Select(attrs={'class': 'form-select'}),
+            'format_rapport': forms.Select(attrs={'class': 'form-select'}),
+            'date_debut': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
+            'date_fin': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
+        }
+        labels = {
+            'type_rapport': 'Rapport',
+            'format_rapport': 'Format',
+            'date_debut': 'Date début',
+            'date_fin': 'Date fin',
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Les exports des rapports sont produits en PDF ou en Excel
+        self.fields['format_rapport'].choices = [(code, libelle) for code, libelle in Rapport.FORMAT_CHOICES if code in ('pdf', 'excel')]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_debut = cleaned_data.get('date_debut')
+        date_fin = cleaned_data.get('date_fin')
+        if date_debut and date_fin and date_fin < date_debut:
+            raise forms.ValidationError("La date de fin doit être postérieure à la date de début.")
+        return cleaned_data
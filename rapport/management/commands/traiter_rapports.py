@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from rapport.taches import traiter_file_rapports, traiter_file_corrections
+
+
+class Command(BaseCommand):
+    help = "Produit les rapports demandés et applique les corrections de kilométrage mises en file (worker des tâches en arrière-plan)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help='Tourne en continu et vide la file toutes les --intervalle secondes'
+        )
+        parser.add_argument(
+            '--intervalle',
+            type=int,
+            default=5,
+            help='Pause en secondes entre deux passages en mode --boucle (défaut: 5)'
+        )
+
+    def handle(self, *args, **options):
+        total_produits = total_echecs = total_corrections = 0
+        while True:
+            produits, echecs = traiter_file_rapports()
+            total_produits += produits
+            total_echecs += echecs
+            appliquees, echecs = traiter_file_corrections()
+            total_corrections += appliquees
+            total_echecs += echecs
+            if not options['boucle']:
+                break
+            time.sleep(max(options['intervalle'], 1))
+
+        self.stdout.write(
+            self.style.SUCCESS(f"✅ {total_produits} rapport(s) produit(s), {total_corrections} correction(s) appliquée(s), {total_echecs} en échec")
+        )
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:40
+
+from django.db import migrations, models
+
+
+def marquer_rapports_existants(apps, schema_editor):
+    """Les rapports enregistrés avant la génération en arrière-plan sont déjà produits"""
+    Rapport = apps.get_model('rapport', 'Rapport')
+    Rapport.objects.update(statut='termine', progression=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rapport', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rapport',
+            name='date_fin_traitement',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rapport',
+            name='message_erreur',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='rapport',
+            name='progression',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='rapport',
+            name='reserve_jusqua',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rapport',
+            name='statut',
+            field=models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('echec', 'Échec')], default='en_attente', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='rapport',
+            index=models.Index(fields=['statut', 'date_generation'], name='rapport_statut_date_idx'),
+        ),
+        migrations.RunPython(marquer_rapports_existants, migrations.RunPython.noop),
+    ]
@@ -28,6 +28,24 @@ class Rapport(models.Model):
     fichier = models.FileField(upload_to='rapports/', blank=True, null=True)
     parametres = models.JSONField(blank=True, null=True)  # Pour stocker des paramètres spécifiques au rapport
     
+    # Génération en arrière-plan (voir rapport.taches)
+    STATUT_CHOICES = (
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('termine', 'Terminé'),
+        ('echec', 'Échec'),
+    )
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='en_attente')
+    progression = models.PositiveSmallIntegerField(default=0)  # Pourcentage
+    message_erreur = models.TextField(blank=True)
+    date_fin_traitement = models.DateTimeField(blank=True, null=True)
+    reserve_jusqua = models.DateTimeField(blank=True, null=True)  # Fin de la réservation par un worker
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['statut', 'date_generation'], name='rapport_statut_date_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.titre} - {self.date_generation}"
     
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.models import Course
+from entretien.models import Entretien
+from ravitaillement.models import Ravitaillement
+from .cache import invalider_rapports
+
+
+# Les rapports en cache (voir rapport.cache) sont recalculés après toute écriture sur leurs données
+@receiver([post_save, post_delete], sender=Course)
+@receiver([post_save, post_delete], sender=Ravitaillement)
+@receiver([post_save, post_delete], sender=Entretien)
+def invalider_rapports_en_cache(sender, instance, **kwargs):
+    invalider_rapports()
@@ -0,0 +1,258 @@
+"""
+Génération des rapports en arrière-plan.
+
+Un rapport demandé sur une longue période (une année de missions, le carburant
+de toute la flotte) dépasse le délai de gunicorn s'il est produit dans la
+requête. La demande crée une ligne `Rapport` en attente (`soumettre_rapport`),
+puis un worker la produit hors du cycle requête/réponse :
+
+- le worker réserve le rapport par une mise à jour conditionnelle (un rapport
+  n'est traité que par un seul worker ; une réservation expirée, worker arrêté
+  brutalement, le rend de nouveau éligible) ;
+- il calcule les données du rapport hors du cache partagé (`calcul_isole`,
+  voir rapport.cache), puis appelle la vue d'export du rapport avec une
+  requête reconstruite à partir des paramètres enregistrés et de l'utilisateur
+  qui l'a demandé ; la vue réutilise ces données sans les recalculer ;
+- le fichier produit est enregistré dans `Rapport.fichier`, la progression et
+  le statut sont mis à jour à chaque étape, et l'utilisateur est notifié.
+
+Le worker tourne dans un processus séparé avec la commande
+`traiter_rapports --boucle` (processus `worker` du Procfile), ou dans un
+thread du serveur d'application démarré à la première demande si
+RAPPORTS_WORKER_INTEGRE est activé. Le même worker applique les corrections
+collectives du kilométrage mises en file (securite.corrections).
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction, close_old_connections
+from django.db.models import Q
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+from django.utils.text import slugify
+
+from core.rendu_pdf import attente_complete
+from .cache import calcul_isole, rapport_en_cache
+from .models import Rapport
+
+logger = logging.getLogger(__name__)
+
+# Paramètres de filtre acceptés en plus de la période, tous rapports confondus
+PARAMETRES_FILTRES = ('vehicule', 'chauffeur', 'demandeur', 'statut', 'station', 'montant_min', 'type_entretien', 'immatriculation', 'marque')
+
+EXTENSIONS = {
+    'application/pdf': 'pdf',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
+}
+
+
+class ErreurRapport(Exception):
+    """La vue du rapport n'a pas produit de fichier"""
+    pass
+
+
+def _parametre(nom, defaut):
+    return getattr(settings, nom, defaut)
+
+
+def _types_rapport():
+    """
+    Type de rapport -> (vue, paramètre GET du format d'export, préparation des
+    données en cache ou None)
+    """
+    from . import views
+
+    return {
+        'course': (views.rapport_missions, 'export', ('missions', views._calculer_rapport_missions, views.PARAMETRES_RAPPORT_MISSIONS)),
+        'ravitaillement': (views.rapport_carburant, 'export', ('carburant', views._calculer_rapport_carburant, views.PARAMETRES_RAPPORT_CARBURANT)),
+        'chauffeur': (views.rapport_evaluation_chauffeurs, 'export', ('evaluation_chauffeurs', views._calculer_evaluation_chauffeurs, views.PARAMETRES_EVALUATION_CHAUFFEURS)),
+        'entretien': (views.rapport_entretiens, 'export', None),
+        'vehicule': (views.rapport_vehicules, 'export', None),
+        'general': (views.rapport_depenses_carburant_entretien, 'format', ('depenses_carburant_entretien', views._calculer_rapport_depenses, views.PARAMETRES_RAPPORT_DEPENSES)),
+    }
+
+
+def soumettre_rapport(generateur, type_rapport, format_rapport, date_debut, date_fin, parametres=None, titre=None):
+    """Enregistre la demande de rapport ; le worker est réveillé après la validation de la transaction"""
+    rapport = Rapport.objects.create(
+        titre=titre or f"{dict(Rapport.TYPE_CHOICES)[type_rapport]} du {date_debut:%d/%m/%Y} au {date_fin:%d/%m/%Y}",
+        type_rapport=type_rapport,
+        format_rapport=format_rapport,
+        date_debut=date_debut,
+        date_fin=date_fin,
+        generateur=generateur,
+        parametres=parametres or {},
+        statut='en_attente',
+    )
+    transaction.on_commit(reveiller_worker)
+    return rapport
+
+
+def _eligibles(maintenant):
+    return Q(statut='en_attente') | Q(statut='en_cours', reserve_jusqua__lt=maintenant)
+
+
+def _reserver_rapport():
+    """Réserve le plus ancien rapport en attente, ou None"""
+    maintenant = timezone.now()
+    for rapport_id in Rapport.objects.filter(_eligibles(maintenant)).order_by('date_generation').values_list('id', flat=True)[:5]:
+        reservation = maintenant + timedelta(seconds=_parametre('RAPPORTS_RESERVATION', 1800))
+        # La mise à jour conditionnelle garantit qu'un rapport n'est réservé que par un seul worker
+        if Rapport.objects.filter(_eligibles(maintenant), id=rapport_id).update(
+            statut='en_cours', progression=5, reserve_jusqua=reservation, message_erreur=''
+        ):
+            return Rapport.objects.select_related('generateur').get(id=rapport_id)
+    return None
+
+
+def _progression(rapport, pourcentage):
+    rapport.progression = pourcentage
+    Rapport.objects.filter(pk=rapport.pk).update(progression=pourcentage)
+
+
+def _requete(rapport, parametre_format):
+    """Requête GET équivalente à l'export du rapport par son demandeur"""
+    requete = HttpRequest()
+    requete.method = 'GET'
+    requete.user = rapport.generateur
+    requete.session = {}
+    requete.GET = QueryDict(mutable=True)
+    for nom, valeur in (rapport.parametres or {}).items():
+        if nom in PARAMETRES_FILTRES and valeur not in (None, ''):
+            requete.GET[nom] = str(valeur)
+    requete.GET['date_debut'] = rapport.date_debut.isoformat()
+    requete.GET['date_fin'] = rapport.date_fin.isoformat()
+    requete.GET[parametre_format] = rapport.format_rapport
+    return requete
+
+
+def _produire(rapport):
+    """Exécute l'export du rapport. Retourne (contenu, extension)"""
+    vue, parametre_format, preparation = _types_rapport()[rapport.type_rapport]
+    requete = _requete(rapport, parametre_format)
+
+    # Le cache du worker peut être local au processus : les données sont calculées
+    # pour ce rapport et partagées avec la vue d'export, sans lire le cache
+    with calcul_isole():
+        if preparation:
+            # Calcul des données (la partie longue)
+            type_cache, calculer, parametres = preparation
+            rapport_en_cache(type_cache, requete, lambda: calculer(requete), parametres)
+            _progression(rapport, 60)
+
+        # Les PDF sont attendus jusqu'au bout : le worker n'a pas de page de suivi
+        with attente_complete():
+            reponse = vue(requete)
+    try:
+        extension = EXTENSIONS.get(reponse.get('Content-Type', '').split(';')[0])
+        if reponse.status_code != 200 or extension is None:
+            detail = b'' if reponse.streaming else reponse.content[:500]
+            raise ErreurRapport(f"Réponse inattendue ({reponse.status_code}) : {detail.decode('utf-8', 'replace') or reponse.get('Content-Type', '')}")
+        contenu = b''.join(reponse.streaming_content) if reponse.streaming else reponse.content
+    finally:
+        reponse.close()
+    return contenu, extension
+
+
+def _notifier(rapport):
+    from notifications.outbox import preparer_notifications_utilisateur, mettre_en_file
+
+    if rapport.statut == 'termine':
+        titre = f"Rapport prêt : {rapport.titre}"
+        message = "Votre rapport est disponible au téléchargement dans « Mes rapports »."
+    else:
+        titre = f"Échec du rapport : {rapport.titre}"
+        message = f"La génération du rapport a échoué : {rapport.message_erreur}"
+    mettre_en_file(preparer_notifications_utilisateur(rapport.generateur, titre, message, canaux=('notification',)))
+
+
+def executer_rapport(rapport):
+    """Produit le fichier d'un rapport réservé et notifie son demandeur. Retourne True en cas de succès"""
+    try:
+        contenu, extension = _produire(rapport)
+        _progression(rapport, 90)
+        rapport.fichier.save(f"{slugify(rapport.titre)[:80] or 'rapport'}_{rapport.pk}.{extension}", ContentFile(contenu), save=False)
+        rapport.statut = 'termine'
+        rapport.progression = 100
+    except Exception as e:
+        logger.exception(f"Échec de la génération du rapport {rapport.pk}")
+        rapport.statut = 'echec'
+        rapport.message_erreur = str(e)
+    rapport.date_fin_traitement = timezone.now()
+    rapport.reserve_jusqua = None
+    rapport.save(update_fields=['fichier', 'statut', 'progression', 'message_erreur', 'date_fin_traitement', 'reserve_jusqua'])
+    _notifier(rapport)
+    return rapport.statut == 'termine'
+
+
+def traiter_file_rapports(limite=None):
+    """
+    Produit les rapports en attente, un par un, jusqu'à vider la file (ou `limite` rapports).
+
+    Returns:
+        tuple: (nombre de rapports produits, nombre de rapports en échec)
+    """
+    produits = echecs = 0
+    while limite is None or produits + echecs < limite:
+        rapport = _reserver_rapport()
+        if rapport is None:
+            break
+        if executer_rapport(rapport):
+            produits += 1
+        else:
+            echecs += 1
+    return produits, echecs
+
+
+# --- Worker en arrière-plan --------------------------------------------------
+
+def traiter_file_corrections():
+    """Le worker applique aussi les corrections de kilométrage mises en file (securite.corrections)"""
+    from securite.corrections import traiter_file_corrections as traiter
+
+    return traiter()
+
+
+_reveil = threading.Event()
+_verrou = threading.Lock()
+_worker = None
+
+
+class RapportsWorkerThread(threading.Thread):
+    """Thread qui produit les rapports dès qu'ils sont demandés, et au moins toutes les N secondes"""
+    def __init__(self, intervalle=None):
+        super().__init__(name='rapports-worker')
+        self.daemon = True
+        self.intervalle = intervalle or _parametre('RAPPORTS_WORKER_INTERVALLE', 30)
+
+    def run(self):
+        logger.info("Démarrage du worker de génération des rapports...")
+        while True:
+            _reveil.wait(self.intervalle)
+            _reveil.clear()
+            try:
+                traiter_file_rapports()
+                traiter_file_corrections()
+            except Exception as e:
+                logger.error(f"Erreur dans le worker des tâches en arrière-plan: {e}")
+            finally:
+                close_old_connections()
+
+
+def demarrer_worker():
+    """Démarre le worker dans un thread séparé (une seule instance par processus)"""
+    global _worker
+    with _verrou:
+        if _worker is None or not _worker.is_alive():
+            _worker = RapportsWorkerThread()
+            _worker.start()
+
+
+def reveiller_worker():
+    """Demande au worker de traiter la file sans attendre"""
+    if _parametre('RAPPORTS_WORKER_INTEGRE', False):
+        demarrer_worker()
+    _reveil.set()
@@ -1,3 +1,216 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+from openpyxl import load_workbook
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from core.models import Etablissement, Utilisateur, Vehicule, Course
+from entretien.models import Entretien
+from ravitaillement.models import Ravitaillement
+from notifications.models import EnvoiNotification
+from .aggregations import collecter_metriques_vehicules
+from .models import Rapport
+from .taches import traiter_file_rapports
+from . import views
 
-# Create your tests here.
+
+class MetriquesVehiculesTest(TestCase):
+    def setUp(self):
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.user = Utilisateur.objects.create_user(username="admin1", password="testpass1", etablissement=self.dep, role="admin")
+        self.vehicules = []
+        for i in range(3):
+            v = Vehicule.objects.create(immatriculation=f"AAA{i}", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.dep, numero_chassis=f"CHASSIS{i}", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+            self.vehicules.append(v)
+        v1 = self.vehicules[0]
+        Course.objects.create(demandeur=self.user, vehicule=v1, point_embarquement="A", destination="B", motif="Test", statut='terminee', kilometrage_depart=1000, kilometrage_fin=1100)
+        Course.objects.create(demandeur=self.user, vehicule=v1, point_embarquement="B", destination="C", motif="Test", statut='terminee', kilometrage_depart=1100, kilometrage_fin=1300)
+        Course.objects.create(demandeur=self.user, vehicule=v1, point_embarquement="C", destination="D", motif="Test", statut='en_cours', kilometrage_depart=1300)
+        Entretien.objects.create(vehicule=v1, motif="Vidange", garage="Garage A", cout=100, date_entretien="2024-01-01", statut="planifie", createur=self.user)
+        Entretien.objects.create(vehicule=v1, motif="Moteur", garage="Garage A", cout=250, date_entretien="2024-02-01", statut="planifie", type_entretien='mecanique', createur=self.user)
+        Ravitaillement.objects.create(vehicule=v1, litres=20, cout_unitaire=2, kilometrage_avant=1300, kilometrage_apres=1310, createur=self.user)
+
+    def test_metriques_agregees(self):
+        v1, v2, _ = self.vehicules
+        metriques = collecter_metriques_vehicules(Vehicule.objects.all())
+        m = metriques[v1.pk]
+        self.assertEqual(m['distance_parcourue_courses'], 300)
+        self.assertEqual(m['plus_ancien_kilometrage_depart'], 1000)
+        self.assertEqual(m['nb_courses'], 2)
+        self.assertEqual(m['derniere_course'].kilometrage_fin, 1300)
+        self.assertEqual(m['nb_entretiens'], 2)
+        self.assertEqual(m['cout_entretiens'], 350)
+        self.assertEqual(m['types_entretiens'], "Entretien mécanique, Entretien ordinaire")
+        self.assertEqual(m['total_litres'], 20)
+        self.assertEqual(m['total_cout_carburant'], 40)
+        self.assertEqual(metriques[v2.pk]['nb_courses'], 0)
+        self.assertIsNone(metriques[v2.pk]['derniere_course'])
+
+    def test_nombre_de_requetes_constant(self):
+        with self.assertNumQueries(5):
+            collecter_metriques_vehicules(Vehicule.objects.all())
+
+
+class ExportsExcelRapportsTest(TestCase):
+    def setUp(self):
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.user = Utilisateur.objects.create_user(username="admin1", password="testpass1", etablissement=self.dep, role="admin")
+        self.vehicule = Vehicule.objects.create(immatriculation="EXP1", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.dep, numero_chassis="CHASSISEXP1", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+        Entretien.objects.create(vehicule=self.vehicule, motif="Vidange", garage="Garage A", cout=100, date_entretien="2024-01-01", statut="planifie", createur=self.user)
+        Ravitaillement.objects.create(vehicule=self.vehicule, litres=20, cout_unitaire=2, kilometrage_avant=1000, kilometrage_apres=1200, createur=self.user)
+        self.client.login(username="admin1", password="testpass1")
+
+    def _lignes(self, url):
+        response = self.client.get(url, {'export': 'excel'})
+        classeur = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        return list(classeur.worksheets[0].iter_rows(values_only=True))
+
+    def test_rapport_entretiens(self):
+        lignes = self._lignes(reverse('rapport:entretiens'))
+        self.assertEqual(lignes[0][:3], ('ID', 'Date', 'Véhicule'))
+        self.assertEqual(lignes[1][2:4], ("EXP1", "Département A"))
+
+    def test_rapport_carburant(self):
+        lignes = self._lignes(reverse('rapport:carburant'))
+        self.assertEqual(lignes[0][0], "Rapport de Consommation de Carburant")
+        self.assertEqual(lignes[-2][0], "Date")
+        self.assertEqual(lignes[-1][3:6], (20, 2, 40))
+        self.assertEqual(lignes[-1][8:], (200, 10))
+
+
+class CacheRapportsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.autre_dep = Etablissement.objects.create(nom="Département B")
+        self.user = Utilisateur.objects.create_user(username="admin1", password="testpass1", etablissement=self.dep, role="admin")
+        Utilisateur.objects.create_user(username="admin2", password="testpass2", etablissement=self.autre_dep, role="admin")
+        self.vehicule = Vehicule.objects.create(immatriculation="CACHE1", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.dep, numero_chassis="CHASSISCACHE1", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+        Ravitaillement.objects.create(vehicule=self.vehicule, litres=20, cout_unitaire=2, kilometrage_avant=1000, kilometrage_apres=1200, createur=self.user)
+        self.client.login(username="admin1", password="testpass1")
+
+    def _calculs(self, nom):
+        calcul = mock.patch.object(views, nom, wraps=getattr(views, nom))
+        self.addCleanup(calcul.stop)
+        return calcul.start()
+
+    def test_vue_et_export_partagent_le_calcul(self):
+        calculs = self._calculs('_calculer_rapport_carburant')
+        url = reverse('rapport:carburant')
+        response = self.client.get(url, {'date_debut': '2020-01-01', 'station': ''})
+        self.assertEqual(response.context['total_ravitaillements'], 1)
+        self.client.get(url, {'station': '  ', 'date_debut': '2020-01-01', 'export': 'excel'})
+        self.assertEqual(calculs.call_count, 1)
+
+        # Autre filtre, autre périmètre : nouveau calcul
+        self.client.get(url, {'date_debut': '2021-01-01'})
+        self.client.login(username="admin2", password="testpass2")
+        response = self.client.get(url, {'date_debut': '2020-01-01'})
+        self.assertEqual(response.context['total_ravitaillements'], 0)
+        self.assertEqual(calculs.call_count, 3)
+
+    def test_invalidation_par_ecriture(self):
+        calculs = self._calculs('_calculer_rapport_carburant')
+        url = reverse('rapport:carburant')
+        self.client.get(url)
+        ravitaillement = Ravitaillement.objects.create(vehicule=self.vehicule, litres=10, cout_unitaire=2, kilometrage_avant=1200, kilometrage_apres=1300, createur=self.user)
+        self.assertEqual(self.client.get(url).context['total_ravitaillements'], 2)
+        ravitaillement.delete()
+        self.assertEqual(self.client.get(url).context['total_ravitaillements'], 1)
+        self.assertEqual(calculs.call_count, 3)
+
+    def test_vue_avancee_reutilise_le_rapport_des_missions(self):
+        Course.objects.create(demandeur=self.user, vehicule=self.vehicule, point_embarquement="A", destination="B", motif="Test", statut='terminee', kilometrage_depart=1000, kilometrage_fin=1100)
+        calculs = self._calculs('_calculer_rapport_missions')
+        self.assertEqual(self.client.get(reverse('rapport:missions')).context['total_missions'], 1)
+        self.assertEqual(self.client.get(reverse('rapport:missions_advanced')).context['total_missions'], 1)
+        self.assertEqual(calculs.call_count, 1)
+
+    def test_evaluations_partagees_notes_de_session(self):
+        chauffeur = Utilisateur.objects.create_user(username="chauffeur1", password="testpass1", etablissement=self.dep, role="chauffeur")
+        Course.objects.create(demandeur=self.user, chauffeur=chauffeur, vehicule=self.vehicule, point_embarquement="A", destination="B", motif="Test", statut='terminee', kilometrage_depart=1000, kilometrage_fin=1100, date_depart=timezone.now() - timedelta(hours=2), date_fin=timezone.now())
+        calculs = self._calculs('_calculer_evaluation_chauffeurs')
+        url = reverse('rapport:evaluation_chauffeurs')
+        self.client.post(url, {'save_notes': 1, 'chauffeur_id': str(chauffeur.id), 'notes': "Ponctuel"})
+        evaluations = self.client.get(url).context['evaluations']
+        self.assertEqual(evaluations[0]['notes'], "Ponctuel")
+        self.client.get(reverse('rapport:evaluation_chauffeurs_advanced'))
+        self.assertEqual(calculs.call_count, 1)
+
+        self.client.login(username="admin2", password="testpass2")
+        response = self.client.get(reverse('rapport:depenses_carburant_entretien'))
+        self.assertEqual(response.context['total_general'], 0)
+
+
+class RapportsArrierePlanTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        reglages = override_settings(MEDIA_ROOT=self.media)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.user = Utilisateur.objects.create_user(username="admin1", password="testpass1", etablissement=self.dep, role="admin")
+        Utilisateur.objects.create_user(username="admin2", password="testpass2", etablissement=self.dep, role="admin")
+        vehicule = Vehicule.objects.create(immatriculation="TACHE1", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.dep, numero_chassis="CHASSISTACHE1", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+        Ravitaillement.objects.create(vehicule=vehicule, litres=20, cout_unitaire=2, kilometrage_avant=1000, kilometrage_apres=1200, createur=self.user)
+        self.client.login(username="admin1", password="testpass1")
+
+    def _demander(self, **donnees):
+        donnees = {'type_rapport': 'ravitaillement', 'format_rapport': 'excel', 'date_debut': '2020-01-01', 'date_fin': '2030-12-31', **donnees}
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(reverse('rapport:mes_rapports'), donnees)
+        self.assertRedirects(response, reverse('rapport:mes_rapports'))
+        self.assertEqual(len(callbacks), 1)
+        return Rapport.objects.get(generateur=self.user)
+
+    def test_rapport_produit_et_telecharge(self):
+        rapport = self._demander()
+        self.assertEqual((rapport.statut, rapport.progression), ('en_attente', 0))
+        self.assertEqual(traiter_file_rapports(), (1, 0))
+
+        rapport.refresh_from_db()
+        self.assertEqual((rapport.statut, rapport.progression), ('termine', 100))
+        self.assertTrue(rapport.fichier.name.endswith('.xlsx'))
+        self.assertTrue(EnvoiNotification.objects.filter(destinataire=self.user, titre__startswith="Rapport prêt").exists())
+
+        etat = self.client.get(reverse('rapport:etat_rapport', args=[rapport.pk])).json()
+        self.assertEqual(etat['url'], reverse('rapport:telecharger_rapport', args=[rapport.pk]))
+        response = self.client.get(etat['url'])
+        classeur = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(classeur.worksheets[0].cell(1, 1).value, "Rapport de Consommation de Carburant")
+
+        # Un rapport n'est visible que par son demandeur
+        self.client.login(username="admin2", password="testpass2")
+        self.assertEqual(self.client.get(etat['url']).status_code, 404)
+        self.assertEqual(self.client.get(reverse('rapport:etat_rapport', args=[rapport.pk])).status_code, 404)
+
+    def test_worker_ignore_le_cache(self):
+        rapport = self._demander()
+        # Entrée en cache pour les mêmes paramètres, dont l'invalidation ne serait pas vue par le worker
+        self.client.get(reverse('rapport:carburant'), {'date_debut': '2020-01-01', 'date_fin': '2030-12-31'})
+        with mock.patch.object(views, '_calculer_rapport_carburant', wraps=views._calculer_rapport_carburant) as calculs:
+            self.assertEqual(traiter_file_rapports(), (1, 0))
+        # Calcul refait une fois par le worker, partagé avec la vue d'export
+        self.assertEqual(calculs.call_count, 1)
+        rapport.refresh_from_db()
+        self.assertEqual(rapport.statut, 'termine')
+
+    def test_echec_enregistre(self):
+        rapport = self._demander(type_rapport='entretien', format_rapport='pdf')
+        with mock.patch.object(views, 'rapport_entretiens', side_effect=RuntimeError("moteur PDF indisponible")):
+            self.assertEqual(traiter_file_rapports(), (0, 1))
+        rapport.refresh_from_db()
+        self.assertEqual(rapport.statut, 'echec')
+        self.assertIn("moteur PDF indisponible", rapport.message_erreur)
+        self.assertEqual(self.client.get(reverse('rapport:telecharger_rapport', args=[rapport.pk])).status_code, 404)
+
+    def test_periode_invalide(self):
+        response = self.client.post(reverse('rapport:mes_rapports'), {'type_rapport': 'course', 'format_rapport': 'pdf', 'date_debut': '2024-02-01', 'date_fin': '2024-01-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Rapport.objects.exists())
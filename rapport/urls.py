@@ -1,6 +1,7 @@
 from django.urls import path
 from . import views
 from .views_advanced import rapport_vehicule_advanced
+from . import views_taches
 
 app_name = 'rapport'
 
@@ -19,4 +20,7 @@ urlpatterns = [
     path('generer/<str:type_rapport>/', views.generer_rapport, name='generer_rapport'),
     path('rapport-journalier-flotte/', views.rapport_journalier_flotte, name='rapport_journalier_flotte'),
     path('vehicule/advanced/', rapport_vehicule_advanced, name='vehicule_advanced'),
+    path('mes-rapports/', views_taches.mes_rapports, name='mes_rapports'),
+    path('mes-rapports/<int:pk>/etat/', views_taches.etat_rapport, name='etat_rapport'),
+    path('mes-rapports/<int:pk>/telecharger/', views_taches.telecharger_rapport, name='telecharger_rapport'),
 ]
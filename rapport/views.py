@@ -32,12 +32,68 @@ from core.models import Vehicule, Course, Utilisateur
 from ravitaillement.models import Ravitaillement
 from entretien.models import Entretien
 from core.models import HistoriqueKilometrage
+from .aggregations import collecter_metriques_vehicules
+from .cache import rapport_en_cache
+from core.exports import Colonne, ClasseurExport
+from core.rendu_pdf import reponse_pdf
 
 logger = logging.getLogger(__name__)
 
 def is_admin_or_dispatch_or_superuser(user):
     return user.is_authenticated and (user.role in ['admin', 'dispatch'] or user.is_superuser)
 
+
+def _consommation_ravitaillement(ravitaillement):
+    """Consommation en L/100km, '-' si la distance n'est pas connue"""
+    distance = (ravitaillement.kilometrage_apres or 0) - (ravitaillement.kilometrage_avant or 0)
+    return (ravitaillement.litres * 100) / distance if distance > 0 else '-'
+
+
+# Colonnes des tableaux détaillés des exports Excel (écrits en flux, voir core.exports)
+COLONNES_RAPPORT_MISSIONS = [
+    Colonne('ID', 'id', largeur=15, format='entier'),
+    Colonne('Chauffeur', 'chauffeur.get_full_name', largeur=15),
+    Colonne('Véhicule', 'vehicule.immatriculation', largeur=15),
+    Colonne('Destination', 'destination', largeur=15),
+    Colonne('Date Départ', 'date_depart', largeur=15, format='datetime'),
+    Colonne('Date Fin', 'date_fin', largeur=15, format='datetime'),
+    Colonne('Statut', 'get_statut_display', largeur=15, cle='statut'),
+    Colonne('Distance', 'distance_parcourue', largeur=15, defaut=0),
+    Colonne('Coût', lambda course: course.distance_parcourue * 0.5 if course.distance_parcourue else 0, largeur=15, format='decimal', cle='cout'),
+]
+
+COLONNES_RAPPORT_CARBURANT = [
+    Colonne('Date', 'date_ravitaillement', largeur=17, format='datetime'),
+    Colonne('Véhicule', lambda ravitaillement: str(ravitaillement.vehicule), largeur=25, cle='vehicule'),
+    Colonne('Station', 'nom_station', largeur=20, defaut='-'),
+    Colonne('Litres', 'litres', largeur=10, format='decimal'),
+    Colonne('Prix/Litre', 'cout_unitaire', largeur=10, format='decimal'),
+    Colonne('Coût Total', 'cout_total', largeur=12, format='decimal'),
+    Colonne('Km Avant', 'kilometrage_avant', largeur=12, defaut='-'),
+    Colonne('Km Après', 'kilometrage_apres', largeur=12, defaut='-'),
+    Colonne('Distance', lambda r: max((r.kilometrage_apres or 0) - (r.kilometrage_avant or 0), 0), largeur=12, cle='distance'),
+    Colonne('Consommation (L/100km)', _consommation_ravitaillement, largeur=20, format='decimal', cle='consommation'),
+]
+
+COLONNES_RAPPORT_ENTRETIENS = [
+    Colonne('ID', 'id', largeur=8),
+    Colonne('Date', 'date_creation', largeur=12, format='date', defaut='-'),
+    Colonne('Véhicule', 'vehicule.immatriculation', largeur=15, defaut='-'),
+    Colonne('Département', 'vehicule.etablissement.nom', largeur=20, defaut='-'),
+    Colonne('Type', 'get_type_entretien_display', largeur=15, cle='type_entretien'),
+    Colonne('Garage', lambda e: e.garage or '-', largeur=20, cle='garage'),
+    Colonne('Coût ($)', lambda e: e.cout or 0, largeur=12, format='decimal', cle='cout'),
+    Colonne('Kilométrage', lambda e: e.kilometrage or '-', largeur=12, cle='kilometrage'),
+    Colonne('Statut', 'get_statut_display', largeur=15, cle='statut'),
+    Colonne('Commentaires', lambda e: e.commentaires or '-', largeur=30, cle='commentaires'),
+]
+
+# Paramètres GET lus par le calcul de chaque rapport : ils forment la clé de cache (voir rapport.cache)
+PARAMETRES_RAPPORT_MISSIONS = ('date_debut', 'date_fin', 'statut', 'chauffeur', 'vehicule', 'demandeur')
+PARAMETRES_RAPPORT_CARBURANT = ('date_debut', 'date_fin', 'vehicule', 'station', 'montant_min')
+PARAMETRES_EVALUATION_CHAUFFEURS = ('chauffeur', 'date_debut', 'date_fin')
+PARAMETRES_RAPPORT_DEPENSES = ('date_debut', 'date_fin', 'vehicule')
+
 @login_required
 @user_passes_test(is_admin_or_dispatch_or_superuser)
 def dashboard(request):
@@ -85,8 +141,12 @@ def rapport_vehicules(request):
 
     stats_vehicules = []
     scores_data = []  # Pour calculer les moyennes de scoring
-    
+
+    # Métriques de toute la flotte en un nombre fixe de requêtes groupées
+    metriques = collecter_metriques_vehicules(vehicules, date_debut, date_fin)
+
     for v in vehicules:
+        m = metriques[v.pk]
         # 1. Distance totale depuis la mise en service
         distance_totale = v.kilometrage_actuel if v.kilometrage_actuel is not None else 0
         # 2. Distance depuis le dernier entretien
@@ -97,13 +157,11 @@ def rapport_vehicules(request):
         else:
             distance_apres_entretien = None
         # 3. Distance parcourue (somme des courses terminées)
-        from core.models import Course
-        courses_terminees = Course.objects.filter(vehicule=v, statut='terminee')
-        distance_parcourue_courses = courses_terminees.aggregate(total=Sum('distance_parcourue'))['total'] or 0
+        distance_parcourue_courses = m['distance_parcourue_courses']
         # 4. Distance estimée (kilométrage)
-        plus_ancien_depart = courses_terminees.order_by('kilometrage_depart').first()
-        if v.kilometrage_actuel is not None and plus_ancien_depart and plus_ancien_depart.kilometrage_depart is not None:
-            distance_estimee_km = v.kilometrage_actuel - plus_ancien_depart.kilometrage_depart
+        plus_ancien_kilometrage_depart = m['plus_ancien_kilometrage_depart']
+        if v.kilometrage_actuel is not None and plus_ancien_kilometrage_depart is not None:
+            distance_estimee_km = v.kilometrage_actuel - plus_ancien_kilometrage_depart
             if distance_estimee_km < 0:
                 distance_estimee_km = 0
         else:
@@ -116,22 +174,12 @@ def rapport_vehicules(request):
             if ecart > seuil:
                 alerte_incoherence = True
 
-        entretiens = Entretien.objects.filter(vehicule=v)
-        if date_debut:
-            entretiens = entretiens.filter(date_creation__date__gte=date_debut)
-        if date_fin:
-            entretiens = entretiens.filter(date_creation__date__lte=date_fin)
-        nb_entretiens = entretiens.count()
-        types_entretiens = ', '.join(sorted(set(e.get_type_entretien_display() for e in entretiens)))
-        cout_entretiens = entretiens.aggregate(Sum('cout'))['cout__sum'] or 0
+        nb_entretiens = m['nb_entretiens']
+        types_entretiens = m['types_entretiens']
+        cout_entretiens = m['cout_entretiens']
 
-        ravs = Ravitaillement.objects.filter(vehicule=v)
-        if date_debut:
-            ravs = ravs.filter(date_ravitaillement__date__gte=date_debut)
-        if date_fin:
-            ravs = ravs.filter(date_ravitaillement__date__lte=date_fin)
-        total_litres = ravs.aggregate(Sum('litres'))['litres__sum'] or 0
-        total_cout_carburant = ravs.aggregate(Sum('cout_total'))['cout_total__sum'] or 0
+        total_litres = m['total_litres']
+        total_cout_carburant = m['total_cout_carburant']
 
         budget_total = cout_entretiens + total_cout_carburant
         
@@ -261,8 +309,8 @@ def rapport_vehicules(request):
             'age_vehicule': age_vehicule,
             'conso_moyenne': conso_moyenne,
             'cout_km': cout_km,
-            'nb_courses': courses_terminees.count(),
-            'derniere_course': courses_terminees.order_by('-date_fin').first()
+            'nb_courses': m['nb_courses'],
+            'derniere_course': m['derniere_course']
         })
         
         scores_data.append(score_total)
@@ -311,16 +359,14 @@ def rapport_vehicules(request):
         return generate_excel_rapport_vehicules(request, stats_vehicules, date_debut, date_fin, context)
     
     return render(request, 'rapport/rapport_vehicules.html', context)
-    
-@user_passes_test(is_admin_or_dispatch_or_superuser)
-def rapport_missions(request):
-    """Rapport détaillé sur les missions avec système de scoring avancé."""
+
+def _calculer_rapport_missions(request):
+    """Missions notées et statistiques du rapport des missions (mises en cache, voir rapport.cache)"""
     date_debut = request.GET.get('date_debut')
     date_fin = request.GET.get('date_fin')
     chauffeur_id = request.GET.get('chauffeur')
     vehicule_id = request.GET.get('vehicule')
     demandeur_id = request.GET.get('demandeur')
-    export_format = request.GET.get('export')
 
     courses = Course.objects.all()
     
@@ -658,6 +704,41 @@ def rapport_missions(request):
             'missions_terminees': chauffeur['missions_terminees']
         })
 
+    return {
+        'courses': missions_scored,
+        'total_missions': total_missions,
+        'total_distance': total_distance,
+        'total_duree': total_duree,
+        'total_cout': total_cout,
+        'score_moyen': round(score_moyen, 1),
+        'stats_par_statut': stats_par_statut,
+        'moyennes': moyennes,
+        'top_destinations': top_destinations,
+        'stats_vehicules': stats_vehicules,
+        'stats_chauffeurs': stats_chauffeurs,
+    }
+
+@login_required
+@user_passes_test(is_admin_or_dispatch_or_superuser)
+def rapport_missions(request):
+    """Rapport détaillé sur les missions avec système de scoring avancé."""
+    date_debut = request.GET.get('date_debut')
+    date_fin = request.GET.get('date_fin')
+    chauffeur_id = request.GET.get('chauffeur')
+    vehicule_id = request.GET.get('vehicule')
+    demandeur_id = request.GET.get('demandeur')
+    statut_filter = request.GET.get('statut')
+    export_format = request.GET.get('export')
+
+    # Calcul partagé par l'affichage et les exports
+    donnees = rapport_en_cache('missions', request, lambda: _calculer_rapport_missions(request), PARAMETRES_RAPPORT_MISSIONS)
+    missions_scored = donnees['courses']
+    stats_par_statut = donnees['stats_par_statut']
+    moyennes = donnees['moyennes']
+    top_destinations = donnees['top_destinations']
+    stats_vehicules = donnees['stats_vehicules']
+    stats_chauffeurs = donnees['stats_chauffeurs']
+
     if export_format:
         if export_format == 'pdf':
             return generate_pdf_rapport_missions(missions_scored, stats_par_statut, moyennes, top_destinations, stats_vehicules, stats_chauffeurs)
@@ -692,11 +773,11 @@ def rapport_missions(request):
         'selected_chauffeur': chauffeur_id,
         'selected_vehicule': vehicule_id,
         'selected_demandeur': demandeur_id,
-        'total_missions': total_missions,
-        'total_distance': total_distance,
-        'total_duree': total_duree,
-        'total_cout': total_cout,
-        'score_moyen': round(score_moyen, 1),
+        'total_missions': donnees['total_missions'],
+        'total_distance': donnees['total_distance'],
+        'total_duree': donnees['total_duree'],
+        'total_cout': donnees['total_cout'],
+        'score_moyen': donnees['score_moyen'],
         'stats_par_statut': stats_par_statut,
         'moyennes': moyennes,
         'top_destinations': top_destinations,
@@ -738,11 +819,10 @@ def generate_pdf_rapport_missions(courses, stats_par_statut, moyennes, top_desti
 
 def generate_excel_rapport_missions(courses, stats_par_statut, moyennes, top_destinations, stats_vehicules, stats_chauffeurs):
     """Génère un rapport Excel des missions."""
-    buffer = BytesIO()
-    workbook = xlsxwriter.Workbook(buffer)
+    export = ClasseurExport()
     
     # Formats
-    header_format = workbook.add_format({
+    header_format = export.add_format({
         'bold': True,
         'text_wrap': True,
         'valign': 'top',
@@ -751,31 +831,11 @@ def generate_excel_rapport_missions(courses, stats_par_statut, moyennes, top_des
     })
     
     # Feuille 1: Missions
-    worksheet = workbook.add_worksheet('Missions')
-    
-    # En-têtes
-    headers = ['ID', 'Chauffeur', 'Véhicule', 'Destination', 'Date Départ', 'Date Fin', 'Statut', 'Distance', 'Coût']
-    for col, header in enumerate(headers):
-        worksheet.write(0, col, header, header_format)
-    
-    # Données
-    for row, course in enumerate(courses, 1):
-        worksheet.write(row, 0, course.id)
-        worksheet.write(row, 1, f"{course.chauffeur.first_name} {course.chauffeur.last_name}")
-        worksheet.write(row, 2, course.vehicule.immatriculation)
-        worksheet.write(row, 3, course.destination)
-        worksheet.write(row, 4, course.date_depart.strftime('%d/%m/%Y %H:%M') if course.date_depart else '')
-        worksheet.write(row, 5, course.date_fin.strftime('%d/%m/%Y %H:%M') if course.date_fin else '')
-        worksheet.write(row, 6, course.get_statut_display())
-        worksheet.write(row, 7, course.distance_parcourue or 0)
-        worksheet.write(row, 8, course.distance_parcourue * 0.5 if course.distance_parcourue else 0)
-    
-    # Ajuster la largeur des colonnes
-    for col in range(len(headers)):
-        worksheet.set_column(col, col, 15)
+    worksheet = export.ajouter_feuille('Missions')
+    export.ecrire_lignes(worksheet, courses, COLONNES_RAPPORT_MISSIONS, style_en_tete=header_format)
     
     # Feuille 2: Statistiques
-    stats_worksheet = workbook.add_worksheet('Statistiques')
+    stats_worksheet = export.ajouter_feuille('Statistiques')
     
     # Statistiques par statut
     stats_worksheet.write(0, 0, 'Statistiques par Statut', header_format)
@@ -806,12 +866,7 @@ def generate_excel_rapport_missions(courses, stats_par_statut, moyennes, top_des
             stats_worksheet.write(row + 3 + i, 2, dest['total_distance'])
             stats_worksheet.write(row + 3 + i, 3, dest['total_cout'])
     
-    workbook.close()
-    buffer.seek(0)
-    
-    response = FileResponse(buffer, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="rapport_missions.xlsx"'
-    return response
+    return export.reponse('rapport_missions.xlsx')
 
 @login_required
 @user_passes_test(is_admin_or_dispatch_or_superuser)
@@ -869,10 +924,8 @@ def rapport_entretiens(request):
     }
     return render(request, 'rapport/rapport_entretiens.html', context)
 
-@login_required
-@user_passes_test(is_admin_or_dispatch_or_superuser)
-def rapport_carburant(request):
-    """Rapport sur les ravitaillements en carburant."""
+def _calculer_rapport_carburant(request):
+    """Ravitaillements et statistiques du rapport carburant (mises en cache, voir rapport.cache)"""
     # Récupération des paramètres de filtre
     date_debut = request.GET.get('date_debut')
     date_fin = request.GET.get('date_fin')
@@ -958,9 +1011,6 @@ def rapport_carburant(request):
     if total_distance_stats > 0 and total_litres_stats > 0:
         global_average_consumption_per_100km = (total_litres_stats * 100) / total_distance_stats
     
-    # Récupération de la liste des véhicules pour le filtre
-    vehicules = Vehicule.objects.filter(etablissement=request.user.etablissement) if not request.user.is_superuser else Vehicule.objects.all()
-    
     # Statistiques par station de ravitaillement
     stats_station = ravitaillements.values('nom_station').annotate(
         count=Count('id'),
@@ -968,32 +1018,46 @@ def rapport_carburant(request):
         total_cout=Sum('cout_total')
     ).order_by('-total_litres')
     
-    context = {
-        'ravitaillements': ravitaillements.order_by('-date_ravitaillement'),
+    return {
+        'ravitaillements': list(ravitaillements.order_by('-date_ravitaillement')),
         'total_ravitaillements': total_ravitaillements,
         'total_litres': total_litres,
         'total_cout': total_cout,
         'stats_vehicules': stats_vehicules,
-        'stats_station': stats_station,
-        'vehicules': vehicules,
-        'date_debut': date_debut,
-        'date_fin': date_fin,
-        'selected_vehicule': vehicule_id,
-        'selected_station': station,
-        'selected_montant_min': montant_min,
+        'stats_station': list(stats_station),
         'total_litres_stats': total_litres_stats,
         'total_cout_stats': total_cout_stats,
         'total_distance_stats': total_distance_stats,
         'cout_moyen_par_litre_global': cout_moyen_par_litre_global,
         'global_average_consumption_per_100km': global_average_consumption_per_100km,
     }
+
+@login_required
+@user_passes_test(is_admin_or_dispatch_or_superuser)
+def rapport_carburant(request):
+    """Rapport sur les ravitaillements en carburant."""
+    # Calcul partagé par l'affichage et les exports
+    donnees = rapport_en_cache('carburant', request, lambda: _calculer_rapport_carburant(request), PARAMETRES_RAPPORT_CARBURANT)
+    
+    # Récupération de la liste des véhicules pour le filtre
+    vehicules = Vehicule.objects.filter(etablissement=request.user.etablissement) if not request.user.is_superuser else Vehicule.objects.all()
+    
+    context = {
+        **donnees,
+        'vehicules': vehicules,
+        'date_debut': request.GET.get('date_debut'),
+        'date_fin': request.GET.get('date_fin'),
+        'selected_vehicule': request.GET.get('vehicule'),
+        'selected_station': request.GET.get('station'),
+        'selected_montant_min': request.GET.get('montant_min'),
+    }
     
     # Gestion de l'export
     export_format = request.GET.get('export')
     if export_format == 'pdf':
-        return generate_pdf_rapport_carburant(ravitaillements, context)
+        return generate_pdf_rapport_carburant(donnees['ravitaillements'], context)
     elif export_format == 'excel':
-        return generate_excel_rapport_carburant(ravitaillements, context)
+        return generate_excel_rapport_carburant(donnees['ravitaillements'], context)
     
     return render(request, 'rapport/rapport_carburant.html', context)
 
@@ -1123,29 +1187,27 @@ def generate_pdf_rapport_carburant(ravitaillements, context):
 
 def generate_excel_rapport_carburant(ravitaillements, context):
     """Génère un fichier Excel du rapport de carburant."""
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=rapport_carburant.xlsx'
-    
-    # Création du classeur Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Rapport Carburant"
+    export = ClasseurExport()
+    ws = export.ajouter_feuille("Rapport Carburant")
+    nombre_colonnes = len(COLONNES_RAPPORT_CARBURANT)
     
     # Styles
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-    
-    # En-tête du rapport
-    ws.append(["Rapport de Consommation de Carburant"])
-    ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=10)
-    ws['A1'].font = Font(size=16, bold=True)
-    ws['A1'].alignment = Alignment(horizontal='center')
+    header_format = export.add_format({
+        'bold': True, 'font_color': 'white', 'fg_color': '#4F81BD',
+        'align': 'center', 'valign': 'vcenter', 'text_wrap': True
+    })
+    titre_format = export.add_format({'bold': True, 'font_size': 16, 'align': 'center'})
+    section_format = export.add_format({'bold': True})
+    
+    # En-tête du rapport (écrit ligne après ligne : le classeur est en mode constant_memory)
+    ligne = 0
+    export.ecrire_titre(ws, ligne, "Rapport de Consommation de Carburant", nombre_colonnes, titre_format)
+    ligne += 1
     
     # Période du rapport
     if context.get('date_debut') or context.get('date_fin'):
-        ws.append([f"Période: {context.get('date_debut', 'Début')} au {context.get('date_fin', 'Fin')}"])
-        ws.merge_cells(start_row=2, start_column=1, end_row=2, end_column=10)
+        export.ecrire_titre(ws, ligne, f"Période: {context.get('date_debut') or 'Début'} au {context.get('date_fin') or 'Fin'}", nombre_colonnes, section_format)
+        ligne += 1
     
     # Filtres appliqués
     filters = []
@@ -1158,13 +1220,13 @@ def generate_excel_rapport_carburant(ravitaillements, context):
         filters.append(f"Montant minimum: {context['selected_montant_min']} $")
     
     if filters:
-        ws.append(["Filtres appliqués: " + ", ".join(filters)])
-        ws.merge_cells(start_row=3, start_column=1, end_row=3, end_column=10)
+        export.ecrire_titre(ws, ligne, "Filtres appliqués: " + ", ".join(filters), nombre_colonnes, section_format)
+        ligne += 1
     
     # Statistiques globales
-    ws.append([""])
-    ws.append(["Statistiques Globales"])
-    ws.merge_cells(start_row=5, start_column=1, end_row=5, end_column=2)
+    ligne += 1
+    ws.write(ligne, 0, "Statistiques Globales", section_format)
+    ligne += 1
     
     stats_data = [
         ["Total des ravitaillements", context['total_ravitaillements']],
@@ -1173,92 +1235,32 @@ def generate_excel_rapport_carburant(ravitaillements, context):
         ["Consommation moyenne", f"{context.get('global_average_consumption_per_100km', 0):.2f} L/100km"],
     ]
     
-    for row in stats_data:
-        ws.append(row)
+    for libelle, valeur in stats_data:
+        ws.write(ligne, 0, libelle)
+        ws.write(ligne, 1, valeur)
+        ligne += 1
     
     # Détail des ravitaillements
-    ws.append([""])
-    ws.append(["Détail des Ravitaillements"])
-    ws.merge_cells(start_row=len(stats_data) + 7, start_column=1, end_row=len(stats_data) + 7, end_column=10)
-    
-    # En-têtes du tableau de détail
-    headers = [
-        'Date', 'Véhicule', 'Station', 'Litres', 'Prix/Litre', 'Coût Total',
-        'Km Avant', 'Km Après', 'Distance', 'Consommation (L/100km)'
-    ]
-    
-    ws.append(headers)
-    
-    # Style des en-têtes
-    for cell in ws[ws.max_row]:
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-    
-    # Données du tableau de détail
-    for ravitaillement in ravitaillements:
-        consommation = (ravitaillement.litres * 100) / (ravitaillement.kilometrage_apres - ravitaillement.kilometrage_avant) if ravitaillement.kilometrage_apres > ravitaillement.kilometrage_avant else 0
-        
-        ws.append([
-            ravitaillement.date_ravitaillement.strftime('%Y-%m-%d %H:%M'),
-            str(ravitaillement.vehicule),
-            ravitaillement.nom_station or '-',
-            ravitaillement.litres,
-            ravitaillement.cout_unitaire,
-            ravitaillement.cout_total,
-            ravitaillement.kilometrage_avant or '-',
-            ravitaillement.kilometrage_apres or '-',
-            ravitaillement.kilometrage_apres - ravitaillement.kilometrage_avant if ravitaillement.kilometrage_apres and ravitaillement.kilometrage_apres > ravitaillement.kilometrage_avant else 0,
-            consommation if consommation > 0 else '-',
-        ])
-    
-    # Ajustement de la largeur des colonnes
-    for column in ws.columns:
-        max_length = 0
-        # Trouver la première cellule non fusionnée
-        column_letter = None
-        for cell in column:
-            if hasattr(cell, 'column_letter'):
-                column_letter = cell.column_letter
-                break
-        if column_letter:
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column_letter].width = min(adjusted_width, 30)
-    
-    # Format des nombres
-    for row in ws.iter_rows(min_row=ws.max_row - ravitaillements.count() + 1, max_row=ws.max_row, min_col=4, max_col=6):
-        for cell in row:
-            cell.number_format = '0.00'
-    
-    for row in ws.iter_rows(min_row=ws.max_row - ravitaillements.count() + 1, max_row=ws.max_row, min_col=9, max_col=10):
-        for cell in row:
-            if isinstance(cell.value, (int, float)):
-                cell.number_format = '0.00'
+    ligne += 1
+    export.ecrire_titre(ws, ligne, "Détail des Ravitaillements", nombre_colonnes, section_format)
+    ligne += 1
+    export.ecrire_lignes(
+        ws, ravitaillements, COLONNES_RAPPORT_CARBURANT, ligne,
+        style_en_tete=header_format
+    )
     
-    # Sauvegarde du classeur
-    wb.save(response)
-    return response
+    return export.reponse('rapport_carburant.xlsx')
 
-@login_required
-@user_passes_test(is_admin_or_dispatch_or_superuser)
-def rapport_evaluation_chauffeurs(request):
-    """Rapport d'évaluation des chauffeurs avec système de scoring avancé."""
-    # Récupération des paramètres de filtre
+def _calculer_evaluation_chauffeurs(request):
+    """
+    Évaluations et moyennes du rapport d'évaluation des chauffeurs (mises en
+    cache, voir rapport.cache). Les notes, propres à la session, sont ajoutées
+    par les vues avec `_ajouter_notes`.
+    """
     chauffeur_id = request.GET.get('chauffeur')
     date_debut = request.GET.get('date_debut')
     date_fin = request.GET.get('date_fin')
     
-    # Récupération de la liste des chauffeurs pour le menu déroulant
-    chauffeurs = Utilisateur.objects.filter(role='chauffeur')
-    if not request.user.is_superuser:
-        chauffeurs = chauffeurs.filter(etablissement=request.user.etablissement)
-    
     # Requête de base pour les courses terminées uniquement, et distance raisonnable
     courses = Course.objects.filter(statut='terminee', distance_parcourue__lte=1000)
     
@@ -1334,9 +1336,6 @@ def rapport_evaluation_chauffeurs(request):
             f"{d['destination']} ({d['count']}x)" for d in destinations
         ]
     
-    # Récupération des notes existantes depuis la session
-    notes_chauffeurs = request.session.get('notes_chauffeurs', {})
-    
     # Calcul des statistiques supplémentaires et du scoring pour chaque chauffeur
     evaluations = []
     scores_data = []  # Pour calculer les moyennes de scoring
@@ -1468,7 +1467,6 @@ def rapport_evaluation_chauffeurs(request):
             'cout_km': cout_km,
             'conso_moyenne': conso_moyenne,
             'top_destinations': destinations_par_chauffeur.get(chauffeur_id, []),
-            'notes': notes_chauffeurs.get(str(chauffeur_id), ''),
             'date_mission': date_mission,
             # Nouvelles métriques de scoring
             'score_total': round(score_total, 1),
@@ -1519,20 +1517,24 @@ def rapport_evaluation_chauffeurs(request):
         'score_moyen': round(score_moyen, 1)
     }
     
-    # Pagination
-    paginator = Paginator(evaluations, 12)  # 12 évaluations par page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    context = {
-        'evaluations': page_obj,
-        'chauffeurs': chauffeurs,
-        'selected_chauffeur': int(chauffeur_id) if chauffeur_id else None,
-        'date_debut': date_debut,
-        'date_fin': date_fin,
+    return {
+        'evaluations': evaluations,
         'moyennes': moyennes,
-        'request': request
     }
+
+def _ajouter_notes(evaluations, notes_chauffeurs):
+    for evaluation in evaluations:
+        evaluation['notes'] = notes_chauffeurs.get(str(evaluation['chauffeur']['id']), '')
+    return evaluations
+
+@login_required
+@user_passes_test(is_admin_or_dispatch_or_superuser)
+def rapport_evaluation_chauffeurs(request):
+    """Rapport d'évaluation des chauffeurs avec système de scoring avancé."""
+    # Récupération des paramètres de filtre
+    chauffeur_id = request.GET.get('chauffeur')
+    date_debut = request.GET.get('date_debut')
+    date_fin = request.GET.get('date_fin')
     
     # Gestion de la sauvegarde des notes
     if request.method == 'POST' and 'save_notes' in request.POST:
@@ -1550,6 +1552,31 @@ def rapport_evaluation_chauffeurs(request):
             messages.success(request, 'Notes enregistrées avec succès.')
             return redirect(request.path + '?' + request.GET.urlencode())
     
+    # Récupération de la liste des chauffeurs pour le menu déroulant
+    chauffeurs = Utilisateur.objects.filter(role='chauffeur')
+    if not request.user.is_superuser:
+        chauffeurs = chauffeurs.filter(etablissement=request.user.etablissement)
+    
+    # Calcul partagé par l'affichage, les exports et la vue avancée
+    donnees = rapport_en_cache('evaluation_chauffeurs', request, lambda: _calculer_evaluation_chauffeurs(request), PARAMETRES_EVALUATION_CHAUFFEURS)
+    evaluations = _ajouter_notes(donnees['evaluations'], request.session.get('notes_chauffeurs', {}))
+    moyennes = donnees['moyennes']
+    
+    # Pagination
+    paginator = Paginator(evaluations, 12)  # 12 évaluations par page
+    page_number = request.GET.get('page')
+    page_obj = paginator.get_page(page_number)
+    
+    context = {
+        'evaluations': page_obj,
+        'chauffeurs': chauffeurs,
+        'selected_chauffeur': int(chauffeur_id) if chauffeur_id else None,
+        'date_debut': date_debut,
+        'date_fin': date_fin,
+        'moyennes': moyennes,
+        'request': request
+    }
+    
     # Gestion de l'export
     export_format = request.GET.get('export')
     if export_format == 'pdf':
@@ -1799,10 +1826,8 @@ def rapport_demandeurs(request):
     }
     return render(request, 'rapport/rapport_demandeurs.html', context)
 
-@login_required
-@user_passes_test(is_admin_or_dispatch_or_superuser)
-def rapport_depenses_carburant_entretien(request):
-    """Rapport combiné sur les dépenses carburant et entretien."""
+def _calculer_rapport_depenses(request):
+    """Totaux et dépenses par véhicule du rapport des dépenses (mis en cache, voir rapport.cache)"""
     from decimal import ROUND_HALF_UP
     
     date_debut = request.GET.get('date_debut')
@@ -1869,16 +1894,28 @@ def rapport_depenses_carburant_entretien(request):
     # Tri par coût total décroissant
     stats_vehicules.sort(key=lambda x: x['cout_total'], reverse=True)
     
-    # Préparation du contexte
-    context = {
+    return {
         'total_carburant': total_carburant,
         'total_entretien': total_entretien,
         'total_general': total_general,  # Ajout du total général manquant
         'depenses_par_vehicule': stats_vehicules,  # Pour correspondre au template
+    }
+
+@login_required
+@user_passes_test(is_admin_or_dispatch_or_superuser)
+def rapport_depenses_carburant_entretien(request):
+    """Rapport combiné sur les dépenses carburant et entretien."""
+    # Calcul partagé par l'affichage et les exports
+    donnees = rapport_en_cache('depenses_carburant_entretien', request, lambda: _calculer_rapport_depenses(request), PARAMETRES_RAPPORT_DEPENSES)
+    vehicules = Vehicule.objects.filter(etablissement=request.user.etablissement) if not request.user.is_superuser else Vehicule.objects.all()
+    
+    # Préparation du contexte
+    context = {
+        **donnees,
         'vehicules': vehicules,
-        'date_debut': date_debut,
-        'date_fin': date_fin,
-        'selected_vehicule': vehicule_id,
+        'date_debut': request.GET.get('date_debut'),
+        'date_fin': request.GET.get('date_fin'),
+        'selected_vehicule': request.GET.get('vehicule'),
     }
     
     # Gestion de l'export
@@ -1962,15 +1999,11 @@ def generate_pdf_rapport_entretiens(request, entretiens, date_debut=None, date_f
 @user_passes_test(is_admin_or_dispatch_or_superuser)
 def generate_excel_rapport_entretiens(request, entretiens, date_debut=None, date_fin=None):
     """Génère un rapport Excel des entretiens."""
-    # Créer un objet BytesIO pour le fichier Excel
-    output = BytesIO()
-    
-    # Créer un classeur Excel et ajouter une feuille de calcul
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-    worksheet = workbook.add_worksheet('Rapport Entretiens')
+    export = ClasseurExport()
+    worksheet = export.ajouter_feuille('Rapport Entretiens')
     
     # Définir les formats
-    header_format = workbook.add_format({
+    header_format = export.add_format({
         'bold': True,
         'text_wrap': True,
         'valign': 'top',
@@ -1979,55 +2012,13 @@ def generate_excel_rapport_entretiens(request, entretiens, date_debut=None, date
         'border': 1
     })
     
-    # Écrire les en-têtes de colonnes
-    headers = [
-        'ID', 'Date', 'Véhicule', 'Département', 'Type', 'Garage',
-        'Coût ($)', 'Kilométrage', 'Statut', 'Commentaires'
-    ]
-    
-    for col_num, header in enumerate(headers):
-        worksheet.write(0, col_num, header, header_format)
-    
-    # Écrire les données
-    for row_num, entretien in enumerate(entretiens, 1):
-        worksheet.write(row_num, 0, entretien.id)
-        worksheet.write(row_num, 1, entretien.date_creation.strftime('%d/%m/%Y') if entretien.date_creation else '-')
-        worksheet.write(row_num, 2, entretien.vehicule.immatriculation if entretien.vehicule else '-')
-        worksheet.write(row_num, 3, entretien.vehicule.etablissement.nom if entretien.vehicule and entretien.vehicule.etablissement else '-')
-        worksheet.write(row_num, 4, entretien.get_type_entretien_display())
-        worksheet.write(row_num, 5, entretien.garage or '-')
-        worksheet.write(row_num, 6, entretien.cout or 0)
-        worksheet.write(row_num, 7, entretien.kilometrage or '-')
-        worksheet.write(row_num, 8, entretien.get_statut_display())
-        worksheet.write(row_num, 9, entretien.commentaires or '-')
-    
-    # Ajuster la largeur des colonnes
-    worksheet.set_column('A:A', 8)  # ID
-    worksheet.set_column('B:B', 12)  # Date
-    worksheet.set_column('C:C', 15)  # Véhicule
-    worksheet.set_column('D:D', 20)  # Département
-    worksheet.set_column('E:E', 15)  # Type
-    worksheet.set_column('F:F', 20)  # Garagiste
-    worksheet.set_column('G:G', 12)  # Coût
-    worksheet.set_column('H:H', 12)  # Kilométrage
-    worksheet.set_column('I:I', 15)  # Statut
-    worksheet.set_column('J:J', 30)  # Commentaires
-    
-    # Ajouter un filtre
-    worksheet.autofilter(0, 0, len(entretiens), len(headers) - 1)
-    
-    # Fermer le classeur
-    workbook.close()
-    
-    # Préparer la réponse
-    output.seek(0)
-    response = HttpResponse(
-        output,
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    # En-têtes, données et filtre automatique, en une seule passe
+    export.ecrire_lignes(
+        worksheet, entretiens.select_related('vehicule__etablissement'), COLONNES_RAPPORT_ENTRETIENS,
+        autofiltre=True, style_en_tete=header_format
     )
-    response['Content-Disposition'] = 'attachment; filename=rapport_entretiens.xlsx'
     
-    return response
+    return export.reponse('rapport_entretiens.xlsx')
 
 def generate_pdf_rapport_depenses(request, context):
     """Génère un fichier PDF pour le rapport des dépenses en utilisant pdfkit."""
@@ -2436,8 +2427,14 @@ def generer_rapport(request, type_rapport):
 
 @login_required
 def rapport_journalier_flotte(request):
+    from suivi.models import FaitJournalierVehicule
     today = timezone.localdate()
     vehicules = Vehicule.objects.all()
+    # Lecture des agrégats journaliers pré-calculés (une seule requête pour toute la flotte)
+    faits = {
+        f.vehicule_id: f
+        for f in FaitJournalierVehicule.objects.filter(date=today).select_related('chauffeur')
+    }
     data = []
     total_distance = 0
     total_missions = 0
@@ -2447,17 +2444,15 @@ def rapport_journalier_flotte(request):
     vehicules_labels = []
     vehicules_distances = []
     for v in vehicules:
-        courses = Course.objects.filter(vehicule=v, date_souhaitee__date=today)
-        distance = sum([(c.kilometrage_fin or 0) - (c.kilometrage_depart or 0) for c in courses if c.kilometrage_depart and c.kilometrage_fin])
-        missions = courses.count()
-        ravs = Ravitaillement.objects.filter(vehicule=v, date_ravitaillement__date=today)
-        total_litres_v = sum([r.quantite for r in ravs])
-        total_depense_v = sum([r.montant for r in ravs])
-        entretiens = Entretien.objects.filter(vehicule=v, date_entretien__date=today)
-        total_maintenance_v = sum([e.cout for e in entretiens if hasattr(e, 'cout') and e.cout])
+        fait = faits.get(v.pk)
+        distance = fait.distance if fait else 0
+        missions = fait.nombre_missions if fait else 0
+        total_litres_v = fait.litres if fait else 0
+        total_depense_v = fait.cout_carburant if fait else 0
+        total_maintenance_v = fait.cout_maintenance if fait else 0
         data.append({
             'vehicule': v,
-            'chauffeur': courses.first().chauffeur if courses.exists() else None,
+            'chauffeur': fait.chauffeur if fait else None,
             'distance': distance,
             'missions': missions,
             'litres': total_litres_v,
@@ -2736,14 +2731,18 @@ def export_rapport_vehicule_advanced_pdf(request, context):
         'user_export': request.user.get_full_name() or request.user.username,
     }
     
-    html_string = render_to_string('rapport/rapport_vehicule_advanced_pdf.html', export_context)
-    html = HTML(string=html_string, base_url=request.build_absolute_uri('/'))
-    response = HttpResponse(content_type='application/pdf')
+    template_name = 'rapport/rapport_vehicule_advanced_pdf.html'
+    html_string = render_to_string(template_name, export_context)
     vehicule = context.get("selected_vehicule")
     immatriculation = vehicule.immatriculation if vehicule else "vehicule"
-    response['Content-Disposition'] = f'attachment; filename="rapport_vehicule_avance_{immatriculation}.pdf"'
-    html.write_pdf(response)
-    return response
+    return reponse_pdf(
+        html_string,
+        f"rapport_vehicule_avance_{immatriculation}.pdf",
+        template_name=template_name,
+        moteur='weasyprint',
+        base_url=request.build_absolute_uri('/'),
+        contexte=export_context,
+    )
 
 def export_rapport_vehicule_advanced_excel(request, context):
     import xlsxwriter
@@ -3040,6 +3039,8 @@ def generate_chauffeur_charts_data(evaluations):
         'moyennes_criteres': moyennes_criteres
     }
 
+@login_required
+@user_passes_test(is_admin_or_dispatch_or_superuser)
 def rapport_evaluation_chauffeurs_advanced(request):
     """Vue avancée du rapport d'évaluation des chauffeurs avec graphiques."""
     # Récupération des paramètres de filtre
@@ -3052,279 +3053,24 @@ def rapport_evaluation_chauffeurs_advanced(request):
     if not request.user.is_superuser:
         chauffeurs = chauffeurs.filter(etablissement=request.user.etablissement)
     
-    # Requête de base pour les courses terminées uniquement, et distance raisonnable
-    courses = Course.objects.filter(statut='terminee', distance_parcourue__lte=1000)
+    # Même calcul (et même entrée de cache) que le rapport d'évaluation
+    donnees = rapport_en_cache('evaluation_chauffeurs', request, lambda: _calculer_evaluation_chauffeurs(request), PARAMETRES_EVALUATION_CHAUFFEURS)
+    evaluations = _ajouter_notes(donnees['evaluations'], request.session.get('notes_chauffeurs', {}))
+    moyennes = donnees['moyennes']
     
-    # Filtrage par chauffeur
-    if chauffeur_id:
-        courses = courses.filter(chauffeur_id=chauffeur_id)
+    # Génération des données pour les graphiques
+    charts_data = generate_chauffeur_charts_data(evaluations)
     
-    # Filtrage par date
-    if date_debut:
-        courses = courses.filter(date_depart__date__gte=date_debut)
-    if date_fin:
-        courses = courses.filter(date_fin__date__lte=date_fin)
-    
-    # Calcul des statistiques des chauffeurs avec les véhicules associés
-    stats_chauffeurs = courses.values(
-        'chauffeur__id',
-        'chauffeur__first_name', 
-        'chauffeur__last_name',
-        'chauffeur__date_joined',
-        'vehicule__immatriculation',
-        'vehicule__marque',
-        'vehicule__modele'
-    ).annotate(
-        missions_terminees=Count('id'),
-        distance_totale=Coalesce(Sum('distance_parcourue'), 0),
-        duree_moyenne=Avg(ExpressionWrapper(
-            F('date_fin') - F('date_depart'),
-            output_field=DurationField()
-        ))
-    ).order_by('-missions_terminees')
-    
-    # Récupération des dépenses de carburant et d'entretien
-    for chauffeur in stats_chauffeurs:
-        vehicule_id = chauffeur.get('vehicule__id')
-        if vehicule_id:
-            # Dépenses de carburant et consommation
-            ravitaillements = Ravitaillement.objects.filter(
-                vehicule_id=vehicule_id,
-                date_ravitaillement__date__range=[date_debut, date_fin] if date_debut and date_fin else None
-            ).aggregate(
-                total_carburant=Coalesce(Sum('cout_total'), 0),
-                total_litres=Coalesce(Sum('litres'), 0)
-            )
-            chauffeur['depenses_carburant'] = ravitaillements['total_carburant']
-            chauffeur['litres_consommes'] = ravitaillements['total_litres']
-            
-            # Dépenses d'entretien
-            depenses_entretien = Entretien.objects.filter(
-                vehicule_id=vehicule_id,
-                date__date__range=[date_debut, date_fin] if date_debut and date_fin else None
-            ).aggregate(
-                total_entretien=Coalesce(Sum('cout'), 0)
-            )
-            chauffeur['depenses_entretien'] = depenses_entretien['total_entretien']
-            
-            # Coût total
-            chauffeur['cout_total'] = chauffeur['depenses_carburant'] + chauffeur['depenses_entretien']
-        else:
-            chauffeur['depenses_carburant'] = 0
-            chauffeur['depenses_entretien'] = 0
-            chauffeur['cout_total'] = 0
-    
-    # Récupération des destinations fréquentes par chauffeur
-    destinations_par_chauffeur = {}
-    for chauffeur in stats_chauffeurs:
-        destinations = (
-            courses.filter(chauffeur_id=chauffeur['chauffeur__id'])
-                  .values('destination')
-                  .annotate(count=Count('id'))
-                  .order_by('-count')[:3]  # Top 3 destinations
-        )
-        destinations_par_chauffeur[chauffeur['chauffeur__id']] = [
-            f"{d['destination']} ({d['count']}x)" for d in destinations
-        ]
-    
-    # Récupération des notes existantes depuis la session
-    notes_chauffeurs = request.session.get('notes_chauffeurs', {})
-    
-    # Calcul des statistiques supplémentaires et du scoring pour chaque chauffeur
-    evaluations = []
-    scores_data = []  # Pour calculer les moyennes de scoring
-    
-    for chauffeur in stats_chauffeurs:
-        # Calcul du nombre de jours prestés
-        jours_prestes = courses.filter(chauffeur__id=chauffeur['chauffeur__id']).values('date_depart__date').distinct().count()
-        # Calcul de l'ancienneté en jours
-        anciennete = (timezone.now().date() - chauffeur['chauffeur__date_joined'].date()).days
-        # Calcul de la distance moyenne par mission
-        distance_moyenne = chauffeur['distance_totale'] / chauffeur['missions_terminees'] if chauffeur['missions_terminees'] > 0 else 0
-        # Calcul du nombre de missions par jour
-        missions_par_jour = chauffeur['missions_terminees'] / jours_prestes if jours_prestes > 0 else 0
-        # Date de la dernière mission terminée
-        last_mission = courses.filter(chauffeur__id=chauffeur['chauffeur__id']).order_by('-date_fin').first()
-        date_mission = last_mission.date_fin if last_mission and last_mission.date_fin else None
-        
-        # Calcul de la consommation moyenne
-        conso_moyenne = (chauffeur.get('litres_consommes', 0) * 100) / chauffeur['distance_totale'] if chauffeur['distance_totale'] > 0 else 0
-        # Calcul du coût par km
-        cout_km = chauffeur['distance_totale'] / chauffeur.get('cout_total', 1) if chauffeur.get('cout_total', 0) > 0 else 0
-        
-        # === SYSTÈME DE SCORING AVANCÉ ===
-        score_total = 0
-        score_details = {}
-        
-        # 1. Score de productivité (40% du total)
-        if missions_par_jour > 0:
-            score_productivite = min(100, (missions_par_jour / 2) * 100)  # 2 missions/jour = 100%
-        else:
-            score_productivite = 0
-        score_details['productivite'] = score_productivite
-        score_total += score_productivite * 0.4
-        
-        # 2. Score d'efficacité énergétique (25% du total)
-        if conso_moyenne > 0:
-            if conso_moyenne <= 6:  # Excellente consommation
-                score_efficacite = 100
-            elif conso_moyenne <= 8:  # Bonne consommation
-                score_efficacite = 80
-            elif conso_moyenne <= 10:  # Consommation moyenne
-                score_efficacite = 60
-            elif conso_moyenne <= 12:  # Consommation élevée
-                score_efficacite = 40
-            else:  # Consommation très élevée
-                score_efficacite = 20
-        else:
-            score_efficacite = 0
-        score_details['efficacite'] = score_efficacite
-        score_total += score_efficacite * 0.25
-        
-        # 3. Score de rentabilité (20% du total)
-        if cout_km > 0:
-            if cout_km <= 50:  # Très rentable
-                score_rentabilite = 100
-            elif cout_km <= 100:  # Rentable
-                score_rentabilite = 80
-            elif cout_km <= 150:  # Moyennement rentable
-                score_rentabilite = 60
-            elif cout_km <= 200:  # Peu rentable
-                score_rentabilite = 40
-            else:  # Non rentable
-                score_rentabilite = 20
-        else:
-            score_rentabilite = 0
-        score_details['rentabilite'] = score_rentabilite
-        score_total += score_rentabilite * 0.20
-        
-        # 4. Score de régularité (15% du total)
-        if jours_prestes > 0:
-            taux_regularite = (jours_prestes / 30) * 100  # Basé sur 30 jours
-            score_regularite = min(100, taux_regularite)
-        else:
-            score_regularite = 0
-        score_details['regularite'] = score_regularite
-        score_total += score_regularite * 0.15
-        
-        # Classification du chauffeur
-        if score_total >= 85:
-            classification = "Excellent"
-            badge_class = "badge-success"
-        elif score_total >= 70:
-            classification = "Bon"
-            badge_class = "badge-primary"
-        elif score_total >= 55:
-            classification = "Moyen"
-            badge_class = "badge-warning"
-        elif score_total >= 40:
-            classification = "À améliorer"
-            badge_class = "badge-danger"
-        else:
-            classification = "Critique"
-            badge_class = "badge-dark"
-        
-        # Recommandations basées sur les scores
-        recommandations = []
-        if score_details['productivite'] < 60:
-            recommandations.append("Augmenter le nombre de missions par jour")
-        if score_details['efficacite'] < 60:
-            recommandations.append("Améliorer la conduite pour réduire la consommation")
-        if score_details['rentabilite'] < 60:
-            recommandations.append("Optimiser les coûts d'exploitation")
-        if score_details['regularite'] < 60:
-            recommandations.append("Améliorer l'assiduité")
-        
-        chauffeur_id = chauffeur['chauffeur__id']
-        evaluations.append({
-            'chauffeur': {
-                'id': chauffeur_id,
-                'first_name': chauffeur['chauffeur__first_name'],
-                'last_name': chauffeur['chauffeur__last_name'],
-                'get_full_name': f"{chauffeur['chauffeur__first_name']} {chauffeur['chauffeur__last_name']}"
-            },
-            'vehicule': {
-                'immatriculation': chauffeur.get('vehicule__immatriculation', 'Non affecté'),
-                'marque': chauffeur.get('vehicule__marque', 'Inconnue'),
-                'modele': chauffeur.get('vehicule__modele', '')
-            },
-            'nb_courses': chauffeur['missions_terminees'],
-            'nb_courses_terminees': chauffeur['missions_terminees'],
-            'nb_jours_prestes': jours_prestes,
-            'distance_totale': chauffeur['distance_totale'],
-            'anciennete': anciennete,
-            'distance_moyenne': distance_moyenne,
-            'missions_par_jour': missions_par_jour,
-            'depenses_carburant': chauffeur.get('depenses_carburant', 0),
-            'depenses_entretien': chauffeur.get('depenses_entretien', 0),
-            'cout_total': chauffeur.get('cout_total', 0),
-            'cout_km': cout_km,
-            'conso_moyenne': conso_moyenne,
-            'top_destinations': destinations_par_chauffeur.get(chauffeur_id, []),
-            'notes': notes_chauffeurs.get(str(chauffeur_id), ''),
-            'date_mission': date_mission,
-            # Nouvelles métriques de scoring
-            'score_total': round(score_total, 1),
-            'score_details': score_details,
-            'classification': classification,
-            'badge_class': badge_class,
-            'recommandations': recommandations,
-            'tendance': 'stable'  # À implémenter avec historique
-        })
-        
-        scores_data.append(score_total)
-    
-    # Calcul des moyennes globales
-    if date_debut and date_fin:
-        try:
-            date_debut_dt = datetime.strptime(date_debut, '%Y-%m-%d').date()
-            date_fin_dt = datetime.strptime(date_fin, '%Y-%m-%d').date()
-            total_jours = (date_fin_dt - date_debut_dt).days + 1
-        except (ValueError, TypeError):
-            total_jours = 1
-    else:
-        # Si pas de date spécifiée, on prend la période depuis la première mission
-        premiere_mission = courses.order_by('date_depart').first()
-        if premiere_mission:
-            total_jours = (timezone.now().date() - premiere_mission.date_depart.date()).days + 1
-        else:
-            total_jours = 1
-    
-    total_missions = sum(eval_['nb_courses'] for eval_ in evaluations)
-    total_distance = sum(eval_['distance_totale'] for eval_ in evaluations)
-    total_jours_prestes = sum(eval_['nb_jours_prestes'] for eval_ in evaluations if eval_['nb_jours_prestes'] > 0)
-    
-    # Calcul des totaux pour les moyennes globales
-    total_litres_consommes = sum(eval_.get('litres_consommes', 0) for eval_ in evaluations)
-    total_cout = sum(eval_.get('cout_total', 0) for eval_ in evaluations)
-    
-    # Calcul de la moyenne des scores
-    score_moyen = sum(scores_data) / len(scores_data) if scores_data else 0
-    
-    moyennes = {
-        'missions_par_jour': total_missions / total_jours if total_jours > 0 else 0,
-        'distance_moyenne': total_distance / total_missions if total_missions > 0 else 0,
-        'conso_moyenne': (total_litres_consommes * 100) / total_distance if total_distance > 0 else 0,
-        'cout_km': total_cout / total_distance if total_distance > 0 else 0,
-        'total_chauffeurs': len(evaluations),
-        'total_distance': total_distance,
-        'moyenne_jours_prestes': total_jours_prestes / len(evaluations) if evaluations else 0,
-        'score_moyen': round(score_moyen, 1)
-    }
-    
-    # Génération des données pour les graphiques
-    charts_data = generate_chauffeur_charts_data(evaluations)
-    
-    context = {
-        'evaluations': evaluations,
-        'chauffeurs': chauffeurs,
-        'selected_chauffeur': int(chauffeur_id) if chauffeur_id else None,
-        'date_debut': date_debut,
-        'date_fin': date_fin,
-        'moyennes': moyennes,
-        'charts_data': charts_data,
-        'request': request
-    }
+    context = {
+        'evaluations': evaluations,
+        'chauffeurs': chauffeurs,
+        'selected_chauffeur': int(chauffeur_id) if chauffeur_id else None,
+        'date_debut': date_debut,
+        'date_fin': date_fin,
+        'moyennes': moyennes,
+        'charts_data': charts_data,
+        'request': request
+    }
     
     return render(request, 'rapport/rapport_evaluation_chauffeurs_advanced.html', context)
 
@@ -3464,6 +3210,8 @@ def generate_mission_charts_data(courses):
         'moyennes_criteres': moyennes_criteres
     }
 
+@login_required
+@user_passes_test(is_admin_or_dispatch_or_superuser)
 def rapport_missions_advanced(request):
     """Vue avancée du rapport des missions avec graphiques."""
     date_debut = request.GET.get('date_debut')
@@ -3471,251 +3219,15 @@ def rapport_missions_advanced(request):
     chauffeur_id = request.GET.get('chauffeur')
     vehicule_id = request.GET.get('vehicule')
     demandeur_id = request.GET.get('demandeur')
-    export_format = request.GET.get('export')
-
-    courses = Course.objects.all()
-    
-    if not request.user.is_superuser:
-        courses = courses.filter(vehicule__etablissement=request.user.etablissement)
-    
-    if date_debut:
-        courses = courses.filter(date_depart__date__gte=date_debut)
-    if date_fin:
-        courses = courses.filter(date_depart__date__lte=date_fin)
     statut_filter = request.GET.get('statut')
-    if statut_filter:
-        courses = courses.filter(statut=statut_filter)
-    if chauffeur_id:
-        courses = courses.filter(chauffeur_id=chauffeur_id)
-    if vehicule_id:
-        courses = courses.filter(vehicule_id=vehicule_id)
-    if demandeur_id:
-        courses = courses.filter(demandeur_id=demandeur_id)
 
-    # Calcul de la distance en km et de la durée en heures
-    courses = courses.annotate(
-        distance_km=ExpressionWrapper(
-            F('distance_parcourue'),
-            output_field=DecimalField(max_digits=10, decimal_places=2)
-        )
-    )
-    
-    courses = courses.annotate(
-        duree_heures=Value(None, output_field=DecimalField(max_digits=10, decimal_places=2))
-    )
-    
-    # === SYSTÈME DE SCORING AVANCÉ POUR MISSIONS ===
-    missions_scored = []
-    scores_data = []  # Pour calculer les moyennes de scoring
-    
-    for course in courses:
-        # Calculer la durée en Python pour chaque cours
-        if course.date_depart and course.date_fin:
-            duree = (course.date_fin - course.date_depart).total_seconds() / 3600.0
-            course.duree_heures = round(duree, 2)
-        else:
-            course.duree_heures = 0
-        
-        # === CALCUL DU SCORE DE LA MISSION ===
-        score_total = 0
-        score_details = {}
-        
-        # 1. Score de ponctualité (30% du total)
-        # Basé sur le respect des horaires et la durée de la mission
-        score_ponctualite = 100
-        if course.date_depart and course.date_fin:
-            duree_mission = course.duree_heures
-            distance_mission = float(course.distance_parcourue) if course.distance_parcourue else 0
-            
-            # Calcul de la vitesse moyenne (km/h)
-            if duree_mission > 0:
-                vitesse_moyenne = distance_mission / duree_mission
-                # Score basé sur la vitesse moyenne (objectif : 60-80 km/h)
-                if 60 <= vitesse_moyenne <= 80:
-                    score_ponctualite = 100
-                elif 50 <= vitesse_moyenne < 60 or 80 < vitesse_moyenne <= 90:
-                    score_ponctualite = 80
-                elif 40 <= vitesse_moyenne < 50 or 90 < vitesse_moyenne <= 100:
-                    score_ponctualite = 60
-                elif vitesse_moyenne < 40 or vitesse_moyenne > 100:
-                    score_ponctualite = 40
-            else:
-                score_ponctualite = 50  # Score neutre si pas de durée
-        else:
-            score_ponctualite = 30  # Pénalité si pas de dates
-        
-        # Pénalité pour missions annulées ou en retard
-        if course.statut == 'annulee':
-            score_ponctualite -= 50
-        elif course.statut == 'en_retard':
-            score_ponctualite -= 30
-        
-        score_ponctualite = max(0, score_ponctualite)
-        score_details['ponctualite'] = score_ponctualite
-        score_total += score_ponctualite * 0.30
-        
-        # 2. Score d'efficacité (25% du total)
-        # Basé sur la distance parcourue et l'optimisation du trajet
-        score_efficacite = 100
-        if course.distance_parcourue:
-            distance = float(course.distance_parcourue)
-            # Score basé sur la distance (missions plus longues = meilleur score)
-            if distance >= 100:  # Mission longue
-                score_efficacite = 100
-            elif distance >= 50:  # Mission moyenne
-                score_efficacite = 80
-            elif distance >= 20:  # Mission courte
-                score_efficacite = 60
-            else:  # Très courte mission
-                score_efficacite = 40
-        else:
-            score_efficacite = 0
-        
-        # Bonus pour missions terminées
-        if course.statut == 'terminee':
-            score_efficacite += 20
-            score_efficacite = min(100, score_efficacite)
-        
-        score_details['efficacite'] = score_efficacite
-        score_total += score_efficacite * 0.25
-        
-        # 3. Score de rentabilité (25% du total)
-        # Basé sur le coût par km et la valeur de la mission
-        score_rentabilite = 100
-        if course.distance_parcourue:
-            distance = float(course.distance_parcourue)
-            cout_km = 0.5  # Coût fixe de 0.5$/km
-            cout_total = distance * cout_km
-            
-            # Score basé sur la rentabilité (missions plus rentables = meilleur score)
-            if cout_total <= 25:  # Mission très rentable
-                score_rentabilite = 100
-            elif cout_total <= 50:  # Mission rentable
-                score_rentabilite = 80
-            elif cout_total <= 100:  # Mission moyennement rentable
-                score_rentabilite = 60
-            else:  # Mission coûteuse
-                score_rentabilite = 40
-        else:
-            score_rentabilite = 50
-        
-        score_details['rentabilite'] = score_rentabilite
-        score_total += score_rentabilite * 0.25
-        
-        # 4. Score de qualité (20% du total)
-        # Basé sur la satisfaction client et la qualité du service
-        score_qualite = 100
-        
-        # Pénalités pour différents statuts
-        if course.statut == 'annulee':
-            score_qualite -= 80
-        elif course.statut == 'en_retard':
-            score_qualite -= 40
-        elif course.statut == 'en_cours':
-            score_qualite -= 20
-        elif course.statut == 'terminee':
-            score_qualite += 10  # Bonus pour mission terminée
-            score_qualite = min(100, score_qualite)
-        
-        # Bonus pour missions avec passagers
-        if hasattr(course, 'nombre_passagers') and course.nombre_passagers and course.nombre_passagers > 0:
-            score_qualite += 10
-            score_qualite = min(100, score_qualite)
-        
-        score_qualite = max(0, score_qualite)
-        score_details['qualite'] = score_qualite
-        score_total += score_qualite * 0.20
-        
-        # Classification de la mission
-        if score_total >= 85:
-            classification = "Excellent"
-            badge_class = "badge-success"
-        elif score_total >= 70:
-            classification = "Bon"
-            badge_class = "badge-primary"
-        elif score_total >= 55:
-            classification = "Moyen"
-            badge_class = "badge-warning"
-        elif score_total >= 40:
-            classification = "À améliorer"
-            badge_class = "badge-danger"
-        else:
-            classification = "Critique"
-            badge_class = "badge-dark"
-        
-        # Recommandations basées sur les scores
-        recommandations = []
-        if score_details['ponctualite'] < 60:
-            recommandations.append("Améliorer la ponctualité et optimiser les trajets")
-        if score_details['efficacite'] < 60:
-            recommandations.append("Optimiser les distances et les itinéraires")
-        if score_details['rentabilite'] < 60:
-            recommandations.append("Réduire les coûts d'exploitation")
-        if score_details['qualite'] < 60:
-            recommandations.append("Améliorer la qualité du service")
-        if course.statut == 'annulee':
-            recommandations.append("Analyser les causes d'annulation")
-        
-        # Ajouter les métriques calculées à la mission
-        course.score_total = round(score_total, 1)
-        course.score_details = score_details
-        course.classification = classification
-        course.badge_class = badge_class
-        course.recommandations = recommandations
-        course.cout_km = 0.5  # Coût fixe
-        course.cout_total = float(course.distance_parcourue * 0.5) if course.distance_parcourue else 0
-        
-        missions_scored.append(course)
-        scores_data.append(score_total)
-    
-    total_missions = len(missions_scored)
-    total_distance = sum(float(c.distance_km) for c in missions_scored if c.distance_km is not None)
-    total_duree = sum(float(c.duree_heures) for c in missions_scored if c.duree_heures is not None)
-    # Calcul du coût basé sur la distance (0.5$ par km)
-    COUT_PAR_KM = Decimal('0.5')  # 0.5$ par km
-    total_cout = float(sum(Decimal(str(c.distance_km)) * COUT_PAR_KM for c in missions_scored if c.distance_km is not None))
-    
-    # Calcul de la moyenne des scores
-    score_moyen = sum(scores_data) / len(scores_data) if scores_data else 0
+    # Même calcul (et même entrée de cache) que le rapport des missions
+    donnees = rapport_en_cache('missions', request, lambda: _calculer_rapport_missions(request), PARAMETRES_RAPPORT_MISSIONS)
+    missions_scored = donnees['courses']
     
     # Génération des données pour les graphiques
     charts_data = generate_mission_charts_data(missions_scored)
     
-    # Calcul des statistiques par statut
-    stats_par_statut = {}
-    for statut_choice in Course.STATUS_CHOICES:
-        statut_code = statut_choice[0]
-        missions_statut = [c for c in missions_scored if c.statut == statut_code]
-        count = len(missions_statut)
-        distance = sum(float(m.distance_parcourue) for m in missions_statut if m.distance_parcourue is not None)
-        duree = sum(float(m.duree_heures) for m in missions_statut if m.duree_heures is not None)
-        cout = float(sum(Decimal(str(m.distance_parcourue)) * Decimal('0.5') for m in missions_statut if m.distance_parcourue is not None))
-        
-        stats_par_statut[statut_code] = {
-            'count': count,
-            'distance': distance,
-            'duree': duree,
-            'cout': cout,
-            'label': dict(Course.STATUS_CHOICES)[statut_code]
-        }
-
-    if total_missions > 0:
-        moyennes = {
-            'distance_moyenne': total_distance / total_missions,
-            'duree_moyenne': total_duree / total_missions,
-            'cout_moyen': total_cout / total_missions,
-            'cout_km': total_cout / total_distance if total_distance > 0 else 0,
-            'score_moyen': round(score_moyen, 1)
-        }
-    else:
-        moyennes = {
-            'distance_moyenne': 0,
-            'duree_moyenne': timedelta(),
-            'cout_moyen': 0,
-            'cout_km': 0,
-            'score_moyen': 0
-        }
-
     # Préparation du contexte
     context = {
         'courses': missions_scored,
@@ -3725,13 +3237,13 @@ def rapport_missions_advanced(request):
         'selected_chauffeur': chauffeur_id,
         'selected_vehicule': vehicule_id,
         'selected_demandeur': demandeur_id,
-        'total_missions': total_missions,
-        'total_distance': total_distance,
-        'total_duree': total_duree,
-        'total_cout': total_cout,
-        'score_moyen': round(score_moyen, 1),
-        'stats_par_statut': stats_par_statut,
-        'moyennes': moyennes,
+        'total_missions': donnees['total_missions'],
+        'total_distance': donnees['total_distance'],
+        'total_duree': donnees['total_duree'],
+        'total_cout': donnees['total_cout'],
+        'score_moyen': donnees['score_moyen'],
+        'stats_par_statut': donnees['stats_par_statut'],
+        'moyennes': donnees['moyennes'],
         'charts_data': charts_data,
         'statut_choices': Course.STATUS_CHOICES,
     }
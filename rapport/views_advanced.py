@@ -13,6 +13,7 @@ from core.models import Vehicule, Utilisateur, Course, ActionTraceur
 from entretien.models import Entretien
 from ravitaillement.models import Ravitaillement
 from .utils.generate_report_data import generer_rapport_complet
+from .cache import rapport_en_cache
 
 @login_required
 def rapport_vehicule_advanced(request):
@@ -26,7 +27,8 @@ def rapport_vehicule_advanced(request):
     if vehicule_id:
         try:
             selected_vehicule = Vehicule.objects.get(id=vehicule_id)
-            rapport = get_vehicule_data(vehicule_id)
+            # Calcul partagé par l'affichage et les exports (voir rapport.cache)
+            rapport = rapport_en_cache('vehicule_advanced', request, lambda: get_vehicule_data(vehicule_id), ('vehicule',))
         except Vehicule.DoesNotExist:
             messages.error(request, f"Aucun véhicule trouvé avec l'ID {vehicule_id}.")
             rapport = None
@@ -40,28 +42,28 @@ def rapport_vehicule_advanced(request):
     }
     export_format = request.GET.get('export')
     if export_format == 'pdf' and rapport:
-        return generer_pdf_rapport_avance(context)
+        return generer_pdf_rapport_avance(request, context)
     elif export_format == 'excel' and rapport:
         return generer_excel_rapport_avance(context)
     return render(request, 'rapport/vehicule_advanced.html', context)
 
-def generer_pdf_rapport_avance(context):
-    """Génère un PDF du rapport avancé"""
-    from weasyprint import HTML
-    from django.template.loader import render_to_string
+def generer_pdf_rapport_avance(request, context):
+    """Génère un PDF du rapport avancé (WeasyPrint, via le service de rendu en arrière-plan)"""
+    from core.rendu_pdf import reponse_pdf
     
     # Rendre le template HTML en chaîne
-    html_string = render_to_string('rapport/vehicule_advanced_pdf.html', context)
+    template_name = 'rapport/vehicule_advanced_pdf.html'
+    html_string = render_to_string(template_name, context)
     
-    # Créer un fichier PDF
-    pdf_file = HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf()
-    
-    # Créer la réponse HTTP avec le PDF
-    response = HttpResponse(pdf_file, content_type='application/pdf')
     filename = f"rapport_avance_{context['rapport']['vehicule']['immatriculation']}_{timezone.now().strftime('%Y%m%d')}.pdf"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    return response
+    return reponse_pdf(
+        html_string,
+        filename,
+        template_name=template_name,
+        moteur='weasyprint',
+        base_url=request.build_absolute_uri('/'),
+        contexte=context,
+    )
 
 def generer_excel_rapport_avance(context):
     """Génère un fichier Excel du rapport avancé"""
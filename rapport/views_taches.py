@@ -0,0 +1,70 @@
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+import os
+
+from .forms import DemandeRapportForm
+from .models import Rapport
+from .taches import PARAMETRES_FILTRES, soumettre_rapport
+from .views import is_admin_or_dispatch_or_superuser
+
+
+def _rapport_de(request, pk):
+    rapports = Rapport.objects.all() if request.user.is_superuser else Rapport.objects.filter(generateur=request.user)
+    return get_object_or_404(rapports, pk=pk)
+
+
+def _etat(rapport):
+    return {
+        'id': rapport.pk,
+        'statut': rapport.statut,
+        'statut_display': rapport.get_statut_display(),
+        'progression': rapport.progression,
+        'message_erreur': rapport.message_erreur,
+        'url': reverse('rapport:telecharger_rapport', args=[rapport.pk]) if rapport.statut == 'termine' and rapport.fichier else None,
+    }
+
+
+@login_required
+@user_passes_test(is_admin_or_dispatch_or_superuser)
+def mes_rapports(request):
+    """Demande de rapports produits en arrière-plan et suivi des rapports demandés"""
+    if request.method == 'POST':
+        form = DemandeRapportForm(request.POST)
+        if form.is_valid():
+            # Filtres optionnels transmis avec la demande (véhicule, chauffeur...)
+            parametres = {nom: request.POST[nom] for nom in PARAMETRES_FILTRES if request.POST.get(nom)}
+            rapport = soumettre_rapport(
+                request.user,
+                form.cleaned_data['type_rapport'],
+                form.cleaned_data['format_rapport'],
+                form.cleaned_data['date_debut'],
+                form.cleaned_data['date_fin'],
+                parametres,
+            )
+            messages.success(request, f"Le rapport « {rapport.titre} » est en cours de génération. Vous serez notifié dès qu'il sera prêt.")
+            return redirect('rapport:mes_rapports')
+    else:
+        form = DemandeRapportForm()
+
+    rapports = Rapport.objects.filter(generateur=request.user).order_by('-date_generation')[:50]
+    return render(request, 'rapport/mes_rapports.html', {'form': form, 'rapports': rapports})
+
+
+@login_required
+@require_GET
+def etat_rapport(request, pk):
+    """État d'un rapport, interrogé par la page de suivi"""
+    return JsonResponse(_etat(_rapport_de(request, pk)))
+
+
+@login_required
+@require_GET
+def telecharger_rapport(request, pk):
+    rapport = _rapport_de(request, pk)
+    if rapport.statut != 'termine' or not rapport.fichier:
+        raise Http404("Rapport non disponible")
+    return FileResponse(rapport.fichier.open('rb'), as_attachment=True, filename=os.path.basename(rapport.fichier.name))
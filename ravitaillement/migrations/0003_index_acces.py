@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ravitaillement', '0002_alter_ravitaillement_nom_station_station_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ravitaillement',
+            index=models.Index(fields=['vehicule', 'date_ravitaillement'], name='ravitaillement_vehicule_idx'),
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.db import models
-from core.models import Utilisateur, Vehicule, ActionTraceur, Etablissement
+from core.models import Utilisateur, Vehicule, ActionTraceur, Etablissement, SuiviKilometrageMixin
 from django.core.exceptions import ValidationError
 from django.utils.text import slugify
 
@@ -52,7 +52,7 @@ class Station(models.Model):
             parts.append(self.pays)
         return ", ".join(parts)
 
-class Ravitaillement(models.Model):
+class Ravitaillement(SuiviKilometrageMixin, models.Model):
     """Modèle pour les ravitaillements de véhicules"""
     vehicule = models.ForeignKey(Vehicule, on_delete=models.CASCADE, related_name='ravitaillements')
     date_ravitaillement = models.DateTimeField(auto_now_add=True)  # On garde auto_now_add pour simplifier
@@ -69,33 +69,22 @@ class Ravitaillement(models.Model):
     commentaires = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='images_ravitaillements/', blank=True, null=True, verbose_name="Photo du reçu")
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicule', 'date_ravitaillement'], name='ravitaillement_vehicule_idx'),
+        ]
+    
+    champs_kilometrage = ('kilometrage_avant', 'kilometrage_apres')
+    module_kilometrage = 'ravitaillement'
+    champ_utilisateur_kilometrage = ('chauffeur', 'createur')
+
     def __str__(self):
         return f"Ravitaillement {self.vehicule.immatriculation} - {self.date_ravitaillement}"
     
     def save(self, *args, **kwargs):
-        from core.models import HistoriqueKilometrage  # Import local pour éviter les problèmes de boucle d'importation
-        
         # Calcul automatique du coût total
         self.cout_total = self.litres * self.cout_unitaire
-        # Historique kilométrage
-        is_update = self.pk is not None
-        if is_update:
-            old = type(self).objects.get(pk=self.pk)
-            km_fields = [('kilometrage_avant', old.kilometrage_avant, self.kilometrage_avant),
-                         ('kilometrage_apres', old.kilometrage_apres, self.kilometrage_apres)]
-            for champ, avant, apres in km_fields:
-                if avant != apres and apres is not None:
-                    HistoriqueKilometrage.objects.create(
-                        vehicule=self.vehicule,
-                        utilisateur=self.chauffeur or self.createur,
-                        module='ravitaillement',
-                        objet_id=self.pk,
-                        valeur_avant=avant,
-                        valeur_apres=apres,
-                        commentaire=f"Modification du {champ} via Ravitaillement #{self.pk}"
-                    )
-        
-        # Sauvegarde de l'instance
+        # Sauvegarde de l'instance (l'historique kilométrique est écrit par SuiviKilometrageMixin)
         super().save(*args, **kwargs)
         
         # Synchronisation du kilométrage actuel du véhicule
@@ -104,19 +93,6 @@ class Ravitaillement(models.Model):
                 self.vehicule.kilometrage_actuel = self.kilometrage_apres
                 self.vehicule.save(update_fields=["kilometrage_actuel"])
         
-        # Création (nouveau ravitaillement)
-        if not is_update:
-            for champ, apres in [('kilometrage_avant', self.kilometrage_avant), ('kilometrage_apres', self.kilometrage_apres)]:
-                if apres is not None:
-                    HistoriqueKilometrage.objects.create(
-                        vehicule=self.vehicule,
-                        utilisateur=self.chauffeur or self.createur,
-                        module='ravitaillement',
-                        objet_id=self.pk,
-                        valeur_avant=None,
-                        valeur_apres=apres,
-                        commentaire=f"Création du {champ} via Ravitaillement #{self.pk}"
-                    )
         # Créer une entrée dans le traceur d'actions
         is_new = self.pk is None
         if is_new:
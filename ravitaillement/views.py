@@ -13,6 +13,7 @@ from core.models import Vehicule, ActionTraceur, Course
 from .models import Ravitaillement, Station
 from .forms import RavitaillementForm, StationForm
 from core.utils import export_to_pdf, export_to_excel  # export_to_pdf_with_image temporairement commenté
+from core.kilometrage import get_kilometrage, lire_releve
 from core.decorators import is_admin_or_dispatch_or_superuser
 from django.utils import timezone
 from entretien.models import Entretien
@@ -291,31 +292,7 @@ def creer_ravitaillement(request):
                 ravitaillement.image = request.FILES['image']
             # Sinon, on laisse le champ vide
             # Vérifier que le kilométrage n'est pas inférieur au dernier kilométrage enregistré
-            dernier_kilometrage = 0
-            # Utiliser ravitaillement.pk pour la cohérence et exclure l'objet courant uniquement s'il existe
-            
-            print(f"DEBUG: Valeur de ravitaillement.vehicule avant la requête: {ravitaillement.vehicule}")
-
-            ravitaillement_qs = Ravitaillement.objects.filter(vehicule=ravitaillement.vehicule)
-            if ravitaillement.pk: # Si l'objet a déjà une clé primaire (est en cours de modification, mais ici c'est une création)
-                ravitaillement_qs = ravitaillement_qs.exclude(pk=ravitaillement.pk)
-
-            dernier_ravitaillement = ravitaillement_qs.order_by('-date_ravitaillement').first()
-
-            if dernier_ravitaillement and dernier_ravitaillement.kilometrage_apres is not None:
-                dernier_kilometrage = dernier_ravitaillement.kilometrage_apres
-            derniere_course = Course.objects.filter(
-                vehicule=ravitaillement.vehicule,
-                statut='terminee'
-            ).order_by('-date_fin').first()
-            if derniere_course and derniere_course.kilometrage_fin > dernier_kilometrage:
-                dernier_kilometrage = derniere_course.kilometrage_fin
-            dernier_entretien = Entretien.objects.filter(
-                vehicule=ravitaillement.vehicule,
-                kilometrage_apres__isnull=False
-            ).order_by('-date_entretien').first()
-            if dernier_entretien and dernier_entretien.kilometrage_apres > dernier_kilometrage:
-                dernier_kilometrage = dernier_entretien.kilometrage_apres
+            dernier_kilometrage = get_kilometrage(ravitaillement.vehicule_id)
             if ravitaillement.kilometrage_avant < dernier_kilometrage:
                 messages.error(request, f"Le kilométrage avant ({ravitaillement.kilometrage_avant}) ne peut pas être inférieur au dernier kilométrage enregistré ({dernier_kilometrage}).")
                 return render(request, 'ravitaillement/formulaire_ravitaillement.html', {'form': form, 'title': 'Nouveau Ravitaillement'})
@@ -332,12 +309,7 @@ def creer_ravitaillement(request):
         if vehicule_id:
             try:
                 vehicule = Vehicule.objects.get(id=vehicule_id)
-                # Chercher le dernier ravitaillement de ce véhicule
-                dernier_ravitaillement = Ravitaillement.objects.filter(vehicule=vehicule).order_by('-date_ravitaillement').first()
-                if dernier_ravitaillement and dernier_ravitaillement.kilometrage_apres is not None:
-                    initial['kilometrage_avant'] = dernier_ravitaillement.kilometrage_apres
-                else:
-                    initial['kilometrage_avant'] = 0
+                initial['kilometrage_avant'] = get_kilometrage(vehicule)
                 initial['vehicule'] = vehicule.id
             except Vehicule.DoesNotExist:
                 initial['kilometrage_avant'] = 0
@@ -705,48 +677,14 @@ def get_vehicule_kilometrage(request):
     """API pour récupérer le kilométrage actuel d'un véhicule"""
     vehicule_id = request.GET.get('vehicule_id')
     
-    if not vehicule_id:
+    if not vehicule_id or not vehicule_id.isdigit():
         return JsonResponse({'error': 'Aucun ID de véhicule fourni'}, status=400)
     
-    try:
-        vehicule = Vehicule.objects.get(id=vehicule_id)
-        
-        # Vérifier d'abord le dernier ravitaillement
-        dernier_ravitaillement = Ravitaillement.objects.filter(
-            vehicule=vehicule
-        ).order_by('-date_ravitaillement').first()
-
-        # Si un ravitaillement existe, utiliser son kilométrage après comme kilométrage de départ
-        if dernier_ravitaillement and dernier_ravitaillement.kilometrage_apres is not None:
-            kilometrage = dernier_ravitaillement.kilometrage_apres
-        else:
-            # Sinon (pas de ravitaillement ou kilométrage après nul), chercher dans les courses et entretiens
-            kilometrage_course = 0
-            derniere_course = Course.objects.filter(
-                vehicule=vehicule, 
-                statut='terminee'
-            ).order_by('-date_fin').first()
-            if derniere_course and derniere_course.kilometrage_fin is not None:
-                kilometrage_course = derniere_course.kilometrage_fin
-            
-            kilometrage_entretien = 0
-            dernier_entretien = Entretien.objects.filter(
-                vehicule=vehicule,
-                kilometrage_apres__isnull=False
-            ).order_by('-date_entretien').first()
-            if dernier_entretien and dernier_entretien.kilometrage_apres is not None:
-                kilometrage_entretien = dernier_entretien.kilometrage_apres
-            
-            # Prendre le maximum des kilométrages trouvés (peut être 0 si aucun historique)
-            kilometrage = max(kilometrage_course, kilometrage_entretien)
-        
-        return JsonResponse({
-            'success': True,
-            'kilometrage': kilometrage,
-            'immatriculation': vehicule.immatriculation
-        })
-        
-    except Vehicule.DoesNotExist:
+    releve = lire_releve(int(vehicule_id))
+    if releve is None:
         return JsonResponse({'error': 'Véhicule non trouvé'}, status=404)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+    return JsonResponse({
+        'success': True,
+        'kilometrage': releve['kilometrage'],
+        'immatriculation': releve['immatriculation']
+    })
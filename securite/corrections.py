@@ -0,0 +1,236 @@
+"""
+Correction collective du kilométrage d'un véhicule par la sécurité.
+
+La correction réécrit le kilométrage de toutes les missions, entretiens,
+ravitaillements et check-lists du véhicule. Elle s'exécute en une seule
+transaction, par mises à jour ensemblistes (update / bulk_update), et
+l'historique est inséré par lots (bulk_create).
+
+`apercu_correction` compte les lignes concernées avant validation. Au-delà de
+SECURITE_CORRECTION_SEUIL_ARRIERE_PLAN lignes, la vue enregistre la demande
+(`soumettre_correction`) et le worker des tâches en arrière-plan l'applique
+(`traiter_file_corrections`, appelé par `traiter_rapports`), avec la même
+réservation que les rapports (voir rapport.taches). Un arrêt du worker annule
+la transaction en cours ; la réservation expirée rend la demande de nouveau
+éligible. L'auteur est notifié à la fin du traitement.
+"""
+import logging
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Vehicule, Course, ActionTraceur, HistoriqueKilometrage, HistoriqueCorrectionKilometrage
+from core.kilometrage import definir_kilometrage
+from entretien.models import Entretien
+from ravitaillement.models import Ravitaillement
+from rapport.cache import invalider_rapports
+from .models import CheckListSecurite, CorrectionKilometrageDemandee
+
+logger = logging.getLogger(__name__)
+
+TAILLE_LOT = 1000
+MOTIF_KILOMETRAGE = re.compile(r'(Kilométrage: )\d+')
+
+# Champs réécrits par la correction, par module de l'historique kilométrique
+CHAMPS_CORRIGES = (
+    ('course', Course, ('kilometrage_depart', 'kilometrage_fin')),
+    ('entretien', Entretien, ('kilometrage', 'kilometrage_apres')),
+    ('ravitaillement', Ravitaillement, ('kilometrage_avant', 'kilometrage_apres')),
+)
+
+
+def _actions_concernees(vehicule):
+    return ActionTraceur.objects.filter(action__icontains=vehicule.immatriculation, details__icontains='Kilométrage:')
+
+
+def _differe(champs, valeur):
+    """Condition : au moins un des champs est différent de la valeur (ou nul)"""
+    condition = Q()
+    for champ in champs:
+        condition |= ~Q(**{champ: valeur}) | Q(**{f"{champ}__isnull": True})
+    return condition
+
+
+def apercu_correction(vehicule, nouveau_km):
+    """
+    Nombre de lignes modifiées par la correction, par table.
+
+    Returns:
+        dict: courses, entretiens, ravitaillements, checklists, historiques,
+        actions et total
+    """
+    apercu = {
+        'courses': Course.objects.filter(vehicule=vehicule).count(),
+        'entretiens': Entretien.objects.filter(vehicule=vehicule).count(),
+        'ravitaillements': Ravitaillement.objects.filter(vehicule=vehicule).count(),
+        'checklists': CheckListSecurite.objects.filter(vehicule=vehicule).count(),
+        'historiques': HistoriqueKilometrage.objects.filter(vehicule=vehicule).count(),
+        'actions': _actions_concernees(vehicule).count(),
+        'nouvelles_lignes_historique': sum(
+            modele.objects.filter(vehicule=vehicule).filter(_differe(champs, nouveau_km)).count()
+            for _, modele, champs in CHAMPS_CORRIGES
+        ),
+    }
+    apercu['total'] = sum(apercu.values())
+    return apercu
+
+
+def _lignes_historique(vehicule, auteur_id, nouveau_km):
+    """Historique des valeurs remplacées, construit sans charger les objets complets"""
+    for module, modele, champs in CHAMPS_CORRIGES:
+        valeurs = modele.objects.filter(vehicule=vehicule).values_list('pk', *champs).order_by('pk')
+        for pk, *anciennes in valeurs.iterator(chunk_size=TAILLE_LOT):
+            for champ, avant in zip(champs, anciennes):
+                if avant != nouveau_km:
+                    yield HistoriqueKilometrage(
+                        vehicule_id=vehicule.pk,
+                        utilisateur_id=auteur_id,
+                        module=module,
+                        objet_id=pk,
+                        valeur_avant=avant,
+                        valeur_apres=nouveau_km,
+                        commentaire=f"Correction collective du {champ} via admin sécurité",
+                    )
+
+
+def appliquer_correction(vehicule_id, nouveau_km, auteur_id, motif, chauffeur_id=None):
+    """
+    Applique la correction dans une seule transaction.
+
+    Returns:
+        HistoriqueCorrectionKilometrage: la trace de la correction
+    """
+    with transaction.atomic():
+        vehicule = Vehicule.objects.select_for_update().get(pk=vehicule_id)
+        ancien_km = vehicule.kilometrage_actuel or 0
+
+        # L'historique existant prend la nouvelle valeur, puis on trace les valeurs remplacées
+        HistoriqueKilometrage.objects.filter(vehicule=vehicule).update(valeur_apres=nouveau_km)
+        lot = []
+        for ligne in _lignes_historique(vehicule, auteur_id, nouveau_km):
+            lot.append(ligne)
+            if len(lot) >= TAILLE_LOT:
+                HistoriqueKilometrage.objects.bulk_create(lot)
+                lot = []
+        HistoriqueKilometrage.objects.bulk_create(lot)
+
+        for _, modele, champs in CHAMPS_CORRIGES:
+            valeurs = {champ: nouveau_km for champ in champs}
+            if modele is Course:
+                # update() ne renseigne pas date_modification, curseur de synchronisation des applications mobiles
+                valeurs['date_modification'] = timezone.now()
+            modele.objects.filter(vehicule=vehicule).update(**valeurs)
+        CheckListSecurite.objects.filter(vehicule=vehicule).update(kilometrage=nouveau_km)
+
+        actions = []
+        for action in _actions_concernees(vehicule).only('id', 'details').iterator(chunk_size=TAILLE_LOT):
+            details = MOTIF_KILOMETRAGE.sub(f'Kilométrage: {nouveau_km}', action.details)
+            if details != action.details:
+                action.details = details
+                actions.append(action)
+        ActionTraceur.objects.bulk_update(actions, ['details'], batch_size=TAILLE_LOT)
+
+        Vehicule.objects.filter(pk=vehicule.pk).update(kilometrage_actuel=nouveau_km)
+        definir_kilometrage(vehicule.pk, nouveau_km)
+        # update() n'émet pas de signaux : les rapports en cache sont invalidés ici
+        invalider_rapports()
+        return HistoriqueCorrectionKilometrage.objects.create(
+            vehicule=vehicule,
+            chauffeur_id=chauffeur_id,
+            valeur_avant=ancien_km,
+            valeur_apres=nouveau_km,
+            motif=motif,
+            auteur_id=auteur_id,
+        )
+
+
+# --- Corrections en arrière-plan ---------------------------------------------
+
+def doit_passer_en_arriere_plan(apercu):
+    return apercu['total'] > getattr(settings, 'SECURITE_CORRECTION_SEUIL_ARRIERE_PLAN', 5000)
+
+
+def soumettre_correction(vehicule_id, nouveau_km, auteur_id, motif, chauffeur_id=None):
+    """Enregistre la correction ; le worker est réveillé après la validation de la transaction"""
+    from rapport.taches import reveiller_worker
+
+    demande = CorrectionKilometrageDemandee.objects.create(
+        vehicule_id=vehicule_id,
+        nouveau_kilometrage=nouveau_km,
+        motif=motif,
+        auteur_id=auteur_id,
+        chauffeur_id=chauffeur_id,
+    )
+    transaction.on_commit(reveiller_worker)
+    return demande
+
+
+def _eligibles(maintenant):
+    return Q(statut='en_attente') | Q(statut='en_cours', reserve_jusqua__lt=maintenant)
+
+
+def _reserver_correction():
+    """Réserve la plus ancienne correction en attente, ou None"""
+    maintenant = timezone.now()
+    demandes = CorrectionKilometrageDemandee.objects.filter(_eligibles(maintenant)).order_by('date_demande')
+    for demande_id in demandes.values_list('id', flat=True)[:5]:
+        reservation = maintenant + timedelta(seconds=getattr(settings, 'RAPPORTS_RESERVATION', 1800))
+        # La mise à jour conditionnelle garantit qu'une correction n'est réservée que par un seul worker
+        if CorrectionKilometrageDemandee.objects.filter(_eligibles(maintenant), id=demande_id).update(
+            statut='en_cours', reserve_jusqua=reservation, message_erreur=''
+        ):
+            return CorrectionKilometrageDemandee.objects.select_related('vehicule', 'auteur').get(id=demande_id)
+    return None
+
+
+def _notifier(demande):
+    from notifications.outbox import preparer_notifications_utilisateur, mettre_en_file
+
+    if demande.auteur is None:
+        return
+    if demande.statut == 'terminee':
+        titre = f"Correction du kilométrage de {demande.vehicule.immatriculation} terminée"
+        message = f"Le kilométrage a été corrigé à {demande.nouveau_kilometrage} km."
+    else:
+        titre = "Échec de la correction du kilométrage"
+        message = f"La correction de {demande.vehicule.immatriculation} à {demande.nouveau_kilometrage} km a échoué : {demande.message_erreur}"
+    mettre_en_file(preparer_notifications_utilisateur(demande.auteur, titre, message, canaux=('notification',)))
+
+
+def executer_correction(demande):
+    """Applique une correction réservée et notifie son auteur. Retourne True en cas de succès"""
+    try:
+        appliquer_correction(demande.vehicule_id, demande.nouveau_kilometrage, demande.auteur_id, demande.motif, demande.chauffeur_id)
+        demande.statut = 'terminee'
+    except Exception as e:
+        logger.exception(f"Échec de la correction du kilométrage {demande.pk}")
+        demande.statut = 'echec'
+        demande.message_erreur = str(e)
+    demande.date_fin_traitement = timezone.now()
+    demande.reserve_jusqua = None
+    demande.save(update_fields=['statut', 'message_erreur', 'date_fin_traitement', 'reserve_jusqua'])
+    _notifier(demande)
+    return demande.statut == 'terminee'
+
+
+def traiter_file_corrections(limite=None):
+    """
+    Applique les corrections en attente, une par une, jusqu'à vider la file (ou `limite` corrections).
+
+    Returns:
+        tuple: (nombre de corrections appliquées, nombre de corrections en échec)
+    """
+    appliquees = echecs = 0
+    while limite is None or appliquees + echecs < limite:
+        demande = _reserver_correction()
+        if demande is None:
+            break
+        if executer_correction(demande):
+            appliquees += 1
+        else:
+            echecs += 1
+    return appliquees, echecs
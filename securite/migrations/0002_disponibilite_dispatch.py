@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('securite', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checklistsecurite',
+            index=models.Index(fields=['vehicule', '-date_controle'], name='checklist_vehicule_date_idx'),
+        ),
+    ]
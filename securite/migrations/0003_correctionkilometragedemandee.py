@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_course_synchronisation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('securite', '0002_disponibilite_dispatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorrectionKilometrageDemandee',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nouveau_kilometrage', models.PositiveIntegerField()),
+                ('motif', models.TextField()),
+                ('date_demande', models.DateTimeField(auto_now_add=True)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('terminee', 'Terminée'), ('echec', 'Échec')], default='en_attente', max_length=20)),
+                ('message_erreur', models.TextField(blank=True)),
+                ('date_fin_traitement', models.DateTimeField(blank=True, null=True)),
+                ('reserve_jusqua', models.DateTimeField(blank=True, null=True)),
+                ('auteur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='corrections_kilometrage_demandees', to=settings.AUTH_USER_MODEL)),
+                ('chauffeur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('vehicule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='corrections_kilometrage_demandees', to='core.vehicule')),
+            ],
+            options={
+                'verbose_name': 'Correction de kilométrage demandée',
+                'verbose_name_plural': 'Corrections de kilométrage demandées',
+                'indexes': [models.Index(fields=['statut', 'date_demande'], name='securite_correction_file_idx')],
+            },
+        ),
+    ]
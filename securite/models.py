@@ -100,6 +100,12 @@ class CheckListSecurite(models.Model):
     # Commentaires
     commentaires = models.TextField(blank=True, null=True)
     
+    class Meta:
+        indexes = [
+            # Dernière check-list d'un véhicule (dispatch.disponibilite)
+            models.Index(fields=['vehicule', '-date_controle'], name='checklist_vehicule_date_idx'),
+        ]
+
     def __str__(self):
         return f"Check-list {self.vehicule.immatriculation} - {self.date_controle}"
     
@@ -148,3 +154,40 @@ class IncidentSecurite(models.Model):
     
     def __str__(self):
         return f"Incident {self.type_incident} - {self.vehicule.immatriculation} ({self.date_signalement:%d/%m/%Y})"
+
+class CorrectionKilometrageDemandee(models.Model):
+    """
+    Correction collective du kilométrage mise en file (securite.corrections).
+
+    Au-delà de SECURITE_CORRECTION_SEUIL_ARRIERE_PLAN lignes concernées, la
+    correction est enregistrée ici puis appliquée par le worker des tâches en
+    arrière-plan (commande traiter_rapports), avec la même réservation que les
+    rapports : une correction interrompue par un arrêt du worker est reprise.
+    """
+    STATUT_CHOICES = (
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('terminee', 'Terminée'),
+        ('echec', 'Échec'),
+    )
+
+    vehicule = models.ForeignKey(Vehicule, on_delete=models.CASCADE, related_name='corrections_kilometrage_demandees')
+    nouveau_kilometrage = models.PositiveIntegerField()
+    motif = models.TextField()
+    auteur = models.ForeignKey(Utilisateur, on_delete=models.SET_NULL, null=True, blank=True, related_name='corrections_kilometrage_demandees')
+    chauffeur = models.ForeignKey(Utilisateur, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    date_demande = models.DateTimeField(auto_now_add=True)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='en_attente')
+    message_erreur = models.TextField(blank=True)
+    date_fin_traitement = models.DateTimeField(blank=True, null=True)
+    reserve_jusqua = models.DateTimeField(blank=True, null=True)  # Fin de la réservation par un worker
+
+    class Meta:
+        verbose_name = "Correction de kilométrage demandée"
+        verbose_name_plural = "Corrections de kilométrage demandées"
+        indexes = [
+            models.Index(fields=['statut', 'date_demande'], name='securite_correction_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"Correction {self.vehicule.immatriculation} → {self.nouveau_kilometrage} km ({self.get_statut_display()})"
@@ -1,3 +1,109 @@
-from django.test import TestCase
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core.models import Etablissement, Utilisateur, Vehicule, Course, ActionTraceur, HistoriqueKilometrage, HistoriqueCorrectionKilometrage
+from core.kilometrage import get_kilometrage
+from entretien.models import Entretien
+from ravitaillement.models import Ravitaillement
+from .models import CheckListSecurite, CorrectionKilometrageDemandee
+from .corrections import apercu_correction, appliquer_correction, traiter_file_corrections
 
-# Create your tests here.
+
+class CorrectionKilometrageTest(TestCase):
+    def setUp(self):
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.securite = Utilisateur.objects.create_user(username="securite1", password="testpass1", etablissement=self.dep, role="securite")
+        self.vehicule = self._vehicule("SEC1")
+
+    def _vehicule(self, immatriculation):
+        return Vehicule.objects.create(immatriculation=immatriculation, marque="Renault", modele="Clio", couleur="rouge", etablissement=self.dep, numero_chassis=f"CH{immatriculation}", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+
+    def _historique(self, vehicule, nombre_courses):
+        for i in range(nombre_courses):
+            Course.objects.create(demandeur=self.securite, vehicule=vehicule, point_embarquement="A", destination="B", motif="Test", statut='terminee', kilometrage_depart=1000 + i, kilometrage_fin=1100 + i)
+        Entretien.objects.create(vehicule=vehicule, createur=self.securite, garage="G", motif="M", cout=10, date_entretien=timezone.now().date(), kilometrage=1200, kilometrage_apres=1210)
+        Ravitaillement.objects.create(vehicule=vehicule, createur=self.securite, litres=10, cout_unitaire=2, kilometrage_avant=1210, kilometrage_apres=1300)
+        CheckListSecurite.objects.create(vehicule=vehicule, controleur=self.securite, lieu_controle="Parking", kilometrage=1400)
+
+    def test_correction_ensembliste(self):
+        self._historique(self.vehicule, 3)
+        historiques_avant = HistoriqueKilometrage.objects.count()
+        apercu = apercu_correction(self.vehicule, 900)
+        self.assertEqual((apercu['courses'], apercu['entretiens'], apercu['ravitaillements'], apercu['checklists']), (3, 1, 1, 1))
+        self.assertEqual(apercu['nouvelles_lignes_historique'], 5)
+
+        correction = appliquer_correction(self.vehicule.id, 900, self.securite.id, "Erreur de saisie")
+        self.assertEqual(correction.valeur_apres, 900)
+        self.assertFalse(Course.objects.exclude(kilometrage_depart=900, kilometrage_fin=900).exists())
+        self.assertFalse(Entretien.objects.exclude(kilometrage=900).exists())
+        self.assertFalse(CheckListSecurite.objects.exclude(kilometrage=900).exists())
+        self.assertEqual(Ravitaillement.objects.get().kilometrage_apres, 900)
+        self.assertEqual(HistoriqueKilometrage.objects.count(), historiques_avant + 10)
+        self.assertEqual(ActionTraceur.objects.filter(details="Kilométrage: 900").count(), 1)
+        self.assertEqual(get_kilometrage(self.vehicule), 900)
+
+    def test_nombre_de_requetes_independant_du_volume(self):
+        grand = self._vehicule("SEC2")
+        self._historique(self.vehicule, 2)
+        self._historique(grand, 20)
+        with CaptureQueriesContext(connection) as petit_volume:
+            appliquer_correction(self.vehicule.id, 900, self.securite.id, "Erreur")
+        with CaptureQueriesContext(connection) as grand_volume:
+            appliquer_correction(grand.id, 900, self.securite.id, "Erreur")
+        self.assertEqual(len(petit_volume), len(grand_volume))
+
+    def test_apercu_puis_validation(self):
+        self._historique(self.vehicule, 2)
+        self.client.login(username="securite1", password="testpass1")
+        url = reverse('securite:corriger_kilometrage')
+        donnees = {'vehicule': self.vehicule.id, 'nouveau_kilometrage': 900, 'motif': "Erreur de saisie"}
+
+        response = self.client.post(url, {**donnees, 'action': 'apercu'})
+        self.assertEqual(response.context['apercu']['courses'], 2)
+        self.assertFalse(HistoriqueCorrectionKilometrage.objects.exists())
+
+        # Sans motif, rien n'est modifié
+        self.client.post(url, {**donnees, 'motif': ''})
+        self.assertFalse(Course.objects.filter(kilometrage_fin=900).exists())
+
+        self.client.post(url, donnees)
+        self.assertEqual(Course.objects.filter(kilometrage_fin=900).count(), 2)
+        self.assertEqual(HistoriqueCorrectionKilometrage.objects.get().auteur, self.securite)
+
+    def test_correction_annulee_en_cas_d_interruption(self):
+        self._historique(self.vehicule, 3)
+        # Interruption en fin de correction : rien n'est appliqué à moitié
+        with mock.patch('securite.corrections.definir_kilometrage', side_effect=RuntimeError("arrêt")):
+            with self.assertRaises(RuntimeError):
+                appliquer_correction(self.vehicule.id, 900, self.securite.id, "Erreur")
+        self.assertFalse(Course.objects.filter(kilometrage_fin=900).exists())
+        self.assertFalse(HistoriqueKilometrage.objects.filter(valeur_apres=900).exists())
+
+        # Volume supérieur à un lot : l'historique est inséré par lots
+        with mock.patch('securite.corrections.TAILLE_LOT', 2):
+            appliquer_correction(self.vehicule.id, 900, self.securite.id, "Erreur")
+        self.assertEqual(Course.objects.filter(kilometrage_depart=900, kilometrage_fin=900).count(), 3)
+        self.assertEqual(HistoriqueKilometrage.objects.filter(commentaire__startswith="Correction collective").count(), 10)
+
+    @override_settings(SECURITE_CORRECTION_SEUIL_ARRIERE_PLAN=0)
+    def test_gros_volume_mis_en_file(self):
+        self._historique(self.vehicule, 2)
+        self.client.login(username="securite1", password="testpass1")
+        self.client.post(reverse('securite:corriger_kilometrage'), {'vehicule': self.vehicule.id, 'nouveau_kilometrage': 900, 'motif': "Erreur"})
+        demande = CorrectionKilometrageDemandee.objects.get()
+        self.assertEqual(demande.statut, 'en_attente')
+        self.assertFalse(Course.objects.filter(kilometrage_fin=900).exists())
+
+        # Le worker applique la correction et notifie son auteur
+        with mock.patch('notifications.outbox.mettre_en_file') as mettre_en_file:
+            self.assertEqual(traiter_file_corrections(), (1, 0))
+        demande.refresh_from_db()
+        self.assertEqual(demande.statut, 'terminee')
+        self.assertIsNone(demande.reserve_jusqua)
+        self.assertEqual(Course.objects.filter(kilometrage_fin=900).count(), 2)
+        self.assertEqual(HistoriqueCorrectionKilometrage.objects.get().auteur, self.securite)
+        mettre_en_file.assert_called_once()
+        self.assertEqual(traiter_file_corrections(), (0, 0))
@@ -15,16 +15,18 @@ import os
 import base64
 # import pandas as pd  # Temporairement commenté pour le déploiement
 from django.templatetags.static import static
-import re
 import tempfile, os
 import openpyxl
 from openpyxl.styles import Font
 
-from core.models import Vehicule, ActionTraceur, HistoriqueKilometrage, Utilisateur
+from core.models import Vehicule, ActionTraceur, Utilisateur
 # Le décorateur securite_required est utilisé via le décorateur login_required avec des vérifications supplémentaires dans les vues
+from core.statistiques import compter, compter_par_statut
 from .models import CheckListSecurite, IncidentSecurite
 from .forms import ChecklistSecuriteForm, IncidentSecuriteForm
 from core.models import HistoriqueCorrectionKilometrage
+from core.kilometrage import definir_kilometrage, lire_releve
+from .corrections import apercu_correction, appliquer_correction, soumettre_correction, doit_passer_en_arriere_plan
 
 # Tentative d'importation de xhtml2pdf pour la génération de PDF
 try:
@@ -76,20 +78,19 @@ def dashboard(request):
     checklists = paginator.get_page(page_number)
     
     # Statistiques
-    stats = {
-        'total': CheckListSecurite.objects.count(),
-        'conformes': CheckListSecurite.objects.filter(statut='conforme').count(),
-        'anomalies_mineures': CheckListSecurite.objects.filter(statut='anomalie_mineure').count(),
-        'non_conformes': CheckListSecurite.objects.filter(statut='non_conforme').count(),
-    }
+    stats = compter_par_statut(CheckListSecurite.objects.all(), {
+        'conformes': 'conforme',
+        'anomalies_mineures': 'anomalie_mineure',
+        'non_conformes': 'non_conforme',
+    }, cle_cache='toutes')
 
     # Statistiques des incidents
-    incident_stats = {
-        'total_incidents': IncidentSecurite.objects.count(),
-        'open_incidents': IncidentSecurite.objects.filter(statut='ouvert').count(),
-        'traite_incidents': IncidentSecurite.objects.filter(statut='traite').count(),
-        'clos_incidents': IncidentSecurite.objects.filter(statut='clos').count(),
-    }
+    incident_stats = compter(IncidentSecurite.objects.all(), {
+        'total_incidents': None,
+        'open_incidents': Q(statut='ouvert'),
+        'traite_incidents': Q(statut='traite'),
+        'clos_incidents': Q(statut='clos'),
+    }, cle_cache='toutes')
 
     # Calcul du taux de conformité
     total_checklists = stats['total']
@@ -139,6 +140,7 @@ def nouvelle_checklist(request):
                     vehicule = checklist.vehicule
                     vehicule.kilometrage_actuel = checklist.kilometrage
                     vehicule.save()
+                    definir_kilometrage(vehicule, checklist.kilometrage, 'checklist', checklist.id)
                     messages.info(request, f"Le kilométrage du véhicule {vehicule.immatriculation} a été mis à jour à {vehicule.kilometrage_actuel} km suite à la checklist.")
             elif checklist.kilometrage is not None and checklist.vehicule.kilometrage_actuel != checklist.kilometrage:
                 messages.warning(request, "Seul le personnel de sécurité peut corriger le kilométrage du véhicule.")
@@ -522,139 +524,41 @@ def corriger_kilometrage(request):
         messages.error(request, "Vous n'avez pas les droits pour accéder à cette page.")
         return redirect('home')
 
-    from core.models import HistoriqueKilometrage  # Import unique pour toute la fonction
     vehicules = Vehicule.objects.all().order_by('immatriculation')
     selected_vehicule = None
     kilometrage_actuel = None
+    apercu = None
+    nouveau_km = None
+    motif = ''
     if request.method == 'POST':
         vehicule_id = request.POST.get('vehicule')
         nouveau_km = request.POST.get('nouveau_kilometrage')
+        motif = request.POST.get('motif', '').strip()
         try:
             selected_vehicule = Vehicule.objects.get(id=vehicule_id)
             kilometrage_actuel = selected_vehicule.kilometrage_actuel
             if nouveau_km is not None and nouveau_km != '':
                 nouveau_km_int = int(nouveau_km)
-                # Stocker l'ancien kilométrage AVANT modification
-                ancien_km = selected_vehicule.kilometrage_actuel
-                selected_vehicule.kilometrage_actuel = nouveau_km_int
-                selected_vehicule.save(update_fields=["kilometrage_actuel"])
-                # Correction sur toutes les checklists liées
-                CheckListSecurite.objects.filter(vehicule=selected_vehicule).update(kilometrage=nouveau_km_int)
-                # Correction sur tous les entretiens liés
-                from entretien.models import Entretien
-                Entretien.objects.filter(vehicule=selected_vehicule).update(kilometrage=nouveau_km_int)
-                # Correction sur tous les ravitaillements liés
-                from ravitaillement.models import Ravitaillement
-                Ravitaillement.objects.filter(vehicule=selected_vehicule).update(kilometrage_avant=nouveau_km_int)
-                Ravitaillement.objects.filter(vehicule=selected_vehicule).update(kilometrage_apres=nouveau_km_int)
-                # Correction sur l'historique kilométrage
-                HistoriqueKilometrage.objects.filter(vehicule=selected_vehicule).update(valeur_apres=nouveau_km_int)
-                # Correction sur l'historique des actions (ActionTraceur.details)
-                actions = ActionTraceur.objects.filter(action__icontains=selected_vehicule.immatriculation, details__icontains='Kilométrage:')
-                for action in actions:
-                    action.details = re.sub(r'(Kilométrage: )\d+', f'Kilométrage: {nouveau_km_int}', action.details)
-                    action.save(update_fields=["details"])
-                # Correction collective sur toutes les missions (Course) du véhicule
-                from core.models import Course, HistoriqueKilometrage
-                courses = Course.objects.filter(vehicule=selected_vehicule)
-                for course in courses:
-                    old_depart = course.kilometrage_depart
-                    old_fin = course.kilometrage_fin
-                    course.kilometrage_depart = nouveau_km_int
-                    course.kilometrage_fin = nouveau_km_int
-                    course.save(update_fields=["kilometrage_depart", "kilometrage_fin"])
-                    # Historique de la modification
-                    if old_depart != nouveau_km_int:
-                        HistoriqueKilometrage.objects.create(
-                            vehicule=selected_vehicule,
-                            utilisateur=request.user,
-                            module='course',
-                            objet_id=course.pk,
-                            valeur_avant=old_depart,
-                            valeur_apres=nouveau_km_int,
-                            commentaire=f"Correction collective du kilometrage_depart via admin sécurité"
-                        )
-                    if old_fin != nouveau_km_int:
-                        HistoriqueKilometrage.objects.create(
-                            vehicule=selected_vehicule,
-                            utilisateur=request.user,
-                            module='course',
-                            objet_id=course.pk,
-                            valeur_avant=old_fin,
-                            valeur_apres=nouveau_km_int,
-                            commentaire=f"Correction collective du kilometrage_fin via admin sécurité"
-                        )
-                # Correction collective sur tous les entretiens du véhicule
-                from entretien.models import Entretien
-                entretiens = Entretien.objects.filter(vehicule=selected_vehicule)
-                for entretien in entretiens:
-                    old_km = entretien.kilometrage
-                    old_km_apres = entretien.kilometrage_apres
-                    entretien.kilometrage = nouveau_km_int
-                    entretien.kilometrage_apres = nouveau_km_int
-                    entretien.save(update_fields=["kilometrage", "kilometrage_apres"])
-                    # Historique de la modification
-                    if old_km != nouveau_km_int:
-                        HistoriqueKilometrage.objects.create(
-                            vehicule=selected_vehicule,
-                            utilisateur=request.user,
-                            module='entretien',
-                            objet_id=entretien.pk,
-                            valeur_avant=old_km,
-                            valeur_apres=nouveau_km_int,
-                            commentaire=f"Correction collective du kilometrage via admin sécurité"
-                        )
-                    if old_km_apres != nouveau_km_int:
-                        HistoriqueKilometrage.objects.create(
-                            vehicule=selected_vehicule,
-                            utilisateur=request.user,
-                            module='entretien',
-                            objet_id=entretien.pk,
-                            valeur_avant=old_km_apres,
-                            valeur_apres=nouveau_km_int,
-                            commentaire=f"Correction collective du kilometrage_apres via admin sécurité"
-                        )
-                # Correction collective sur tous les ravitaillements du véhicule (seulement kilometrage_apres)
-                from ravitaillement.models import Ravitaillement
-                ravitaillements = Ravitaillement.objects.filter(vehicule=selected_vehicule)
-                for ravitaillement in ravitaillements:
-                    old_km_apres = ravitaillement.kilometrage_apres
-                    ravitaillement.kilometrage_apres = nouveau_km_int
-                    ravitaillement.save(update_fields=["kilometrage_apres"])
-                    # Historique de la modification
-                    if old_km_apres != nouveau_km_int:
-                        HistoriqueKilometrage.objects.create(
-                            vehicule=selected_vehicule,
-                            utilisateur=request.user,
-                            module='ravitaillement',
-                            objet_id=ravitaillement.pk,
-                            valeur_avant=old_km_apres,
-                            valeur_apres=nouveau_km_int,
-                            commentaire=f"Correction collective du kilometrage_apres via admin sécurité"
-                        )
-                # Avant la correction, stocker l'ancien kilométrage
-                # ancien_km = selected_vehicule.kilometrage_actuel # This line is removed as it's now defined above
-                # Après la correction, enregistrer dans l'historique de correction
-                # (ancien_km est bien l'ancienne valeur, nouveau_km_int la nouvelle)
-                motif = request.POST.get('motif', '').strip()
+                # Le motif est vérifié avant toute modification
                 if not motif:
                     messages.error(request, "Le motif de la correction est obligatoire.")
                     return redirect(request.path)
-                chauffeur = None
-                if 'chauffeur_id' in request.POST:
-                    try:
-                        chauffeur = Utilisateur.objects.get(id=request.POST['chauffeur_id'])
-                    except Utilisateur.DoesNotExist:
-                        chauffeur = None
-                HistoriqueCorrectionKilometrage.objects.create(
-                    vehicule=selected_vehicule,
-                    chauffeur=chauffeur,
-                    valeur_avant=ancien_km,
-                    valeur_apres=nouveau_km_int,
-                    motif=motif,
-                    auteur=request.user
-                )
-                messages.success(request, f"Kilométrage du véhicule {selected_vehicule.immatriculation} corrigé à {nouveau_km} km partout (missions, entretiens et ravitaillements inclus - seul kilometrage_apres modifié pour ravitaillements).")
+                chauffeur_id = request.POST.get('chauffeur_id') or None
+                if chauffeur_id and not Utilisateur.objects.filter(id=chauffeur_id).exists():
+                    chauffeur_id = None
+
+                # Aperçu des lignes concernées ; la correction est appliquée en une transaction (securite.corrections)
+                apercu = apercu_correction(selected_vehicule, nouveau_km_int)
+                if request.POST.get('action') != 'apercu':
+                    if doit_passer_en_arriere_plan(apercu):
+                        soumettre_correction(selected_vehicule.id, nouveau_km_int, request.user.id, motif, chauffeur_id)
+                        messages.info(request, f"Correction du véhicule {selected_vehicule.immatriculation} mise en file ({apercu['total']} lignes concernées). Vous serez notifié à la fin du traitement.")
+                    else:
+                        appliquer_correction(selected_vehicule.id, nouveau_km_int, request.user.id, motif, chauffeur_id)
+                        messages.success(request, f"Kilométrage du véhicule {selected_vehicule.immatriculation} corrigé à {nouveau_km} km partout (missions, entretiens, ravitaillements et check-lists inclus).")
+                    return redirect(f"{request.path}?vehicule={selected_vehicule.id}")
+        except ValueError:
+            messages.error(request, "Le nouveau kilométrage doit être un nombre entier.")
         except Vehicule.DoesNotExist:
             messages.error(request, "Véhicule introuvable.")
     elif request.method == 'GET' and request.GET.get('vehicule'):
@@ -669,6 +573,9 @@ def corriger_kilometrage(request):
         'vehicules': vehicules,
         'selected_vehicule': selected_vehicule,
         'kilometrage_actuel': kilometrage_actuel,
+        'apercu': apercu,
+        'nouveau_kilometrage': nouveau_km,
+        'motif': motif,
     }
     return render(request, 'securite/corriger_kilometrage.html', context)
 
@@ -676,11 +583,10 @@ def get_kilometrage_vehicule(request):
     vehicule_id = request.GET.get('vehicule_id')
     if not vehicule_id:
         return JsonResponse({'success': False, 'error': 'Aucun véhicule spécifié.'})
-    try:
-        vehicule = Vehicule.objects.get(id=vehicule_id)
-        return JsonResponse({'success': True, 'kilometrage_actuel': vehicule.kilometrage_actuel})
-    except Vehicule.DoesNotExist:
+    releve = lire_releve(int(vehicule_id)) if vehicule_id.isdigit() else None
+    if releve is None:
         return JsonResponse({'success': False, 'error': 'Véhicule introuvable.'})
+    return JsonResponse({'success': True, 'kilometrage_actuel': releve['kilometrage']})
 
 @login_required
 def historique_corrections_km(request):
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import SuiviVehicule
+from .models import SuiviVehicule, FaitJournalierVehicule
 
 class SuiviVehiculeAdmin(admin.ModelAdmin):
     list_display = ('vehicule', 'date', 'distance_parcourue', 'nombre_courses')
@@ -9,3 +9,12 @@ class SuiviVehiculeAdmin(admin.ModelAdmin):
     readonly_fields = ('vehicule', 'date', 'distance_parcourue', 'nombre_courses')
 
 admin.site.register(SuiviVehicule, SuiviVehiculeAdmin)
+
+class FaitJournalierVehiculeAdmin(admin.ModelAdmin):
+    list_display = ('vehicule', 'date', 'distance', 'nombre_missions', 'litres', 'cout_carburant', 'cout_maintenance', 'chauffeur')
+    list_filter = ('date',)
+    search_fields = ('vehicule__immatriculation',)
+    date_hierarchy = 'date'
+    readonly_fields = ('vehicule', 'date', 'distance', 'nombre_missions', 'litres', 'cout_carburant', 'cout_maintenance', 'chauffeur', 'date_maj')
+
+admin.site.register(FaitJournalierVehicule, FaitJournalierVehiculeAdmin)
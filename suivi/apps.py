@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SuiviConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'suivi'
+
+    def ready(self):
+        import suivi.signals  # noqa
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from core.models import Vehicule
+from suivi.models import SuiviVehicule
+
+
+class Command(BaseCommand):
+    help = 'Recalcule entièrement les totaux cumulés du suivi des véhicules (distance, entretiens, carburant)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--vehicule',
+            type=str,
+            help='Immatriculation du véhicule à recalculer (optionnel)'
+        )
+
+    def handle(self, *args, **options):
+        vehicule_immat = options.get('vehicule')
+
+        # Filtrer les véhicules
+        vehicules = Vehicule.objects.filter(suivis__isnull=False).distinct()
+        if vehicule_immat:
+            vehicules = vehicules.filter(immatriculation__icontains=vehicule_immat)
+
+        total_lignes = 0
+        for vehicule in vehicules:
+            nb_lignes = SuiviVehicule.reconstruire(vehicule)
+            total_lignes += nb_lignes
+            self.stdout.write(f"{vehicule.immatriculation}: {nb_lignes} lignes de suivi recalculées")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"\n✅ {total_lignes} lignes de suivi recalculées")
+        )
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from suivi.models import FaitJournalierVehicule
+
+
+class Command(BaseCommand):
+    help = 'Reconstruit les faits journaliers de la flotte à partir des courses, ravitaillements et entretiens'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jours',
+            type=int,
+            default=7,
+            help='Nombre de jours à reconstruire en remontant depuis aujourd\'hui (défaut: 7)'
+        )
+        parser.add_argument(
+            '--depuis',
+            type=str,
+            help='Date de début (AAAA-MM-JJ), prioritaire sur --jours'
+        )
+        parser.add_argument(
+            '--jusqu-a',
+            dest='jusqu_a',
+            type=str,
+            help='Date de fin (AAAA-MM-JJ), aujourd\'hui par défaut'
+        )
+
+    def _parse_date(self, valeur):
+        try:
+            return datetime.strptime(valeur, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f"Date invalide : {valeur} (format attendu AAAA-MM-JJ)")
+
+    def handle(self, *args, **options):
+        date_fin = self._parse_date(options['jusqu_a']) if options.get('jusqu_a') else timezone.localdate()
+        if options.get('depuis'):
+            date_debut = self._parse_date(options['depuis'])
+        else:
+            date_debut = date_fin - timedelta(days=max(options['jours'], 1) - 1)
+        if date_debut > date_fin:
+            raise CommandError("La date de début doit précéder la date de fin")
+
+        nb_lignes = FaitJournalierVehicule.reconcilier(date_debut, date_fin)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ {nb_lignes} faits journaliers reconstruits du {date_debut:%d/%m/%Y} au {date_fin:%d/%m/%Y}"
+            )
+        )
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_historiquecorrectionkilometrage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('suivi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaitJournalierVehicule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('distance', models.PositiveIntegerField(default=0)),
+                ('nombre_missions', models.PositiveIntegerField(default=0)),
+                ('litres', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('cout_carburant', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cout_maintenance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('date_maj', models.DateTimeField(auto_now=True)),
+                ('chauffeur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='faits_journaliers', to=settings.AUTH_USER_MODEL)),
+                ('vehicule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='faits_journaliers', to='core.vehicule')),
+            ],
+            options={
+                'verbose_name': 'Fait journalier véhicule',
+                'verbose_name_plural': 'Faits journaliers véhicules',
+                'indexes': [models.Index(fields=['date'], name='suivi_fait_date_idx')],
+                'unique_together': {('vehicule', 'date')},
+            },
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
-from core.models import Vehicule
-from django.db.models import Sum
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
+from core.models import Vehicule, Course, Utilisateur
+from django.db.models import Sum, Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, TruncDate
 from entretien.models import Entretien
 from ravitaillement.models import Ravitaillement
 
@@ -23,37 +25,108 @@ class SuiviVehicule(models.Model):
     
     @classmethod
     def mettre_a_jour_suivi(cls, vehicule, date, distance):
-        """Met à jour le suivi journalier pour un véhicule"""
-        obj, created = cls.objects.get_or_create(
-            vehicule=vehicule,
-            date=date,
-            defaults={
-                'distance_parcourue': distance, 
-                'nombre_courses': 1,
-                'date_immatriculation': vehicule.date_immatriculation if hasattr(vehicule, 'date_immatriculation') else None
-            }
+        """Met à jour le suivi journalier pour un véhicule (une course terminée de plus)"""
+        return cls.appliquer_variation(vehicule, date, distance=distance, courses=1)
+
+    @classmethod
+    def appliquer_variation(cls, vehicule, date, distance=0, courses=0, entretiens=0, litres=0):
+        """
+        Applique une variation aux compteurs du suivi, en coût constant.
+
+        Les totaux cumulés (distance totale, entretiens, carburant) sont portés
+        d'une ligne à l'autre : une nouvelle journée reprend les totaux de la
+        journée précédente au lieu de ré-agréger tout l'historique du véhicule.
+        La ligne du jour est modifiée par une seule écriture (expressions F),
+        ce qui rend la mise à jour sûre en cas d'accès concurrents.
+        """
+        variations = {
+            'distance_parcourue': F('distance_parcourue') + distance,
+            'nombre_courses': F('nombre_courses') + courses,
+            'distance_totale': F('distance_totale') + distance,
+            'nombre_entretiens': F('nombre_entretiens') + entretiens,
+            'volume_carburant_consomme': F('volume_carburant_consomme') + litres,
+        }
+        with transaction.atomic():
+            suivis = cls.objects.filter(vehicule=vehicule)
+            if not suivis.filter(date=date).update(**variations):
+                precedent = suivis.filter(date__lt=date).order_by('-date').values(
+                    'distance_totale', 'nombre_entretiens', 'volume_carburant_consomme'
+                ).first()
+                entretiens_du_jour, litres_du_jour = entretiens, litres
+                if precedent is None:
+                    # Pas de ligne antérieure : totaux sources jusqu'à la date, comme `reconstruire`.
+                    # Ils reflètent déjà l'événement courant, qui reste à reporter sur les jours suivants.
+                    precedent = {
+                        'distance_totale': 0,
+                        'nombre_entretiens': Entretien.objects.filter(vehicule=vehicule, date_entretien__lte=date).count(),
+                        'volume_carburant_consomme': Ravitaillement.objects.filter(
+                            vehicule=vehicule, date_ravitaillement__date__lte=date
+                        ).aggregate(Sum('litres'))['litres__sum'] or 0,
+                    }
+                    entretiens_du_jour, litres_du_jour = 0, 0
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(
+                            vehicule=vehicule,
+                            date=date,
+                            date_immatriculation=getattr(vehicule, 'date_immatriculation', None),
+                            distance_parcourue=distance,
+                            nombre_courses=courses,
+                            distance_totale=precedent['distance_totale'] + distance,
+                            nombre_entretiens=max(precedent['nombre_entretiens'] + entretiens_du_jour, 0),
+                            volume_carburant_consomme=max(precedent['volume_carburant_consomme'] + litres_du_jour, 0),
+                        )
+                except IntegrityError:
+                    # Ligne créée entre-temps par une autre requête
+                    suivis.filter(date=date).update(**variations)
+            # Reporter la variation sur les journées postérieures (saisie rétroactive, rare)
+            if distance or entretiens or litres:
+                suivis.filter(date__gt=date).update(
+                    distance_totale=variations['distance_totale'],
+                    nombre_entretiens=variations['nombre_entretiens'],
+                    volume_carburant_consomme=variations['volume_carburant_consomme'],
+                )
+        return suivis.filter(date=date).first()
+
+    @classmethod
+    def reconstruire(cls, vehicule):
+        """
+        Recalcule entièrement les totaux cumulés des lignes de suivi d'un véhicule.
+
+        Chaque ligne reçoit la distance cumulée jusqu'à sa date, le nombre
+        d'entretiens et le volume de carburant enregistrés jusqu'à cette date.
+        Retourne le nombre de lignes mises à jour.
+        """
+        suivis = list(cls.objects.filter(vehicule=vehicule).order_by('date'))
+        if not suivis:
+            return 0
+        dates_entretiens = sorted(Entretien.objects.filter(vehicule=vehicule).values_list('date_entretien', flat=True))
+        litres_par_jour = {}
+        for r in Ravitaillement.objects.filter(vehicule=vehicule).annotate(
+            jour=TruncDate('date_ravitaillement')
+        ).values('jour').annotate(litres=Sum('litres')).order_by():
+            litres_par_jour[r['jour']] = r['litres'] or 0
+        jours_ravitaillement = sorted(litres_par_jour)
+
+        distance_totale = 0
+        i_entretien = 0
+        i_ravitaillement = 0
+        volume = 0
+        for suivi in suivis:
+            distance_totale += suivi.distance_parcourue
+            while i_entretien < len(dates_entretiens) and dates_entretiens[i_entretien] <= suivi.date:
+                i_entretien += 1
+            while i_ravitaillement < len(jours_ravitaillement) and jours_ravitaillement[i_ravitaillement] <= suivi.date:
+                volume += litres_par_jour[jours_ravitaillement[i_ravitaillement]]
+                i_ravitaillement += 1
+            suivi.distance_totale = distance_totale
+            suivi.nombre_entretiens = i_entretien
+            suivi.volume_carburant_consomme = volume
+        cls.objects.bulk_update(
+            suivis, ['distance_totale', 'nombre_entretiens', 'volume_carburant_consomme'], batch_size=500
         )
-        
-        if not created:
-            obj.distance_parcourue += distance
-            obj.nombre_courses += 1
-            obj.save()
-        
-        # Mettre à jour la distance totale
-        obj.distance_totale = cls.distance_totale_par_vehicule(vehicule)
-        
-        # Mettre à jour le nombre d'entretiens
-        obj.nombre_entretiens = Entretien.objects.filter(vehicule=vehicule).count()
-        
-        # Mettre à jour le volume de carburant consommé
-        obj.volume_carburant_consomme = Ravitaillement.objects.filter(
-            vehicule=vehicule
-        ).aggregate(Sum('litres'))['litres__sum'] or 0
-        
-        obj.save()
-        
-        return obj
-    
+        return len(suivis)
+
     @classmethod
     def distance_totale_par_vehicule(cls, vehicule):
         """Retourne la distance totale parcourue par un véhicule"""
@@ -66,3 +139,148 @@ class SuiviVehicule(models.Model):
             vehicule=vehicule, 
             date__range=[date_debut, date_fin]
         ).aggregate(Sum('distance_parcourue'))['distance_parcourue__sum'] or 0
+
+
+def date_course(course):
+    """Retourne le jour (heure locale) auquel une course est rattachée dans les faits journaliers"""
+    moment = course.date_souhaitee or course.date_depart or course.date_demande
+    return timezone.localtime(moment).date() if moment else None
+
+
+def _jour_course():
+    """Expression SQL équivalente à date_course()"""
+    return TruncDate(Coalesce('date_souhaitee', 'date_depart', 'date_demande'))
+
+
+class FaitJournalierVehicule(models.Model):
+    """
+    Agrégat journalier par véhicule (table de faits) maintenu à l'écriture.
+
+    Chaque ligne résume l'activité d'un véhicule sur une journée : distance,
+    missions, carburant et maintenance. Les lignes sont recalculées lors de
+    l'enregistrement d'une course, d'un ravitaillement ou d'un entretien
+    (voir suivi.signals) et réconciliées chaque nuit par la commande
+    reconcilier_faits_journaliers. Les rapports de flotte journaliers,
+    hebdomadaires et mensuels deviennent de simples parcours de plage de dates.
+    """
+    vehicule = models.ForeignKey(Vehicule, on_delete=models.CASCADE, related_name='faits_journaliers')
+    date = models.DateField()
+    distance = models.PositiveIntegerField(default=0)
+    nombre_missions = models.PositiveIntegerField(default=0)
+    litres = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    cout_carburant = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cout_maintenance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    chauffeur = models.ForeignKey(Utilisateur, on_delete=models.SET_NULL, null=True, blank=True, related_name='faits_journaliers')
+    date_maj = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Fait journalier véhicule"
+        verbose_name_plural = "Faits journaliers véhicules"
+        unique_together = ('vehicule', 'date')
+        indexes = [
+            models.Index(fields=['date'], name='suivi_fait_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.vehicule.immatriculation} - {self.date} - {self.distance} km"
+
+    @classmethod
+    def _courses_du_jour(cls, date):
+        return Course.objects.annotate(jour=_jour_course()).filter(jour=date)
+
+    @classmethod
+    def recalculer(cls, vehicule_id, date):
+        """Recalcule la ligne d'un véhicule pour une journée à partir des données sources"""
+        if not vehicule_id or not date:
+            return None
+        courses = cls._courses_du_jour(date).filter(vehicule_id=vehicule_id)
+        stats_courses = courses.aggregate(distance=Sum('distance_parcourue'), missions=Count('id'))
+        premiere_course = courses.exclude(chauffeur__isnull=True).order_by('pk').values('chauffeur_id').first()
+        stats_carburant = Ravitaillement.objects.filter(
+            vehicule_id=vehicule_id, date_ravitaillement__date=date
+        ).aggregate(litres=Sum('litres'), cout=Sum('cout_total'))
+        cout_maintenance = Entretien.objects.filter(
+            vehicule_id=vehicule_id, date_entretien=date
+        ).aggregate(cout=Sum('cout'))['cout']
+
+        valeurs = {
+            'distance': stats_courses['distance'] or 0,
+            'nombre_missions': stats_courses['missions'],
+            'litres': stats_carburant['litres'] or 0,
+            'cout_carburant': stats_carburant['cout'] or 0,
+            'cout_maintenance': cout_maintenance or 0,
+            'chauffeur_id': premiere_course['chauffeur_id'] if premiere_course else None,
+        }
+        if not any([valeurs['nombre_missions'], valeurs['litres'], valeurs['cout_carburant'], valeurs['cout_maintenance']]):
+            cls.objects.filter(vehicule_id=vehicule_id, date=date).delete()
+            return None
+        obj, _ = cls.objects.update_or_create(vehicule_id=vehicule_id, date=date, defaults=valeurs)
+        return obj
+
+    @classmethod
+    def reconcilier(cls, date_debut, date_fin):
+        """
+        Reconstruit toutes les lignes de la période en requêtes groupées.
+
+        Retourne le nombre de lignes écrites.
+        """
+        faits = {}
+
+        def ligne(vehicule_id, jour):
+            cle = (vehicule_id, jour)
+            if cle not in faits:
+                faits[cle] = cls(vehicule_id=vehicule_id, date=jour)
+            return faits[cle]
+
+        courses = Course.objects.annotate(jour=_jour_course()).filter(
+            jour__range=[date_debut, date_fin], vehicule__isnull=False
+        )
+        premier_chauffeur = Subquery(
+            Course.objects.annotate(jour=_jour_course()).filter(
+                vehicule_id=OuterRef('vehicule_id'), jour=OuterRef('jour'), chauffeur__isnull=False
+            ).order_by('pk').values('chauffeur_id')[:1]
+        )
+        for r in courses.values('vehicule_id', 'jour').annotate(
+            distance=Sum('distance_parcourue'), missions=Count('id'), chauffeur_id=premier_chauffeur
+        ).order_by():
+            fait = ligne(r['vehicule_id'], r['jour'])
+            fait.distance = r['distance'] or 0
+            fait.nombre_missions = r['missions']
+            fait.chauffeur_id = r['chauffeur_id']
+
+        ravitaillements = Ravitaillement.objects.annotate(jour=TruncDate('date_ravitaillement')).filter(
+            jour__range=[date_debut, date_fin]
+        )
+        for r in ravitaillements.values('vehicule_id', 'jour').annotate(
+            litres=Sum('litres'), cout=Sum('cout_total')
+        ).order_by():
+            fait = ligne(r['vehicule_id'], r['jour'])
+            fait.litres = r['litres'] or 0
+            fait.cout_carburant = r['cout'] or 0
+
+        entretiens = Entretien.objects.filter(date_entretien__range=[date_debut, date_fin])
+        for r in entretiens.values('vehicule_id', 'date_entretien').annotate(cout=Sum('cout')).order_by():
+            fait = ligne(r['vehicule_id'], r['date_entretien'])
+            fait.cout_maintenance = r['cout'] or 0
+
+        with transaction.atomic():
+            cls.objects.filter(date__range=[date_debut, date_fin]).delete()
+            cls.objects.bulk_create(faits.values(), batch_size=500)
+        return len(faits)
+
+    @classmethod
+    def totaux_par_vehicule(cls, date_debut, date_fin, vehicules=None):
+        """Retourne {vehicule_id: totaux} sur une période (jour, semaine, mois...)"""
+        faits = cls.objects.filter(date__range=[date_debut, date_fin])
+        if vehicules is not None:
+            faits = faits.filter(vehicule__in=vehicules)
+        return {
+            r['vehicule_id']: r
+            for r in faits.values('vehicule_id').annotate(
+                distance_totale=Sum('distance'),
+                missions=Sum('nombre_missions'),
+                litres_total=Sum('litres'),
+                cout_carburant_total=Sum('cout_carburant'),
+                cout_maintenance_total=Sum('cout_maintenance'),
+            ).order_by()
+        }
@@ -0,0 +1,88 @@
+"""
+Maintenance incrémentale des faits journaliers et du suivi des véhicules.
+
+Chaque enregistrement ou suppression d'une course, d'un ravitaillement ou d'un
+entretien recalcule uniquement la ligne (véhicule, jour) concernée. Les
+déplacements d'une donnée vers un autre véhicule ou un autre jour sont
+rattrapés par la réconciliation nocturne.
+"""
+import logging
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from core.models import Course, Vehicule
+from entretien.models import Entretien
+from ravitaillement.models import Ravitaillement
+from .models import FaitJournalierVehicule, SuiviVehicule, date_course
+
+logger = logging.getLogger(__name__)
+
+
+def _suppression_du_vehicule(kwargs):
+    """Vrai si la suppression provient de celle du véhicule (ses lignes de suivi disparaissent aussi)"""
+    return isinstance(kwargs.get('origin'), Vehicule)
+
+
+def _recalculer_fait(vehicule_id, date):
+    try:
+        with transaction.atomic():
+            FaitJournalierVehicule.recalculer(vehicule_id, date)
+    except Exception as e:
+        # Ne jamais bloquer l'enregistrement métier : la réconciliation nocturne rattrapera
+        logger.error(f"Erreur lors de la mise à jour du fait journalier ({vehicule_id}, {date}): {e}")
+
+
+@receiver([post_save, post_delete], sender=Course)
+def maj_fait_course(sender, instance, **kwargs):
+    if _suppression_du_vehicule(kwargs):
+        return
+    _recalculer_fait(instance.vehicule_id, date_course(instance))
+
+
+@receiver([post_save, post_delete], sender=Ravitaillement)
+def maj_fait_ravitaillement(sender, instance, **kwargs):
+    if _suppression_du_vehicule(kwargs):
+        return
+    if instance.date_ravitaillement:
+        _recalculer_fait(instance.vehicule_id, timezone.localtime(instance.date_ravitaillement).date())
+
+
+@receiver([post_save, post_delete], sender=Entretien)
+def maj_fait_entretien(sender, instance, **kwargs):
+    if _suppression_du_vehicule(kwargs):
+        return
+    _recalculer_fait(instance.vehicule_id, instance.date_entretien)
+
+
+def _appliquer_variation_suivi(vehicule, date, **variations):
+    try:
+        SuiviVehicule.appliquer_variation(vehicule, date, **variations)
+    except Exception as e:
+        # La commande rebuild_suivi permet de recalculer les totaux en cas d'échec
+        logger.error(f"Erreur lors de la mise à jour du suivi ({vehicule}, {date}): {e}")
+
+
+@receiver(post_save, sender=Entretien)
+def suivi_entretien_cree(sender, instance, created, **kwargs):
+    if created:
+        _appliquer_variation_suivi(instance.vehicule, instance.date_entretien, entretiens=1)
+
+
+@receiver(post_delete, sender=Entretien)
+def suivi_entretien_supprime(sender, instance, **kwargs):
+    if _suppression_du_vehicule(kwargs):
+        return
+    _appliquer_variation_suivi(instance.vehicule, instance.date_entretien, entretiens=-1)
+
+
+@receiver(post_save, sender=Ravitaillement)
+def suivi_ravitaillement_cree(sender, instance, created, **kwargs):
+    if created and instance.litres:
+        _appliquer_variation_suivi(instance.vehicule, timezone.localtime(instance.date_ravitaillement).date(), litres=instance.litres)
+
+
+@receiver(post_delete, sender=Ravitaillement)
+def suivi_ravitaillement_supprime(sender, instance, **kwargs):
+    if instance.litres and not _suppression_du_vehicule(kwargs):
+        _appliquer_variation_suivi(instance.vehicule, timezone.localtime(instance.date_ravitaillement).date(), litres=-instance.litres)
@@ -1,6 +1,14 @@
+import json
 from django.test import TestCase, Client
 from django.urls import reverse
-from core.models import Etablissement, Utilisateur, Vehicule
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.utils import timezone
+from core.models import Etablissement, Utilisateur, Vehicule, Course
+from entretien.models import Entretien
+from ravitaillement.models import Ravitaillement
+from .models import FaitJournalierVehicule, SuiviVehicule
 
 # Create your tests here.
 
@@ -24,3 +32,107 @@ class IsolationDepartementSuiviTest(TestCase):
         response = client.get(reverse("suivi:suivi_vehicules"))
         self.assertContains(response, "BBB222")
         self.assertNotContains(response, "AAA111")
+
+    def test_export_vehicules_par_etablissement(self):
+        Course.objects.create(demandeur=self.user1, vehicule=self.vehicule1, point_embarquement="A", destination="B", motif="Test", statut='terminee', kilometrage_depart=100, kilometrage_fin=180)
+        Ravitaillement.objects.create(vehicule=self.vehicule1, createur=self.user1, litres=10, cout_unitaire=2, kilometrage_avant=180, kilometrage_apres=200)
+        self.client.login(username="user1", password="testpass1")
+        response = self.client.get(reverse("suivi:export_vehicules_excel"), {'format': 'jsonl'})
+        lignes = [json.loads(ligne) for ligne in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([ligne['immatriculation'] for ligne in lignes], ["AAA111"])
+        self.assertEqual((lignes[0]['distance_totale'], lignes[0]['nombre_entretiens'], lignes[0]['volume_carburant']), (80, 0, 10.0))
+        self.assertEqual(lignes[0]['statut'], "Disponible")
+
+
+class FaitJournalierVehiculeTest(TestCase):
+    def setUp(self):
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.user = Utilisateur.objects.create_user(username="chauffeur1", password="testpass1", etablissement=self.dep, role="chauffeur")
+        self.vehicule = Vehicule.objects.create(immatriculation="AAA111", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.dep, numero_chassis="CHASSIS1", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+        self.today = timezone.localdate()
+
+    def _alimenter(self):
+        Course.objects.create(demandeur=self.user, chauffeur=self.user, vehicule=self.vehicule, point_embarquement="A", destination="B", motif="Test", statut='terminee', kilometrage_depart=1000, kilometrage_fin=1120)
+        Ravitaillement.objects.create(vehicule=self.vehicule, litres=20, cout_unitaire=2, kilometrage_avant=1120, kilometrage_apres=1130, createur=self.user)
+        Entretien.objects.create(vehicule=self.vehicule, motif="Vidange", garage="Garage A", cout=75, date_entretien=self.today, createur=self.user)
+
+    def test_maintenance_incrementale(self):
+        self._alimenter()
+        fait = FaitJournalierVehicule.objects.get(vehicule=self.vehicule, date=self.today)
+        self.assertEqual(fait.distance, 120)
+        self.assertEqual(fait.nombre_missions, 1)
+        self.assertEqual(fait.litres, 20)
+        self.assertEqual(fait.cout_carburant, 40)
+        self.assertEqual(fait.cout_maintenance, 75)
+        self.assertEqual(fait.chauffeur, self.user)
+
+    def test_reconciliation(self):
+        self._alimenter()
+        FaitJournalierVehicule.objects.all().delete()
+        self.assertEqual(FaitJournalierVehicule.reconcilier(self.today, self.today), 1)
+        fait = FaitJournalierVehicule.objects.get(vehicule=self.vehicule, date=self.today)
+        self.assertEqual(fait.distance, 120)
+        self.assertEqual(fait.cout_maintenance, 75)
+        self.assertEqual(fait.chauffeur, self.user)
+        totaux = FaitJournalierVehicule.totaux_par_vehicule(self.today, self.today)
+        self.assertEqual(totaux[self.vehicule.pk]['missions'], 1)
+
+
+class SuiviVehiculeIncrementalTest(TestCase):
+    def setUp(self):
+        self.dep = Etablissement.objects.create(nom="Département A")
+        self.user = Utilisateur.objects.create_user(username="chauffeur1", password="testpass1", etablissement=self.dep, role="chauffeur")
+        self.vehicule = Vehicule.objects.create(immatriculation="AAA111", marque="Renault", modele="Clio", couleur="rouge", etablissement=self.dep, numero_chassis="CHASSIS1", date_expiration_assurance="2030-01-01", date_expiration_controle_technique="2030-01-01", date_expiration_vignette="2030-01-01", date_expiration_stationnement="2030-01-01")
+        self.today = timezone.localdate()
+
+    def test_totaux_portes_de_la_veille(self):
+        hier = self.today - timedelta(days=1)
+        SuiviVehicule.mettre_a_jour_suivi(self.vehicule, hier, 100)
+        Entretien.objects.create(vehicule=self.vehicule, motif="Vidange", garage="Garage A", cout=75, date_entretien=self.today, createur=self.user)
+        Ravitaillement.objects.create(vehicule=self.vehicule, litres=20, cout_unitaire=2, kilometrage_avant=1100, kilometrage_apres=1110, createur=self.user)
+        SuiviVehicule.mettre_a_jour_suivi(self.vehicule, self.today, 50)
+        suivi = SuiviVehicule.mettre_a_jour_suivi(self.vehicule, self.today, 30)
+        self.assertEqual(suivi.distance_parcourue, 80)
+        self.assertEqual(suivi.nombre_courses, 2)
+        self.assertEqual(suivi.distance_totale, 180)
+        self.assertEqual(suivi.nombre_entretiens, 1)
+        self.assertEqual(suivi.volume_carburant_consomme, 20)
+
+    def test_premiere_ligne_et_saisie_retroactive(self):
+        hier = self.today - timedelta(days=1)
+        SuiviVehicule.mettre_a_jour_suivi(self.vehicule, self.today, 10)
+        # Entretien antérieur à la première ligne : la ligne de la veille est créée, le jour suivant reporté
+        Entretien.objects.create(vehicule=self.vehicule, motif="Vidange", garage="Garage A", cout=75, date_entretien=hier, createur=self.user)
+        self.assertEqual(SuiviVehicule.objects.get(vehicule=self.vehicule, date=hier).nombre_entretiens, 1)
+        self.assertEqual(SuiviVehicule.objects.get(vehicule=self.vehicule, date=self.today).nombre_entretiens, 1)
+        # Première ligne d'une date passée : les entretiens postérieurs ne sont pas comptés
+        avant_hier = self.today - timedelta(days=2)
+        Entretien.objects.create(vehicule=self.vehicule, motif="Pneus", garage="Garage A", cout=50, date_entretien=self.today, createur=self.user)
+        SuiviVehicule.mettre_a_jour_suivi(self.vehicule, avant_hier, 5)
+        self.assertEqual(SuiviVehicule.objects.get(vehicule=self.vehicule, date=avant_hier).nombre_entretiens, 0)
+        totaux = list(SuiviVehicule.objects.filter(vehicule=self.vehicule).order_by('date').values_list('nombre_entretiens', 'distance_totale'))
+        SuiviVehicule.reconstruire(self.vehicule)
+        self.assertEqual(list(SuiviVehicule.objects.filter(vehicule=self.vehicule).order_by('date').values_list('nombre_entretiens', 'distance_totale')), totaux)
+
+    def test_mise_a_jour_en_cout_constant(self):
+        SuiviVehicule.mettre_a_jour_suivi(self.vehicule, self.today, 10)
+        # Savepoint, mise à jour du jour, report sur les jours suivants, release, relecture
+        with self.assertNumQueries(5):
+            SuiviVehicule.mettre_a_jour_suivi(self.vehicule, self.today, 10)
+
+    def test_reconstruction(self):
+        SuiviVehicule.mettre_a_jour_suivi(self.vehicule, self.today - timedelta(days=2), 100)
+        SuiviVehicule.mettre_a_jour_suivi(self.vehicule, self.today, 50)
+        Entretien.objects.create(vehicule=self.vehicule, motif="Vidange", garage="Garage A", cout=75, date_entretien=self.today - timedelta(days=1), createur=self.user)
+        SuiviVehicule.objects.update(distance_totale=0, nombre_entretiens=0)
+        call_command('rebuild_suivi', stdout=StringIO())
+        suivi = SuiviVehicule.objects.get(vehicule=self.vehicule, date=self.today)
+        self.assertEqual(suivi.distance_totale, 150)
+        self.assertEqual(suivi.nombre_entretiens, 1)
+
+    def test_suppression_vehicule(self):
+        SuiviVehicule.mettre_a_jour_suivi(self.vehicule, self.today, 10)
+        Entretien.objects.create(vehicule=self.vehicule, motif="Vidange", garage="Garage A", cout=75, date_entretien=self.today, createur=self.user)
+        self.vehicule.delete()
+        self.assertFalse(SuiviVehicule.objects.exists())
+        self.assertFalse(FaitJournalierVehicule.objects.exists())
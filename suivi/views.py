@@ -5,10 +5,11 @@ from core.models import Vehicule, Course, ActionTraceur
 from entretien.models import Entretien
 from ravitaillement.models import Ravitaillement
 from .models import SuiviVehicule
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum, Count, Q, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.http import HttpResponse
 import csv
-import xlwt
+from core.exports import Colonne, exporter
 from django.template.loader import get_template
 # from xhtml2pdf import pisa  # Temporairement commenté pour le déploiement
 from io import BytesIO
@@ -129,60 +130,85 @@ def export_vehicules_pdf(request):
         content_type='text/plain'
     )
 
+def _perimetre(request, queryset, champ='etablissement'):
+    """Restreint un export à l'établissement de l'utilisateur (sauf superutilisateur)"""
+    if request.user.is_superuser:
+        return queryset
+    return queryset.filter(**{champ: request.user.etablissement})
+
+
+def _nom_perimetre(request):
+    if request.user.is_superuser or not request.user.etablissement:
+        return 'Tous'
+    return request.user.etablissement.nom
+
+
+def _par_vehicule(queryset, agregat):
+    """Sous-requête : agrégat calculé sur les lignes du véhicule courant (0 sans ligne)"""
+    sous_requete = Subquery(
+        queryset.filter(vehicule=OuterRef('pk')).order_by().values('vehicule').annotate(total=agregat).values('total')[:1]
+    )
+    return Coalesce(sous_requete, Value(0), output_field=sous_requete.output_field)
+
+
+def _nom_ou_identifiant(utilisateur):
+    return utilisateur.get_full_name() or utilisateur.username if utilisateur else None
+
+
+COLONNES_VEHICULES = [
+    Colonne('Immatriculation', 'immatriculation', largeur=18),
+    Colonne('Marque', 'marque', largeur=18),
+    Colonne('Modèle', 'modele', largeur=18),
+    Colonne('Date Immatriculation', 'date_immatriculation', largeur=20, format='date', defaut="Non renseignée"),
+    Colonne('Distance Parcourue (km)', 'distance_totale', largeur=22, format='entier', defaut=0),
+    Colonne('Nombre Entretiens', 'nombre_entretiens', largeur=18, format='entier', defaut=0),
+    Colonne('Volume Carburant (L)', 'volume_carburant', largeur=20, format='decimal', defaut=0),
+    Colonne('Statut', lambda vehicule: "Indisponible" if vehicule.en_mission else "Disponible", largeur=14, cle='statut'),
+]
+
+COLONNES_MISSIONS = [
+    Colonne('Date', 'date_demande', largeur=18, format='datetime'),
+    Colonne('Véhicule', 'vehicule.immatriculation', largeur=16, defaut="Non assigné"),
+    Colonne('Chauffeur', 'chauffeur.get_full_name', largeur=22, defaut="Non assigné"),
+    Colonne('Demandeur', lambda course: _nom_ou_identifiant(course.demandeur), largeur=22, defaut="Non spécifié", cle='demandeur'),
+    Colonne('Destination', 'destination', largeur=25),
+    Colonne('Statut', 'get_statut_display', largeur=14, cle='statut'),
+    Colonne('Distance (km)', 'distance_parcourue', largeur=14, format='entier', defaut="-"),
+]
+
+COLONNES_ENTRETIENS = [
+    Colonne('Date', 'date_entretien', largeur=12, format='date'),
+    Colonne('Véhicule', lambda e: f"{e.vehicule.immatriculation} ({e.vehicule.marque} {e.vehicule.modele})", largeur=30, cle='vehicule'),
+    Colonne('Garage', 'garage', largeur=20),
+    Colonne('Motif', 'motif', largeur=30),
+    Colonne('Coût ($)', 'cout', largeur=12, format='decimal'),
+    Colonne('Statut', 'get_statut_display', largeur=12, cle='statut'),
+]
+
+COLONNES_CARBURANT = [
+    Colonne('Date', 'date_ravitaillement', largeur=18, format='datetime'),
+    Colonne('Véhicule', 'vehicule.immatriculation', largeur=16),
+    Colonne('Station', 'nom_station', largeur=20, defaut='Non spécifiée'),
+    Colonne('Kilométrage', 'kilometrage_apres', largeur=12, format='entier'),
+    Colonne('Distance', 'distance_parcourue', largeur=12, format='entier'),
+    Colonne('Litres', 'litres', largeur=10, format='decimal'),
+    Colonne('Prix/L', 'cout_unitaire', largeur=10, format='decimal'),
+    Colonne('Coût total', 'cout_total', largeur=12, format='decimal'),
+    Colonne('Conso. (L/100km)', lambda r: r.consommation_moyenne if r.consommation_moyenne > 0 else 'N/A', largeur=16, format='decimal', cle='consommation_moyenne'),
+]
+
+
 @login_required
 @user_passes_test(is_admin_or_superuser)
 def export_vehicules_excel(request):
-    """Exporter la liste des véhicules en Excel"""
-    vehicules = Vehicule.objects.all()
-    if not request.user.is_superuser:
-        vehicules = vehicules.filter(departement=request.user.departement)
-    # Créer un nouveau classeur Excel
-    wb = xlwt.Workbook(encoding='utf-8')
-    ws = wb.add_sheet('Suivi Véhicules')
-    
-    # Définir les styles
-    header_style = xlwt.easyxf('font: bold on; pattern: pattern solid, fore_colour gray25; align: horiz center')
-    date_style = xlwt.easyxf('font: bold off; align: horiz right', num_format_str='DD/MM/YYYY')
-    number_style = xlwt.easyxf('font: bold off; align: horiz right')
-    
-    # Écrire les en-têtes
-    headers = ['Immatriculation', 'Marque', 'Modèle', 'Date Immatriculation', 'Distance Parcourue (km)', 'Nombre Entretiens', 'Volume Carburant (L)', 'Statut']
-    for col_num, header in enumerate(headers):
-        ws.write(0, col_num, header, header_style)
-        ws.col(col_num).width = 256 * 20  # 20 caractères de large
-    
-    # Récupérer les données
-    row_num = 1
-    
-    for vehicule in vehicules:
-        # Calculer la distance totale parcourue
-        distance_totale = Course.objects.filter(
-            vehicule=vehicule, 
-            statut='terminee'
-        ).aggregate(Sum('distance_parcourue'))['distance_parcourue__sum'] or 0
-        
-        # Calculer le nombre d'entretiens
-        nombre_entretiens = Entretien.objects.filter(vehicule=vehicule).count()
-        
-        # Calculer le volume de carburant consommé
-        volume_carburant = Ravitaillement.objects.filter(
-            vehicule=vehicule
-        ).aggregate(Sum('litres'))['litres__sum'] or 0
-        
-        # Écrire les données
-        ws.write(row_num, 0, vehicule.immatriculation)
-        ws.write(row_num, 1, vehicule.marque)
-        ws.write(row_num, 2, vehicule.modele)
-        if vehicule.date_immatriculation:
-            ws.write(row_num, 3, vehicule.date_immatriculation, date_style)
-        else:
-            ws.write(row_num, 3, "Non renseignée")
-        ws.write(row_num, 4, distance_totale, number_style)
-        ws.write(row_num, 5, nombre_entretiens, number_style)
-        ws.write(row_num, 6, float(volume_carburant), number_style)
-        ws.write(row_num, 7, "Disponible" if vehicule.est_disponible() else "Indisponible")
-        
-        row_num += 1
+    """Exporter la liste des véhicules en Excel (ou CSV / JSON lines avec ?format=)"""
+    # Les totaux sont calculés en sous-requêtes : une seule requête quel que soit le nombre de véhicules
+    vehicules = _perimetre(request, Vehicule.objects.all()).annotate(
+        distance_totale=_par_vehicule(Course.objects.filter(statut='terminee'), Sum('distance_parcourue')),
+        nombre_entretiens=_par_vehicule(Entretien.objects.all(), Count('pk')),
+        volume_carburant=_par_vehicule(Ravitaillement.objects.all(), Sum('litres')),
+        en_mission=Exists(Course.objects.filter(vehicule=OuterRef('pk'), statut__in=['validee', 'en_cours'])),
+    ).order_by('immatriculation')
     
     # Tracer l'action
     ActionTraceur.objects.create(
@@ -190,18 +216,8 @@ def export_vehicules_excel(request):
         action="Export Excel du suivi des véhicules",
     )
     
-    # Préparer la réponse
-    response = HttpResponse(content_type='application/ms-excel')
-    response['Content-Disposition'] = f'attachment; filename="suivi_vehicules.xls"'
-    
-    # Ajouter le nom du département dans le titre
-    titre = f"Suivi Véhicules - Département : {request.user.departement.nom if not request.user.is_superuser else 'Tous'}"
-    response['Content-Disposition'] = f'attachment; filename="{titre}.xls"'
-    
-    # Sauvegarder le classeur dans la réponse
-    wb.save(response)
-    
-    return response
+    titre = f"Suivi Véhicules - Département : {_nom_perimetre(request)}"
+    return exporter(request, vehicules, COLONNES_VEHICULES, titre, titre=titre, nom_feuille='Suivi Véhicules')
 
 @login_required
 @user_passes_test(is_admin_or_superuser)
@@ -272,95 +288,22 @@ def export_missions_pdf(request):
 @login_required
 @user_passes_test(is_admin_or_superuser)
 def export_missions_excel(request):
-    """Exporter la liste des missions en Excel"""
-    queryset = Course.objects.all()
-    if not request.user.is_superuser:
-        queryset = queryset.filter(departement=request.user.departement)
-    # Initialiser le queryset
-    missions = queryset.order_by('-date_demande')
+    """Exporter la liste des missions en Excel (ou CSV / JSON lines avec ?format=)"""
+    queryset = _perimetre(request, Course.objects.all())
+    missions = queryset.select_related('vehicule', 'chauffeur', 'demandeur').order_by('-date_demande')
     
     # Calculer la distance totale parcourue
     distance_totale = queryset.aggregate(Sum('distance_parcourue'))['distance_parcourue__sum'] or 0
     
-    # Créer un nouveau classeur Excel
-    wb = xlwt.Workbook(encoding='utf-8')
-    ws = wb.add_sheet('Suivi Missions')
-    
-    # Définir les styles
-    header_style = xlwt.easyxf('font: bold on; pattern: pattern solid, fore_colour gray25; align: horiz center')
-    date_style = xlwt.easyxf('font: bold off; align: horiz right', num_format_str='DD/MM/YYYY HH:MM')
-    number_style = xlwt.easyxf('font: bold off; align: horiz right')
-    total_style = xlwt.easyxf('font: bold on; align: horiz right')
-    
-    # Écrire les en-têtes
-    headers = ['Date', 'Véhicule', 'Chauffeur', 'Demandeur', 'Destination', 'Statut', 'Distance (km)']
-    for col_num, header in enumerate(headers):
-        ws.write(0, col_num, header, header_style)
-        ws.col(col_num).width = 256 * 20  # 20 caractères de large
-    
-    # Écrire les données
-    row_num = 1
-    
-    for mission in missions:
-        # Écrire les données
-        ws.write(row_num, 0, mission.date_demande, date_style)
-        
-        if mission.vehicule:
-            ws.write(row_num, 1, mission.vehicule.immatriculation)
-        else:
-            ws.write(row_num, 1, "Non assigné")
-            
-        if mission.chauffeur:
-            ws.write(row_num, 2, mission.chauffeur.get_full_name())
-        else:
-            ws.write(row_num, 2, "Non assigné")
-            
-        if mission.demandeur:
-            if mission.demandeur.get_full_name():
-                ws.write(row_num, 3, mission.demandeur.get_full_name())
-            else:
-                ws.write(row_num, 3, mission.demandeur.username)
-        else:
-            ws.write(row_num, 3, "Non spécifié")
-            
-        ws.write(row_num, 4, mission.destination)
-        
-        # Statut en français
-        statut_map = {
-            'en_attente': 'En attente',
-            'validee': 'Validée',
-            'en_cours': 'En cours',
-            'terminee': 'Terminée',
-            'annulee': 'Annulée'
-        }
-        ws.write(row_num, 5, statut_map.get(mission.statut, mission.statut))
-        
-        if mission.distance_parcourue:
-            ws.write(row_num, 6, float(mission.distance_parcourue), number_style)
-        else:
-            ws.write(row_num, 6, "-")
-        
-        row_num += 1
-    
-    # Ajouter une ligne de total
-    row_num += 1
-    ws.write(row_num, 0, "TOTAL", total_style)
-    ws.write(row_num, 6, float(distance_totale), total_style)
-    
     # Tracer l'action
     ActionTraceur.objects.create(
         utilisateur=request.user,
         action="Export Excel du suivi des missions",
     )
     
-    # Préparer la réponse
-    response = HttpResponse(content_type='application/ms-excel')
-    response['Content-Disposition'] = f'attachment; filename="Suivi Missions - Département : {request.user.departement.nom if not request.user.is_superuser else "Tous"}.xls"'
-    
-    # Sauvegarder le classeur dans la réponse
-    wb.save(response)
-    
-    return response
+    titre = f"Suivi Missions - Département : {_nom_perimetre(request)}"
+    return exporter(request, missions, COLONNES_MISSIONS, titre, titre=titre, nom_feuille='Suivi Missions',
+                    totaux={'Distance (km)': distance_totale})
 
 @login_required
 @user_passes_test(is_admin_or_superuser)
@@ -439,10 +382,8 @@ def export_entretiens_pdf(request):
 @login_required
 @user_passes_test(is_admin_or_superuser)
 def export_entretiens_excel(request):
-    """Exporter la liste des entretiens en Excel"""
-    queryset = Entretien.objects.all()
-    if not request.user.is_superuser:
-        queryset = queryset.filter(vehicule__departement=request.user.departement)
+    """Exporter la liste des entretiens en Excel (ou CSV / JSON lines avec ?format=)"""
+    queryset = _perimetre(request, Entretien.objects.all(), 'vehicule__etablissement')
     # Recherche
     search_query = request.GET.get('search', '')
     date_debut = request.GET.get('date_debut')
@@ -457,9 +398,9 @@ def export_entretiens_excel(request):
     
     # Filtrer par date
     if date_debut:
-        queryset = queryset.filter(date_entretien__date__gte=date_debut)
+        queryset = queryset.filter(date_entretien__gte=date_debut)
     if date_fin:
-        queryset = queryset.filter(date_entretien__date__lte=date_fin)
+        queryset = queryset.filter(date_entretien__lte=date_fin)
     
     # Tri
     sort_by = request.GET.get('sort', '-date_entretien')
@@ -474,68 +415,20 @@ def export_entretiens_excel(request):
     if sort_by not in valid_sort_fields:
         sort_by = '-date_entretien'  # Valeur par défaut sécurisée
     
-    entretiens = queryset.order_by(sort_by)
+    entretiens = queryset.select_related('vehicule').order_by(sort_by)
     
     # Calculer le coût total des entretiens
     cout_total = queryset.aggregate(Sum('cout'))['cout__sum'] or 0
     
-    # Créer un nouveau classeur Excel
-    wb = xlwt.Workbook(encoding='utf-8')
-    ws = wb.add_sheet('Suivi Entretiens')
-    
-    # Définir les styles
-    header_style = xlwt.easyxf('font: bold on; pattern: pattern solid, fore_colour gray25; align: horiz center')
-    date_style = xlwt.easyxf('font: bold off; align: horiz right', num_format_str='DD/MM/YYYY')
-    number_style = xlwt.easyxf('font: bold off; align: horiz right')
-    total_style = xlwt.easyxf('font: bold on; align: horiz right')
-    
-    # Écrire les en-têtes
-    headers = ['Date', 'Véhicule', 'Garage', 'Motif', 'Coût ($)', 'Statut']
-    for col_num, header in enumerate(headers):
-        ws.write(0, col_num, header, header_style)
-        ws.col(col_num).width = 256 * 20  # 20 caractères de large
-    
-    # Écrire les données
-    row_num = 1
-    
-    for entretien in entretiens:
-        # Écrire les données
-        ws.write(row_num, 0, entretien.date_entretien, date_style)
-        ws.write(row_num, 1, f"{entretien.vehicule.immatriculation} ({entretien.vehicule.marque} {entretien.vehicule.modele})")
-        ws.write(row_num, 2, entretien.garage)
-        ws.write(row_num, 3, entretien.motif)
-        ws.write(row_num, 4, float(entretien.cout), number_style)
-        
-        # Statut en français
-        statut_map = {
-            'planifie': 'Planifié',
-            'en_cours': 'En cours',
-            'termine': 'Terminé',
-            'annule': 'Annulé'
-        }
-        ws.write(row_num, 5, statut_map.get(entretien.statut, entretien.statut))
-        
-        row_num += 1
-    
-    # Ajouter une ligne de total
-    row_num += 1
-    ws.write(row_num, 0, "TOTAL", total_style)
-    ws.write(row_num, 4, float(cout_total), total_style)
-    
     # Tracer l'action
     ActionTraceur.objects.create(
         utilisateur=request.user,
         action="Export Excel du suivi des entretiens",
     )
     
-    # Préparer la réponse
-    response = HttpResponse(content_type='application/ms-excel')
-    response['Content-Disposition'] = f'attachment; filename="Suivi Entretiens - Département : {request.user.departement.nom if not request.user.is_superuser else "Tous"}.xls"'
-    
-    # Sauvegarder le classeur dans la réponse
-    wb.save(response)
-    
-    return response
+    titre = f"Suivi Entretiens - Département : {_nom_perimetre(request)}"
+    return exporter(request, entretiens, COLONNES_ENTRETIENS, titre, titre=titre, nom_feuille='Suivi Entretiens',
+                    totaux={'Coût ($)': cout_total})
 
 @login_required
 @user_passes_test(is_admin_or_superuser)
@@ -626,56 +519,12 @@ def export_carburant_pdf(request):
 @login_required
 @user_passes_test(is_admin_or_superuser)
 def export_carburant_excel(request):
-    """Exporter le suivi de la consommation de carburant en Excel"""
-    queryset = Ravitaillement.objects.all()
-    if not request.user.is_superuser:
-        queryset = queryset.filter(vehicule__departement=request.user.departement)
-    # Initialiser le queryset
-    ravitaillements = queryset.order_by('-date_ravitaillement')
+    """Exporter le suivi de la consommation de carburant en Excel (ou CSV / JSON lines avec ?format=)"""
+    queryset = _perimetre(request, Ravitaillement.objects.all(), 'vehicule__etablissement')
+    ravitaillements = queryset.select_related('vehicule').order_by('-date_ravitaillement')
     
     # Calcul des totaux
-    total_litres = ravitaillements.aggregate(Sum('litres'))['litres__sum'] or 0
-    total_cout = ravitaillements.aggregate(Sum('cout_total'))['cout_total__sum'] or 0
-    
-    # Créer un nouveau classeur Excel
-    wb = xlwt.Workbook(encoding='utf-8')
-    ws = wb.add_sheet('Suivi Carburant')
-    
-    # Définir les styles
-    header_style = xlwt.easyxf('font: bold on; pattern: pattern solid, fore_colour gray25; align: horiz center')
-    date_style = xlwt.easyxf('font: bold off; align: horiz right', num_format_str='DD/MM/YYYY HH:MM')
-    number_style = xlwt.easyxf('font: bold off; align: horiz right')
-    
-    # Écrire les en-têtes
-    headers = ['Date', 'Véhicule', 'Station', 'Kilométrage', 'Distance', 'Litres', 'Prix/L', 'Coût total', 'Conso. (L/100km)']
-    for col_num, header in enumerate(headers):
-        ws.write(0, col_num, header, header_style)
-        ws.col(col_num).width = 256 * 20  # 20 caractères de large
-    
-    # Écrire les données
-    row_num = 1
-    for ravitaillement in ravitaillements:
-        ws.write(row_num, 0, ravitaillement.date_ravitaillement, date_style)
-        ws.write(row_num, 1, ravitaillement.vehicule.immatriculation)
-        ws.write(row_num, 2, ravitaillement.nom_station or 'Non spécifiée')
-        ws.write(row_num, 3, ravitaillement.kilometrage_apres, number_style)
-        ws.write(row_num, 4, ravitaillement.distance_parcourue, number_style)
-        ws.write(row_num, 5, float(ravitaillement.litres), number_style)
-        ws.write(row_num, 6, float(ravitaillement.cout_unitaire), number_style)
-        ws.write(row_num, 7, float(ravitaillement.cout_total), number_style)
-        
-        if ravitaillement.consommation_moyenne > 0:
-            ws.write(row_num, 8, float(ravitaillement.consommation_moyenne), number_style)
-        else:
-            ws.write(row_num, 8, 'N/A')
-        
-        row_num += 1
-    
-    # Ajouter une ligne de total
-    row_num += 1
-    ws.write(row_num, 0, 'TOTAL', xlwt.easyxf('font: bold on'))
-    ws.write(row_num, 5, float(total_litres), xlwt.easyxf('font: bold on; align: horiz right'))
-    ws.write(row_num, 7, float(total_cout), xlwt.easyxf('font: bold on; align: horiz right'))
+    totaux = queryset.aggregate(litres=Sum('litres'), cout=Sum('cout_total'))
     
     # Tracer l'action
     ActionTraceur.objects.create(
@@ -683,11 +532,6 @@ def export_carburant_excel(request):
         action="Export Excel du suivi de la consommation de carburant",
     )
     
-    # Préparer la réponse
-    response = HttpResponse(content_type='application/ms-excel')
-    response['Content-Disposition'] = f'attachment; filename="Suivi Carburant - Département : {request.user.departement.nom if not request.user.is_superuser else "Tous"}.xls"'
-    
-    # Sauvegarder le classeur dans la réponse
-    wb.save(response)
-    
-    return response
+    titre = f"Suivi Carburant - Département : {_nom_perimetre(request)}"
+    return exporter(request, ravitaillements, COLONNES_CARBURANT, titre, titre=titre, nom_feuille='Suivi Carburant',
+                    totaux={'Litres': totaux['litres'] or 0, 'Coût total': totaux['cout'] or 0})